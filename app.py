@@ -8,7 +8,6 @@ import os
 import json
 import logging
 import math
-import threading
 from datetime import datetime, date, timedelta
 from typing import Dict, List, Optional, Tuple
 from collections import defaultdict
@@ -25,6 +24,9 @@ import re
 # Import database functions
 from database import (
     get_db_connection, 
+    db_connection,
+    open_connection_scope,
+    close_connection_scope,
     encrypt_password, 
     decrypt_password, 
     get_user_hr_parameters, 
@@ -35,22 +37,31 @@ from database import (
     get_cached_trimp_data,
     save_cached_trimp_data,
     calculate_data_hash,
-    invalidate_cached_trimp_data,
     get_cached_oxygen_debt_data,
     save_cached_oxygen_debt_data,
-    invalidate_cached_oxygen_debt_data,
     get_cached_spo2_distribution_data,
     save_cached_spo2_distribution_data,
-    invalidate_cached_spo2_distribution_data,
     get_config_value,
+    get_daily_batch_data,
+    drop_o2ring_timestamp_index,
+    create_o2ring_timestamp_index,
+    encode_series,
+    decode_series,
     set_config_value
 )
 
 # Import job functions
-from jobs import collect_garmin_data_job
+from job_queue import get_job_executor
 
 # Import models
 from models import HeartRateAnalyzer, TRIMPCalculator
+from o2ring_timestamps import parse_o2ring_timestamp
+from sync_state import sync_start_date
+from derived_data import data_changed
+from spo2_analysis import (
+    calculate_spo2_distribution, get_spo2_events, get_spo2_summaries, index_o2ring_file,
+    london_day_bounds, london_dates_between, refresh_spo2_summaries, DESATURATION_DROPS
+)
 
 # Import configuration
 from config import SERVER_CONFIG, API_CONFIG
@@ -94,6 +105,22 @@ cipher_suite = Fernet(ENCRYPTION_KEY)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+@app.before_request
+def open_request_db_connection():
+    """Share one database connection between the helpers used by a request."""
+    open_connection_scope()
+
+@app.teardown_request
+def close_request_db_connection(exception=None):
+    """Close the request's shared database connection."""
+    close_connection_scope()
+
+@app.before_request
+def start_job_executor():
+    """Start the background workers so jobs queued before a restart resume."""
+    if not app.testing:
+        get_job_executor()
+
 def init_database():
     """Initialize the database with required tables."""
     # Import and call the proper init_database function from database.py
@@ -430,9 +457,8 @@ def collect_data():
     if start_date == end_date:
         # Single date - create one job
         job_id = create_background_job('collect_data', target_date=start_date)
-        # Run the job in a separate thread
-        thread = threading.Thread(target=collect_garmin_data_job, args=(start_date, job_id), daemon=True)
-        thread.start()
+        # Hand the queued job to the background workers
+        get_job_executor().notify()
         
         logger.info(f"collect_data: Created single job {job_id} for {start_date}")
         
@@ -443,40 +469,26 @@ def collect_data():
             'status': 'pending'
         })
     else:
-        # Date range - create parallel jobs for each date
+        # Date range - one job collecting the whole range with ranged Garmin queries
         try:
             start = datetime.strptime(start_date, '%Y-%m-%d').date()
             end = datetime.strptime(end_date, '%Y-%m-%d').date()
             
             logger.info(f"collect_data: Processing date range from {start} to {end}")
             
-            if (end - start).days > 30:  # Limit to 30 days
+            if end < start:
+                return jsonify({'error': 'End date is before start date'}), 400
+            if (end - start).days > API_CONFIG['MAX_DATE_RANGE_DAYS']:
                 return jsonify({'error': f'Date range too large. Maximum {API_CONFIG["MAX_DATE_RANGE_DAYS"]} days allowed.'}), 400
             
-            job_ids = []
-            current_date = start
-            job_count = 0
-            
-            while current_date <= end:
-                job_id = create_background_job('collect_data', target_date=current_date.isoformat())
-                # Run the job in a separate thread
-                thread = threading.Thread(target=collect_garmin_data_job, args=(current_date.isoformat(), job_id), daemon=True)
-                thread.start()
-                job_ids.append(job_id)
-                logger.info(f"collect_data: Created job {job_id} for {current_date.isoformat()}")
-                current_date += timedelta(days=1)
-                job_count += 1
-                
-                # Add a small delay between job creation to prevent rate limiting
-                if job_count % 3 == 0:  # Every 3 jobs
-                    time.sleep(0.5)  # 500ms delay between jobs
-            
-            logger.info(f"collect_data: Created {len(job_ids)} jobs total")
+            job_id = create_background_job('collect_range', start_date=start.isoformat(), end_date=end.isoformat())
+            get_job_executor().notify()
+            logger.info(f"collect_data: Created range job {job_id} for {start_date} to {end_date}")
             
             return jsonify({
                 'success': True,
-                'job_ids': job_ids,
-                'message': f'Started {len(job_ids)} data collection jobs from {start_date} to {end_date}',
+                'job_id': job_id,
+                'message': f'Data collection job started for {start_date} to {end_date}',
                 'status': 'pending'
             })
             
@@ -484,6 +496,30 @@ def collect_data():
             logger.error(f"collect_data: ValueError: {e}")
             return jsonify({'error': 'Invalid date format'}), 400
 
+@app.route('/sync-data', methods=['POST'])
+def sync_data():
+    """Start a background job collecting the days that changed since the last sync."""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    # Only admin can collect data
+    if session.get('user_role') != 'admin':
+        return jsonify({'error': 'Insufficient permissions'}), 403
+    
+    # From the sync watermark to today; the job skips days in between that have settled
+    end = date.today()
+    start = sync_start_date(end)
+    job_id = create_background_job('collect_range', start_date=start.isoformat(), end_date=end.isoformat())
+    get_job_executor().notify()
+    logger.info(f"sync_data: Created range job {job_id} for {start} to {end}")
+    
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'message': f'Sync job started for {start.isoformat()} to {end.isoformat()}',
+        'status': 'pending'
+    })
+
 @app.route('/api/data/<date>')
 def get_data(date):
     """Get heart rate data for a specific date label."""
@@ -623,8 +659,8 @@ def get_activities(date):
     activities_list = []
     for activity in activities:
         # Convert from new schema format
-        heart_rate_series = json.loads(activity['heart_rate_series']) if activity['heart_rate_series'] else []
-        breathing_rate_series = json.loads(activity['breathing_rate_series']) if activity['breathing_rate_series'] else []
+        heart_rate_series = decode_series(activity['heart_rate_series'])
+        breathing_rate_series = decode_series(activity['breathing_rate_series'])
         trimp_data = json.loads(activity['trimp_data']) if activity['trimp_data'] else {}
         
         # Check for CSV override
@@ -786,7 +822,7 @@ def save_activity_spo2(activity_id):
             return jsonify({'error': 'Activity not found'}), 404
         
         # Get first HR timestamp to calculate base timestamp
-        heart_rate_series = json.loads(activity['heart_rate_series']) if activity['heart_rate_series'] else []
+        heart_rate_series = decode_series(activity['heart_rate_series'])
         if not heart_rate_series:
             return jsonify({'error': 'Activity has no HR data to calculate timestamps'}), 400
         
@@ -970,7 +1006,7 @@ def download_activity_hr_csv(activity_id):
     if not activity:
         return jsonify({'error': 'Activity not found'}), 404
     
-    heart_rate_series = json.loads(activity['heart_rate_series']) if activity['heart_rate_series'] else []
+    heart_rate_series = decode_series(activity['heart_rate_series'])
     
     if not heart_rate_series:
         return jsonify({'error': 'No HR data available for this activity'}), 404
@@ -1082,23 +1118,12 @@ def upload_activity_hr_csv(activity_id):
         from database import save_user_data
         logger.info(f"Saving CSV override to database for activity {activity_id}")
         save_user_data('activity_hr_csv', activity_id, hr_series)
+        data_changed('activity_hr', activity_ids=[activity_id])
         
         # Recalculate TRIMP and update activity data
         logger.info(f"Recalculating TRIMP for activity {activity_id}")
         recalculate_activity_trimp(activity_id, hr_series)
         
-        # Invalidate cached TRIMP data for the activity and its date
-        invalidate_cached_trimp_data(activity_id, 'activity')
-        # Get the activity's date to invalidate daily cache
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT date FROM activity_data WHERE activity_id = ?", (activity_id,))
-        activity = cur.fetchone()
-        if activity:
-            invalidate_cached_trimp_data(activity['date'], 'daily')
-        cur.close()
-        conn.close()
-        
         logger.info(f"CSV upload successful for activity {activity_id}")
         return jsonify({'success': True, 'message': 'CSV uploaded successfully'})
         
@@ -1169,10 +1194,10 @@ def recalculate_activity_trimp(activity_id, hr_series_override=None):
         hr_series = hr_series_override
         logger.info(f"Using override HR series: {len(hr_series)} points")
     else:
-        hr_series = json.loads(activity['heart_rate_series']) if activity['heart_rate_series'] else []
+        hr_series = decode_series(activity['heart_rate_series'])
         logger.info(f"Using original HR series: {len(hr_series)} points")
     
-    breathing_series = json.loads(activity['breathing_rate_series']) if activity['breathing_rate_series'] else []
+    breathing_series = decode_series(activity['breathing_rate_series'])
     logger.info(f"Breathing series: {len(breathing_series)} points")
     
     # Calculate TRIMP using the same logic as in jobs.py
@@ -1228,7 +1253,7 @@ def recalculate_activity_trimp(activity_id, hr_series_override=None):
             SET heart_rate_series = ?, trimp_data = ?, total_trimp = ?, updated_at = CURRENT_TIMESTAMP
             WHERE date = ?
         """, (
-            json.dumps(daily_hr_series),
+            encode_series(daily_hr_series),
             json.dumps(daily_trimp_results),
             daily_trimp_results.get('total_trimp', 0.0),
             date
@@ -1299,6 +1324,9 @@ def hr_parameters():
         max_hr = data.get('max_hr', current_max_hr)
         
         ensure_user_hr_parameters(resting_hr, max_hr)
+        if (resting_hr, max_hr) != (current_resting_hr, current_max_hr):
+            # Every TRIMP was calculated with the old parameters
+            data_changed('hr_parameters', everything=True)
         return jsonify({'success': True, 'resting_hr': resting_hr, 'max_hr': max_hr})
     
     else:  # GET
@@ -1356,7 +1384,7 @@ def get_resting_hr_data():
             row = cur.fetchone()
             if row and row['heart_rate_series']:
                 try:
-                    hr_series = json.loads(row['heart_rate_series'])
+                    hr_series = decode_series(row['heart_rate_series'])
                 except Exception as e:
                     logger.error(f"Error parsing HR series for {date_str}: {e}")
                     hr_series = []
@@ -1468,6 +1496,14 @@ def get_jobs():
     
     return jsonify(jobs)
 
+@app.route('/api/jobs/metrics')
+def get_job_metrics():
+    """Get job queue depth and worker counters."""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    return jsonify(get_job_executor().metrics())
+
 @app.route('/api/jobs/<job_id>')
 def get_job_status(job_id):
     """Get status of a specific job."""
@@ -1629,8 +1665,7 @@ def daily_trimp_overrides(date):
                 # Delete existing overrides if empty
                 delete_user_data('daily_trimp_overrides', date)
             
-            # Invalidate cached TRIMP data for this date
-            invalidate_cached_trimp_data(date, 'daily')
+            data_changed('trimp_overrides', dates=[date])
             
             return jsonify({
                 'success': True,
@@ -1685,7 +1720,7 @@ def download_daily_hr_csv(date):
     if not daily_data:
         return jsonify({'error': 'Daily data not found'}), 404
     
-    heart_rate_series = json.loads(daily_data['heart_rate_series']) if daily_data['heart_rate_series'] else []
+    heart_rate_series = decode_series(daily_data['heart_rate_series'])
     
     if not heart_rate_series:
         return jsonify({'error': 'No HR data available for this date'}), 404
@@ -1820,7 +1855,7 @@ def create_manual_activity(date):
             'manual',
             start_datetime.isoformat(),
             duration_seconds,
-            json.dumps(hr_series),
+            encode_series(hr_series),
             json.dumps(trimp_results),
             float(trimp_results['total_trimp']),
             heart_rate,
@@ -1835,8 +1870,7 @@ def create_manual_activity(date):
         
         # Recalculate TRIMP for the day with the new manual activity
         logger.info(f"Recalculating TRIMP for the day")
-        # Invalidate cached TRIMP data for this date
-        invalidate_cached_trimp_data(date, 'daily')
+        data_changed('day_activities', dates=[date])
         
         from jobs import build_daily_hr_timeseries, calculate_trimp_with_caching
         
@@ -1931,8 +1965,7 @@ def delete_activity(activity_id):
         
         # Recalculate TRIMP for the day without this activity
         logger.info(f"Recalculating TRIMP for the day after delete")
-        # Invalidate cached TRIMP data for this date
-        invalidate_cached_trimp_data(date, 'daily')
+        data_changed('day_activities', dates=[date])
         
         from jobs import build_daily_hr_timeseries, calculate_trimp_with_caching
         
@@ -2008,7 +2041,7 @@ def get_resting_hr_detail(date):
             return jsonify({'error': 'No HR data available for this date'}), 404
         
         try:
-            hr_series = json.loads(row['heart_rate_series'])
+            hr_series = decode_series(row['heart_rate_series'])
         except Exception as e:
             logger.error(f"Error parsing HR series for {date}: {e}")
             cur.close()
@@ -2251,178 +2284,168 @@ def set_backup_folder():
         logger.error(f"Error setting backup folder: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
-def process_o2ring_file(file):
-    """Process an O2Ring CSV file and return result dict."""
+O2RING_CSV_HEADER = ['Time', 'SpO2(%)', 'Pulse Rate(bpm)', 'Motion', 'SpO2 Reminder', 'PR Reminder', '']
+
+def iter_o2ring_rows(reader):
+    """
+    Lazily parse O2Ring CSV rows (after the header).
+    
+    Rows where the device failed to record (SpO2 255 or pulse 65535) are skipped
+    together with the valid rows immediately before and after them.
+    
+    Args:
+        reader: csv.reader positioned after the header row
+        
+    Yields:
+        Tuples of (timestamp, spo2_value, heart_rate, motion, spo2_reminder, pr_reminder)
+    """
+    # Each row is held back until the next one shows it is not next to a recording failure
+    pending = None
+    skip_next = False
+    
+    for row_num, row in enumerate(reader, start=2):  # Start at 2 because we skipped header
+        if len(row) < 6:  # Need at least 6 columns
+            logger.warning(f"Skipping row {row_num}: insufficient columns")
+            continue
+        
+        try:
+            # Parse timestamp (format: "10:09:10PM Aug 21, 2025")
+            time_str = row[0].strip()
+            if not time_str:
+                continue
+            
+            timestamp = parse_o2ring_timestamp(time_str)
+            if timestamp is None:
+                logger.warning(f"Skipping row {row_num}: invalid timestamp format: {time_str}")
+                continue
+            
+            spo2_value = int(row[1])
+            heart_rate = int(row[2])
+            motion = int(row[3])
+            spo2_reminder = int(row[4])
+            pr_reminder = int(row[5])
+        except (ValueError, IndexError) as e:
+            logger.warning(f"Skipping row {row_num}: parsing error: {e}")
+            continue
+        
+        # Check for device recording failures
+        if spo2_value == 255 or heart_rate == 65535:
+            logger.warning(f"Row {row_num}: Device recording failure detected (SpO2: {spo2_value}, HR: {heart_rate}) - skipping this row and adjacent rows")
+            pending = None
+            skip_next = True
+            continue
+        
+        if skip_next:
+            skip_next = False
+            continue
+        
+        if pending is not None:
+            yield pending
+        pending = (timestamp, spo2_value, heart_rate, motion, spo2_reminder, pr_reminder)
+    
+    if pending is not None:
+        yield pending
+
+def process_o2ring_file(file, refresh_summaries=True):
+    """
+    Process an O2Ring CSV file and return result dict.
+    
+    The file's desaturation events are indexed with its data. Unless refresh_summaries
+    is False, the SpO2 summaries of the nights it covers are refreshed too; otherwise
+    the caller refreshes the returned 'dates' itself.
+    """
     try:
         # Validate file extension
         if not file.filename.lower().endswith('.csv'):
             return {'success': False, 'error': 'File must be a CSV'}
         
-        # Read and parse CSV
-        import io
+        import codecs
         import csv
-        from datetime import datetime
-        import pytz
         
-        # Read file content
-        content = file.read().decode('utf-8')
-        csv_file = io.StringIO(content)
-        reader = csv.reader(csv_file)
+        # Stream the file instead of reading it into memory
+        reader = csv.reader(codecs.iterdecode(file.stream, 'utf-8'))
         
         # Validate header
-        header = next(reader)
-        expected_header = ['Time', 'SpO2(%)', 'Pulse Rate(bpm)', 'Motion', 'SpO2 Reminder', 'PR Reminder', '']
-        
-        if header != expected_header:
+        header = next(reader, None)
+        if header != O2RING_CSV_HEADER:
             return {
                 'success': False, 
-                'error': f'Invalid header format. Expected: {expected_header}, Got: {header}'
+                'error': f'Invalid header format. Expected: {O2RING_CSV_HEADER}, Got: {header}'
             }
         
-        # Parse CSV data
-        data_points = []
-        first_timestamp = None
-        last_timestamp = None
-        
-        # First pass: collect all rows and identify invalid ones
-        all_rows = []
-        invalid_indices = set()
-        
-        for row_num, row in enumerate(reader, start=2):  # Start at 2 because we skipped header
-            if len(row) < 6:  # Need at least 6 columns
-                logger.warning(f"Skipping row {row_num}: insufficient columns")
-                continue
+        with db_connection() as conn:
+            cur = conn.cursor()
             
-            try:
-                # Parse timestamp (format: "10:09:10PM Aug 21, 2025")
-                time_str = row[0].strip()
-                if not time_str:
-                    continue
-                
-                # Parse the timestamp
-                timestamp = parse_o2ring_timestamp(time_str)
-                if timestamp is None:
-                    logger.warning(f"Skipping row {row_num}: invalid timestamp format: {time_str}")
-                    continue
-                
-                # Parse SpO2 value
-                spo2_value = int(row[1])
-                
-                # Parse heart rate
-                heart_rate = int(row[2])
-                
-                # Parse motion
-                motion = int(row[3])
-                
-                # Parse SpO2 Reminder
-                spo2_reminder = int(row[4])
-                
-                # Parse PR Reminder
-                pr_reminder = int(row[5])
-                
-                # Check for device recording failures
-                if spo2_value == 255 or heart_rate == 65535:
-                    # Mark this row and adjacent rows as invalid
-                    current_index = len(all_rows)
-                    invalid_indices.add(current_index)  # Current row
-                    if current_index > 0:
-                        invalid_indices.add(current_index - 1)  # Previous row
-                    if current_index < len(all_rows):
-                        invalid_indices.add(current_index + 1)  # Next row (will be added)
-                    
-                    logger.warning(f"Row {row_num}: Device recording failure detected (SpO2: {spo2_value}, HR: {heart_rate}) - skipping this row and adjacent rows")
-                    continue
-                
-                # Store row data
-                all_rows.append({
-                    'row_num': row_num,
-                    'timestamp': timestamp,
-                    'spo2_value': spo2_value,
-                    'heart_rate': heart_rate,
-                    'motion': motion,
-                    'spo2_reminder': spo2_reminder,
-                    'pr_reminder': pr_reminder
-                })
-                
-            except (ValueError, IndexError) as e:
-                logger.warning(f"Skipping row {row_num}: parsing error: {e}")
-                continue
-        
-        # Second pass: filter out invalid rows and their adjacent rows
-        for i, row_data in enumerate(all_rows):
-            if i not in invalid_indices:
-                data_points.append({
-                    'timestamp': row_data['timestamp'],
-                    'spo2_value': row_data['spo2_value'],
-                    'heart_rate': row_data['heart_rate'],
-                    'motion': row_data['motion'],
-                    'spo2_reminder': row_data['spo2_reminder'],
-                    'pr_reminder': row_data['pr_reminder']
-                })
-                
-                # Track first and last timestamps
-                if first_timestamp is None or row_data['timestamp'] < first_timestamp:
-                    first_timestamp = row_data['timestamp']
-                if last_timestamp is None or row_data['timestamp'] > last_timestamp:
-                    last_timestamp = row_data['timestamp']
-        
-        if not data_points:
-            return {'success': False, 'error': 'No valid data points found in CSV'}
-        
-        # Store in database
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        # Check if file already exists
-        cur.execute("SELECT id FROM o2ring_files WHERE filename = ?", (file.filename,))
-        existing_file = cur.fetchone()
-        
-        if existing_file:
-            return {
-                'success': False, 
-                'error': f'File "{file.filename}" has already been loaded. Skipping duplicate.'
-            }
-        
-        # Insert file record
-        cur.execute("""
-            INSERT INTO o2ring_files (filename, first_timestamp, last_timestamp, row_count)
-            VALUES (?, ?, ?, ?)
-        """, (file.filename, first_timestamp, last_timestamp, len(data_points)))
-        
-        file_id = cur.lastrowid
-        
-        # Insert data points
-        for point in data_points:
+            # Check if file already exists
+            cur.execute("SELECT id FROM o2ring_files WHERE filename = ?", (file.filename,))
+            if cur.fetchone():
+                cur.close()
+                return {
+                    'success': False, 
+                    'error': f'File "{file.filename}" has already been loaded. Skipping duplicate.'
+                }
+            
+            # Insert the file record first so rows can reference it; the summary is filled in below
             cur.execute("""
+                INSERT INTO o2ring_files (filename, first_timestamp, last_timestamp, row_count)
+                VALUES (?, 0, 0, 0)
+            """, (file.filename,))
+            file_id = cur.lastrowid
+            
+            stats = {'count': 0, 'first': None, 'last': None}
+            timestamps = []
+            spo2_values = []
+            
+            def data_rows():
+                for point in iter_o2ring_rows(reader):
+                    timestamp = point[0]
+                    timestamps.append(timestamp)
+                    spo2_values.append(point[1])
+                    if stats['first'] is None or timestamp < stats['first']:
+                        stats['first'] = timestamp
+                    if stats['last'] is None or timestamp > stats['last']:
+                        stats['last'] = timestamp
+                    stats['count'] += 1
+                    yield (file_id,) + point
+            
+            # Insert all data points in one transaction
+            cur.executemany("""
                 INSERT INTO o2ring_data (file_id, timestamp, spo2_value, heart_rate, motion, spo2_reminder, pr_reminder)
                 VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (
-                file_id,
-                point['timestamp'],
-                point['spo2_value'],
-                point['heart_rate'],
-                point['motion'],
-                point['spo2_reminder'],
-                point['pr_reminder']
-            ))
+            """, data_rows())
+            
+            if not stats['count']:
+                conn.rollback()
+                cur.close()
+                return {'success': False, 'error': 'No valid data points found in CSV'}
+            
+            cur.execute("""
+                UPDATE o2ring_files SET first_timestamp = ?, last_timestamp = ?, row_count = ?
+                WHERE id = ?
+            """, (stats['first'], stats['last'], stats['count'], file_id))
+            
+            # Index desaturation events while the samples are in memory
+            event_count = index_o2ring_file(cur, file_id, timestamps, spo2_values)
+            dates = london_dates_between(stats['first'], stats['last'])
+            if refresh_summaries:
+                refresh_spo2_summaries(cur, dates)
+            
+            conn.commit()
+            cur.close()
         
-        conn.commit()
-        cur.close()
-        conn.close()
+        data_point_count = stats['count']
         
-        # Invalidate oxygen debt cache for the date range covered by this file
-        from datetime import datetime
-        start_date = datetime.fromtimestamp(first_timestamp / 1000).strftime('%Y-%m-%d')
-        end_date = datetime.fromtimestamp(last_timestamp / 1000).strftime('%Y-%m-%d')
-        invalidate_oxygen_debt_cache_for_date_range(start_date, end_date)
+        data_changed('o2ring', dates=dates)
         
-        logger.info(f"O2Ring file processed successfully: {file.filename}, {len(data_points)} data points")
+        logger.info(f"O2Ring file processed successfully: {file.filename}, {data_point_count} data points, {event_count} desaturation events")
         
         return {
             'success': True,
-            'message': f'File processed successfully with {len(data_points)} data points',
+            'message': f'File processed successfully with {data_point_count} data points',
             'filename': file.filename,
-            'data_points': len(data_points)
+            'data_points': data_point_count,
+            'desaturation_events': event_count,
+            'dates': dates
         }
         
     except Exception as e:
@@ -2475,28 +2498,46 @@ def load_o2ring_files():
         
         loaded_count = 0
         errors = []
+        loaded_dates = set()
         
-        for filename, file_path in csv_files:
-            try:
-                # Process the file using the existing upload logic
-                with open(file_path, 'rb') as f:
-                    # Create a file-like object that mimics request.files
-                    from werkzeug.datastructures import FileStorage
-                    file_storage = FileStorage(
-                        stream=f,
-                        filename=filename,
-                        content_type='text/csv'
-                    )
-                    
-                    # Call the existing upload function
-                    result = process_o2ring_file(file_storage)
-                    if result['success']:
-                        loaded_count += 1
-                    else:
-                        errors.append(f"{filename}: {result['error']}")
+        # Updating the timestamp index row by row slows a large backfill down,
+        # so drop it and build it once when all files are loaded. The nightly
+        # SpO2 summaries read by timestamp, so they are refreshed after that.
+        rebuild_index = len(csv_files) >= API_CONFIG['O2RING_INDEX_REBUILD_FILES']
+        if rebuild_index:
+            drop_o2ring_timestamp_index()
+        
+        try:
+            for filename, file_path in csv_files:
+                try:
+                    # Process the file using the existing upload logic
+                    with open(file_path, 'rb') as f:
+                        # Create a file-like object that mimics request.files
+                        from werkzeug.datastructures import FileStorage
+                        file_storage = FileStorage(
+                            stream=f,
+                            filename=filename,
+                            content_type='text/csv'
+                        )
                         
-            except Exception as e:
-                errors.append(f"{filename}: {str(e)}")
+                        # Call the existing upload function
+                        result = process_o2ring_file(file_storage, refresh_summaries=not rebuild_index)
+                        if result['success']:
+                            loaded_count += 1
+                            loaded_dates.update(result['dates'])
+                        else:
+                            errors.append(f"{filename}: {result['error']}")
+                            
+                except Exception as e:
+                    errors.append(f"{filename}: {str(e)}")
+        finally:
+            if rebuild_index:
+                create_o2ring_timestamp_index()
+                with db_connection() as conn:
+                    cur = conn.cursor()
+                    refresh_spo2_summaries(cur, sorted(loaded_dates))
+                    conn.commit()
+                    cur.close()
         
         message = f"Loaded {loaded_count} new files"
         if errors:
@@ -2683,7 +2724,7 @@ def o2ring_delete_file(file_id):
         cur = conn.cursor()
         
         # Check if file exists
-        cur.execute("SELECT filename FROM o2ring_files WHERE id = ?", (file_id,))
+        cur.execute("SELECT filename, first_timestamp, last_timestamp FROM o2ring_files WHERE id = ?", (file_id,))
         file_record = cur.fetchone()
         
         if not file_record:
@@ -2691,19 +2732,19 @@ def o2ring_delete_file(file_id):
         
         # Delete associated data first (since foreign keys are disabled)
         cur.execute("DELETE FROM o2ring_data WHERE file_id = ?", (file_id,))
+        cur.execute("DELETE FROM spo2_events WHERE file_id = ?", (file_id,))
         
         # Then delete the file record
         cur.execute("DELETE FROM o2ring_files WHERE id = ?", (file_id,))
         
+        dates = london_dates_between(file_record['first_timestamp'], file_record['last_timestamp'])
+        refresh_spo2_summaries(cur, dates)
+        
         conn.commit()
         cur.close()
         conn.close()
         
-        # Invalidate oxygen debt cache for the date range covered by this file
-        from datetime import datetime
-        start_date = datetime.fromtimestamp(file_record['first_timestamp'] / 1000).strftime('%Y-%m-%d')
-        end_date = datetime.fromtimestamp(file_record['last_timestamp'] / 1000).strftime('%Y-%m-%d')
-        invalidate_oxygen_debt_cache_for_date_range(start_date, end_date)
+        data_changed('o2ring', dates=dates)
         
         logger.info(f"O2Ring file deleted: {file_record['filename']}")
         
@@ -2728,22 +2769,21 @@ def get_o2ring_data_for_period(start_timestamp, end_timestamp):
         List of [timestamp, spo2_value, spo2_reminder] tuples
     """
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        cur.execute("""
-            SELECT timestamp, spo2_value, spo2_reminder
-            FROM o2ring_data 
-            WHERE timestamp >= ? AND timestamp <= ?
-            ORDER BY timestamp
-        """, (start_timestamp, end_timestamp))
-        
-        data_points = []
-        for row in cur.fetchall():
-            data_points.append([row['timestamp'], row['spo2_value'], row['spo2_reminder']])
-        
-        cur.close()
-        conn.close()
+        with db_connection() as conn:
+            cur = conn.cursor()
+            
+            cur.execute("""
+                SELECT timestamp, spo2_value, spo2_reminder
+                FROM o2ring_data 
+                WHERE timestamp >= ? AND timestamp <= ?
+                ORDER BY timestamp
+            """, (start_timestamp, end_timestamp))
+            
+            data_points = []
+            for row in cur.fetchall():
+                data_points.append([row['timestamp'], row['spo2_value'], row['spo2_reminder']])
+            
+            cur.close()
         
         return data_points
         
@@ -2751,34 +2791,36 @@ def get_o2ring_data_for_period(start_timestamp, end_timestamp):
         logger.error(f"Error getting O2Ring data for period {start_timestamp}-{end_timestamp}: {e}")
         return []
 
-def parse_o2ring_timestamp(time_str):
-    """
-    Parse O2Ring timestamp format: "10:09:10PM Aug 21, 2025"
-    Returns Unix timestamp in milliseconds (same format as Garmin data)
+def get_o2ring_data_for_dates(dates):
     """
-    try:
-        from datetime import datetime
-        import pytz
-        
-        # Parse the timestamp string
-        # Format: "10:09:10PM Aug 21, 2025"
-        dt = datetime.strptime(time_str, "%I:%M:%S%p %b %d, %Y")
-        
-        # Assume UK timezone (Europe/London)
-        uk_tz = pytz.timezone('Europe/London')
-        
-        # Localize the datetime to UK timezone
-        dt_uk = uk_tz.localize(dt)
-        
-        # Convert to Unix timestamp in milliseconds
-        timestamp_ms = int(dt_uk.timestamp() * 1000)
-        
-        return timestamp_ms
+    Get O2Ring data for several whole days (Europe/London) with a single range query.
+    
+    Args:
+        dates: List of date strings (YYYY-MM-DD)
         
-    except Exception as e:
-        logger.error(f"Error parsing O2Ring timestamp '{time_str}': {e}")
-        return None
-
+    Returns:
+        Dict of date -> list of [timestamp, spo2_value, spo2_reminder] tuples
+    """
+    if not dates:
+        return {}
+    
+    import bisect
+    
+    day_bounds = {date: london_day_bounds(date) for date in dates}
+    
+    data_points = get_o2ring_data_for_period(
+        min(start for start, _ in day_bounds.values()),
+        max(end for _, end in day_bounds.values())
+    )
+    timestamps = [point[0] for point in data_points]
+    
+    results = {}
+    for date, (start_timestamp, end_timestamp) in day_bounds.items():
+        first = bisect.bisect_left(timestamps, start_timestamp)
+        last = bisect.bisect_right(timestamps, end_timestamp)
+        results[date] = data_points[first:last]
+    
+    return results
 
 @app.route('/api/data/batch/trimp', methods=['POST'])
 def get_trimp_batch_data():
@@ -2799,71 +2841,57 @@ def get_trimp_batch_data():
         if not (len(date) == 10 and date[4] == '-' and date[7] == '-'):
             return jsonify({'error': f'Invalid date format: {date}. Expected YYYY-MM-DD'}), 400
     
-    conn = get_db_connection()
-    cur = conn.cursor()
+    # Daily rows, TRIMP cached with the current HR parameters and TRIMP overrides for every date in one query
+    from jobs import trimp_cache_prefix
+    batch_data = get_daily_batch_data(dates, 'cached_trimp_data', 'daily_trimp_overrides',
+                                      hash_prefix=trimp_cache_prefix(get_user_hr_parameters()))
+    
+    # Fallback: rebuild time series and calculate TRIMP for cache misses (rare case)
+    misses = [date for date, row in batch_data.items() if row['has_daily_data'] and not row['cached_data']]
+    recalculated = {}
+    if misses:
+        from jobs import build_daily_hr_timeseries_batch, calculate_trimp_with_caching
+        with db_connection() as conn:
+            cur = conn.cursor()
+            enriched_hr_series = build_daily_hr_timeseries_batch(misses, conn, cur)
+            cur.close()
+        for date in misses:
+            recalculated[date] = calculate_trimp_with_caching(date, enriched_hr_series[date], 'daily')
     
     results = {}
-    
-    try:
-        for date in dates:
-            # Get basic data from daily_data table
-            cur.execute("""
-                SELECT heart_rate_series, daily_score, activity_type
-                FROM daily_data 
-                WHERE date = ?
-            """, (date,))
-            
-            data = cur.fetchone()
-            
-            if data:
-                # For batch requests (chart data), try to serve from cached data only
-                from database import get_cached_trimp_data
-                cached_trimp = get_cached_trimp_data(date, 'daily')
-                
-                if cached_trimp:
-                    # Use cached TRIMP data - no need to rebuild time series for charts
-                    trimp_data = cached_trimp['trimp_data'].get('presentation_buckets', {})
-                    total_trimp = cached_trimp['trimp_data'].get('total_trimp', 0.0)
-                else:
-                    # Fallback: rebuild time series and calculate TRIMP (rare case)
-                    from jobs import build_daily_hr_timeseries, calculate_trimp_with_caching
-                    enriched_hr_series = build_daily_hr_timeseries(date, conn, cur)
-                    trimp_results = calculate_trimp_with_caching(date, enriched_hr_series, 'daily')
-                    trimp_data = trimp_results.get('presentation_buckets', {})
-                    total_trimp = trimp_results.get('total_trimp', 0.0)
-                
-                results[date] = {
-                    'date': date,
-                    'presentation_buckets': trimp_data,
-                    'total_trimp': total_trimp,
-                    'daily_score': data['daily_score'],
-                    'activity_type': data['activity_type']
-                }
-            else:
-                # Check for TRIMP overrides even when there's no daily data
-                trimp_overrides = get_user_data('daily_trimp_overrides', date)
-                if trimp_overrides:
-                    try:
-                        overrides_data = json.loads(trimp_overrides)
-                        total_trimp = sum(float(value) for value in overrides_data.values() if value is not None and value != '')
-                        
-                        results[date] = {
-                            'date': date,
-                            'presentation_buckets': overrides_data,
-                            'total_trimp': total_trimp,
-                            'daily_score': None,
-                            'activity_type': None,
-                            'trimp_overrides': overrides_data
-                        }
-                    except (json.JSONDecodeError, ValueError) as e:
-                        logger.error(f"Error parsing TRIMP overrides for {date}: {e}")
-                        results[date] = None
-                else:
+    for date in dates:
+        row = batch_data[date]
+        
+        if row['has_daily_data']:
+            trimp_results = row['cached_data'] if row['cached_data'] else recalculated[date]
+            results[date] = {
+                'date': date,
+                'presentation_buckets': trimp_results.get('presentation_buckets', {}),
+                'total_trimp': trimp_results.get('total_trimp', 0.0),
+                'daily_score': row['daily_score'],
+                'activity_type': row['activity_type']
+            }
+        else:
+            # Check for TRIMP overrides even when there's no daily data
+            trimp_overrides = row['user_data']
+            if trimp_overrides:
+                try:
+                    overrides_data = json.loads(trimp_overrides)
+                    total_trimp = sum(float(value) for value in overrides_data.values() if value is not None and value != '')
+                    
+                    results[date] = {
+                        'date': date,
+                        'presentation_buckets': overrides_data,
+                        'total_trimp': total_trimp,
+                        'daily_score': None,
+                        'activity_type': None,
+                        'trimp_overrides': overrides_data
+                    }
+                except (json.JSONDecodeError, ValueError) as e:
+                    logger.error(f"Error parsing TRIMP overrides for {date}: {e}")
                     results[date] = None
-    
-    finally:
-        cur.close()
-        conn.close()
+            else:
+                results[date] = None
     
     return jsonify({
         'success': True,
@@ -2889,59 +2917,34 @@ def get_oxygen_debt_batch_data():
         if not (len(date) == 10 and date[4] == '-' and date[7] == '-'):
             return jsonify({'error': f'Invalid date format: {date}. Expected YYYY-MM-DD'}), 400
     
-    conn = get_db_connection()
-    cur = conn.cursor()
+    # Daily rows and cached oxygen debt for every date in one query
+    batch_data = get_daily_batch_data(dates, 'cached_oxygen_debt_data')
     
-    results = {}
-    
-    try:
-        for date in dates:
-            # Get basic data from daily_data table
-            cur.execute("""
-                SELECT heart_rate_series, daily_score, activity_type
-                FROM daily_data 
-                WHERE date = ?
-            """, (date,))
-            
-            data = cur.fetchone()
-            
-            if data:
-                # Get oxygen debt data from cache
-                from database import get_cached_oxygen_debt_data
-                cached_oxygen_debt = get_cached_oxygen_debt_data(date, 'daily')
-                
-                oxygen_debt_data = {}
-                
-                if cached_oxygen_debt:
-                    # Use cached oxygen debt data
-                    oxygen_debt_data = cached_oxygen_debt['oxygen_debt_data']
-                else:
-                    # Fallback: calculate oxygen debt from SpO2 data (rare case)
-                    from datetime import datetime
-                    import pytz
-                    uk_tz = pytz.timezone('Europe/London')
-                    start_of_day = uk_tz.localize(datetime.strptime(date, '%Y-%m-%d'))
-                    end_of_day = start_of_day + timedelta(days=1)
-                    start_timestamp = int(start_of_day.timestamp() * 1000)
-                    end_timestamp = int(end_of_day.timestamp() * 1000)
-                    
-                    o2ring_data = get_o2ring_data_for_period(start_timestamp, end_timestamp)
-                    if o2ring_data:
-                        spo2_series = [[row[0], row[1]] for row in o2ring_data]
-                        oxygen_debt_data = calculate_oxygen_debt_with_caching(date, spo2_series, 'daily')
-                
-                results[date] = {
-                    'date': date,
-                    'oxygen_debt': oxygen_debt_data,
-                    'daily_score': data['daily_score'],
-                    'activity_type': data['activity_type']
-                }
-            else:
-                results[date] = None
+    # Fallback: use the nightly SpO2 summary, or calculate oxygen debt from SpO2 data (rare case)
+    misses = [date for date, row in batch_data.items() if row['has_daily_data'] and not row['cached_data']]
+    recalculated = {
+        date: summary['spo2_distribution'].get('oxygen_debt', {})
+        for date, summary in get_spo2_summaries(misses).items()
+    }
+    misses = [date for date in misses if date not in recalculated]
+    for date, o2ring_data in get_o2ring_data_for_dates(misses).items():
+        if o2ring_data:
+            spo2_series = [[row[0], row[1]] for row in o2ring_data]
+            recalculated[date] = calculate_oxygen_debt_with_caching(date, spo2_series, 'daily')
     
-    finally:
-        cur.close()
-        conn.close()
+    results = {}
+    for date in dates:
+        row = batch_data[date]
+        
+        if row['has_daily_data']:
+            results[date] = {
+                'date': date,
+                'oxygen_debt': row['cached_data'] if row['cached_data'] else recalculated.get(date, {}),
+                'daily_score': row['daily_score'],
+                'activity_type': row['activity_type']
+            }
+        else:
+            results[date] = None
     
     return jsonify({
         'success': True,
@@ -2967,240 +2970,91 @@ def get_spo2_distribution_batch_data():
         if not (len(date) == 10 and date[4] == '-' and date[7] == '-'):
             return jsonify({'error': f'Invalid date format: {date}. Expected YYYY-MM-DD'}), 400
     
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    results = {}
+    # Daily rows and cached SpO2 distributions for every date in one query
+    batch_data = get_daily_batch_data(dates, 'cached_spo2_distribution_data')
     
-    try:
-        for date in dates:
-            # Get basic data from daily_data table
-            cur.execute("""
-                SELECT heart_rate_series, daily_score, activity_type
-                FROM daily_data 
-                WHERE date = ?
-            """, (date,))
-            
-            data = cur.fetchone()
-            
-            if data:
-                # Get SpO2 distribution data from cache
-                from database import get_cached_spo2_distribution_data
-                cached_spo2_distribution = get_cached_spo2_distribution_data(date, 'daily')
-                
-                spo2_distribution_data = {}
-                
-                if cached_spo2_distribution:
-                    # Use cached SpO2 distribution data
-                    spo2_distribution_data = cached_spo2_distribution['spo2_distribution_data']
-                else:
-                    # Fallback: calculate SpO2 distribution from raw O2Ring data (rare case)
-                    from datetime import datetime
-                    import pytz
-                    uk_tz = pytz.timezone('Europe/London')
-                    start_of_day = uk_tz.localize(datetime.strptime(date, '%Y-%m-%d'))
-                    end_of_day = start_of_day + timedelta(days=1)
-                    start_timestamp = int(start_of_day.timestamp() * 1000)
-                    end_timestamp = int(end_of_day.timestamp() * 1000)
-                    
-                    o2ring_data = get_o2ring_data_for_period(start_timestamp, end_timestamp)
-                    if o2ring_data:
-                        spo2_distribution_data = calculate_spo2_distribution_with_caching(date, o2ring_data, 'daily')
-                
-                results[date] = {
-                    'date': date,
-                    'spo2_distribution': spo2_distribution_data,
-                    'daily_score': data['daily_score'],
-                    'activity_type': data['activity_type']
-                }
-            else:
-                results[date] = None
+    # Fallback: use the nightly SpO2 summary, or calculate SpO2 distribution from raw O2Ring data (rare case)
+    misses = [date for date, row in batch_data.items() if row['has_daily_data'] and not row['cached_data']]
+    recalculated = {date: summary['spo2_distribution'] for date, summary in get_spo2_summaries(misses).items()}
+    misses = [date for date in misses if date not in recalculated]
+    for date, o2ring_data in get_o2ring_data_for_dates(misses).items():
+        if o2ring_data:
+            recalculated[date] = calculate_spo2_distribution_with_caching(date, o2ring_data, 'daily')
     
-    finally:
-        cur.close()
-        conn.close()
+    results = {}
+    for date in dates:
+        row = batch_data[date]
+        
+        if row['has_daily_data']:
+            results[date] = {
+                'date': date,
+                'spo2_distribution': row['cached_data'] if row['cached_data'] else recalculated.get(date, {}),
+                'daily_score': row['daily_score'],
+                'activity_type': row['activity_type']
+            }
+        else:
+            results[date] = None
     
     return jsonify({
         'success': True,
         'data': results
     })
 
-def calculate_spo2_distribution(spo2_data, start_timestamp=None, end_timestamp=None):
-    """
-    Calculate SpO2 distribution statistics for a given time period.
+@app.route('/api/data/batch/spo2-summary', methods=['POST'])
+def get_spo2_summary_batch_data():
+    """Get nightly SpO2 summaries (ODI, nadir, T90) for multiple dates in a single request."""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
     
-    Args:
-        spo2_data: List of [timestamp, spo2_value, spo2_reminder] tuples
-        start_timestamp: Optional start timestamp in milliseconds (for filtering)
-        end_timestamp: Optional end timestamp in milliseconds (for filtering)
-        
-    Returns:
-        Dictionary with 'at_level' and 'at_or_below_level' statistics
-    """
-    if not spo2_data:
-        return {
-            'at_level': [],
-            'at_or_below_level': [],
-            'total_seconds': 0
-        }
+    data = request.get_json()
+    if not data or 'dates' not in data:
+        return jsonify({'error': 'No dates provided'}), 400
     
-    # Filter data to time period if specified
-    if start_timestamp and end_timestamp:
-        filtered_data = [
-            point for point in spo2_data 
-            if start_timestamp <= point[0] <= end_timestamp
-        ]
-    else:
-        filtered_data = spo2_data
+    dates = data['dates']
+    if not isinstance(dates, list) or len(dates) == 0:
+        return jsonify({'error': 'Invalid dates format'}), 400
     
-    if not filtered_data:
-        return {
-            'at_level': [],
-            'at_or_below_level': [],
-            'total_seconds': 0
-        }
+    # Validate date format for all dates
+    for date in dates:
+        if not (len(date) == 10 and date[4] == '-' and date[7] == '-'):
+            return jsonify({'error': f'Invalid date format: {date}. Expected YYYY-MM-DD'}), 400
     
-    # Sort by timestamp
-    filtered_data.sort(key=lambda x: x[0])
-    
-    # Calculate total time period in seconds
-    total_start = filtered_data[0][0]
-    total_end = filtered_data[-1][0]
-    total_seconds = (total_end - total_start) / 1000  # Convert from milliseconds
-    
-    # Calculate total SpO2 data time (sum of all intervals)
-    total_spo2_seconds = 0
-    for i in range(len(filtered_data) - 1):
-        current_point = filtered_data[i]
-        next_point = filtered_data[i + 1]
-        interval_seconds = (next_point[0] - current_point[0]) / 1000
-        total_spo2_seconds += interval_seconds
-    
-    # Add the last point
-    if filtered_data:
-        total_spo2_seconds += 1  # Assume last point represents 1 second
-    
-    # Initialize counters for each SpO2 level (0-100 to handle all possible values)
-    level_counts = {level: 0 for level in range(0, 101)}
-    
-    # Count seconds at each level
-    # Since O2Ring data is typically recorded every few seconds, we'll interpolate
-    # between consecutive points to get a more accurate time distribution
-    
-    for i in range(len(filtered_data) - 1):
-        current_point = filtered_data[i]
-        next_point = filtered_data[i + 1]
-        
-        current_timestamp = current_point[0]
-        next_timestamp = next_point[0]
-        current_spo2 = current_point[1]
-        
-        # Calculate time interval between points in seconds
-        interval_seconds = (next_timestamp - current_timestamp) / 1000
-        
-        # Add this interval to the appropriate SpO2 level
-        if 0 <= current_spo2 <= 100:
-            level_counts[current_spo2] += interval_seconds
-    
-    # Handle the last point (assume it continues for a short interval)
-    if filtered_data:
-        last_point = filtered_data[-1]
-        last_spo2 = last_point[1]
-        if 0 <= last_spo2 <= 100:
-            # Assume last point represents 1 second
-            level_counts[last_spo2] += 1
-    
-    # Create at_level statistics (80-99 for display, with same logic as individual_levels)
-    at_level_stats = []
-    for level in range(99, 79, -1):  # 99 down to 80
-        if level == 80:
-            # Special case: level 80 includes all time at 80 or below
-            seconds = 0
-            for l in range(80, -1, -1):  # From 80 down to 0
-                seconds += level_counts[l]
-        else:
-            # Regular case: just time at this specific level
-            seconds = level_counts[level]
-        
-        percent = (seconds / total_spo2_seconds * 100) if total_spo2_seconds > 0 else 0
-        at_level_stats.append({
-            'spo2': level,
-            'seconds': round(seconds, 1),
-            'percent': round(percent, 0)  # 0 decimal places
-        })
+    # Precomputed at O2Ring ingest, so this reads one row per night instead of the samples
+    summaries = get_spo2_summaries(dates)
     
-    # Create at_or_below_level statistics (80-99 for display)
-    at_or_below_stats = []
-    for level in range(99, 79, -1):  # 99 down to 80
-        # Calculate cumulative time from current level down to 80 (inclusive)
-        cumulative_seconds = 0
-        for l in range(level, 79, -1):  # From current level down to 80
-            if l == 80:
-                # For level 80, include all time at 80 or below
-                for ll in range(80, -1, -1):
-                    cumulative_seconds += level_counts[ll]
-            else:
-                cumulative_seconds += level_counts[l]
-        
-        percent = (cumulative_seconds / total_spo2_seconds * 100) if total_spo2_seconds > 0 else 0
-        at_or_below_stats.append({
-            'spo2': level,
-            'seconds': round(cumulative_seconds, 1),
-            'percent': round(percent, 0)  # 0 decimal places
-        })
+    results = {}
+    for date in dates:
+        summary = summaries.get(date)
+        if summary:
+            summary = {key: value for key, value in summary.items() if key != 'spo2_distribution'}
+        results[date] = summary
     
-    # Calculate oxygen debt metrics for thresholds 95, 90, and 88
-    oxygen_debt = {}
-    
-    for threshold in [95, 90, 88]:
-        # Calculate time under threshold (cumulative time at threshold-1 and below)
-        time_under_threshold = 0
-        area_under_threshold = 0
-        
-        for level in range(threshold - 1, -1, -1):  # From threshold-1 down to 0
-            if level in level_counts:
-                time_at_level = level_counts[level]
-                time_under_threshold += time_at_level
-                # Calculate area: time * depth below threshold
-                depth_below = threshold - level
-                area_under_threshold += time_at_level * depth_below
-        
-        oxygen_debt[f'time_under_{threshold}'] = round(time_under_threshold, 1)
-        oxygen_debt[f'area_under_{threshold}'] = round(area_under_threshold, 1)
-    
-    return {
-        'at_level': at_level_stats,
-        'at_or_below_level': at_or_below_stats,
-        'total_seconds': round(total_seconds, 1),
-        'oxygen_debt': oxygen_debt
-    }
+    return jsonify({
+        'success': True,
+        'data': results
+    })
 
-def invalidate_oxygen_debt_cache_for_date_range(start_date, end_date):
-    """
-    Invalidate oxygen debt cache for all dates in a given range.
+@app.route('/api/data/<date>/spo2-events')
+def get_daily_spo2_events(date):
+    """Get the desaturation events of a specific night."""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
     
-    Args:
-        start_date: Start date string (YYYY-MM-DD)
-        end_date: End date string (YYYY-MM-DD)
-    """
-    from datetime import datetime, timedelta
+    # Validate date format
+    if not (len(date) == 10 and date[4] == '-' and date[7] == '-'):
+        return jsonify({'error': 'Invalid date format. Expected YYYY-MM-DD'}), 400
     
-    try:
-        # Parse dates
-        start = datetime.strptime(start_date, '%Y-%m-%d')
-        end = datetime.strptime(end_date, '%Y-%m-%d')
-        
-        # Iterate through each date in the range
-        current_date = start
-        while current_date <= end:
-            date_str = current_date.strftime('%Y-%m-%d')
-            invalidate_cached_oxygen_debt_data(date_str, 'daily')
-            current_date += timedelta(days=1)
-            
-        logger.info(f"Invalidated oxygen debt cache for date range {start_date} to {end_date}")
-        
-    except Exception as e:
-        logger.error(f"Error invalidating oxygen debt cache for date range: {e}")
+    drop = request.args.get('drop', DESATURATION_DROPS[0], type=int)
+    if drop not in DESATURATION_DROPS:
+        return jsonify({'error': f'Invalid drop. Expected one of {list(DESATURATION_DROPS)}'}), 400
+    
+    start_timestamp, end_timestamp = london_day_bounds(date)
+    
+    return jsonify({
+        'date': date,
+        'drop': drop,
+        'events': get_spo2_events(start_timestamp, end_timestamp, drop)
+    })
 
 def calculate_oxygen_debt_with_caching(target_date, spo2_data, data_type='daily'):
     """
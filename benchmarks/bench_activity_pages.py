@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Benchmark paging through a long activity history.
+
+Starts a local HTTP stand-in for the Garmin activity search service (with a
+fixed delay per request to mimic a network round trip) holding several years
+of activities, and lists them all with get_activities_by_date (20 per page,
+one request at a time) and with iter_activities_by_date using larger pages
+and prefetching.
+
+Usage: python benchmarks/bench_activity_pages.py
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_fit_batch_upload import make_client
+
+ACTIVITIES = 3000
+LATENCY_SECONDS = 0.05
+
+
+class SearchHandler(BaseHTTPRequestHandler):
+    requests = 0
+    activities = [{'activityId': n, 'activityName': f"Activity {n}", 'distance': 5000.0 + n}
+                  for n in range(ACTIVITIES)]
+
+    def do_GET(self):
+        SearchHandler.requests += 1
+        time.sleep(LATENCY_SECONDS)
+        query = parse_qs(urlsplit(self.path).query)
+        start, limit = int(query['start'][0]), int(query['limit'][0])
+        body = json.dumps(self.activities[start:start + limit]).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def main():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SearchHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api = make_client(server.server_address[1])
+
+    runs = (
+        ('get_activities_by_date', lambda: api.get_activities_by_date('2015-01-01')),
+        ('page 20, prefetch 4', lambda: api.iter_activities_by_date('2015-01-01', prefetch=4)),
+        ('page 200, prefetch 0', lambda: api.iter_activities_by_date('2015-01-01', page_size=200)),
+        ('page 200, prefetch 4', lambda: api.iter_activities_by_date('2015-01-01', page_size=200, prefetch=4)),
+    )
+
+    print(f"{ACTIVITIES} activities, {LATENCY_SECONDS * 1000:.0f} ms per request")
+    print(f"{'listing':<24} {'requests':>8} {'seconds':>8}")
+    for name, listing in runs:
+        SearchHandler.requests = 0
+        started = time.perf_counter()
+        count = sum(1 for _ in listing())
+        elapsed = time.perf_counter() - started
+        assert count == ACTIVITIES, count
+        # Let prefetched requests past the last page finish before counting the next run
+        time.sleep(2 * LATENCY_SECONDS)
+        print(f"{name:<24} {SearchHandler.requests:>8} {elapsed:>8.2f}")
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Benchmark database connections opened per request.
+
+Runs /api/activities/<date> and /api/data/<date> against a temporary database
+with a day of synthetic activities, once with the request-scoped shared
+connection and once with every helper opening its own connection (the
+previous behaviour), and reports connections opened and time per request.
+
+Usage: python benchmarks/bench_db_connections.py
+"""
+
+import contextlib
+import io
+import json
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+from database import encode_series, init_database
+
+DATE = '2024-07-03'
+START_MS = 1_720_000_000_000
+ACTIVITY_COUNT = 10
+REQUESTS = 20
+
+
+def populate_database():
+    """Create the schema and one day of daily and activity data."""
+    init_database()
+    conn = database.get_db_connection()
+    conn.execute("CREATE TABLE IF NOT EXISTS hr_parameters (id INTEGER PRIMARY KEY, resting_hr INTEGER, max_hr INTEGER, updated_at TIMESTAMP)")
+    conn.execute("INSERT INTO hr_parameters (id, resting_hr, max_hr) VALUES (1, 48, 167)")
+    daily = [[START_MS + i * 120_000, 60 + i % 40] for i in range(720)]
+    conn.execute("INSERT INTO daily_data (date, heart_rate_series, trimp_data) VALUES (?, ?, ?)",
+                 (DATE, encode_series(daily), json.dumps({})))
+    for index in range(ACTIVITY_COUNT):
+        start = START_MS + index * 3_600_000
+        series = [[start + i * 1000, 90 + i % 60] for i in range(1800)]
+        conn.execute("""
+            INSERT INTO activity_data (activity_id, date, activity_name, activity_type, start_time_local,
+                                       duration_seconds, heart_rate_series, trimp_data, total_trimp)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (str(index), DATE, f"Activity {index}", 'running', f"{DATE}T{index:02d}:00:00", 1800,
+              encode_series(series), json.dumps({}), 0.0))
+    conn.commit()
+    conn.close()
+
+
+def measure(app, url, shared):
+    """Return (connections opened, seconds) per request."""
+    opened = []
+    connect = sqlite3.connect
+
+    def counting_connect(*args, **kwargs):
+        opened.append(None)
+        return connect(*args, **kwargs)
+
+    sqlite3.connect = counting_connect
+    try:
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['user_id'] = 1
+        hooks = app.before_request_funcs.get(None, [])
+        saved_hooks = list(hooks)
+        if not shared:
+            hooks.clear()
+        try:
+            started = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                for _ in range(REQUESTS):
+                    response = client.get(url)
+                    assert response.status_code == 200, response.status_code
+            elapsed = time.perf_counter() - started
+        finally:
+            hooks[:] = saved_hooks
+    finally:
+        sqlite3.connect = connect
+
+    return len(opened) / REQUESTS, elapsed / REQUESTS
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.chdir(tmp_dir)
+        populate_database()
+
+        from app import app
+        app.testing = True
+        logging.disable(logging.INFO)
+
+        print(f"{'endpoint':<26} {'conns before':>12} {'conns after':>11} {'ms before':>9} {'ms after':>8}")
+        for url in (f"/api/activities/{DATE}", f"/api/data/{DATE}"):
+            before_count, before_time = measure(app, url, shared=False)
+            after_count, after_time = measure(app, url, shared=True)
+            print(f"{url:<26} {before_count:>12.0f} {after_count:>11.0f} {before_time * 1000:>9.1f} {after_time * 1000:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Benchmark batched body composition uploads.
+
+Starts a local HTTP stand-in for the Garmin upload service (with a fixed delay
+per request to mimic a network round trip) and uploads a few years of daily
+weigh-ins twice: once per measurement with add_body_composition, and once with
+add_body_composition_batch.
+
+Usage: python benchmarks/bench_fit_batch_upload.py
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from requests.adapters import HTTPAdapter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from garth.auth_tokens import OAuth1Token, OAuth2Token
+
+from garminconnect import Garmin
+
+MEASUREMENTS = 3 * 365
+LATENCY_SECONDS = 0.02
+
+
+class UploadHandler(BaseHTTPRequestHandler):
+    uploads = 0
+    bytes_received = 0
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        UploadHandler.uploads += 1
+        UploadHandler.bytes_received += len(body)
+        time.sleep(LATENCY_SECONDS)
+        response = json.dumps({'detailedImportResult': {'successes': []}}).encode()
+        self.send_response(202)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+
+class LocalAdapter(HTTPAdapter):
+    """Sends https://connectapi.garmin.com/... requests to the local stand-in."""
+
+    def __init__(self, port):
+        super().__init__()
+        self.port = port
+
+    def send(self, request, **kwargs):
+        path = request.url.split('/', 3)[3]
+        request.url = f"http://127.0.0.1:{self.port}/{path}"
+        return super().send(request, **kwargs)
+
+
+def make_client(port):
+    api = Garmin('user@example.com', 'secret')
+    far_future = int(time.time()) + 86400
+    api.garth.configure(
+        oauth1_token=OAuth1Token(oauth_token='token', oauth_token_secret='secret'),
+        oauth2_token=OAuth2Token(scope='', jti='', token_type='Bearer', access_token='token',
+                                 refresh_token='refresh', expires_in=86400, expires_at=far_future,
+                                 refresh_token_expires_in=86400, refresh_token_expires_at=far_future),
+    )
+    api.garth.sess.mount('https://', LocalAdapter(port))
+    return api
+
+
+def measure(upload):
+    UploadHandler.uploads = 0
+    UploadHandler.bytes_received = 0
+    started = time.perf_counter()
+    upload()
+    return time.perf_counter() - started, UploadHandler.uploads, UploadHandler.bytes_received
+
+
+def main():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), UploadHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api = make_client(server.server_address[1])
+
+    start = datetime(2021, 1, 1, 7, 30)
+    records = [
+        {'timestamp': (start + timedelta(days=day)).isoformat(), 'weight': 80 - day % 100 / 50, 'percent_fat': 22.0}
+        for day in range(MEASUREMENTS)
+    ]
+
+    def per_record():
+        for record in records:
+            api.add_body_composition(**record)
+
+    def batched():
+        api.add_body_composition_batch(records)
+
+    print(f"{MEASUREMENTS} measurements, {LATENCY_SECONDS * 1000:.0f} ms per request")
+    print(f"{'path':<12} {'requests':>8} {'kB sent':>8} {'seconds':>8}")
+    for name, upload in (('per record', per_record), ('batched', batched)):
+        elapsed, uploads, sent = measure(upload)
+        print(f"{name:<12} {uploads:>8} {sent / 1024:>8.0f} {elapsed:>8.2f}")
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
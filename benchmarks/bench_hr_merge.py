@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Benchmark merging activity HR data into the daily HR time series.
+
+Compares merge_hr_series against the previous per-segment filter and re-sort
+on synthetic days with 1 to 50 activities.
+
+Usage: python benchmarks/bench_hr_merge.py
+"""
+
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jobs import find_continuous_segments, merge_hr_series
+
+DAY_START_MS = 1_720_000_000_000
+ACTIVITY_COUNTS = [1, 2, 5, 10, 20, 50]
+
+
+def legacy_merge(daily_hr_series, activity_hr_series_list):
+    """Per-segment filter and re-sort, as build_daily_hr_timeseries used to do."""
+    for activity_hr_series in activity_hr_series_list:
+        if not activity_hr_series:
+            continue
+        for segment in find_continuous_segments(activity_hr_series):
+            segment_start = segment[0][0]
+            segment_end = segment[-1][0]
+            daily_hr_series = [point for point in daily_hr_series
+                               if point[0] < segment_start or point[0] > segment_end]
+            daily_hr_series.extend(segment)
+        daily_hr_series.sort(key=lambda x: x[0])
+    return daily_hr_series
+
+
+def make_day(activity_count, seed=0):
+    """Build a 1 Hz daily series and activity_count 1 Hz activities with a few pauses each."""
+    rng = random.Random(seed)
+    daily = [[DAY_START_MS + i * 1000, rng.randint(45, 110)] for i in range(86_400)]
+    activities = []
+    slot = 86_400 // activity_count
+    for index in range(activity_count):
+        ts = DAY_START_MS + (index * slot + rng.randint(0, slot // 4)) * 1000
+        series = []
+        for _ in range(min(3600, slot // 2)):
+            ts += 1000 if rng.random() > 0.002 else 120_000
+            series.append([ts, rng.randint(90, 180)])
+        activities.append(series)
+    return daily, activities
+
+
+def main():
+    print(f"{'activities':>10} {'legacy ms':>10} {'merge ms':>10} {'speedup':>8}")
+    for activity_count in ACTIVITY_COUNTS:
+        daily, activities = make_day(activity_count)
+        assert merge_hr_series(daily, activities) == legacy_merge(daily, activities)
+
+        repeats = 3
+        legacy = min(timeit.repeat(lambda: legacy_merge(daily, activities), number=1, repeat=repeats))
+        merged = min(timeit.repeat(lambda: merge_hr_series(daily, activities), number=1, repeat=repeats))
+        print(f"{activity_count:>10} {legacy * 1000:>10.1f} {merged * 1000:>10.1f} {legacy / merged:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
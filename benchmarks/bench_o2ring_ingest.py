@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Benchmark O2Ring CSV ingestion.
+
+Writes a synthetic folder of 30 nights (about 8,000 rows each at 4 s sampling)
+and loads it into a temporary database twice: once with the previous approach
+(whole file read into memory, a dict per row and one INSERT per row) and once
+through /api/load-o2ring-files, which streams rows into executemany and
+rebuilds the timestamp index after the load.
+
+Usage: python benchmarks/bench_o2ring_ingest.py
+"""
+
+import csv
+import io
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+from database import init_database
+
+NIGHTS = 30
+ROWS_PER_NIGHT = 8000
+HEADER = ['Time', 'SpO2(%)', 'Pulse Rate(bpm)', 'Motion', 'SpO2 Reminder', 'PR Reminder', '']
+
+
+def write_folder(folder):
+    """Write NIGHTS synthetic O2Ring CSV files into folder."""
+    rng = random.Random(1)
+    for night in range(NIGHTS):
+        start = datetime(2024, 3, 1, 22, 30) + timedelta(days=night)
+        with open(os.path.join(folder, f"O2Ring_{start:%Y%m%d}.csv"), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(HEADER)
+            spo2, pulse = 95, 60
+            for index in range(ROWS_PER_NIGHT):
+                spo2 = max(80, min(99, spo2 + rng.randint(-1, 1)))
+                pulse = max(45, min(110, pulse + rng.randint(-2, 2)))
+                failed = rng.random() < 0.001
+                when = start + timedelta(seconds=4 * index)
+                writer.writerow([when.strftime('%I:%M:%S%p %b %d, %Y'), 255 if failed else spo2, pulse,
+                                 rng.randint(0, 3), 0, 0, ''])
+
+
+def legacy_load(folder):
+    """The previous ingest loop, kept here for comparison."""
+    from o2ring_timestamps import parse_o2ring_timestamp_strptime as parse_o2ring_timestamp
+
+    for filename in sorted(os.listdir(folder)):
+        with open(os.path.join(folder, filename), 'rb') as f:
+            reader = csv.reader(io.StringIO(f.read().decode('utf-8')))
+        next(reader)
+        all_rows, invalid_indices = [], set()
+        for row in reader:
+            timestamp = parse_o2ring_timestamp(row[0].strip())
+            spo2_value, heart_rate = int(row[1]), int(row[2])
+            if spo2_value == 255 or heart_rate == 65535:
+                invalid_indices.update({len(all_rows), len(all_rows) - 1})
+                continue
+            all_rows.append({'timestamp': timestamp, 'spo2_value': spo2_value, 'heart_rate': heart_rate,
+                             'motion': int(row[3]), 'spo2_reminder': int(row[4]), 'pr_reminder': int(row[5])})
+        data_points = [point for i, point in enumerate(all_rows) if i not in invalid_indices]
+
+        conn = database.get_db_connection()
+        cur = conn.cursor()
+        cur.execute("INSERT INTO o2ring_files (filename, first_timestamp, last_timestamp, row_count) VALUES (?, ?, ?, ?)",
+                    (filename, data_points[0]['timestamp'], data_points[-1]['timestamp'], len(data_points)))
+        file_id = cur.lastrowid
+        for point in data_points:
+            cur.execute("""
+                INSERT INTO o2ring_data (file_id, timestamp, spo2_value, heart_rate, motion, spo2_reminder, pr_reminder)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (file_id, point['timestamp'], point['spo2_value'], point['heart_rate'],
+                  point['motion'], point['spo2_reminder'], point['pr_reminder']))
+        conn.commit()
+        cur.close()
+        conn.close()
+
+
+def reset_database():
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists('garmin_hr.db' + suffix):
+            os.remove('garmin_hr.db' + suffix)
+    init_database()
+
+
+def count_rows():
+    conn = database.get_db_connection()
+    count = conn.execute("SELECT COUNT(*) FROM o2ring_data").fetchone()[0]
+    conn.close()
+    return count
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        folder = os.path.join(tmp_dir, 'o2ring')
+        os.makedirs(folder)
+        write_folder(folder)
+        os.chdir(tmp_dir)
+
+        from app import app
+        app.testing = True
+        logging.disable(logging.WARNING)
+
+        reset_database()
+        started = time.perf_counter()
+        legacy_load(folder)
+        legacy_time = time.perf_counter() - started
+        legacy_rows = count_rows()
+
+        reset_database()
+        database.set_config_value('o2ring_csv_folder', folder)
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['user_id'] = 1
+            session['user_role'] = 'admin'
+        started = time.perf_counter()
+        response = client.post('/api/load-o2ring-files')
+        bulk_time = time.perf_counter() - started
+        assert response.get_json()['loaded_count'] == NIGHTS, response.get_json()
+        bulk_rows = count_rows()
+
+        assert bulk_rows == legacy_rows, (bulk_rows, legacy_rows)
+        print(f"{NIGHTS} nights, {bulk_rows} rows")
+        print(f"per-row INSERT:       {legacy_time:6.2f} s ({legacy_rows / legacy_time:8.0f} rows/s)")
+        print(f"streaming executemany: {bulk_time:6.2f} s ({bulk_rows / bulk_time:8.0f} rows/s)")
+
+
+if __name__ == '__main__':
+    main()
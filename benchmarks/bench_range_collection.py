@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Benchmark collecting a month of data as one range job instead of per-day jobs.
+
+Starts a local HTTP stand-in for Garmin Connect (with a fixed delay per request
+to mimic a network round trip) serving daily heart rates, two activities per
+day (listed per day and through the activity search) and their original FIT
+file. Collects 30 days once as per-day jobs run three at a time, as the job
+queue did for a date range, and once with a single collect_garmin_range_job.
+Finally the range is synced again, which skips the settled days.
+
+Usage: python benchmarks/bench_range_collection.py
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_fit_batch_upload import make_client
+
+from database import init_database
+from jobs import collect_garmin_data_job
+from range_collection import collect_garmin_range_job
+
+DAYS = 30
+JOB_WORKERS = 3
+LATENCY_SECONDS = 0.05
+FIT_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests',
+                        '12129115726_ACTIVITY.fit')
+
+
+def day_activities(day):
+    return [{'activityId': int(day.replace('-', '')) * 10 + n, 'activityName': 'Walk',
+             'startTimeLocal': f"{day} 0{n + 1}:10:57", 'duration': 10} for n in range(2)]
+
+
+class GarminHandler(BaseHTTPRequestHandler):
+    requests = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with GarminHandler.lock:
+            GarminHandler.requests += 1
+        time.sleep(LATENCY_SECONDS)
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        if url.path.startswith('/wellness-service/wellness/dailyHeartRate/'):
+            start = int(datetime.fromisoformat(query['date'][0]).timestamp() * 1000)
+            body = json.dumps({'heartRateValues': [[start + i * 120000, 55 + i % 40] for i in range(720)]}).encode()
+        elif url.path.startswith('/mobile-gateway/heartRate/forDate/'):
+            body = json.dumps(day_activities(url.path.rsplit('/', 1)[1])).encode()
+        elif url.path == '/activitylist-service/activities/search/activities':
+            first = date.fromisoformat(query['startDate'][0])
+            last = date.fromisoformat(query['endDate'][0])
+            activities = [activity for offset in range((last - first).days + 1)
+                          for activity in day_activities((first + timedelta(days=offset)).isoformat())]
+            start, limit = int(query['start'][0]), int(query['limit'][0])
+            body = json.dumps(activities[start:start + limit]).encode()
+        elif url.path.startswith('/download-service/files/activity/'):
+            with open(FIT_FILE, 'rb') as f:
+                body = f.read()
+        else:
+            body = b'{}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def per_day_jobs(api, days):
+    with ThreadPoolExecutor(max_workers=JOB_WORKERS) as pool:
+        list(pool.map(lambda day: collect_garmin_data_job(day, str(uuid.uuid4()), api=api), days))
+
+
+def range_job(api, days):
+    collect_garmin_range_job(days[0], days[-1], str(uuid.uuid4()), api=api)
+
+
+def main():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), GarminHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.disable(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.chdir(tmp_dir)
+        init_database()
+        conn = sqlite3.connect('garmin_hr.db')
+        conn.execute("CREATE TABLE hr_parameters (id INTEGER PRIMARY KEY, resting_hr INTEGER, max_hr INTEGER)")
+        conn.execute("INSERT INTO hr_parameters (resting_hr, max_hr) VALUES (48, 180)")
+        conn.commit()
+        conn.close()
+
+        api = make_client(server.server_address[1])
+        api.display_name = 'runner'
+
+        first_day = date.today() - timedelta(days=DAYS + 7)
+        days = [(first_day + timedelta(days=offset)).isoformat() for offset in range(DAYS)]
+
+        print(f"{DAYS} days, 2 activities per day, {LATENCY_SECONDS * 1000:.0f} ms per request")
+        print(f"{'run':<14} {'requests':>8} {'seconds':>8}")
+        runs = (('per-day jobs', per_day_jobs, True), ('range job', range_job, True), ('range re-sync', range_job, False))
+        for name, collect, from_scratch in runs:
+            if from_scratch:
+                # Forget the previous run's sync state so every day is fetched again
+                conn = sqlite3.connect('garmin_hr.db')
+                conn.execute("DELETE FROM sync_state")
+                conn.commit()
+                conn.close()
+            GarminHandler.requests = 0
+            started = time.perf_counter()
+            collect(api, days)
+            elapsed = time.perf_counter() - started
+            print(f"{name:<14} {GarminHandler.requests:>8} {elapsed:>8.2f}")
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
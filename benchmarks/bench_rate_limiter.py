@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Benchmark a bulk backfill against a rate limited server.
+
+Starts a local HTTP stand-in for Garmin Connect that allows 20 requests per
+second (with a burst of 10) and answers anything beyond that with 429 and a
+Retry-After header, then fetches a year of daily heart rates from 8 threads:
+once with a bare client (throttled days fail, as they did before), and once
+through a RateLimiter that backs off, honours Retry-After and adapts its
+concurrency. The limiter's own rate is deliberately set to twice what the
+server allows.
+
+Usage: python benchmarks/bench_rate_limiter.py
+"""
+
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_fit_batch_upload import make_client
+
+from garminconnect.ratelimit import RateLimiter
+
+DAYS = 365
+THREADS = 8
+SERVER_RATE = 20
+LATENCY_SECONDS = 0.02
+
+
+class ThrottlingHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    lock = threading.Lock()
+    tokens = 10.0
+    updated_at = time.monotonic()
+    served = 0
+    throttled = 0
+
+    @classmethod
+    def take_token(cls):
+        with cls.lock:
+            now = time.monotonic()
+            cls.tokens = min(10.0, cls.tokens + (now - cls.updated_at) * SERVER_RATE)
+            cls.updated_at = now
+            if cls.tokens < 1:
+                cls.throttled += 1
+                return False
+            cls.tokens -= 1
+            cls.served += 1
+            return True
+
+    def do_GET(self):
+        time.sleep(LATENCY_SECONDS)
+        if self.take_token():
+            status, body = 200, json.dumps({'heartRateValues': [[0, 60]]}).encode()
+        else:
+            status, body = 429, b'{}'
+        self.send_response(status)
+        if status == 429:
+            self.send_header('Retry-After', '1')
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def backfill(api, days):
+    def fetch(day):
+        try:
+            api.get_heart_rates(day)
+            return True
+        except Exception:
+            return False
+
+    ThrottlingHandler.served = ThrottlingHandler.throttled = 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(THREADS) as pool:
+        results = list(pool.map(fetch, days))
+    return time.perf_counter() - started, results.count(True), results.count(False)
+
+
+def main():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ThrottlingHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.disable(logging.WARNING)
+
+    first_day = date(2023, 1, 1)
+    days = [(first_day + timedelta(days=offset)).isoformat() for offset in range(DAYS)]
+
+    api = make_client(server.server_address[1])
+    api.display_name = 'runner'
+    print(f"{DAYS} days from {THREADS} threads, server allows {SERVER_RATE} requests/s")
+    print(f"{'client':<14} {'ok':>5} {'failed':>6} {'429s':>5} {'seconds':>8}")
+
+    elapsed, ok, failed = backfill(api, days)
+    print(f"{'no limiter':<14} {ok:>5} {failed:>6} {ThrottlingHandler.throttled:>5} {elapsed:>8.2f}")
+
+    time.sleep(1)
+    api.rate_limiter = RateLimiter(rate=SERVER_RATE * 2, burst=10, max_concurrency=THREADS,
+                                   max_retries=10, backoff_base=0.1, backoff_max=2)
+    elapsed, ok, failed = backfill(api, days)
+    print(f"{'RateLimiter':<14} {ok:>5} {failed:>6} {ThrottlingHandler.throttled:>5} {elapsed:>8.2f}")
+    print(f"limiter: {api.rate_limiter.metrics()}")
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Benchmark re-collecting a month of data with the on-disk response cache.
+
+Starts a local HTTP stand-in for Garmin Connect (with a fixed delay per request
+to mimic a network round trip) serving daily heart rates, one activity per day
+and its original FIT file (the same test file for every activity). Then runs
+the data collection job for 30 past days twice through a client with a
+ResponseCache; the second run should be served entirely from the cache.
+
+Usage: python benchmarks/bench_response_cache.py
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_fit_batch_upload import make_client
+
+from database import init_database
+from garminconnect.cache import ResponseCache
+from jobs import collect_garmin_data_job
+
+DAYS = 30
+LATENCY_SECONDS = 0.05
+FIT_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests',
+                        '12129115726_ACTIVITY.fit')
+
+
+class GarminHandler(BaseHTTPRequestHandler):
+    requests = 0
+
+    def do_GET(self):
+        GarminHandler.requests += 1
+        time.sleep(LATENCY_SECONDS)
+        path = self.path.split('?')[0]
+        if path.startswith('/wellness-service/wellness/dailyHeartRate/'):
+            day = self.path.split('date=')[1]
+            start = int(datetime.fromisoformat(day).timestamp() * 1000)
+            body = json.dumps({'heartRateValues': [[start + i * 120000, 55 + i % 40] for i in range(720)]}).encode()
+        elif path.startswith('/mobile-gateway/heartRate/forDate/'):
+            day = path.rsplit('/', 1)[1]
+            body = json.dumps([{'activityId': int(day.replace('-', '')), 'activityName': 'Walk',
+                                'startTimeLocal': f"{day} 01:10:57", 'duration': 10}]).encode()
+        elif path.startswith('/download-service/files/activity/'):
+            with open(FIT_FILE, 'rb') as f:
+                body = f.read()
+        else:
+            body = b'{}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def collect(api, days):
+    GarminHandler.requests = 0
+    started = time.perf_counter()
+    for day in days:
+        collect_garmin_data_job(day, str(uuid.uuid4()), api=api)
+    return time.perf_counter() - started, GarminHandler.requests
+
+
+def main():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), GarminHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.disable(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.chdir(tmp_dir)
+        init_database()
+        conn = sqlite3.connect('garmin_hr.db')
+        conn.execute("CREATE TABLE hr_parameters (id INTEGER PRIMARY KEY, resting_hr INTEGER, max_hr INTEGER)")
+        conn.execute("INSERT INTO hr_parameters (resting_hr, max_hr) VALUES (48, 180)")
+        conn.commit()
+        conn.close()
+
+        api = make_client(server.server_address[1])
+        api.display_name = 'runner'
+        api.response_cache = ResponseCache(os.path.join(tmp_dir, 'garmin_cache.db'))
+
+        first_day = date.today() - timedelta(days=DAYS + 7)
+        days = [(first_day + timedelta(days=offset)).isoformat() for offset in range(DAYS)]
+
+        print(f"{DAYS} days, {LATENCY_SECONDS * 1000:.0f} ms per request")
+        print(f"{'run':<8} {'requests':>8} {'seconds':>8}")
+        for name in ('cold', 'cached'):
+            elapsed, requests = collect(api, days)
+            print(f"{name:<8} {requests:>8} {elapsed:>8.2f}")
+        print(f"cache: {api.response_cache.stats()}")
+        api.response_cache.close()
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Benchmark the binary series format against the legacy JSON text storage.
+
+Reports stored size and decode time for typical daily, activity HR and
+breathing rate series.
+
+Usage: python benchmarks/bench_series_codec.py
+"""
+
+import json
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import decode_series, encode_series
+
+START_MS = 1_720_000_000_000
+
+
+def make_series():
+    """Build synthetic series shaped like the ones collected from Garmin."""
+    rng = random.Random(0)
+    return {
+        'daily HR (2 min)': [[START_MS + i * 120_000, rng.choice([None, rng.randint(45, 110)])] for i in range(720)],
+        'activity HR (1 Hz, 1 h)': [[float(START_MS + i * 1000), float(rng.randint(80, 180))] for i in range(3600)],
+        'breathing rate (1 Hz, 1 h)': [[float(START_MS + i * 1000), round(rng.uniform(10, 30), 2)] for i in range(3600)],
+    }
+
+
+def main():
+    print(f"{'series':<28} {'json B':>8} {'binary B':>9} {'ratio':>6} {'json us':>8} {'binary us':>10} {'speedup':>8}")
+    for name, series in make_series().items():
+        json_value = json.dumps(series)
+        binary_value = encode_series(series)
+        assert decode_series(binary_value) == json.loads(json_value)
+
+        number = 200
+        json_time = min(timeit.repeat(lambda: json.loads(json_value), number=number, repeat=3)) / number
+        binary_time = min(timeit.repeat(lambda: decode_series(binary_value), number=number, repeat=3)) / number
+        print(f"{name:<28} {len(json_value):>8} {len(binary_value):>9} {len(json_value) / len(binary_value):>5.1f}x "
+              f"{json_time * 1e6:>8.0f} {binary_time * 1e6:>10.0f} {json_time / binary_time:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
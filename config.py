@@ -17,6 +17,37 @@ API_CONFIG = {
     'MAX_DATE_RANGE_DAYS': 30,
     'MAX_ACTIVITIES_LIMIT': 9999,
     'UNIQUE_TIMESTAMP_THRESHOLD': 100,
+    'TOKEN_REFRESH_MARGIN_SECONDS': 600,  # Refresh the Garmin OAuth2 token this long before it expires
+    'O2RING_INDEX_REBUILD_FILES': 5,  # Folder loads this large drop the O2Ring timestamp index and rebuild it at the end
+    'ACTIVITY_FIT_DOWNLOAD': True,  # Read activity HR from the original FIT file instead of downsampled details
+    'RESPONSE_CACHE_PATH': 'garmin_cache.db',  # On-disk cache of Garmin API responses, '' to disable
+    'RESPONSE_CACHE_MAX_BYTES': 512 * 1024 * 1024,  # Least recently used responses are evicted above this size
+    'RANGE_COLLECTION_WORKERS': 4,  # Parallel Garmin requests within one date range collection job
+    'ACTIVITY_FETCH_WORKERS': 4,  # Parallel activity downloads within one day's collection
+    'SYNC_SETTLE_DAYS': 2,  # Days fetched this long after the fact are final and skipped by range and incremental syncs
+}
+
+# Background Job Executor
+JOB_CONFIG = {
+    'MAX_WORKERS': 3,  # Data collection jobs running at once
+    'REQUESTS_PER_SECOND': 1.0,  # Token bucket refill rate for Garmin API calls
+    'BURST': 5,  # Token bucket capacity
+    'REQUEST_RETRIES': 3,  # Retries of a single throttled request before the job sees the 429
+    'REQUEST_BACKOFF_BASE_SECONDS': 2,  # Backoff before the first request retry, doubled (with jitter) for each further one
+    'MAX_RETRIES': 4,  # Retries after a 429 before the job fails
+    'RETRY_BASE_SECONDS': 30,  # First retry delay, doubled for each further retry
+    'RETRY_MAX_SECONDS': 600,
+    'POLL_INTERVAL_SECONDS': 5,  # How often idle workers check the queue
+    'STALE_JOB_SECONDS': 1800,  # 'running' jobs older than this are requeued on startup
+    'RECOMPUTE_PROCESSES': 0,  # Processes calculating TRIMP when derived data is recomputed, 0 for one per core
+    'RECOMPUTE_CHUNK_SIZE': 100,  # Days or activities read, calculated and written back together in a recompute
+}
+
+# SpO2 Analytics Configuration
+SPO2_CONFIG = {
+    'BASELINE_WINDOW_SECONDS': 120,  # Desaturations are measured against the mean SpO2 of this window before each sample
+    'MIN_EVENT_SECONDS': 10,  # Shorter dips below the baseline are not counted as desaturations
+    'MAX_SAMPLE_GAP_SECONDS': 60,  # Longer gaps between samples are not recording time and end a desaturation
 }
 
 # Server Configuration
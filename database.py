@@ -4,12 +4,19 @@ Database utilities for Garmin Heart Rate Analyzer
 """
 
 import sqlite3
+import threading
+from contextlib import contextmanager
 from cryptography.fernet import Fernet
 import os
 from dotenv import load_dotenv
 import logging
 import json
 import hashlib
+import marshal
+import math
+import struct
+import zlib
+import numpy as np
 
 # Load environment variables
 load_dotenv('env.local')
@@ -23,12 +30,77 @@ else:
 
 logger = logging.getLogger(__name__)
 
+# Connection shared by db_connection() callers on the current thread, if a scope is open
+_connection_scope = threading.local()
+
 def get_db_connection():
     """Create a SQLite database connection."""
     conn = sqlite3.connect('garmin_hr.db')
     conn.row_factory = sqlite3.Row
+    # Safe with WAL and avoids an fsync per commit
+    conn.execute("PRAGMA synchronous = NORMAL")
     return conn
 
+def open_connection_scope():
+    """
+    Start sharing one connection between db_connection() calls on this thread.
+    
+    Scopes nest; the connection is closed when the outermost scope is closed.
+    """
+    depth = getattr(_connection_scope, 'depth', 0)
+    if depth == 0:
+        _connection_scope.connection = None
+    _connection_scope.depth = depth + 1
+
+def close_connection_scope():
+    """End a scope opened with open_connection_scope(), closing the shared connection."""
+    depth = getattr(_connection_scope, 'depth', 0)
+    if depth == 0:
+        return
+    
+    _connection_scope.depth = depth - 1
+    if depth == 1:
+        conn = _connection_scope.connection
+        _connection_scope.connection = None
+        if conn is not None:
+            conn.rollback()
+            conn.close()
+
+@contextmanager
+def connection_scope():
+    """Context manager form of open_connection_scope()/close_connection_scope()."""
+    open_connection_scope()
+    try:
+        yield
+    finally:
+        close_connection_scope()
+
+@contextmanager
+def db_connection():
+    """
+    Context manager yielding a database connection.
+    
+    Inside a connection scope (e.g. a Flask request) the scope's connection is
+    opened on first use and reused; otherwise a new connection is opened and
+    closed on exit. Uncommitted changes are rolled back if the block raises.
+    """
+    if getattr(_connection_scope, 'depth', 0) == 0:
+        conn = get_db_connection()
+        try:
+            yield conn
+        finally:
+            conn.close()
+        return
+    
+    if _connection_scope.connection is None:
+        _connection_scope.connection = get_db_connection()
+    conn = _connection_scope.connection
+    try:
+        yield conn
+    except Exception:
+        conn.rollback()
+        raise
+
 def encrypt_password(password: str) -> str:
     """Encrypt a password using Fernet."""
     return cipher_suite.encrypt(password.encode()).decode()
@@ -39,35 +111,36 @@ def decrypt_password(encrypted_password: str) -> str:
 
 def update_job_status(job_id: str, status: str, result: str = None, error_message: str = None):
     """Update the status of a background job."""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    cur.execute("""
-        UPDATE background_jobs 
-        SET status = ?, result = ?, error_message = ?, updated_at = CURRENT_TIMESTAMP
-        WHERE job_id = ?
-    """, (status, result, error_message, job_id))
-    
-    conn.commit()
-    cur.close()
-    conn.close()
+    with db_connection() as conn:
+        cur = conn.cursor()
+        
+        cur.execute("""
+            UPDATE background_jobs 
+            SET status = ?, result = ?, error_message = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE job_id = ?
+        """, (status, result, error_message, job_id))
+        
+        conn.commit()
+        cur.close()
 
 def get_user_hr_parameters():
     """Get system HR parameters (resting_hr, max_hr)."""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
+    with db_connection() as conn:
+        cur = conn.cursor()
+        parameters = read_hr_parameters(cur)
+        cur.close()
+    return parameters
+
+def read_hr_parameters(cur):
+    """Read the system HR parameters (resting_hr, max_hr) on the caller's cursor, e.g. inside a transaction."""
     cur.execute("SELECT resting_hr, max_hr FROM hr_parameters LIMIT 1")
-    
     result = cur.fetchone()
-    cur.close()
-    conn.close()
     
     if result:
-        logger.info(f"get_user_hr_parameters: Found HR parameters - resting: {result['resting_hr']}, max: {result['max_hr']}")
+        logger.info(f"read_hr_parameters: Found HR parameters - resting: {result['resting_hr']}, max: {result['max_hr']}")
         return result['resting_hr'], result['max_hr']
     else:
-        logger.warning(f"get_user_hr_parameters: No HR parameters found in database, using defaults")
+        logger.warning(f"read_hr_parameters: No HR parameters found in database, using defaults")
         # Default values for Pete
         return 48, 167
 
@@ -82,18 +155,17 @@ def get_user_data(data_type: str, target_id: str):
     Returns:
         The data content or None if not found
     """
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    cur.execute("""
-        SELECT data_content
-        FROM user_data 
-        WHERE data_type = ? AND target_id = ?
-    """, (data_type, target_id))
-    
-    result = cur.fetchone()
-    cur.close()
-    conn.close()
+    with db_connection() as conn:
+        cur = conn.cursor()
+        
+        cur.execute("""
+            SELECT data_content
+            FROM user_data 
+            WHERE data_type = ? AND target_id = ?
+        """, (data_type, target_id))
+        
+        result = cur.fetchone()
+        cur.close()
     
     if result and result['data_content']:
         return json.loads(result['data_content'])
@@ -108,20 +180,19 @@ def save_user_data(data_type: str, target_id: str, data_content):
         target_id: activity_id for activities, date for daily
         data_content: The data to save (will be JSON serialized)
     """
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    # Convert to JSON string
-    json_content = json.dumps(data_content) if data_content else None
-    
-    cur.execute("""
-        INSERT OR REPLACE INTO user_data (data_type, target_id, data_content, updated_at)
-        VALUES (?, ?, ?, CURRENT_TIMESTAMP)
-    """, (data_type, target_id, json_content))
-    
-    conn.commit()
-    cur.close()
-    conn.close()
+    with db_connection() as conn:
+        cur = conn.cursor()
+        
+        # Convert to JSON string
+        json_content = json.dumps(data_content) if data_content else None
+        
+        cur.execute("""
+            INSERT OR REPLACE INTO user_data (data_type, target_id, data_content, updated_at)
+            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+        """, (data_type, target_id, json_content))
+        
+        conn.commit()
+        cur.close()
 
 def delete_user_data(data_type: str, target_id: str):
     """
@@ -131,236 +202,510 @@ def delete_user_data(data_type: str, target_id: str):
         data_type: 'activity_spo2', 'activity_notes', or 'daily_notes'
         target_id: activity_id for activities, date for daily
     """
-    conn = get_db_connection()
-    cur = conn.cursor()
+    with db_connection() as conn:
+        cur = conn.cursor()
+        
+        cur.execute("""
+            DELETE FROM user_data 
+            WHERE data_type = ? AND target_id = ?
+        """, (data_type, target_id))
+        
+        conn.commit()
+        cur.close()
+
+def get_user_data_batch(data_type: str, target_ids):
+    """
+    Get user-entered data of one type for many targets in a single query.
+    
+    Args:
+        data_type: 'activity_spo2', 'activity_notes', 'activity_hr_csv', 'daily_notes', ...
+        target_ids: activity_ids for activities, dates for daily
+        
+    Returns:
+        Dict of target_id -> data content, for targets that have data
+    """
+    target_ids = list(dict.fromkeys(target_ids))
+    if not target_ids:
+        return {}
     
-    cur.execute("""
-        DELETE FROM user_data 
-        WHERE data_type = ? AND target_id = ?
-    """, (data_type, target_id))
+    placeholders = ', '.join('?' * len(target_ids))
+    with db_connection() as conn:
+        cur = conn.cursor()
+        
+        cur.execute(f"""
+            SELECT target_id, data_content
+            FROM user_data 
+            WHERE data_type = ? AND target_id IN ({placeholders})
+        """, (data_type, *target_ids))
+        
+        results = {
+            row['target_id']: json.loads(row['data_content'])
+            for row in cur.fetchall()
+            if row['data_content']
+        }
+        cur.close()
     
-    conn.commit()
-    cur.close()
-    conn.close()
+    return results
+
+O2RING_TIMESTAMP_INDEX_SQL = """
+    CREATE INDEX IF NOT EXISTS idx_o2ring_data_timestamp 
+    ON o2ring_data(timestamp)
+"""
 
 def init_database():
     """Initialize the database with all required tables."""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    # Create users table
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            email TEXT UNIQUE NOT NULL,
-            name TEXT,
-            role TEXT DEFAULT 'user',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    
-    # Create garmin_credentials table
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS garmin_credentials (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            email TEXT NOT NULL,
-            password_encrypted TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    
-    # Create background_jobs table
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS background_jobs (
-            job_id TEXT PRIMARY KEY,
-            job_type TEXT NOT NULL,
-            target_date TEXT,
-            start_date TEXT,
-            end_date TEXT,
-            status TEXT DEFAULT 'pending',
-            result TEXT,
-            error_message TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    
-    # Create daily_data table (new schema)
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS daily_data (
-            date DATE PRIMARY KEY,
-            heart_rate_series JSON,
-            trimp_data JSON,
-            total_trimp FLOAT,
-            daily_score FLOAT,
-            activity_type VARCHAR(50),
-            cached_trimp_data JSON,
-            trimp_calculation_hash VARCHAR(64),
-            cached_oxygen_debt_data JSON,
-            oxygen_debt_calculation_hash VARCHAR(64),
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    
-    # Create activity_data table (new schema)
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS activity_data (
-            activity_id VARCHAR(50) PRIMARY KEY,
-            date DATE,
-            activity_name VARCHAR(255),
-            activity_type VARCHAR(50),
-            start_time_local TIMESTAMP,
-            duration_seconds INTEGER,
-            distance_meters FLOAT NULL,
-            elevation_gain FLOAT NULL,
-            average_hr INTEGER NULL,
-            max_hr INTEGER NULL,
-            heart_rate_series JSON,
-            breathing_rate_series JSON,
-            trimp_data JSON,
-            total_trimp FLOAT,
-            cached_trimp_data JSON,
-            trimp_calculation_hash VARCHAR(64),
-            cached_oxygen_debt_data JSON,
-            oxygen_debt_calculation_hash VARCHAR(64),
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (date) REFERENCES daily_data(date)
-        )
-    """)
-    
-    # Create user_data table for SpO2 and notes (separate from system data)
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS user_data (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            data_type VARCHAR(50) NOT NULL,  -- 'activity_spo2', 'activity_notes', 'daily_notes'
-            target_id VARCHAR(100) NOT NULL,  -- activity_id for activities, date for daily
-            data_content JSON,                -- SpO2 series or text notes
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(data_type, target_id)
-        )
-    """)
-    
-    # Create legacy tables for migration (if they don't exist)
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS heart_rate_data (
-            date DATE PRIMARY KEY,
-            heart_rate_values JSON,
-            presentation_buckets JSON,
-            total_trimp FLOAT,
-            daily_score FLOAT,
-            activity_type VARCHAR(50),
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS activities (
-            activity_id VARCHAR(50) PRIMARY KEY,
-            date DATE,
-            activity_name VARCHAR(255),
-            activity_type VARCHAR(50),
-            start_time_local TIMESTAMP,
-            duration_seconds INTEGER,
-            distance_meters FLOAT,
-            elevation_gain FLOAT,
-            average_hr INTEGER,
-            max_hr INTEGER,
-            individual_hr_buckets JSON,
-            presentation_buckets JSON,
-            trimp_data JSON,
-            total_trimp FLOAT,
-            raw_activity_data TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    
-    # Create O2Ring data tables
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS o2ring_files (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            filename VARCHAR(255) NOT NULL,
-            first_timestamp BIGINT NOT NULL,  -- Unix timestamp in milliseconds
-            last_timestamp BIGINT NOT NULL,   -- Unix timestamp in milliseconds
-            row_count INTEGER NOT NULL,
-            uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS o2ring_data (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            file_id INTEGER NOT NULL,
-            timestamp BIGINT NOT NULL,        -- Unix timestamp in milliseconds
-            spo2_value INTEGER NOT NULL,      -- 0-100
-            heart_rate INTEGER NOT NULL,      -- BPM
-            motion INTEGER NOT NULL,          -- Motion level
-            spo2_reminder INTEGER NOT NULL,   -- SpO2 Reminder (0 or low integer)
-            pr_reminder INTEGER NOT NULL,     -- PR Reminder (0 or low integer)
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (file_id) REFERENCES o2ring_files(id) ON DELETE CASCADE
-        )
-    """)
-    
-    # Create index for efficient timestamp queries
-    cur.execute("""
-        CREATE INDEX IF NOT EXISTS idx_o2ring_data_timestamp 
-        ON o2ring_data(timestamp)
-    """)
-    
-    # Create index for file-based queries
-    cur.execute("""
-        CREATE INDEX IF NOT EXISTS idx_o2ring_data_file_id 
-        ON o2ring_data(file_id)
-    """)
-    
-    # Create system configuration table
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS system_config (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            config_key VARCHAR(100) UNIQUE NOT NULL,
-            config_value TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    
-    conn.commit()
-    cur.close()
-    conn.close() 
+    with db_connection() as conn:
+        cur = conn.cursor()
+        
+        # Write-ahead logging lets readers run alongside background job writes
+        cur.execute("PRAGMA journal_mode = WAL")
+        
+        # Create users table
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                email TEXT UNIQUE NOT NULL,
+                name TEXT,
+                role TEXT DEFAULT 'user',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        # Create garmin_credentials table
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS garmin_credentials (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                email TEXT NOT NULL,
+                password_encrypted TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        # Create background_jobs table
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS background_jobs (
+                job_id TEXT PRIMARY KEY,
+                job_type TEXT NOT NULL,
+                target_date TEXT,
+                start_date TEXT,
+                end_date TEXT,
+                status TEXT DEFAULT 'pending',
+                result TEXT,
+                error_message TEXT,
+                attempts INTEGER DEFAULT 0,
+                next_attempt_at TIMESTAMP,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        # Create daily_data table (new schema)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS daily_data (
+                date DATE PRIMARY KEY,
+                heart_rate_series JSON,
+                trimp_data JSON,
+                total_trimp FLOAT,
+                daily_score FLOAT,
+                activity_type VARCHAR(50),
+                cached_trimp_data JSON,
+                trimp_calculation_hash VARCHAR(64),
+                cached_oxygen_debt_data JSON,
+                oxygen_debt_calculation_hash VARCHAR(64),
+                cached_spo2_distribution_data JSON,
+                spo2_distribution_calculation_hash VARCHAR(64),
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        # Create activity_data table (new schema)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS activity_data (
+                activity_id VARCHAR(50) PRIMARY KEY,
+                date DATE,
+                activity_name VARCHAR(255),
+                activity_type VARCHAR(50),
+                start_time_local TIMESTAMP,
+                duration_seconds INTEGER,
+                distance_meters FLOAT NULL,
+                elevation_gain FLOAT NULL,
+                average_hr INTEGER NULL,
+                max_hr INTEGER NULL,
+                heart_rate_series JSON,
+                breathing_rate_series JSON,
+                trimp_data JSON,
+                total_trimp FLOAT,
+                cached_trimp_data JSON,
+                trimp_calculation_hash VARCHAR(64),
+                cached_oxygen_debt_data JSON,
+                oxygen_debt_calculation_hash VARCHAR(64),
+                cached_spo2_distribution_data JSON,
+                spo2_distribution_calculation_hash VARCHAR(64),
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (date) REFERENCES daily_data(date)
+            )
+        """)
+        
+        # Create user_data table for SpO2 and notes (separate from system data)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS user_data (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                data_type VARCHAR(50) NOT NULL,  -- 'activity_spo2', 'activity_notes', 'daily_notes'
+                target_id VARCHAR(100) NOT NULL,  -- activity_id for activities, date for daily
+                data_content JSON,                -- SpO2 series or text notes
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(data_type, target_id)
+            )
+        """)
+        
+        # Create legacy tables for migration (if they don't exist)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS heart_rate_data (
+                date DATE PRIMARY KEY,
+                heart_rate_values JSON,
+                presentation_buckets JSON,
+                total_trimp FLOAT,
+                daily_score FLOAT,
+                activity_type VARCHAR(50),
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS activities (
+                activity_id VARCHAR(50) PRIMARY KEY,
+                date DATE,
+                activity_name VARCHAR(255),
+                activity_type VARCHAR(50),
+                start_time_local TIMESTAMP,
+                duration_seconds INTEGER,
+                distance_meters FLOAT,
+                elevation_gain FLOAT,
+                average_hr INTEGER,
+                max_hr INTEGER,
+                individual_hr_buckets JSON,
+                presentation_buckets JSON,
+                trimp_data JSON,
+                total_trimp FLOAT,
+                raw_activity_data TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        # Create O2Ring data tables
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS o2ring_files (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                filename VARCHAR(255) NOT NULL,
+                first_timestamp BIGINT NOT NULL,  -- Unix timestamp in milliseconds
+                last_timestamp BIGINT NOT NULL,   -- Unix timestamp in milliseconds
+                row_count INTEGER NOT NULL,
+                uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS o2ring_data (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                file_id INTEGER NOT NULL,
+                timestamp BIGINT NOT NULL,        -- Unix timestamp in milliseconds
+                spo2_value INTEGER NOT NULL,      -- 0-100
+                heart_rate INTEGER NOT NULL,      -- BPM
+                motion INTEGER NOT NULL,          -- Motion level
+                spo2_reminder INTEGER NOT NULL,   -- SpO2 Reminder (0 or low integer)
+                pr_reminder INTEGER NOT NULL,     -- PR Reminder (0 or low integer)
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (file_id) REFERENCES o2ring_files(id) ON DELETE CASCADE
+            )
+        """)
+        
+        # Create index for efficient timestamp queries
+        cur.execute(O2RING_TIMESTAMP_INDEX_SQL)
+        
+        # Create index for file-based queries
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_o2ring_data_file_id 
+            ON o2ring_data(file_id)
+        """)
+        
+        # Create SpO2 analytics tables, filled when O2Ring files are loaded
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS spo2_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                file_id INTEGER NOT NULL,
+                drop_percent INTEGER NOT NULL,    -- Minimum drop below the baseline (3 or 4)
+                start_timestamp BIGINT NOT NULL,  -- Unix timestamp in milliseconds
+                end_timestamp BIGINT NOT NULL,    -- Unix timestamp in milliseconds
+                baseline REAL NOT NULL,           -- Rolling baseline SpO2 at the start
+                nadir INTEGER NOT NULL,           -- Lowest SpO2 of the event
+                FOREIGN KEY (file_id) REFERENCES o2ring_files(id) ON DELETE CASCADE
+            )
+        """)
+        
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_spo2_events_drop_start
+            ON spo2_events(drop_percent, start_timestamp)
+        """)
+        
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_spo2_events_file_id
+            ON spo2_events(file_id)
+        """)
+        
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS spo2_daily_summary (
+                date DATE PRIMARY KEY,            -- Europe/London calendar day
+                recording_seconds REAL NOT NULL,
+                nadir INTEGER NOT NULL,
+                t90_seconds REAL NOT NULL,        -- Time below 90%
+                events_3 INTEGER NOT NULL,
+                odi_3 REAL,                       -- Desaturations of 3% or more per recorded hour
+                events_4 INTEGER NOT NULL,
+                odi_4 REAL,                       -- Desaturations of 4% or more per recorded hour
+                spo2_distribution TEXT NOT NULL,  -- JSON, as calculate_spo2_distribution returns it
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        # Create sync state table: when each day/activity was last fetched from Garmin and a fingerprint of it
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS sync_state (
+                kind VARCHAR(20) NOT NULL,        -- 'day' or 'activity'
+                entity_id VARCHAR(50) NOT NULL,   -- date for days, activity_id for activities
+                fingerprint VARCHAR(64) NOT NULL, -- hash of the Garmin data last fetched
+                fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (kind, entity_id)
+            )
+        """)
+        
+        # Create system configuration table
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS system_config (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                config_key VARCHAR(100) UNIQUE NOT NULL,
+                config_value TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        conn.commit()
+        cur.close()
+
+# marshal format used for fingerprints: version 2 writes floats in binary and,
+# unlike later versions, never back-references shared objects, so equal data
+# always serializes to the same bytes
+FINGERPRINT_MARSHAL_VERSION = 2
+FINGERPRINT_DIGEST_SIZE = 16
+
+def _canonical_mapping(data_content):
+    """Replace dicts (and dicts within them) by key-sorted item tuples, so key order is ignored."""
+    if isinstance(data_content, dict):
+        return ('dict', tuple((key, _canonical_mapping(value)) for key, value in sorted(data_content.items())))
+    return data_content
 
 def calculate_data_hash(data_content):
     """
-    Calculate a hash of data content for change detection.
+    Calculate a fingerprint of data content for change detection.
+    
+    The content is serialized with marshal, which writes HR and SpO2 series
+    directly to a compact binary buffer, and hashed with BLAKE2b. Content
+    marshal cannot write falls back to sorted-key JSON. Dict key order is
+    ignored; unlike JSON, lists and tuples fingerprint differently.
     
     Args:
         data_content: The data to hash (can be dict, list, or string)
         
     Returns:
-        SHA256 hash string
+        Hex digest string (32 characters)
     """
-    if data_content is None:
-        return hashlib.sha256(b'null').hexdigest()
+    try:
+        buffer = marshal.dumps(_canonical_mapping(data_content), FINGERPRINT_MARSHAL_VERSION)
+    except (TypeError, ValueError):
+        buffer = json.dumps(data_content, sort_keys=True).encode('utf-8')
+    return hashlib.blake2b(buffer, digest_size=FINGERPRINT_DIGEST_SIZE).hexdigest()
+
+# Binary storage format for [timestamp, value] series columns
+# (daily_data.heart_rate_series, activity_data.heart_rate_series/breathing_rate_series).
+# Layout: header (magic, version, flags, point count), then int64 timestamp deltas
+# followed by int16 or float64 values, optionally zlib-compressed.
+SERIES_FORMAT_MAGIC = b'GHS'
+SERIES_FORMAT_VERSION = 1
+SERIES_HEADER = struct.Struct('<3sBBI')
+
+SERIES_FLAG_ZLIB = 0x01
+SERIES_FLAG_FLOAT_TIMESTAMPS = 0x02
+SERIES_FLAG_FLOAT_VALUES = 0x04
+SERIES_FLAG_WIDE_VALUES = 0x08
+
+SERIES_INT16_MISSING = -32768
+SERIES_MAX_EXACT_FLOAT = 2 ** 53
+
+
+def _series_column_flags(timestamps, values):
+    """
+    Work out how timestamps and values can be packed without changing them.
+    
+    Args:
+        timestamps: List of timestamps
+        values: List of values (None for missing readings)
+        
+    Returns:
+        Flags describing the packing, or None if the series must stay JSON
+    """
+    flags = 0
+    
+    timestamp_types = set(map(type, timestamps))
+    if timestamp_types == {float}:
+        if not all(t.is_integer() and abs(t) <= SERIES_MAX_EXACT_FLOAT for t in timestamps):
+            return None
+        flags |= SERIES_FLAG_FLOAT_TIMESTAMPS
+    elif timestamp_types != {int} or not all(-2 ** 63 <= t < 2 ** 63 for t in timestamps):
+        return None
     
-    # Convert to JSON string for consistent hashing
-    json_str = json.dumps(data_content, sort_keys=True)
-    return hashlib.sha256(json_str.encode('utf-8')).hexdigest()
+    present = [v for v in values if v is not None]
+    value_types = set(map(type, present))
+    if value_types <= {int}:
+        if not all(SERIES_INT16_MISSING < v < 2 ** 15 for v in present):
+            return None
+    elif value_types == {float}:
+        flags |= SERIES_FLAG_FLOAT_VALUES
+        if any(math.isnan(v) for v in present):
+            return None
+        if not all(v.is_integer() and SERIES_INT16_MISSING < v < 2 ** 15 for v in present):
+            flags |= SERIES_FLAG_WIDE_VALUES
+    else:
+        return None
+    
+    return flags
 
-def get_config_value(config_key: str, default: str = None) -> str:
-    """Get a configuration value from the system_config table."""
-    conn = get_db_connection()
-    cur = conn.cursor()
+
+def encode_series(series, compress=True):
+    """
+    Encode a [timestamp, value] series for storage.
     
-    cur.execute("SELECT config_value FROM system_config WHERE config_key = ?", (config_key,))
-    result = cur.fetchone()
+    Series whose types cannot be reproduced exactly from the binary format
+    (mixed int/float values, non-numeric timestamps, ...) are stored as JSON.
+    
+    Args:
+        series: List of [timestamp, value] pairs
+        compress: Whether to zlib-compress the packed columns (when it saves space)
+        
+    Returns:
+        Bytes in the binary series format, or a JSON string
+    """
+    if series is None:
+        return None
+    
+    if not all(isinstance(point, (list, tuple)) and len(point) == 2 for point in series):
+        return json.dumps(series)
+    
+    timestamps = [point[0] for point in series]
+    values = [point[1] for point in series]
+    flags = _series_column_flags(timestamps, values)
+    if flags is None:
+        return json.dumps(series)
+    
+    timestamp_array = np.array(timestamps, dtype=np.int64)
+    deltas = np.diff(timestamp_array, prepend=np.int64(0)).astype('<i8')
+    
+    if flags & SERIES_FLAG_WIDE_VALUES:
+        value_array = np.array([np.nan if v is None else v for v in values], dtype='<f8')
+    else:
+        value_array = np.array([SERIES_INT16_MISSING if v is None else v for v in values], dtype='<i2')
+    
+    payload = deltas.tobytes() + value_array.tobytes()
+    if compress:
+        compressed = zlib.compress(payload)
+        if len(compressed) < len(payload):
+            payload = compressed
+            flags |= SERIES_FLAG_ZLIB
+    
+    header = SERIES_HEADER.pack(SERIES_FORMAT_MAGIC, SERIES_FORMAT_VERSION, flags, len(series))
+    return header + payload
+
+
+def is_binary_series(stored_value) -> bool:
+    """Check whether a stored series value uses the binary series format."""
+    return isinstance(stored_value, (bytes, bytearray, memoryview)) and \
+        bytes(stored_value[:len(SERIES_FORMAT_MAGIC)]) == SERIES_FORMAT_MAGIC
+
+
+def decode_series(stored_value):
+    """
+    Decode a stored [timestamp, value] series.
     
-    cur.close()
-    conn.close()
+    Reads both the binary series format and legacy JSON text.
+    
+    Args:
+        stored_value: Column value as returned by sqlite3
+        
+    Returns:
+        List of [timestamp, value] pairs
+    """
+    if not stored_value:
+        return []
+    
+    if not is_binary_series(stored_value):
+        return json.loads(stored_value)
+    
+    _, version, flags, count = SERIES_HEADER.unpack_from(stored_value)
+    if version != SERIES_FORMAT_VERSION:
+        raise ValueError(f"Unsupported series format version {version}")
+    
+    payload = memoryview(stored_value)[SERIES_HEADER.size:]
+    if flags & SERIES_FLAG_ZLIB:
+        payload = zlib.decompress(payload)
+    
+    timestamp_array = np.cumsum(np.frombuffer(payload, dtype='<i8', count=count))
+    if flags & SERIES_FLAG_FLOAT_TIMESTAMPS:
+        timestamp_array = timestamp_array.astype(np.float64)
+    
+    if flags & SERIES_FLAG_WIDE_VALUES:
+        value_array = np.frombuffer(payload, dtype='<f8', count=count, offset=8 * count)
+        missing = np.isnan(value_array)
+    else:
+        value_array = np.frombuffer(payload, dtype='<i2', count=count, offset=8 * count)
+        missing = value_array == SERIES_INT16_MISSING
+        if flags & SERIES_FLAG_FLOAT_VALUES:
+            value_array = value_array.astype(np.float64)
+    
+    values = value_array.tolist()
+    if missing.any():
+        for index in np.flatnonzero(missing).tolist():
+            values[index] = None
+    
+    return list(map(list, zip(timestamp_array.tolist(), values)))
+
+
+def drop_o2ring_timestamp_index():
+    """Drop the O2Ring timestamp index before a bulk load."""
+    with db_connection() as conn:
+        conn.execute("DROP INDEX IF EXISTS idx_o2ring_data_timestamp")
+        conn.commit()
+
+def create_o2ring_timestamp_index():
+    """(Re)build the O2Ring timestamp index after a bulk load."""
+    with db_connection() as conn:
+        conn.execute(O2RING_TIMESTAMP_INDEX_SQL)
+        conn.commit()
+
+
+def get_config_value(config_key: str, default: str = None) -> str:
+    """Get a configuration value from the system_config table."""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        
+        cur.execute("SELECT config_value FROM system_config WHERE config_key = ?", (config_key,))
+        result = cur.fetchone()
+        
+        cur.close()
     
     if result:
         return result['config_value']
@@ -368,17 +713,16 @@ def get_config_value(config_key: str, default: str = None) -> str:
 
 def set_config_value(config_key: str, config_value: str):
     """Set a configuration value in the system_config table."""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    cur.execute("""
-        INSERT OR REPLACE INTO system_config (config_key, config_value, updated_at)
-        VALUES (?, ?, CURRENT_TIMESTAMP)
-    """, (config_key, config_value))
-    
-    conn.commit()
-    cur.close()
-    conn.close()
+    with db_connection() as conn:
+        cur = conn.cursor()
+        
+        cur.execute("""
+            INSERT OR REPLACE INTO system_config (config_key, config_value, updated_at)
+            VALUES (?, ?, CURRENT_TIMESTAMP)
+        """, (config_key, config_value))
+        
+        conn.commit()
+        cur.close()
 
 def get_cached_trimp_data(date, data_type='daily'):
     """
@@ -391,35 +735,34 @@ def get_cached_trimp_data(date, data_type='daily'):
     Returns:
         Cached TRIMP data dict or None if not found/invalid
     """
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    try:
-        if data_type == 'daily':
-            cur.execute("""
-                SELECT cached_trimp_data, trimp_calculation_hash
-                FROM daily_data 
-                WHERE date = ?
-            """, (date,))
-        else:  # activity
-            cur.execute("""
-                SELECT cached_trimp_data, trimp_calculation_hash
-                FROM activity_data 
-                WHERE activity_id = ?
-            """, (date,))
-        
-        result = cur.fetchone()
+    with db_connection() as conn:
+        cur = conn.cursor()
         
-        if result and result['cached_trimp_data']:
-            return {
-                'trimp_data': json.loads(result['cached_trimp_data']),
-                'hash': result['trimp_calculation_hash']
-            }
-        return None
-        
-    finally:
-        cur.close()
-        conn.close()
+        try:
+            if data_type == 'daily':
+                cur.execute("""
+                    SELECT cached_trimp_data, trimp_calculation_hash
+                    FROM daily_data 
+                    WHERE date = ?
+                """, (date,))
+            else:  # activity
+                cur.execute("""
+                    SELECT cached_trimp_data, trimp_calculation_hash
+                    FROM activity_data 
+                    WHERE activity_id = ?
+                """, (date,))
+            
+            result = cur.fetchone()
+            
+            if result and result['cached_trimp_data']:
+                return {
+                    'trimp_data': json.loads(result['cached_trimp_data']),
+                    'hash': result['trimp_calculation_hash']
+                }
+            return None
+            
+        finally:
+            cur.close()
 
 def save_cached_trimp_data(date, trimp_data, data_hash, data_type='daily'):
     """
@@ -431,30 +774,29 @@ def save_cached_trimp_data(date, trimp_data, data_hash, data_type='daily'):
         data_hash: Hash of the input data used for calculation
         data_type: 'daily' or 'activity'
     """
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    try:
-        trimp_json = json.dumps(trimp_data) if trimp_data else None
-        
-        if data_type == 'daily':
-            cur.execute("""
-                UPDATE daily_data 
-                SET cached_trimp_data = ?, trimp_calculation_hash = ?, updated_at = CURRENT_TIMESTAMP
-                WHERE date = ?
-            """, (trimp_json, data_hash, date))
-        else:  # activity
-            cur.execute("""
-                UPDATE activity_data 
-                SET cached_trimp_data = ?, trimp_calculation_hash = ?, updated_at = CURRENT_TIMESTAMP
-                WHERE activity_id = ?
-            """, (trimp_json, data_hash, date))
+    with db_connection() as conn:
+        cur = conn.cursor()
         
-        conn.commit()
-        
-    finally:
-        cur.close()
-        conn.close()
+        try:
+            trimp_json = json.dumps(trimp_data) if trimp_data else None
+            
+            if data_type == 'daily':
+                cur.execute("""
+                    UPDATE daily_data 
+                    SET cached_trimp_data = ?, trimp_calculation_hash = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE date = ?
+                """, (trimp_json, data_hash, date))
+            else:  # activity
+                cur.execute("""
+                    UPDATE activity_data 
+                    SET cached_trimp_data = ?, trimp_calculation_hash = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE activity_id = ?
+                """, (trimp_json, data_hash, date))
+            
+            conn.commit()
+            
+        finally:
+            cur.close()
 
 def invalidate_cached_trimp_data(date, data_type='daily'):
     """
@@ -464,28 +806,27 @@ def invalidate_cached_trimp_data(date, data_type='daily'):
         date: Date string (YYYY-MM-DD) or activity_id
         data_type: 'daily' or 'activity'
     """
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    try:
-        if data_type == 'daily':
-            cur.execute("""
-                UPDATE daily_data 
-                SET cached_trimp_data = NULL, trimp_calculation_hash = NULL, updated_at = CURRENT_TIMESTAMP
-                WHERE date = ?
-            """, (date,))
-        else:  # activity
-            cur.execute("""
-                UPDATE activity_data 
-                SET cached_trimp_data = NULL, trimp_calculation_hash = NULL, updated_at = CURRENT_TIMESTAMP
-                WHERE activity_id = ?
-            """, (date,))
+    with db_connection() as conn:
+        cur = conn.cursor()
         
-        conn.commit()
-        
-    finally:
-        cur.close()
-        conn.close()
+        try:
+            if data_type == 'daily':
+                cur.execute("""
+                    UPDATE daily_data 
+                    SET cached_trimp_data = NULL, trimp_calculation_hash = NULL, updated_at = CURRENT_TIMESTAMP
+                    WHERE date = ?
+                """, (date,))
+            else:  # activity
+                cur.execute("""
+                    UPDATE activity_data 
+                    SET cached_trimp_data = NULL, trimp_calculation_hash = NULL, updated_at = CURRENT_TIMESTAMP
+                    WHERE activity_id = ?
+                """, (date,))
+            
+            conn.commit()
+            
+        finally:
+            cur.close()
 
 def get_cached_oxygen_debt_data(date, data_type='daily'):
     """
@@ -498,35 +839,34 @@ def get_cached_oxygen_debt_data(date, data_type='daily'):
     Returns:
         Cached oxygen debt data dict or None if not found/invalid
     """
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    try:
-        if data_type == 'daily':
-            cur.execute("""
-                SELECT cached_oxygen_debt_data, oxygen_debt_calculation_hash
-                FROM daily_data 
-                WHERE date = ?
-            """, (date,))
-        else:  # activity
-            cur.execute("""
-                SELECT cached_oxygen_debt_data, oxygen_debt_calculation_hash
-                FROM activity_data 
-                WHERE activity_id = ?
-            """, (date,))
-        
-        result = cur.fetchone()
-        
-        if result and result['cached_oxygen_debt_data']:
-            return {
-                'oxygen_debt_data': json.loads(result['cached_oxygen_debt_data']),
-                'hash': result['oxygen_debt_calculation_hash']
-            }
-        return None
+    with db_connection() as conn:
+        cur = conn.cursor()
         
-    finally:
-        cur.close()
-        conn.close()
+        try:
+            if data_type == 'daily':
+                cur.execute("""
+                    SELECT cached_oxygen_debt_data, oxygen_debt_calculation_hash
+                    FROM daily_data 
+                    WHERE date = ?
+                """, (date,))
+            else:  # activity
+                cur.execute("""
+                    SELECT cached_oxygen_debt_data, oxygen_debt_calculation_hash
+                    FROM activity_data 
+                    WHERE activity_id = ?
+                """, (date,))
+            
+            result = cur.fetchone()
+            
+            if result and result['cached_oxygen_debt_data']:
+                return {
+                    'oxygen_debt_data': json.loads(result['cached_oxygen_debt_data']),
+                    'hash': result['oxygen_debt_calculation_hash']
+                }
+            return None
+            
+        finally:
+            cur.close()
 
 def save_cached_oxygen_debt_data(date, oxygen_debt_data, data_hash, data_type='daily'):
     """
@@ -538,30 +878,29 @@ def save_cached_oxygen_debt_data(date, oxygen_debt_data, data_hash, data_type='d
         data_hash: Hash of the input data used for calculation
         data_type: 'daily' or 'activity'
     """
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    try:
-        oxygen_debt_json = json.dumps(oxygen_debt_data) if oxygen_debt_data else None
-        
-        if data_type == 'daily':
-            cur.execute("""
-                UPDATE daily_data 
-                SET cached_oxygen_debt_data = ?, oxygen_debt_calculation_hash = ?, updated_at = CURRENT_TIMESTAMP
-                WHERE date = ?
-            """, (oxygen_debt_json, data_hash, date))
-        else:  # activity
-            cur.execute("""
-                UPDATE activity_data 
-                SET cached_oxygen_debt_data = ?, oxygen_debt_calculation_hash = ?, updated_at = CURRENT_TIMESTAMP
-                WHERE activity_id = ?
-            """, (oxygen_debt_json, data_hash, date))
-        
-        conn.commit()
+    with db_connection() as conn:
+        cur = conn.cursor()
         
-    finally:
-        cur.close()
-        conn.close()
+        try:
+            oxygen_debt_json = json.dumps(oxygen_debt_data) if oxygen_debt_data else None
+            
+            if data_type == 'daily':
+                cur.execute("""
+                    UPDATE daily_data 
+                    SET cached_oxygen_debt_data = ?, oxygen_debt_calculation_hash = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE date = ?
+                """, (oxygen_debt_json, data_hash, date))
+            else:  # activity
+                cur.execute("""
+                    UPDATE activity_data 
+                    SET cached_oxygen_debt_data = ?, oxygen_debt_calculation_hash = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE activity_id = ?
+                """, (oxygen_debt_json, data_hash, date))
+            
+            conn.commit()
+            
+        finally:
+            cur.close()
 
 def invalidate_cached_oxygen_debt_data(date, data_type='daily'):
     """
@@ -571,28 +910,27 @@ def invalidate_cached_oxygen_debt_data(date, data_type='daily'):
         date: Date string (YYYY-MM-DD) or activity_id
         data_type: 'daily' or 'activity'
     """
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    try:
-        if data_type == 'daily':
-            cur.execute("""
-                UPDATE daily_data 
-                SET cached_oxygen_debt_data = NULL, oxygen_debt_calculation_hash = NULL, updated_at = CURRENT_TIMESTAMP
-                WHERE date = ?
-            """, (date,))
-        else:  # activity
-            cur.execute("""
-                UPDATE activity_data 
-                SET cached_oxygen_debt_data = NULL, oxygen_debt_calculation_hash = NULL, updated_at = CURRENT_TIMESTAMP
-                WHERE activity_id = ?
-            """, (date,))
-        
-        conn.commit()
+    with db_connection() as conn:
+        cur = conn.cursor()
         
-    finally:
-        cur.close()
-        conn.close()
+        try:
+            if data_type == 'daily':
+                cur.execute("""
+                    UPDATE daily_data 
+                    SET cached_oxygen_debt_data = NULL, oxygen_debt_calculation_hash = NULL, updated_at = CURRENT_TIMESTAMP
+                    WHERE date = ?
+                """, (date,))
+            else:  # activity
+                cur.execute("""
+                    UPDATE activity_data 
+                    SET cached_oxygen_debt_data = NULL, oxygen_debt_calculation_hash = NULL, updated_at = CURRENT_TIMESTAMP
+                    WHERE activity_id = ?
+                """, (date,))
+            
+            conn.commit()
+            
+        finally:
+            cur.close()
 
 def get_cached_spo2_distribution_data(date, data_type='daily'):
     """
@@ -605,35 +943,34 @@ def get_cached_spo2_distribution_data(date, data_type='daily'):
     Returns:
         Cached SpO2 distribution data dict or None if not found/invalid
     """
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    try:
-        if data_type == 'daily':
-            cur.execute("""
-                SELECT cached_spo2_distribution_data, spo2_distribution_calculation_hash
-                FROM daily_data 
-                WHERE date = ?
-            """, (date,))
-        else:  # activity
-            cur.execute("""
-                SELECT cached_spo2_distribution_data, spo2_distribution_calculation_hash
-                FROM activity_data 
-                WHERE activity_id = ?
-            """, (date,))
-        
-        result = cur.fetchone()
+    with db_connection() as conn:
+        cur = conn.cursor()
         
-        if result and result['cached_spo2_distribution_data']:
-            return {
-                'spo2_distribution_data': json.loads(result['cached_spo2_distribution_data']),
-                'hash': result['spo2_distribution_calculation_hash']
-            }
-        return None
-        
-    finally:
-        cur.close()
-        conn.close()
+        try:
+            if data_type == 'daily':
+                cur.execute("""
+                    SELECT cached_spo2_distribution_data, spo2_distribution_calculation_hash
+                    FROM daily_data 
+                    WHERE date = ?
+                """, (date,))
+            else:  # activity
+                cur.execute("""
+                    SELECT cached_spo2_distribution_data, spo2_distribution_calculation_hash
+                    FROM activity_data 
+                    WHERE activity_id = ?
+                """, (date,))
+            
+            result = cur.fetchone()
+            
+            if result and result['cached_spo2_distribution_data']:
+                return {
+                    'spo2_distribution_data': json.loads(result['cached_spo2_distribution_data']),
+                    'hash': result['spo2_distribution_calculation_hash']
+                }
+            return None
+            
+        finally:
+            cur.close()
 
 def save_cached_spo2_distribution_data(date, spo2_distribution_data, data_hash, data_type='daily'):
     """
@@ -645,30 +982,29 @@ def save_cached_spo2_distribution_data(date, spo2_distribution_data, data_hash,
         data_hash: Hash of the input data used for calculation
         data_type: 'daily' or 'activity'
     """
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    try:
-        spo2_distribution_json = json.dumps(spo2_distribution_data) if spo2_distribution_data else None
+    with db_connection() as conn:
+        cur = conn.cursor()
         
-        if data_type == 'daily':
-            cur.execute("""
-                UPDATE daily_data 
-                SET cached_spo2_distribution_data = ?, spo2_distribution_calculation_hash = ?, updated_at = CURRENT_TIMESTAMP
-                WHERE date = ?
-            """, (spo2_distribution_json, data_hash, date))
-        else:  # activity
-            cur.execute("""
-                UPDATE activity_data 
-                SET cached_spo2_distribution_data = ?, spo2_distribution_calculation_hash = ?, updated_at = CURRENT_TIMESTAMP
-                WHERE activity_id = ?
-            """, (spo2_distribution_json, data_hash, date))
-        
-        conn.commit()
-        
-    finally:
-        cur.close()
-        conn.close()
+        try:
+            spo2_distribution_json = json.dumps(spo2_distribution_data) if spo2_distribution_data else None
+            
+            if data_type == 'daily':
+                cur.execute("""
+                    UPDATE daily_data 
+                    SET cached_spo2_distribution_data = ?, spo2_distribution_calculation_hash = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE date = ?
+                """, (spo2_distribution_json, data_hash, date))
+            else:  # activity
+                cur.execute("""
+                    UPDATE activity_data 
+                    SET cached_spo2_distribution_data = ?, spo2_distribution_calculation_hash = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE activity_id = ?
+                """, (spo2_distribution_json, data_hash, date))
+            
+            conn.commit()
+            
+        finally:
+            cur.close()
 
 def invalidate_cached_spo2_distribution_data(date, data_type='daily'):
     """
@@ -678,28 +1014,27 @@ def invalidate_cached_spo2_distribution_data(date, data_type='daily'):
         date: Date string (YYYY-MM-DD) or activity_id
         data_type: 'daily' or 'activity'
     """
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    try:
-        if data_type == 'daily':
-            cur.execute("""
-                UPDATE daily_data 
-                SET cached_spo2_distribution_data = NULL, spo2_distribution_calculation_hash = NULL, updated_at = CURRENT_TIMESTAMP
-                WHERE date = ?
-            """, (date,))
-        else:  # activity
-            cur.execute("""
-                UPDATE activity_data 
-                SET cached_spo2_distribution_data = NULL, spo2_distribution_calculation_hash = NULL, updated_at = CURRENT_TIMESTAMP
-                WHERE activity_id = ?
-            """, (date,))
+    with db_connection() as conn:
+        cur = conn.cursor()
         
-        conn.commit()
-        
-    finally:
-        cur.close()
-        conn.close()
+        try:
+            if data_type == 'daily':
+                cur.execute("""
+                    UPDATE daily_data 
+                    SET cached_spo2_distribution_data = NULL, spo2_distribution_calculation_hash = NULL, updated_at = CURRENT_TIMESTAMP
+                    WHERE date = ?
+                """, (date,))
+            else:  # activity
+                cur.execute("""
+                    UPDATE activity_data 
+                    SET cached_spo2_distribution_data = NULL, spo2_distribution_calculation_hash = NULL, updated_at = CURRENT_TIMESTAMP
+                    WHERE activity_id = ?
+                """, (date,))
+            
+            conn.commit()
+            
+        finally:
+            cur.close()
 
 def invalidate_spo2_distribution_cache_for_date_range(start_date, end_date):
     """
@@ -709,22 +1044,83 @@ def invalidate_spo2_distribution_cache_for_date_range(start_date, end_date):
         start_date: Start date string (YYYY-MM-DD)
         end_date: End date string (YYYY-MM-DD)
     """
-    conn = get_db_connection()
-    cur = conn.cursor()
+    with db_connection() as conn:
+        cur = conn.cursor()
+        
+        try:
+            cur.execute("""
+                UPDATE daily_data 
+                SET cached_spo2_distribution_data = NULL, spo2_distribution_calculation_hash = NULL, updated_at = CURRENT_TIMESTAMP
+                WHERE date >= ? AND date <= ?
+            """, (start_date, end_date))
+            
+            conn.commit()
+            logger.info(f"Invalidated SpO2 distribution cache for date range {start_date} to {end_date}")
+            
+        except Exception as e:
+            logger.error(f"Error invalidating SpO2 distribution cache for date range: {e}")
+            
+        finally:
+            cur.close()
+
+# Cached derived columns that get_daily_batch_data() can return -> their calculation hash column
+DAILY_CACHE_COLUMNS = {
+    'cached_trimp_data': 'trimp_calculation_hash',
+    'cached_oxygen_debt_data': 'oxygen_debt_calculation_hash',
+    'cached_spo2_distribution_data': 'spo2_distribution_calculation_hash',
+}
+
+def get_daily_batch_data(dates, cache_column, user_data_type=None, hash_prefix=None):
+    """
+    Get daily_data summaries, one cached derived column and optional user data
+    for many dates in a single query.
     
-    try:
-        cur.execute("""
-            UPDATE daily_data 
-            SET cached_spo2_distribution_data = NULL, spo2_distribution_calculation_hash = NULL, updated_at = CURRENT_TIMESTAMP
-            WHERE date >= ? AND date <= ?
-        """, (start_date, end_date))
+    Args:
+        dates: List of date strings (YYYY-MM-DD)
+        cache_column: One of DAILY_CACHE_COLUMNS
+        user_data_type: Optional user_data type keyed by date (e.g. 'daily_trimp_overrides')
+        hash_prefix: Only return cached data whose calculation hash starts with this
+            (e.g. jobs.trimp_cache_prefix of the current HR parameters)
         
-        conn.commit()
-        logger.info(f"Invalidated SpO2 distribution cache for date range {start_date} to {end_date}")
+    Returns:
+        Dict of date -> dict with 'has_daily_data', 'daily_score', 'activity_type',
+        'cached_data' (parsed JSON or None) and 'user_data' (parsed JSON or None)
+    """
+    if cache_column not in DAILY_CACHE_COLUMNS:
+        raise ValueError(f"Unknown cache column: {cache_column}")
+    
+    dates = list(dict.fromkeys(dates))
+    if not dates:
+        return {}
+    
+    values = ', '.join(['(?)'] * len(dates))
+    hash_column = DAILY_CACHE_COLUMNS[cache_column]
+    with db_connection() as conn:
+        cur = conn.cursor()
         
-    except Exception as e:
-        logger.error(f"Error invalidating SpO2 distribution cache for date range: {e}")
+        cur.execute(f"""
+            WITH requested(date) AS (VALUES {values})
+            SELECT requested.date AS date,
+                   daily_data.date IS NOT NULL AS has_daily_data,
+                   daily_data.daily_score,
+                   daily_data.activity_type,
+                   CASE WHEN ? IS NULL OR substr(daily_data.{hash_column}, 1, length(?)) = ?
+                        THEN daily_data.{cache_column} END AS cached_data,
+                   user_data.data_content AS user_data
+            FROM requested
+            LEFT JOIN daily_data ON daily_data.date = requested.date
+            LEFT JOIN user_data ON user_data.data_type = ? AND user_data.target_id = requested.date
+        """, (*dates, hash_prefix, hash_prefix, hash_prefix, user_data_type))
         
-    finally:
+        results = {}
+        for row in cur.fetchall():
+            results[row['date']] = {
+                'has_daily_data': bool(row['has_daily_data']),
+                'daily_score': row['daily_score'],
+                'activity_type': row['activity_type'],
+                'cached_data': json.loads(row['cached_data']) if row['cached_data'] else None,
+                'user_data': json.loads(row['user_data']) if row['user_data'] else None
+            }
         cur.close()
-        conn.close()
\ No newline at end of file
+    
+    return results
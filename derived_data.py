@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Derived data dependency graph for Garmin Heart Rate Analyzer
+
+The cached calculations in daily_data and activity_data depend on raw data and
+on each other:
+
+    activity HR series / HR CSV override -> activity TRIMP -> day TRIMP -> weekly and two-week views
+    daily HR series, TRIMP overrides, the day's set of activities -> day TRIMP
+    HR parameters -> activity TRIMP, day TRIMP
+    O2Ring data -> day and activity oxygen debt and SpO2 distribution
+
+Code that writes raw data reports it with data_changed(). The caches downstream
+of the change are cleared with one UPDATE per cache for the whole scope, and a
+'recompute_derived' background job recalculates the cleared TRIMP caches so
+pages find them warm. Oxygen debt and SpO2 distributions are recalculated when
+they are next read; range pages fall back to the nightly SpO2 summaries until
+then. Weekly and two-week views are built from the day caches on request, so
+clearing days is enough for them.
+
+Garmin collection replaces daily_data and activity_data rows outright, which
+drops their caches with them, so it does not report changes here.
+"""
+
+import json
+import logging
+import random
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from database import db_connection, update_job_status
+from trimp_recompute import recompute_trimp
+
+logger = logging.getLogger(__name__)
+
+RECOMPUTE_JOB_TYPE = 'recompute_derived'
+
+# Derived cache -> (table, cached data column, calculation hash column)
+DERIVED_CACHES = {
+    'activity_trimp': ('activity_data', 'cached_trimp_data', 'trimp_calculation_hash'),
+    'activity_oxygen_debt': ('activity_data', 'cached_oxygen_debt_data', 'oxygen_debt_calculation_hash'),
+    'activity_spo2_distribution': ('activity_data', 'cached_spo2_distribution_data', 'spo2_distribution_calculation_hash'),
+    'daily_trimp': ('daily_data', 'cached_trimp_data', 'trimp_calculation_hash'),
+    'daily_oxygen_debt': ('daily_data', 'cached_oxygen_debt_data', 'oxygen_debt_calculation_hash'),
+    'daily_spo2_distribution': ('daily_data', 'cached_spo2_distribution_data', 'spo2_distribution_calculation_hash'),
+}
+
+# Raw data -> derived caches calculated directly from it
+SOURCE_DEPENDENTS = {
+    'activity_hr': ('activity_trimp',),
+    'day_activities': ('daily_trimp',),
+    'daily_hr': ('daily_trimp',),
+    'trimp_overrides': ('daily_trimp',),
+    'hr_parameters': ('activity_trimp', 'daily_trimp'),
+    'o2ring': ('activity_oxygen_debt', 'activity_spo2_distribution', 'daily_oxygen_debt', 'daily_spo2_distribution'),
+}
+
+# Derived cache -> derived caches calculated from it
+CACHE_DEPENDENTS = {
+    'activity_trimp': ('daily_trimp',),
+}
+
+# Derived caches the recompute job recalculates
+RECOMPUTED_CACHES = ('activity_trimp', 'daily_trimp')
+
+
+def stale_caches(source: str) -> List[str]:
+    """Return every derived cache downstream of a kind of raw data, in DERIVED_CACHES order."""
+    if source not in SOURCE_DEPENDENTS:
+        raise ValueError(f"Unknown data source: {source}")
+
+    stale = set()
+    pending = list(SOURCE_DEPENDENTS[source])
+    while pending:
+        cache = pending.pop()
+        if cache not in stale:
+            stale.add(cache)
+            pending.extend(CACHE_DEPENDENTS.get(cache, ()))
+    return [cache for cache in DERIVED_CACHES if cache in stale]
+
+
+def _scope_condition(table: str, dates: List[str], activity_ids: List[str]):
+    """SQL condition and parameters matching the rows of a table that a change touched."""
+    conditions = []
+    params = []
+    if dates:
+        conditions.append(f"date IN ({', '.join('?' * len(dates))})")
+        params.extend(dates)
+    if activity_ids:
+        placeholders = ', '.join('?' * len(activity_ids))
+        if table == 'activity_data':
+            conditions.append(f"activity_id IN ({placeholders})")
+        else:
+            # An activity's day is derived from it too
+            conditions.append(f"date IN (SELECT date FROM activity_data WHERE activity_id IN ({placeholders}))")
+        params.extend(activity_ids)
+    return ' OR '.join(conditions), params
+
+
+def invalidate_caches(cur, caches: Iterable[str], dates: Iterable[str] = (), activity_ids: Iterable[str] = (),
+                      everything: bool = False) -> Dict[str, int]:
+    """
+    Clear derived caches for the days and activities a change touched, one UPDATE per cache.
+
+    Args:
+        cur: Database cursor (the caller commits)
+        caches: Keys of DERIVED_CACHES
+        dates: Days whose rows are stale (YYYY-MM-DD); activity caches of activities on those days too
+        activity_ids: Activities whose rows are stale; day caches of their days too
+        everything: Clear the caches of every row instead
+
+    Returns:
+        Dict of cache -> number of rows cleared
+    """
+    dates = sorted(set(dates))
+    activity_ids = sorted({str(activity_id) for activity_id in activity_ids})
+
+    cleared = {}
+    for cache in caches:
+        table, data_column, hash_column = DERIVED_CACHES[cache]
+        condition, params = _scope_condition(table, dates, activity_ids)
+        if not condition and not everything:
+            cleared[cache] = 0
+            continue
+
+        where = f"{data_column} IS NOT NULL"
+        if not everything:
+            where += f" AND ({condition})"
+        cur.execute(f"""
+            UPDATE {table}
+            SET {data_column} = NULL, {hash_column} = NULL, updated_at = CURRENT_TIMESTAMP
+            WHERE {where}
+        """, [] if everything else params)
+        cleared[cache] = cur.rowcount
+
+    return cleared
+
+
+def schedule_recompute(cur, start_date: Optional[str], end_date: Optional[str]) -> str:
+    """
+    Queue a recompute job for a date range (None for both means every day).
+
+    A recompute job that has not started yet is widened to cover the range
+    instead, so a burst of edits queues one job.
+
+    Returns:
+        The job ID
+    """
+    cur.execute("""
+        SELECT job_id, start_date, end_date
+        FROM background_jobs
+        WHERE job_type = ? AND status = 'pending'
+        ORDER BY created_at
+        LIMIT 1
+    """, (RECOMPUTE_JOB_TYPE,))
+    pending = cur.fetchone()
+
+    if pending:
+        if pending['start_date'] is None or start_date is None:
+            start_date = end_date = None
+        else:
+            start_date = min(start_date, pending['start_date'])
+            end_date = max(end_date, pending['end_date'])
+        cur.execute("""
+            UPDATE background_jobs SET start_date = ?, end_date = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE job_id = ?
+        """, (start_date, end_date, pending['job_id']))
+        return pending['job_id']
+
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')[:-3]
+    job_id = f"{RECOMPUTE_JOB_TYPE}_{timestamp}_{random.randint(1000, 9999)}"
+    cur.execute("""
+        INSERT INTO background_jobs (job_id, job_type, start_date, end_date, status)
+        VALUES (?, ?, ?, ?, 'pending')
+    """, (job_id, RECOMPUTE_JOB_TYPE, start_date, end_date))
+    return job_id
+
+
+def data_changed(source: str, dates: Iterable[str] = (), activity_ids: Iterable[str] = (), everything: bool = False) -> Dict[str, int]:
+    """
+    Report a change to raw data: clear the derived caches downstream of it and
+    queue their recalculation.
+
+    Args:
+        source: Key of SOURCE_DEPENDENTS
+        dates: Days the change touched (YYYY-MM-DD)
+        activity_ids: Activities the change touched
+        everything: The change affects every day and activity (e.g. HR parameters)
+
+    Returns:
+        Dict of cache -> number of rows cleared
+    """
+    dates = list(dates)
+    activity_ids = [str(activity_id) for activity_id in activity_ids]
+    caches = stale_caches(source)
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+
+        cleared = invalidate_caches(cur, caches, dates, activity_ids, everything)
+
+        if any(cache in RECOMPUTED_CACHES for cache in caches):
+            if everything:
+                schedule_recompute(cur, None, None)
+            else:
+                days = set(dates)
+                if activity_ids:
+                    cur.execute(f"SELECT DISTINCT date FROM activity_data WHERE activity_id IN ({', '.join('?' * len(activity_ids))})",
+                                activity_ids)
+                    days.update(row['date'] for row in cur.fetchall())
+                if days:
+                    schedule_recompute(cur, min(days), max(days))
+
+        conn.commit()
+        cur.close()
+
+    logger.info(f"data_changed: {source} changed, cleared {cleared}")
+    return cleared
+
+
+def recompute_derived_job(start_date: Optional[str], end_date: Optional[str], job_id: str):
+    """
+    Background job recalculating the cleared TRIMP caches of a date range (see trimp_recompute).
+
+    Args:
+        start_date: First day (YYYY-MM-DD), None for every day
+        end_date: Last day (YYYY-MM-DD), None for every day
+        job_id: Background job ID
+    """
+    try:
+        progress = recompute_trimp(start_date, end_date, job_id)
+        update_job_status(job_id, 'completed', json.dumps(progress))
+        logger.info(f"recompute_derived_job: {job_id} completed: {progress}")
+
+    except Exception as e:
+        logger.error(f"recompute_derived_job: {job_id} failed: {e}")
+        update_job_status(job_id, 'failed', error_message=f"Error recalculating derived data: {str(e)}")
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Garmin session token cache for Garmin Heart Rate Analyzer
+
+A full Garmin SSO login is slow and heavily rate limited, so the garth OAuth
+tokens from a successful login are stored encrypted in system_config and reused
+by later jobs. The short-lived OAuth2 token is refreshed from the long-lived
+OAuth1 token before it expires, and the refreshed tokens are saved again.
+
+Clients also share an on-disk cache of API responses, so re-collecting past
+days is served locally instead of being downloaded again.
+"""
+
+import logging
+import threading
+import time
+from typing import Optional
+
+from cryptography.fernet import InvalidToken
+from garminconnect import Garmin
+from garminconnect.cache import ResponseCache
+
+from config import API_CONFIG
+from database import decrypt_password, encrypt_password, get_config_value, set_config_value
+
+logger = logging.getLogger(__name__)
+
+GARMIN_TOKENS_CONFIG_KEY = 'garmin_tokens'
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """
+    Return the shared Garmin response cache, opening it on first use.
+    
+    Returns:
+        ResponseCache, or None if disabled in API_CONFIG
+    """
+    global _response_cache
+    
+    if not API_CONFIG['RESPONSE_CACHE_PATH']:
+        return None
+    
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache(API_CONFIG['RESPONSE_CACHE_PATH'],
+                                            max_bytes=API_CONFIG['RESPONSE_CACHE_MAX_BYTES'])
+        return _response_cache
+
+
+def load_garmin_tokens() -> Optional[str]:
+    """
+    Load the cached garth tokens.
+    
+    Returns:
+        Serialized garth tokens, or None if nothing usable is cached
+    """
+    encrypted_tokens = get_config_value(GARMIN_TOKENS_CONFIG_KEY)
+    if not encrypted_tokens:
+        return None
+    
+    try:
+        return decrypt_password(encrypted_tokens)
+    except InvalidToken:
+        # Encrypted with a different key, e.g. before ENCRYPTION_KEY was set
+        logger.warning("load_garmin_tokens: Cached Garmin tokens could not be decrypted, ignoring them")
+        return None
+
+
+def save_garmin_tokens(api: Garmin):
+    """Encrypt and cache the garth tokens of an authenticated client."""
+    set_config_value(GARMIN_TOKENS_CONFIG_KEY, encrypt_password(api.garth.dumps()))
+
+
+def clear_garmin_tokens():
+    """Forget the cached tokens so the next client does a full login."""
+    set_config_value(GARMIN_TOKENS_CONFIG_KEY, '')
+
+
+def tokens_need_refresh(api: Garmin, margin_seconds: int = None) -> bool:
+    """
+    Check whether the client's OAuth2 token expires within the refresh margin.
+    
+    Args:
+        api: Authenticated Garmin client
+        margin_seconds: How long before expiry to refresh (defaults to API_CONFIG)
+    
+    Returns:
+        True if the token is missing, expired or about to expire
+    """
+    if margin_seconds is None:
+        margin_seconds = API_CONFIG['TOKEN_REFRESH_MARGIN_SECONDS']
+    
+    oauth2_token = api.garth.oauth2_token
+    if oauth2_token is None:
+        return True
+    return oauth2_token.expires_at - time.time() < margin_seconds
+
+
+def refresh_garmin_tokens(api: Garmin, margin_seconds: int = None) -> bool:
+    """
+    Refresh the client's OAuth2 token if it is about to expire and cache the new tokens.
+    
+    Args:
+        api: Authenticated Garmin client
+        margin_seconds: How long before expiry to refresh (defaults to API_CONFIG)
+    
+    Returns:
+        True if the token was refreshed
+    """
+    if not tokens_need_refresh(api, margin_seconds):
+        return False
+    
+    logger.info("refresh_garmin_tokens: Refreshing Garmin OAuth2 token")
+    api.garth.refresh_oauth2()
+    save_garmin_tokens(api)
+    return True
+
+
+def login_garmin_client(email: str, password: str) -> Garmin:
+    """
+    Return an authenticated Garmin client, resuming the cached session if possible.
+    
+    Falls back to a full login with the credentials when there are no cached tokens
+    or they have been rejected, and caches the tokens from that login.
+    
+    Args:
+        email: Garmin Connect email
+        password: Garmin Connect password
+    
+    Returns:
+        Authenticated Garmin client
+    """
+    tokens = load_garmin_tokens()
+    if tokens:
+        api = Garmin(email, password, response_cache=get_response_cache())
+        try:
+            api.login(tokenstore=tokens)
+            refresh_garmin_tokens(api)
+            logger.info("login_garmin_client: Resumed cached Garmin session")
+            return api
+        except Exception as e:
+            if "429" in str(e):
+                # Rate limited, a full login would only make it worse
+                raise
+            logger.warning(f"login_garmin_client: Cached Garmin session rejected, logging in again: {e}")
+            clear_garmin_tokens()
+    
+    api = Garmin(email, password, response_cache=get_response_cache())
+    api.login()
+    save_garmin_tokens(api)
+    logger.info("login_garmin_client: Logged in to Garmin and cached the session tokens")
+    return api
@@ -2,13 +2,16 @@
 
 import logging
 import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime, timezone
 from enum import Enum, auto
 from typing import Any, Dict, List, Optional
 
 import garth
 
-from .fit import FitEncoderWeight
+from .fit import FitEncoderBloodPressure, FitEncoderWeight
+from .ratelimit import throttle_response
 
 logger = logging.getLogger(__name__)
 
@@ -16,6 +19,13 @@ logger = logging.getLogger(__name__)
 class Garmin:
     """Class for fetching data from Garmin Connect."""
 
+    # Size limit for each file uploaded by the *_batch methods
+    FIT_UPLOAD_MAX_BYTES = 256 * 1024
+
+    # Largest page iter_activities_by_date requests. Listing ends on an
+    # empty page, so a server that returns fewer is still read to the end.
+    ACTIVITIES_MAX_PAGE_SIZE = 1000
+
     def __init__(
         self,
         email=None,
@@ -23,13 +33,21 @@ class Garmin:
         is_cn=False,
         prompt_mfa=None,
         return_on_mfa=False,
+        response_cache=None,
+        rate_limiter=None,
     ):
-        """Create a new class instance."""
+        """Create a new class instance.
+
+        'response_cache' is an optional cache.ResponseCache for GET requests
+        to endpoints whose past data does not change. 'rate_limiter' is an
+        optional ratelimit.RateLimiter that requests to Garmin go through."""
         self.username = email
         self.password = password
         self.is_cn = is_cn
         self.prompt_mfa = prompt_mfa
         self.return_on_mfa = return_on_mfa
+        self.response_cache = response_cache
+        self.rate_limiter = rate_limiter
 
         self.garmin_connect_user_settings_url = (
             "/userprofile-service/userprofile/user-settings"
@@ -221,10 +239,33 @@ class Garmin:
         self.unit_system = None
 
     def connectapi(self, path, **kwargs):
-        return self.garth.connectapi(path, **kwargs)
+        def fetch():
+            return self._request(self.garth.connectapi, path, **kwargs)
+
+        if self.response_cache is None or kwargs.get("method", "GET") != "GET":
+            return fetch()
+        return self.response_cache.cached(path, kwargs.get("params"), fetch)
 
     def download(self, path, **kwargs):
-        return self.garth.download(path, **kwargs)
+        def fetch():
+            return self._request(self.garth.download, path, **kwargs)
+
+        if self.response_cache is None:
+            return fetch()
+        return self.response_cache.cached(path, kwargs.get("params"), fetch)
+
+    def _request(self, send, *args, **kwargs):
+        """Send a request to Garmin, through the rate limiter if there is
+        one. Throttled requests it gave up on raise
+        GarminConnectTooManyRequestsError."""
+        if self.rate_limiter is None:
+            return send(*args, **kwargs)
+        try:
+            return self.rate_limiter.call(lambda: send(*args, **kwargs))
+        except Exception as e:
+            if throttle_response(e) is None:
+                raise
+            raise GarminConnectTooManyRequestsError(str(e)) from e
 
     def login(self, /, tokenstore: Optional[str] = None) -> tuple[Any, Any]:
         """Log in using Garth."""
@@ -399,11 +440,127 @@ class Garmin:
         )
         fitEncoder.finish()
 
+        return self._upload_fit(fitEncoder, "body_composition.fit")
+
+    def add_body_composition_batch(
+        self, records, max_file_bytes: Optional[int] = None
+    ) -> List[Any]:
+        """
+        Upload many body composition measurements in a few FIT files.
+
+        Each record is a dict with the keyword arguments of
+        add_body_composition ('timestamp', 'weight', 'percent_fat', ...).
+        Records are packed into multi-record files of at most
+        'max_file_bytes' (default FIT_UPLOAD_MAX_BYTES), so a backfill takes
+        one upload per file instead of one per measurement. Returns the
+        upload responses, one per file.
+        """
+
+        def write_record(encoder, record):
+            record = dict(record)
+            timestamp = record.pop("timestamp", None)
+            dt = (
+                datetime.fromisoformat(timestamp)
+                if timestamp
+                else datetime.now()
+            )
+            encoder.write_device_info(dt)
+            encoder.write_weight_scale(dt, **record)
+
+        return self._upload_fit_batches(
+            FitEncoderWeight,
+            write_record,
+            records,
+            "body_composition.fit",
+            max_file_bytes,
+        )
+
+    def add_blood_pressure_batch(
+        self, records, max_file_bytes: Optional[int] = None
+    ) -> List[Any]:
+        """
+        Upload many blood pressure measurements in a few FIT files.
+
+        Each record is a dict with 'timestamp', 'systolic', 'diastolic' and
+        optionally 'pulse', as for set_blood_pressure. Returns the upload
+        responses, one per file.
+        """
+
+        def write_record(encoder, record):
+            timestamp = record.get("timestamp")
+            dt = (
+                datetime.fromisoformat(timestamp)
+                if timestamp
+                else datetime.now()
+            )
+            encoder.write_blood_pressure(
+                dt,
+                systolic_blood_pressure=record["systolic"],
+                diastolic_blood_pressure=record["diastolic"],
+                heart_rate=record.get("pulse"),
+            )
+
+        return self._upload_fit_batches(
+            FitEncoderBloodPressure,
+            write_record,
+            records,
+            "blood_pressure.fit",
+            max_file_bytes,
+        )
+
+    def _upload_fit(self, encoder, filename: str):
+        """Upload a finished FIT file."""
+
         url = self.garmin_connect_upload
         files = {
-            "file": ("body_composition.fit", fitEncoder.getvalue()),
+            "file": (filename, encoder.getvalue()),
         }
-        return self.garth.post("connectapi", url, files=files, api=True)
+        return self._request(
+            self.garth.post, "connectapi", url, files=files, api=True
+        )
+
+    def _upload_fit_batches(
+        self,
+        encoder_class,
+        write_record,
+        records,
+        filename: str,
+        max_file_bytes: Optional[int] = None,
+    ) -> List[Any]:
+        """Write records into size-bounded FIT files and upload each one."""
+
+        max_file_bytes = max_file_bytes or self.FIT_UPLOAD_MAX_BYTES
+        responses = []
+        encoder = None
+        record_size = 0
+
+        def upload(encoder):
+            encoder.finish()
+            logger.debug(
+                "Uploading %s with %d bytes", filename, encoder.get_size()
+            )
+            responses.append(self._upload_fit(encoder, filename))
+
+        for record in records:
+            # 2 bytes for the CRC written by finish()
+            if (
+                encoder is not None
+                and encoder.get_size() + record_size + 2 > max_file_bytes
+            ):
+                upload(encoder)
+                encoder = None
+            if encoder is None:
+                encoder = encoder_class()
+                encoder.write_file_info()
+                encoder.write_file_creator()
+
+            size_before = encoder.data_size
+            write_record(encoder, record)
+            record_size = max(record_size, encoder.data_size - size_before)
+
+        if encoder is not None:
+            upload(encoder)
+        return responses
 
     def add_weigh_in(
         self, weight: int, unitKey: str = "kg", timestamp: str = ""
@@ -1137,17 +1294,43 @@ class Garmin:
         :return: list of JSON activities
         """
 
-        activities = []
-        start = 0
-        limit = 20
+        return list(
+            self.iter_activities_by_date(
+                startdate, enddate, activitytype, sortorder
+            )
+        )
+
+    def iter_activities_by_date(
+        self,
+        startdate,
+        enddate=None,
+        activitytype=None,
+        sortorder=None,
+        page_size=20,
+        prefetch=0,
+    ):
+        """
+        Yield activities between specific dates as their pages arrive.
+        Takes the same filters as get_activities_by_date, plus:
+        :param page_size: activities per request, at most
+                          ACTIVITIES_MAX_PAGE_SIZE; the listing ends on an
+                          empty page, so a smaller server cap is fine
+        :param prefetch: number of further pages to request concurrently
+                         while the current page is consumed
+        :return: generator of JSON activities
+        """
+
+        if page_size < 1:
+            raise ValueError("page_size must be at least 1")
+        page_size = min(page_size, self.ACTIVITIES_MAX_PAGE_SIZE)
+
         # mimicking the behavior of the web interface that fetches
-        # 20 activities at a time
+        # a page of activities at a time
         # and automatically loads more on scroll
         url = self.garmin_connect_activities
         params = {
             "startDate": str(startdate),
-            "start": str(start),
-            "limit": str(limit),
+            "limit": str(page_size),
         }
         if enddate:
             params["endDate"] = str(enddate)
@@ -1156,20 +1339,55 @@ class Garmin:
         if sortorder:
             params["sortOrder"] = str(sortorder)
 
+        def fetch_page(start):
+            logger.debug(
+                f"Requesting activities {start} to {start + page_size}"
+            )
+            return self.connectapi(url, params={**params, "start": str(start)})
+
         logger.debug(
             f"Requesting activities by date from {startdate} to {enddate}"
         )
-        while True:
-            params["start"] = str(start)
-            logger.debug(f"Requesting activities {start} to {start+limit}")
-            act = self.connectapi(url, params=params)
-            if act:
-                activities.extend(act)
-                start = start + limit
-            else:
-                break
 
-        return activities
+        def fetch_pages_from(start):
+            # One page at a time, advancing by what the server returned, so a
+            # server that caps "limit" below page_size skips nothing
+            while True:
+                page = fetch_page(start)
+                if not page:
+                    return
+                yield from page
+                start += len(page)
+
+        if prefetch < 1:
+            yield from fetch_pages_from(0)
+            return
+
+        # Keep the next 'prefetch' pages in flight while yielding one
+        executor = ThreadPoolExecutor(max_workers=prefetch)
+        try:
+            pending = deque(
+                executor.submit(fetch_page, page * page_size)
+                for page in range(prefetch + 1)
+            )
+            next_start = (prefetch + 1) * page_size
+            start = 0
+            while True:
+                page = pending.popleft().result()
+                if not page:
+                    return
+                yield from page
+                start += len(page)
+                if len(page) < page_size:
+                    # Either the last page or a server cap: the prefetched
+                    # offsets no longer line up, so continue one at a time
+                    break
+                pending.append(executor.submit(fetch_page, next_start))
+                next_start += page_size
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        yield from fetch_pages_from(start)
 
     def get_progress_summary_between_dates(
         self, startdate, enddate, metric="distance", groupbyactivities=True
@@ -1380,6 +1598,20 @@ class Garmin:
 
         return self.connectapi(url, params=params)
 
+    def forget_activity(self, activity_id):
+        """Drop the cached details and original file of an activity, so
+        the next request fetches them again (e.g. after it was edited)."""
+
+        if self.response_cache is None:
+            return
+        activity_id = str(activity_id)
+        self.response_cache.invalidate(
+            f"{self.garmin_connect_activity}/{activity_id}/details"
+        )
+        self.response_cache.invalidate(
+            f"{self.garmin_connect_fit_download}/{activity_id}"
+        )
+
     def get_activity_exercise_sets(self, activity_id):
         """Return activity exercise sets."""
 
@@ -1531,3 +1763,12 @@ class GarminConnectAuthenticationError(Exception):
 
 class GarminConnectInvalidFileFormatError(Exception):
     """Raised when an invalid file format is passed to upload."""
+
+
+def __getattr__(name):
+    # AsyncGarmin needs aiohttp, which is an optional dependency
+    if name == "AsyncGarmin":
+        from .aio import AsyncGarmin
+
+        return AsyncGarmin
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,178 @@
+"""asyncio client for Garmin Connect, for fetching many days concurrently."""
+
+import asyncio
+import logging
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, Optional, Union
+
+import aiohttp
+
+from . import (
+    Garmin,
+    GarminConnectAuthenticationError,
+    GarminConnectConnectionError,
+    GarminConnectTooManyRequestsError,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 4
+
+
+class AsyncGarmin:
+    """asyncio sibling of Garmin for read-only Connect API requests.
+
+    Wraps a logged-in Garmin instance and shares its URL table, display name
+    and garth OAuth tokens, so both can be used side by side. Requests go
+    through one aiohttp session and at most 'concurrency' run at once.
+
+    Use as an async context manager:
+
+        async with AsyncGarmin(api) as client:
+            days = await client.gather_range("get_heart_rates", start, end)
+    """
+
+    def __init__(
+        self,
+        garmin: Garmin,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        base_url: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ):
+        """Create a client sharing 'garmin''s session tokens."""
+        self.garmin = garmin
+        self.concurrency = concurrency
+        self.base_url = base_url or f"https://connectapi.{garmin.garth.domain}"
+        self.timeout = timeout or garmin.garth.timeout
+        self.session = None
+        self._semaphore = None
+        self._refresh_lock = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def open(self):
+        """Open the HTTP session."""
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                headers={
+                    "User-Agent": self.garmin.garth.sess.headers["User-Agent"]
+                },
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._refresh_lock = asyncio.Lock()
+
+    async def close(self):
+        """Close the HTTP session."""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def _authorization(self) -> str:
+        garth_client = self.garmin.garth
+        async with self._refresh_lock:
+            if (
+                garth_client.oauth2_token is None
+                or garth_client.oauth2_token.expired
+            ):
+                # refresh through garth, so the sync client sees the new token
+                await asyncio.to_thread(garth_client.refresh_oauth2)
+        return str(garth_client.oauth2_token)
+
+    async def connectapi(self, path: str, **kwargs) -> Any:
+        """Async version of Garmin.connectapi (GET only)."""
+        await self.open()
+        async with self._semaphore:
+            headers = {"Authorization": await self._authorization()}
+            async with self.session.get(
+                self.base_url + path, headers=headers, **kwargs
+            ) as response:
+                if response.status == 401:
+                    raise GarminConnectAuthenticationError(
+                        f"Authentication error: {path}"
+                    )
+                if response.status == 429:
+                    raise GarminConnectTooManyRequestsError(
+                        f"Too many requests: {path}"
+                    )
+                if response.status >= 400:
+                    raise GarminConnectConnectionError(
+                        f"Error {response.status} requesting {path}"
+                    )
+                if response.status == 204:
+                    return None
+                return await response.json()
+
+    async def get_heart_rates(self, cdate: str) -> Dict[str, Any]:
+        """Fetch available heart rates data 'cDate' format 'YYYY-MM-DD'."""
+
+        url = f"{self.garmin.garmin_connect_heartrates_daily_url}/{self.garmin.display_name}"  # noqa
+        params = {"date": str(cdate)}
+        logger.debug("Requesting heart rates")
+
+        return await self.connectapi(url, params=params)
+
+    async def get_activities_fordate(self, fordate: str):
+        """Return available activities for date."""
+
+        url = f"{self.garmin.garmin_connect_activity_fordate}/{fordate}"
+        logger.debug(f"Requesting activities for date {fordate}")
+
+        return await self.connectapi(url)
+
+    async def get_activity_details(
+        self, activity_id, maxchart=2000, maxpoly=4000
+    ):
+        """Return activity details."""
+
+        activity_id = str(activity_id)
+        params = {
+            "maxChartSize": str(maxchart),
+            "maxPolylineSize": str(maxpoly),
+        }
+        url = f"{self.garmin.garmin_connect_activity}/{activity_id}/details"
+        logger.debug("Requesting details for activity id %s", activity_id)
+
+        return await self.connectapi(url, params=params)
+
+    async def gather_range(
+        self,
+        method: Union[str, Callable],
+        start: Union[str, date],
+        end: Union[str, date],
+        concurrency: Optional[int] = None,
+        return_exceptions: bool = False,
+    ) -> Dict[str, Any]:
+        """Call a per-day method for every date from 'start' to 'end'.
+
+        'method' is the name of an AsyncGarmin method taking a 'YYYY-MM-DD'
+        date, or any coroutine function taking one. At most 'concurrency'
+        days (default: the client's limit) are in flight at once. Returns
+        {date: result} in date order. With 'return_exceptions' a failed day
+        maps to its exception instead of cancelling the range."""
+        if isinstance(method, str):
+            method = getattr(self, method)
+        if isinstance(start, str):
+            start = datetime.strptime(start, "%Y-%m-%d").date()
+        if isinstance(end, str):
+            end = datetime.strptime(end, "%Y-%m-%d").date()
+
+        days = [
+            (start + timedelta(days=offset)).isoformat()
+            for offset in range((end - start).days + 1)
+        ]
+        limit = asyncio.Semaphore(concurrency or self.concurrency)
+
+        async def fetch(day):
+            async with limit:
+                return await method(day)
+
+        results = await asyncio.gather(
+            *(fetch(day) for day in days), return_exceptions=return_exceptions
+        )
+        return dict(zip(days, results))
@@ -0,0 +1,282 @@
+"""On-disk cache for Garmin Connect API responses."""
+
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from datetime import date
+from typing import Any, Callable, Dict, Iterable, Optional
+from urllib.parse import urlencode
+
+logger = logging.getLogger(__name__)
+
+DATE_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+# Returned by ResponseCache.get for keys that are not cached
+MISS = object()
+
+
+class CachePolicy:
+    """How long responses from the endpoints matching 'pattern' are kept.
+
+    Responses for a day at least 'immutable_after_days' old never expire.
+    More recent days (Garmin devices keep syncing data for today and
+    yesterday) expire after 'recent_ttl' seconds. Responses without a date
+    in their path or params, such as activity details, expire after
+    'undated_ttl' seconds, or never if it is None.
+
+    Empty responses (None, {}, [], b"") are never cached, nor are dict
+    responses without a value under 'data_key', so a day fetched before the
+    watch synced it is fetched again.
+    """
+
+    def __init__(
+        self,
+        pattern: str,
+        recent_ttl: float = 15 * 60,
+        immutable_after_days: int = 2,
+        undated_ttl: Optional[float] = None,
+        data_key: Optional[str] = None,
+    ):
+        self.pattern = re.compile(pattern)
+        self.recent_ttl = recent_ttl
+        self.immutable_after_days = immutable_after_days
+        self.undated_ttl = undated_ttl
+        self.data_key = data_key
+
+    def matches(self, path: str) -> bool:
+        return self.pattern.match(path) is not None
+
+    def cacheable(self, value: Any) -> bool:
+        """Whether a response holds data worth keeping."""
+        if not value:
+            return False
+        if self.data_key is not None and isinstance(value, dict):
+            return bool(value.get(self.data_key))
+        return True
+
+    def ttl(self, path: str, params: Optional[dict] = None, today=None):
+        """Seconds until a response expires, None if it never does."""
+        values = [path] + [str(value) for value in (params or {}).values()]
+        days = [
+            match for value in values for match in DATE_PATTERN.findall(value)
+        ]
+        if not days:
+            return self.undated_ttl
+
+        # For ranges the most recent day decides
+        newest = date.fromisoformat(max(days))
+        age = ((today or date.today()) - newest).days
+        if age >= self.immutable_after_days:
+            return None
+        return self.recent_ttl
+
+
+# Activities can be edited or trimmed after upload; sync drops their cached
+# responses when it sees a change (Garmin.forget_activity), and this bounds
+# how long an edit made any other way can be served stale
+ACTIVITY_TTL = 24 * 60 * 60
+
+DEFAULT_POLICIES = (
+    CachePolicy(
+        r"/wellness-service/wellness/dailyHeartRate/",
+        data_key="heartRateValues",
+    ),
+    CachePolicy(r"/wellness-service/wellness/daily/spo2/"),
+    CachePolicy(r"/mobile-gateway/heartRate/forDate/"),
+    CachePolicy(
+        r"/activity-service/activity/\d+/details$", undated_ttl=ACTIVITY_TTL
+    ),
+    CachePolicy(
+        r"/download-service/files/activity/\d+$", undated_ttl=ACTIVITY_TTL
+    ),
+)
+
+
+class ResponseCache:
+    """Compressed, size-bounded SQLite store of API responses.
+
+    Entries are keyed on path and params. Only endpoints with a matching
+    CachePolicy are cached, and the least recently used entries are evicted
+    once the stored (compressed) size exceeds 'max_bytes'. Safe to share
+    between threads.
+
+    Garmin only calls cached() and invalidate(); any object providing them
+    can be plugged in as Garmin.response_cache instead.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int = 512 * 1024 * 1024,
+        policies: Iterable[CachePolicy] = DEFAULT_POLICIES,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.policies = list(policies)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                is_binary INTEGER NOT NULL,
+                body BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL,
+                last_access REAL NOT NULL
+            )
+            """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_responses_last_access "
+            "ON responses(last_access)"
+        )
+        self.size = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()[0]
+
+    @staticmethod
+    def make_key(path: str, params: Optional[dict] = None) -> str:
+        if not params:
+            return path
+        return f"{path}?{urlencode(sorted(params.items()))}"
+
+    def policy_for(self, path: str) -> Optional[CachePolicy]:
+        for policy in self.policies:
+            if policy.matches(path):
+                return policy
+        return None
+
+    def get(self, key: str) -> Any:
+        """Return the cached response for 'key', or MISS."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT is_binary, body, size, expires_at FROM responses "
+                "WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                return MISS
+            is_binary, body, size, expires_at = row
+            if expires_at is not None and expires_at <= now:
+                self._conn.execute(
+                    "DELETE FROM responses WHERE key = ?", (key,)
+                )
+                self.size -= size
+                return MISS
+            self._conn.execute(
+                "UPDATE responses SET last_access = ? WHERE key = ?",
+                (now, key),
+            )
+
+        body = zlib.decompress(body)
+        return body if is_binary else json.loads(body)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        """Store a response, expiring after 'ttl' seconds if given."""
+        is_binary = isinstance(value, (bytes, bytearray))
+        body = bytes(value) if is_binary else json.dumps(value).encode()
+        body = zlib.compress(body)
+        now = time.time()
+        expires_at = None if ttl is None else now + ttl
+
+        with self._lock:
+            old = self._conn.execute(
+                "SELECT size FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(key, is_binary, body, size, expires_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, int(is_binary), body, len(body), expires_at, now),
+            )
+            self.size += len(body) - (old[0] if old else 0)
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        self._conn.execute("BEGIN")
+        rows = self._conn.execute(
+            "SELECT key, size FROM responses ORDER BY last_access"
+        )
+        evicted = []
+        for key, size in rows:
+            if self.size <= self.max_bytes:
+                break
+            evicted.append((key,))
+            self.size -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        self._conn.execute("COMMIT")
+        self.evictions += len(evicted)
+        logger.debug("Evicted %d cached responses", len(evicted))
+
+    def cached(
+        self, path: str, params: Optional[dict], fetch: Callable[[], Any]
+    ):
+        """Return the response for path and params, calling fetch() on a
+        miss. Endpoints without a policy are always fetched."""
+        policy = self.policy_for(path)
+        if policy is None:
+            return fetch()
+
+        key = self.make_key(path, params)
+        value = self.get(key)
+        with self._lock:
+            if value is MISS:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if value is not MISS:
+            return value
+
+        value = fetch()
+        if policy.cacheable(value):
+            self.set(key, value, policy.ttl(path, params))
+        return value
+
+    def invalidate(self, path: str):
+        """Remove the cached responses for a path, whatever their params."""
+        prefix = f"{path}?"
+        with self._lock:
+            removed = self._conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM responses "
+                "WHERE key = ? OR substr(key, 1, ?) = ?",
+                (path, len(prefix), prefix),
+            ).fetchone()[0]
+            self._conn.execute(
+                "DELETE FROM responses WHERE key = ? OR substr(key, 1, ?) = ?",
+                (path, len(prefix), prefix),
+            )
+            self.size -= removed
+
+    def clear(self):
+        """Remove every cached response."""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self.size = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss/eviction counters and the stored size."""
+        with self._lock:
+            entries = self._conn.execute(
+                "SELECT COUNT(*) FROM responses"
+            ).fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": entries,
+            "bytes": self.size,
+        }
+
+    def close(self):
+        self._conn.close()
@@ -1,28 +1,31 @@
 import time
+import zipfile
 from datetime import datetime
 from io import BytesIO
-from struct import pack, unpack
+from struct import Struct, pack, unpack_from
+
+_CRC_NIBBLE_TABLE = (
+    0x0000,
+    0xCC01,
+    0xD801,
+    0x1400,
+    0xF001,
+    0x3C00,
+    0x2800,
+    0xE401,
+    0xA001,
+    0x6C00,
+    0x7800,
+    0xB401,
+    0x5000,
+    0x9C01,
+    0x8801,
+    0x4400,
+)
 
 
 def _calcCRC(crc, byte):
-    table = [
-        0x0000,
-        0xCC01,
-        0xD801,
-        0x1400,
-        0xF001,
-        0x3C00,
-        0x2800,
-        0xE401,
-        0xA001,
-        0x6C00,
-        0x7800,
-        0xB401,
-        0x5000,
-        0x9C01,
-        0x8801,
-        0x4400,
-    ]
+    table = _CRC_NIBBLE_TABLE
     # compute checksum of lower four bits of byte
     tmp = table[crc & 0xF]
     crc = (crc >> 4) & 0x0FFF
@@ -34,6 +37,58 @@ def _calcCRC(crc, byte):
     return crc
 
 
+# one entry per byte value, so the CRC advances a whole byte per lookup
+_CRC_TABLE = tuple(_calcCRC(0, byte) for byte in range(256))
+
+
+def _crc_update(crc, data):
+    """Continue the FIT CRC-16 over data"""
+    table = _CRC_TABLE
+    for byte in data:
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+    return crc
+
+
+def _gf2_apply(operator, crc):
+    result = 0
+    bit = 0
+    while crc:
+        if crc & 1:
+            result ^= operator[bit]
+        crc >>= 1
+        bit += 1
+    return result
+
+
+def _gf2_compose(first, second):
+    """Operator applying first, then second"""
+    return [_gf2_apply(second, column) for column in first]
+
+
+# _CRC_ZERO_OPERATORS[k] advances a CRC over 2**k zero bytes. The CRC has no
+# final xor, so it is linear and crc(init, data) == crc(0, data) ^
+# crc(init, zeros), which lets the CRC of the data written after the header
+# be combined with the header's CRC once the header is final.
+_CRC_ZERO_OPERATORS = [
+    [(1 << bit >> 8) ^ _CRC_TABLE[(1 << bit) & 0xFF] for bit in range(16)]
+]
+for _ in range(31):
+    _CRC_ZERO_OPERATORS.append(
+        _gf2_compose(_CRC_ZERO_OPERATORS[-1], _CRC_ZERO_OPERATORS[-1])
+    )
+
+
+def _crc_combine(crc1, crc2, length2):
+    """CRC of a + b from crc1 = CRC of a, crc2 = CRC of b, length2 = len(b)"""
+    power = 0
+    while length2:
+        if length2 & 1:
+            crc1 = _gf2_apply(_CRC_ZERO_OPERATORS[power], crc1)
+        length2 >>= 1
+        power += 1
+    return crc1 ^ crc2
+
+
 class FitBaseType(object):
     """BaseType Definition
 
@@ -202,6 +257,9 @@ class FitEncoder(Fit):
 
     def __init__(self):
         self.buf = BytesIO()
+        # running CRC and length of everything written after the header
+        self.data_crc = 0
+        self.data_size = 0
         self.write_header()  # create header first
         self.device_info_defined = False
 
@@ -235,6 +293,14 @@ class FitEncoder(Fit):
             data_type,
         )
         self.buf.write(s)
+        self.header = s
+
+    def write(self, data):
+        """append data after the header, keeping the CRC up to date"""
+        self.buf.seek(0, 2)
+        self.buf.write(data)
+        self.data_crc = _crc_update(self.data_crc, data)
+        self.data_size += len(data)
 
     def _build_content_block(self, content):
         field_defs = []
@@ -277,7 +343,7 @@ class FitEncoder(Fit):
             "BBHB", 0, 0, msg_number, len(content)
         )  # reserved, architecture(0: little endian)
 
-        self.buf.write(
+        self.write(
             b"".join(
                 [
                     # definition
@@ -304,7 +370,7 @@ class FitEncoder(Fit):
         fixed_content = pack(
             "BBHB", 0, 0, msg_number, len(content)
         )  # reserved, architecture(0: little endian)
-        self.buf.write(
+        self.write(
             b"".join(
                 [
                     # definition
@@ -358,11 +424,11 @@ class FitEncoder(Fit):
             fixed_content = pack(
                 "BBHB", 0, 0, msg_number, len(content)
             )  # reserved, architecture(0: little endian)
-            self.buf.write(header + fixed_content + fields)
+            self.write(header + fixed_content + fields)
             self.device_info_defined = True
 
         header = self.record_header(lmsg_type=self.LMSG_TYPE_DEVICE_INFO)
-        self.buf.write(header + values)
+        self.write(header + values)
 
     def record_header(self, definition=False, lmsg_type=0):
         msg = 0
@@ -371,22 +437,14 @@ class FitEncoder(Fit):
         return pack("B", msg + lmsg_type)
 
     def crc(self):
-        orig_pos = self.buf.tell()
-        self.buf.seek(0)
-
-        crc = 0
-        while True:
-            b = self.buf.read(1)
-            if not b:
-                break
-            crc = _calcCRC(crc, unpack("b", b)[0])
-        self.buf.seek(orig_pos)
+        crc = _crc_combine(
+            _crc_update(0, self.header), self.data_crc, self.data_size
+        )
         return pack("H", crc)
 
     def finish(self):
         """re-weite file-header, then append crc to end of file"""
-        data_size = self.get_size() - self.HEADER_SIZE
-        self.write_header(data_size=data_size)
+        self.write_header(data_size=self.data_size)
         crc = self.crc()
         self.buf.seek(0, 2)
         self.buf.write(crc)
@@ -449,11 +507,11 @@ class FitEncoderBloodPressure(FitEncoder):
             fixed_content = pack(
                 "BBHB", 0, 0, msg_number, len(content)
             )  # reserved, architecture(0: little endian)
-            self.buf.write(header + fixed_content + fields)
+            self.write(header + fixed_content + fields)
             self.blood_pressure_monitor_defined = True
 
         header = self.record_header(lmsg_type=self.LMSG_TYPE_BLOOD_PRESSURE)
-        self.buf.write(header + values)
+        self.write(header + values)
 
 
 class FitEncoderWeight(FitEncoder):
@@ -504,8 +562,198 @@ class FitEncoderWeight(FitEncoder):
             fixed_content = pack(
                 "BBHB", 0, 0, msg_number, len(content)
             )  # reserved, architecture(0: little endian)
-            self.buf.write(header + fixed_content + fields)
+            self.write(header + fixed_content + fields)
             self.weight_scale_defined = True
 
         header = self.record_header(lmsg_type=self.LMSG_TYPE_WEIGHT_SCALE)
-        self.buf.write(header + values)
+        self.write(header + values)
+
+
+class FitDecoder(Fit):
+    """Streaming decoder for FIT files, e.g. ORIGINAL activity downloads.
+
+    Messages are decoded straight out of a memoryview of the file with one
+    precompiled struct.Struct per definition message, so nothing is copied
+    apart from the decoded values themselves."""
+
+    # FIT timestamps are seconds since UTC 00:00 Dec 31 1989
+    EPOCH_OFFSET = 631065600
+
+    MSG_RECORD = 20
+    FIELD_TIMESTAMP = 253
+    RECORD_HEART_RATE = 3
+    RECORD_RESPIRATION_RATE = 99
+    RECORD_ENHANCED_RESPIRATION_RATE = 108  # breaths/min * 100
+
+    # base type number -> (struct format, size, invalid value)
+    BASE_TYPES = {
+        0: ("B", 1, 0xFF),
+        1: ("b", 1, 0x7F),
+        2: ("B", 1, 0xFF),
+        3: ("h", 2, 0x7FFF),
+        4: ("H", 2, 0xFFFF),
+        5: ("i", 4, 0x7FFFFFFF),
+        6: ("I", 4, 0xFFFFFFFF),
+        8: ("f", 4, None),
+        9: ("d", 8, None),
+        10: ("B", 1, 0x00),
+        11: ("H", 2, 0x0000),
+        12: ("I", 4, 0x00000000),
+        14: ("q", 8, 0x7FFFFFFFFFFFFFFF),
+        15: ("Q", 8, 0xFFFFFFFFFFFFFFFF),
+        16: ("Q", 8, 0x0000000000000000),
+    }
+
+    def __init__(self, data):
+        """data is the content of a .fit file, or of a zip containing one"""
+        if bytes(data[:2]) == b"PK":
+            data = self._extract_fit_from_zip(data)
+        self.view = memoryview(data)
+
+    @staticmethod
+    def _extract_fit_from_zip(data):
+        with zipfile.ZipFile(BytesIO(data)) as archive:
+            for name in archive.namelist():
+                if name.lower().endswith(".fit"):
+                    return archive.read(name)
+        raise ValueError("No .fit file found in zip archive")
+
+    def _build_definition(self, offset, developer_data):
+        """Parse a definition message, returning (definition, next offset)"""
+        view = self.view
+        big_endian = view[offset + 1] == 1
+        endian = ">" if big_endian else "<"
+        global_msg_num = unpack_from(endian + "H", view, offset + 2)[0]
+        num_fields = view[offset + 4]
+        offset += 5
+
+        formats = [endian]
+        field_nums = []
+        invalids = []
+        for _ in range(num_fields):
+            field_num, size, base_type = view[offset : offset + 3]
+            offset += 3
+            fmt, base_size, invalid = self.BASE_TYPES.get(
+                base_type & 0x1F, (None, 0, None)
+            )
+            if fmt is None or size != base_size:
+                # strings, byte arrays and multi-value fields are kept raw
+                fmt, invalid = f"{size}s", None
+            formats.append(fmt)
+            field_nums.append(field_num)
+            invalids.append(invalid)
+
+        if developer_data:
+            num_dev_fields = view[offset]
+            offset += 1
+            dev_size = sum(
+                view[offset + 3 * i + 1] for i in range(num_dev_fields)
+            )
+            offset += 3 * num_dev_fields
+            if dev_size:
+                formats.append(f"{dev_size}x")
+
+        definition = (
+            global_msg_num,
+            Struct("".join(formats)),
+            tuple(field_nums),
+            tuple(invalids),
+        )
+        return definition, offset
+
+    def messages(self):
+        """Yield (global message number, {field number: value}) per data message.
+
+        Invalid values are returned as None. Messages using a compressed
+        timestamp header get their full timestamp in field 253."""
+        view = self.view
+        offset = 0
+        while offset + Fit.HEADER_SIZE <= len(view):
+            header_size = view[offset]
+            data_size = unpack_from("<I", view, offset + 4)[0]
+            if bytes(view[offset + 8 : offset + 12]) != b".FIT":
+                raise ValueError("Not a FIT file")
+            end = offset + header_size + data_size
+            if end > len(view):
+                raise ValueError("Truncated FIT file")
+            offset += header_size
+
+            definitions = {}
+            last_timestamp = None
+            while offset < end:
+                record_header = view[offset]
+                offset += 1
+                compressed_timestamp = None
+
+                if record_header & 0x80:
+                    # compressed timestamp: 2 bit local type, 5 bit time offset
+                    local_type = (record_header >> 5) & 0x03
+                    time_offset = record_header & 0x1F
+                    if last_timestamp is not None:
+                        compressed_timestamp = (
+                            last_timestamp & ~0x1F
+                        ) + time_offset
+                        if time_offset < (last_timestamp & 0x1F):
+                            compressed_timestamp += 0x20
+                        last_timestamp = compressed_timestamp
+                elif record_header & 0x40:
+                    definitions[record_header & 0x0F], offset = (
+                        self._build_definition(offset, record_header & 0x20)
+                    )
+                    continue
+                else:
+                    local_type = record_header & 0x0F
+
+                global_msg_num, struct, field_nums, invalids = definitions[
+                    local_type
+                ]
+                values = struct.unpack_from(view, offset)
+                offset += struct.size
+
+                fields = {
+                    num: (None if value == invalid else value)
+                    for num, value, invalid in zip(
+                        field_nums, values, invalids
+                    )
+                }
+                timestamp = fields.get(self.FIELD_TIMESTAMP)
+                if timestamp is not None:
+                    last_timestamp = timestamp
+                elif compressed_timestamp is not None:
+                    fields[self.FIELD_TIMESTAMP] = compressed_timestamp
+                yield global_msg_num, fields
+
+            # skip the file CRC, another FIT file may be chained after it
+            offset = end + 2
+
+    def records(self):
+        """Yield the field dict of every record message"""
+        for global_msg_num, fields in self.messages():
+            if global_msg_num == self.MSG_RECORD:
+                yield fields
+
+    def activity_series(self):
+        """Decode record messages into per-second series.
+
+        Returns a dict with "heart_rate" and "respiration_rate" lists of
+        [timestamp in ms, value] pairs, skipping samples without a value."""
+        heart_rate = []
+        respiration_rate = []
+        for fields in self.records():
+            timestamp = fields.get(self.FIELD_TIMESTAMP)
+            if timestamp is None:
+                continue
+            timestamp_ms = (timestamp + self.EPOCH_OFFSET) * 1000
+
+            hr = fields.get(self.RECORD_HEART_RATE)
+            if hr is not None:
+                heart_rate.append([timestamp_ms, hr])
+
+            rate = fields.get(self.RECORD_ENHANCED_RESPIRATION_RATE)
+            if rate is not None:
+                respiration_rate.append([timestamp_ms, rate / 100])
+            else:
+                rate = fields.get(self.RECORD_RESPIRATION_RATE)
+                if rate is not None:
+                    respiration_rate.append([timestamp_ms, float(rate)])
+        return {"heart_rate": heart_rate, "respiration_rate": respiration_rate}
@@ -0,0 +1,216 @@
+"""Client-side rate limiting for Garmin Connect requests."""
+
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def error_response(error: Exception):
+    """Return the HTTP response an error carries, None if it has none.
+
+    garth wraps the requests HTTPError in GarthHTTPError.error."""
+    while error is not None:
+        response = getattr(error, "response", None)
+        if response is not None:
+            return response
+        error = getattr(error, "error", None)
+    return None
+
+
+def throttle_response(error: Exception):
+    """Return the HTTP response of a 429 error, None for other errors."""
+    response = error_response(error)
+    return response if response is not None and response.status_code == 429 else None
+
+
+def retry_after_seconds(response) -> Optional[float]:
+    """Parse a Retry-After header given in seconds or as an HTTP date."""
+    if response is None:
+        return None
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Thread-safe token bucket limiting how often requests are made."""
+
+    def __init__(self, rate: float, capacity: int):
+        """'rate' tokens are added per second, up to 'capacity'."""
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+
+    def acquire(self) -> float:
+        """Block until a token is available, then take it.
+
+        Returns the number of seconds spent waiting."""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                else:
+                    self._refill(now)
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return waited
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def pause(self, seconds: float):
+        """Stop handing out tokens for the given time and empty the bucket."""
+        with self.lock:
+            now = time.monotonic()
+            self.paused_until = max(self.paused_until, now + seconds)
+            self.tokens = 0.0
+            self.updated_at = self.paused_until
+
+
+class AdaptiveConcurrency:
+    """Limit on requests in flight, adjusted AIMD style.
+
+    Each success raises the limit by 1/limit (about one per round of
+    requests), each throttled request halves it, within [minimum, maximum].
+    """
+
+    def __init__(self, maximum: int, minimum: int = 1):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = float(maximum)
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, throttled: bool = False):
+        with self.condition:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(self.minimum, self.limit / 2)
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+
+class RateLimiter:
+    """Request middleware shared by every thread using one Garmin client.
+
+    Requests wait for a slot under the adaptive concurrency limit and for a
+    token from the bucket. A 429 response halves the concurrency limit and
+    the request is retried after a jittered exponential backoff, waiting at
+    least as long as the server's Retry-After (which pauses the bucket for
+    all threads). After 'max_retries' retries the 429 error is raised.
+    """
+
+    def __init__(
+        self,
+        rate: float = 1.0,
+        burst: int = 5,
+        max_concurrency: int = 4,
+        max_retries: int = 3,
+        backoff_base: float = 2.0,
+        backoff_max: float = 120.0,
+        sleep: Callable[[float], Any] = time.sleep,
+    ):
+        self.bucket = TokenBucket(rate, burst)
+        self.concurrency = AdaptiveConcurrency(max_concurrency)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        self._metrics = {
+            "requests": 0,
+            "throttled": 0,
+            "retries": 0,
+            "given_up": 0,
+            "retry_after_honoured": 0,
+            "bucket_wait_seconds": 0.0,
+            "backoff_seconds": 0.0,
+        }
+
+    def _count(self, name: str, delta=1):
+        with self._lock:
+            self._metrics[name] += delta
+
+    def backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        """Seconds to wait before retry number 'attempt' (from 1)."""
+        ceiling = min(self.backoff_max, self.backoff_base * 2**attempt)
+        delay = random.uniform(ceiling / 2, ceiling)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def call(self, fetch: Callable[[], Any]) -> Any:
+        """Run one request through the limiter."""
+        attempt = 0
+        while True:
+            self.concurrency.acquire()
+            throttled = None
+            try:
+                self._count("bucket_wait_seconds", self.bucket.acquire())
+                self._count("requests")
+                return fetch()
+            except Exception as e:
+                throttled = throttle_response(e)
+                if throttled is None:
+                    raise
+                self._count("throttled")
+                if attempt >= self.max_retries:
+                    self._count("given_up")
+                    raise
+            finally:
+                self.concurrency.release(throttled is not None)
+
+            attempt += 1
+            retry_after = retry_after_seconds(throttled)
+            if retry_after is not None:
+                self._count("retry_after_honoured")
+                self.bucket.pause(retry_after)
+            delay = self.backoff(attempt, retry_after)
+            logger.warning(
+                "Throttled by Garmin Connect, retry %d in %.1f s",
+                attempt,
+                delay,
+            )
+            self._count("retries")
+            self._count("backoff_seconds", delay)
+            self.sleep(delay)
+
+    def metrics(self) -> Dict[str, Any]:
+        """Return throttle counters and the current concurrency limit."""
+        with self._lock:
+            metrics = dict(self._metrics)
+        with self.concurrency.condition:
+            metrics["concurrency_limit"] = int(self.concurrency.limit)
+            metrics["in_flight"] = self.concurrency.in_flight
+        return metrics
@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""
+Background job executor for Garmin Heart Rate Analyzer
+
+Jobs are queued as 'pending' rows in the background_jobs table, so they survive
+a restart, and are run by a bounded pool of worker threads that share one
+authenticated Garmin client, resumed from cached session tokens where possible.
+Garmin API calls go through the client's rate limiter (token bucket, adaptive
+concurrency and retries with backoff on 429), and jobs that are still rate
+limited are requeued with exponential backoff. Derived data recompute jobs run
+on the same workers without touching Garmin.
+"""
+
+import logging
+import random
+import threading
+
+from config import JOB_CONFIG
+from database import connection_scope, get_db_connection
+from derived_data import RECOMPUTE_JOB_TYPE, recompute_derived_job
+from garmin_session import clear_garmin_tokens, refresh_garmin_tokens
+from garminconnect import GarminConnectAuthenticationError, GarminConnectTooManyRequestsError
+from garminconnect.ratelimit import RateLimiter, error_response
+from jobs import GarminClientError, collect_garmin_data_job, create_garmin_client
+from range_collection import collect_garmin_range_job
+
+logger = logging.getLogger(__name__)
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """Check whether an exception is Garmin telling us to slow down."""
+    if isinstance(error, GarminConnectTooManyRequestsError):
+        return True
+    return "429" in str(error) or "Too Many Requests" in str(error)
+
+
+def is_auth_error(error: Exception) -> bool:
+    """Check whether an exception means the Garmin session is no longer valid."""
+    if isinstance(error, GarminConnectAuthenticationError):
+        return True
+    response = error_response(error)
+    return response is not None and response.status_code == 401
+
+
+class RateLimitedClient:
+    """
+    Proxy around a Garmin client that records rate limiting and auth failures,
+    even when the job swallows the exception.
+    
+    Throttling itself happens in the client's RateLimiter, which only sees requests
+    that reach Garmin, so re-collecting cached days is not throttled.
+    """
+    
+    def __init__(self, client):
+        self._client = client
+        self.rate_limited = False
+        self.auth_failed = False
+    
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if not callable(attribute):
+            return attribute
+        
+        def call(*args, **kwargs):
+            try:
+                return attribute(*args, **kwargs)
+            except Exception as e:
+                if is_rate_limit_error(e):
+                    self.rate_limited = True
+                elif is_auth_error(e):
+                    self.auth_failed = True
+                raise
+        
+        return call
+
+
+class JobExecutor:
+    """Bounded pool of worker threads running queued data collection and recompute jobs."""
+    
+    JOB_TYPES = ('collect_data', 'collect_range', RECOMPUTE_JOB_TYPE)
+    JOB_TYPE_PLACEHOLDERS = ', '.join('?' * len(JOB_TYPES))
+    
+    def __init__(self, max_workers: int = None, requests_per_second: float = None, burst: int = None):
+        """
+        Args:
+            max_workers: Number of concurrent jobs (defaults to JOB_CONFIG)
+            requests_per_second: Token bucket refill rate (defaults to JOB_CONFIG)
+            burst: Token bucket capacity (defaults to JOB_CONFIG)
+        """
+        self.max_workers = max_workers or JOB_CONFIG['MAX_WORKERS']
+        self.rate_limiter = RateLimiter(
+            rate=requests_per_second or JOB_CONFIG['REQUESTS_PER_SECOND'],
+            burst=burst or JOB_CONFIG['BURST'],
+            max_concurrency=self.max_workers,
+            max_retries=JOB_CONFIG['REQUEST_RETRIES'],
+            backoff_base=JOB_CONFIG['REQUEST_BACKOFF_BASE_SECONDS'],
+            backoff_max=JOB_CONFIG['RETRY_MAX_SECONDS'],
+        )
+        self.bucket = self.rate_limiter.bucket
+        self.client = None
+        self.client_lock = threading.Lock()
+        self.wake_up = threading.Event()
+        self.stop_event = threading.Event()
+        self.workers = []
+        self.stats_lock = threading.Lock()
+        self.stats = {'active_workers': 0, 'completed': 0, 'failed': 0, 'retries_scheduled': 0, 'rate_limited': 0}
+    
+    def start(self):
+        """Requeue jobs orphaned by a previous process and start the workers."""
+        if self.workers:
+            return
+        
+        self.requeue_stale_jobs()
+        for index in range(self.max_workers):
+            worker = threading.Thread(target=self._worker_loop, name=f"job-worker-{index}", daemon=True)
+            worker.start()
+            self.workers.append(worker)
+        logger.info(f"JobExecutor: Started {self.max_workers} workers")
+    
+    def stop(self, timeout: float = None):
+        """Stop the workers once their current jobs finish."""
+        self.stop_event.set()
+        self.wake_up.set()
+        for worker in self.workers:
+            worker.join(timeout)
+        self.workers = []
+    
+    def notify(self):
+        """Wake idle workers after new jobs have been queued."""
+        self.wake_up.set()
+    
+    def requeue_stale_jobs(self):
+        """Put jobs left 'running' by a process that died back in the queue."""
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute(f"""
+            UPDATE background_jobs
+            SET status = 'pending', updated_at = CURRENT_TIMESTAMP
+            WHERE job_type IN ({self.JOB_TYPE_PLACEHOLDERS}) AND status = 'running'
+              AND updated_at < datetime('now', ?)
+        """, (*self.JOB_TYPES, f"-{JOB_CONFIG['STALE_JOB_SECONDS']} seconds"))
+        requeued = cur.rowcount
+        conn.commit()
+        cur.close()
+        conn.close()
+        
+        if requeued:
+            logger.info(f"JobExecutor: Requeued {requeued} stale jobs")
+    
+    def claim_next_job(self):
+        """
+        Atomically move the oldest runnable pending job to 'running'.
+        
+        Returns:
+            Tuple of (job_id, target_date, attempts) or None if the queue is empty;
+            target_date is None for date range jobs
+        """
+        conn = get_db_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute("BEGIN IMMEDIATE")
+            cur.execute(f"""
+                SELECT job_id, target_date, attempts
+                FROM background_jobs
+                WHERE job_type IN ({self.JOB_TYPE_PLACEHOLDERS}) AND status = 'pending'
+                  AND (next_attempt_at IS NULL OR next_attempt_at <= CURRENT_TIMESTAMP)
+                ORDER BY created_at
+                LIMIT 1
+            """, self.JOB_TYPES)
+            job = cur.fetchone()
+            
+            if job:
+                cur.execute("""
+                    UPDATE background_jobs
+                    SET status = 'running', attempts = COALESCE(attempts, 0) + 1, updated_at = CURRENT_TIMESTAMP
+                    WHERE job_id = ?
+                """, (job['job_id'],))
+            
+            conn.commit()
+            return (job['job_id'], job['target_date'], (job['attempts'] or 0) + 1) if job else None
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+            conn.close()
+    
+    def queue_depth(self) -> int:
+        """Number of jobs waiting to run."""
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute(f"SELECT COUNT(*) FROM background_jobs WHERE job_type IN ({self.JOB_TYPE_PLACEHOLDERS}) AND status = 'pending'",
+                    self.JOB_TYPES)
+        depth = cur.fetchone()[0]
+        cur.close()
+        conn.close()
+        return depth
+    
+    def metrics(self) -> dict:
+        """Queue depth plus worker, outcome, throttling and response cache counters."""
+        with self.stats_lock:
+            metrics = dict(self.stats)
+        metrics['queue_depth'] = self.queue_depth()
+        metrics['max_workers'] = self.max_workers
+        metrics['garmin_requests'] = self.rate_limiter.metrics()
+        response_cache = getattr(self.client, 'response_cache', None)
+        if response_cache is not None:
+            metrics['response_cache'] = response_cache.stats()
+        return metrics
+    
+    def _count(self, stat: str, delta: int = 1):
+        with self.stats_lock:
+            self.stats[stat] += delta
+    
+    def _get_client(self):
+        """Return the shared Garmin client, logging in on first use and keeping its token fresh."""
+        with self.client_lock:
+            if self.client is None:
+                self.client = create_garmin_client()
+                self.client.rate_limiter = self.rate_limiter
+            else:
+                refresh_garmin_tokens(self.client)
+            return self.client
+    
+    def _worker_loop(self):
+        while not self.stop_event.is_set():
+            try:
+                job = self.claim_next_job()
+            except Exception as e:
+                logger.error(f"JobExecutor: Failed to claim job: {e}")
+                job = None
+            
+            if job is None:
+                self.wake_up.wait(JOB_CONFIG['POLL_INTERVAL_SECONDS'])
+                self.wake_up.clear()
+                continue
+            
+            self._count('active_workers')
+            try:
+                with connection_scope():
+                    self.run_job(*job)
+            except Exception as e:
+                logger.error(f"JobExecutor: Job {job[0]} crashed: {e}")
+            finally:
+                self._count('active_workers', -1)
+    
+    def run_job(self, job_id: str, target_date: str, attempt: int):
+        """
+        Run one claimed job, requeueing it with backoff if Garmin rate limited it.
+        
+        Args:
+            job_id: Job identifier
+            target_date: Date to collect (YYYY-MM-DD), None for a date range job
+            attempt: 1 for the first run, 2 for the first retry, ...
+        """
+        if self._job_type(job_id) == RECOMPUTE_JOB_TYPE:
+            recompute_derived_job(*self._job_range(job_id), job_id)
+            self._count('completed' if self._job_status(job_id) == 'completed' else 'failed')
+            return
+        
+        date_range = None
+        if target_date is None:
+            date_range = self._job_range(job_id)
+            target_date = ' to '.join(date_range)
+        
+        try:
+            client = RateLimitedClient(self._get_client())
+        except GarminClientError as e:
+            self._finish_job(job_id, 'failed', str(e))
+            return
+        except Exception as e:
+            if is_rate_limit_error(e):
+                self._retry_or_fail(job_id, target_date, attempt)
+            else:
+                self._finish_job(job_id, 'failed', f"Error collecting data: {str(e)}")
+            return
+        
+        if date_range:
+            collect_garmin_range_job(*date_range, job_id, api=client)
+        else:
+            collect_garmin_data_job(target_date, job_id, api=client)
+        
+        if client.auth_failed:
+            # The cached session was rejected, log in again for the next job
+            with self.client_lock:
+                self.client = None
+                clear_garmin_tokens()
+        
+        if client.rate_limited:
+            self._retry_or_fail(job_id, target_date, attempt)
+        else:
+            self._count('completed' if self._job_status(job_id) == 'completed' else 'failed')
+    
+    def _retry_or_fail(self, job_id: str, target_date: str, attempt: int):
+        """Requeue a rate limited job with exponential backoff, or fail it after MAX_RETRIES."""
+        self._count('rate_limited')
+        
+        if attempt > JOB_CONFIG['MAX_RETRIES']:
+            self._finish_job(job_id, 'failed', f"Rate limited by Garmin API for {target_date}. Please try again later.")
+            return
+        
+        delay = min(JOB_CONFIG['RETRY_MAX_SECONDS'], JOB_CONFIG['RETRY_BASE_SECONDS'] * 2 ** (attempt - 1))
+        delay *= 1 + random.uniform(0, 0.25)
+        
+        # Back off globally too, since every worker shares the same Garmin account
+        self.bucket.pause(JOB_CONFIG['RETRY_BASE_SECONDS'])
+        
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE background_jobs
+            SET status = 'pending', error_message = ?, next_attempt_at = datetime('now', ?),
+                updated_at = CURRENT_TIMESTAMP
+            WHERE job_id = ?
+        """, (f"Rate limited by Garmin API, retrying in {delay:.0f}s", f"+{delay:.0f} seconds", job_id))
+        conn.commit()
+        cur.close()
+        conn.close()
+        
+        self._count('retries_scheduled')
+        logger.warning(f"JobExecutor: Job {job_id} rate limited, retry {attempt} in {delay:.0f}s")
+    
+    def _finish_job(self, job_id: str, status: str, error_message: str = None):
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE background_jobs
+            SET status = ?, error_message = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE job_id = ?
+        """, (status, error_message, job_id))
+        conn.commit()
+        cur.close()
+        conn.close()
+        self._count(status)
+    
+    def _job_range(self, job_id: str):
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute("SELECT start_date, end_date FROM background_jobs WHERE job_id = ?", (job_id,))
+        row = cur.fetchone()
+        cur.close()
+        conn.close()
+        return row['start_date'], row['end_date']
+    
+    def _job_type(self, job_id: str):
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute("SELECT job_type FROM background_jobs WHERE job_id = ?", (job_id,))
+        row = cur.fetchone()
+        cur.close()
+        conn.close()
+        return row['job_type'] if row else None
+    
+    def _job_status(self, job_id: str):
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute("SELECT status FROM background_jobs WHERE job_id = ?", (job_id,))
+        row = cur.fetchone()
+        cur.close()
+        conn.close()
+        return row['status'] if row else None
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_job_executor() -> JobExecutor:
+    """Return the process-wide job executor, starting it on first use."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = JobExecutor()
+            _executor.start()
+        return _executor
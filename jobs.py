@@ -3,23 +3,40 @@
 Background job functions for Garmin Heart Rate Analyzer
 """
 
+import bisect
 import json
 import logging
 import garminconnect
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from database import (
     get_db_connection, 
     decrypt_password, 
     get_user_hr_parameters, 
-    update_job_status
+    update_job_status,
+    get_user_data_batch,
+    encode_series,
+    decode_series
 )
 from datetime import datetime, date, timedelta
 from garminconnect import Garmin
+from garminconnect.fit import FitDecoder
 from cryptography.fernet import Fernet
 import os
 from models import HeartRateAnalyzer
 from typing import Dict, List, Optional, Tuple
 import math
+from operator import itemgetter
 from config import TIME_CONFIG, API_CONFIG
+from garmin_session import login_garmin_client
+from sync_state import (
+    SYNC_KIND_ACTIVITY,
+    SYNC_KIND_DAY,
+    day_fingerprint,
+    delete_sync_states,
+    get_sync_states,
+    plan_activity_sync,
+    save_sync_states,
+)
 from database import get_cached_trimp_data, save_cached_trimp_data, calculate_data_hash, invalidate_cached_trimp_data
 
 
@@ -119,13 +136,50 @@ def detect_breathing_rate_position(activity_details: Dict) -> Optional[int]:
         return None
 
 
-def collect_garmin_data_job(target_date: str, job_id: str):
+class GarminClientError(Exception):
+    """Raised when an authenticated Garmin client cannot be created."""
+
+
+def create_garmin_client():
+    """
+    Log in to Garmin Connect with the stored credentials, reusing cached session tokens.
+    
+    Returns:
+        Authenticated Garmin client
+        
+    Raises:
+        GarminClientError: If credentials or the encryption key are missing
+    """
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT email, password_encrypted FROM garmin_credentials LIMIT 1")
+    creds = cur.fetchone()
+    cur.close()
+    conn.close()
+    
+    if not creds:
+        raise GarminClientError("No Garmin credentials found")
+    
+    # Decrypt password
+    key = os.environ.get('ENCRYPTION_KEY')
+    if not key:
+        raise GarminClientError("Encryption key not found")
+    
+    fernet = Fernet(key.encode())
+    password = fernet.decrypt(creds['password_encrypted'].encode()).decode()
+    
+    logger.info(f"create_garmin_client: Connecting to Garmin with email {creds['email']}")
+    return login_garmin_client(creds['email'], password)
+
+
+def collect_garmin_data_job(target_date: str, job_id: str, api=None):
     """
     Background job to collect heart rate data from Garmin Connect.
     
     Args:
         target_date: Date to collect data for (YYYY-MM-DD)
         job_id: Unique job identifier
+        api: Authenticated Garmin client to reuse (logs in if not given)
     """
     logger.info(f"collect_garmin_data_job: Starting job {job_id} for date {target_date}")
     
@@ -140,52 +194,22 @@ def collect_garmin_data_job(target_date: str, job_id: str):
         """, (job_id,))
         conn.commit()
         
-        # Get Garmin credentials
-        cur.execute("SELECT email, password_encrypted FROM garmin_credentials LIMIT 1")
-        creds = cur.fetchone()
-        
-        if not creds:
-            error_msg = "No Garmin credentials found"
-            logger.error(f"collect_garmin_data_job: {error_msg}")
-            cur.execute("""
-                UPDATE background_jobs 
-                SET status = 'failed', error_message = ?, updated_at = CURRENT_TIMESTAMP
-                WHERE job_id = ?
-            """, (error_msg, job_id))
-            conn.commit()
-            cur.close()
-            conn.close()
-            return
-        
-        # Decrypt password
-        key = os.environ.get('ENCRYPTION_KEY')
-        if not key:
-            error_msg = "Encryption key not found"
-            logger.error(f"collect_garmin_data_job: {error_msg}")
-            cur.execute("""
-                UPDATE background_jobs 
-                SET status = 'failed', error_message = ?, updated_at = CURRENT_TIMESTAMP
-                WHERE job_id = ?
-            """, (error_msg, job_id))
-            conn.commit()
-            cur.close()
-            conn.close()
-            return
-        
-        fernet = Fernet(key.encode())
-        password = fernet.decrypt(creds['password_encrypted'].encode()).decode()
-        
-        logger.info(f"collect_garmin_data_job: Connecting to Garmin with email {creds['email']}")
-        
-        # Clean up any existing data for this date (user data is stored separately)
-        logger.info(f"collect_garmin_data_job: Cleaning up existing data for {target_date}")
-        cur.execute("DELETE FROM daily_data WHERE date = ?", (target_date,))
-        cur.execute("DELETE FROM activity_data WHERE date = ?", (target_date,))
-        conn.commit()
-        
-        # Connect to Garmin
-        api = Garmin(creds['email'], password)
-        api.login()
+        # Connect to Garmin unless the caller already holds an authenticated client
+        if api is None:
+            try:
+                api = create_garmin_client()
+            except GarminClientError as e:
+                error_msg = str(e)
+                logger.error(f"collect_garmin_data_job: {error_msg}")
+                cur.execute("""
+                    UPDATE background_jobs 
+                    SET status = 'failed', error_message = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE job_id = ?
+                """, (error_msg, job_id))
+                conn.commit()
+                cur.close()
+                conn.close()
+                return
         
         # Get heart rate data
         logger.info(f"collect_garmin_data_job: Fetching heart rate data for {target_date}")
@@ -197,6 +221,7 @@ def collect_garmin_data_job(target_date: str, job_id: str):
         if not heart_rate_data:
             error_msg = f"No heart rate data returned from Garmin for {target_date}"
             logger.warning(f"collect_garmin_data_job: {error_msg}")
+            clear_day_data(cur, target_date)
             cur.execute("""
                 UPDATE background_jobs 
                 SET status = 'completed', result = ?, updated_at = CURRENT_TIMESTAMP
@@ -211,6 +236,7 @@ def collect_garmin_data_job(target_date: str, job_id: str):
         if 'heartRateValues' not in heart_rate_data:
             error_msg = f"Heart rate data missing 'heartRateValues' for {target_date}"
             logger.warning(f"collect_garmin_data_job: {error_msg}")
+            clear_day_data(cur, target_date)
             cur.execute("""
                 UPDATE background_jobs 
                 SET status = 'completed', result = ?, updated_at = CURRENT_TIMESTAMP
@@ -227,24 +253,53 @@ def collect_garmin_data_job(target_date: str, job_id: str):
         # Check if we have daily HR data
         has_daily_hr_data = heart_rate_values and len(heart_rate_values) > 0
         
+        if has_daily_hr_data and any(value is None for value in heart_rate_values):
+            error_msg = f"Heart rate data contains None values for {target_date} - no valid data"
+            logger.warning(f"collect_garmin_data_job: {error_msg}")
+            clear_day_data(cur, target_date)
+            cur.execute("""
+                UPDATE background_jobs 
+                SET status = 'completed', result = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE job_id = ?
+            """, (json.dumps({'message': error_msg, 'data_found': False}), job_id))
+            conn.commit()
+            cur.close()
+            conn.close()
+            return
+        
+        # List the day's activities and compare everything with what the last sync fetched
+        activities = list_activities_for_date(api, target_date)
+        changed_ids, removed_ids, activity_fingerprints = plan_activity_sync(cur, {target_date: activities})
+        removed_ids = removed_ids[target_date]
+        hr_fingerprint = day_fingerprint(heart_rate_values)
+        day_state = get_sync_states(SYNC_KIND_DAY, [target_date]).get(target_date)
+        
+        if day_state and day_state['fingerprint'] == hr_fingerprint and not changed_ids and not removed_ids:
+            logger.info(f"collect_garmin_data_job: Garmin data for {target_date} unchanged since {day_state['fetched_at']}, keeping stored data")
+            save_sync_states(cur, SYNC_KIND_DAY, {target_date: hr_fingerprint})
+            cur.execute("""
+                UPDATE background_jobs 
+                SET status = 'completed', result = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE job_id = ?
+            """, (json.dumps({'message': 'Data unchanged since the last sync', 'data_changed': False}), job_id))
+            conn.commit()
+            cur.close()
+            conn.close()
+            return
+        
+        # Replace the day's HR and drop the activities that are gone (user data is stored separately).
+        # Changed activities are replaced once their new series has been fetched.
+        logger.info(f"collect_garmin_data_job: Replacing data for {target_date}: {len(changed_ids)} new or changed activities, {len(removed_ids)} removed")
+        cur.execute("DELETE FROM daily_data WHERE date = ?", (target_date,))
+        if removed_ids:
+            cur.execute(f"DELETE FROM activity_data WHERE activity_id IN ({', '.join('?' * len(removed_ids))})", removed_ids)
+        delete_sync_states(cur, SYNC_KIND_ACTIVITY, removed_ids)
+        conn.commit()
+        
         if not has_daily_hr_data:
             logger.info(f"collect_garmin_data_job: No daily HR data found for {target_date}, will try to construct from activities")
             # Don't exit early - continue to collect activities
         else:
-            # Check for None values in heart rate data
-            if any(value is None for value in heart_rate_values):
-                error_msg = f"Heart rate data contains None values for {target_date} - no valid data"
-                logger.warning(f"collect_garmin_data_job: {error_msg}")
-                cur.execute("""
-                    UPDATE background_jobs 
-                    SET status = 'completed', result = ?, updated_at = CURRENT_TIMESTAMP
-                    WHERE job_id = ?
-                """, (json.dumps({'message': error_msg, 'data_found': False}), job_id))
-                conn.commit()
-                cur.close()
-                conn.close()
-                return
-            
             # Get HR parameters for analysis
             resting_hr, max_hr = get_user_hr_parameters()
             analyzer = HeartRateAnalyzer(resting_hr, max_hr)
@@ -279,7 +334,7 @@ def collect_garmin_data_job(target_date: str, job_id: str):
                 VALUES (?, ?, ?, ?, ?, ?)
             """, (
                 str(target_date),
-                json.dumps(heart_rate_values),
+                encode_series(heart_rate_values),
                 json.dumps(analysis_results['trimp_data']),
                 float(total_trimp),
                 float(daily_score),
@@ -291,8 +346,14 @@ def collect_garmin_data_job(target_date: str, job_id: str):
         
         # Collect activities for the same date
         activity_collection_success = True
+        stored_ids = []
         try:
-            collect_activities_for_date(api, target_date, conn, cur)
+            changed_activities = [activity for activity in activities if str(activity['activityId']) in changed_ids]
+            stored_ids = collect_activities_for_date(api, target_date, conn, cur, activities=changed_activities)
+            missing_ids = sorted(set(changed_ids) - set(stored_ids))
+            if missing_ids:
+                logger.warning(f"collect_garmin_data_job: Could not fetch activities {', '.join(missing_ids)}")
+                activity_collection_success = False
         except Exception as activity_error:
             logger.warning(f"collect_garmin_data_job: Failed to collect activities: {activity_error}")
             activity_collection_success = False
@@ -304,32 +365,21 @@ def collect_garmin_data_job(target_date: str, job_id: str):
         if final_hr_series:
             logger.info(f"collect_garmin_data_job: Built HR time series with {len(final_hr_series)} points")
             
-            # Calculate TRIMP from the final HR time series
-            trimp_results = calculate_trimp_from_timeseries(final_hr_series)
-            
-            # Update or insert daily data
-            cur.execute("DELETE FROM daily_data WHERE date = ?", (target_date,))
-            cur.execute("""
-                INSERT INTO daily_data 
-                (date, heart_rate_series, trimp_data, total_trimp, daily_score, activity_type)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (
-                str(target_date),
-                json.dumps(final_hr_series),
-                json.dumps({
-                    'presentation_buckets': trimp_results['presentation_buckets'],
-                    'total_trimp': trimp_results['total_trimp']
-                }),
-                float(trimp_results['total_trimp']),
-                0.0,  # daily_score - could be calculated separately
-                'mixed'  # activity_type - could be determined from activities
-            ))
+            # Calculate TRIMP from the final HR time series and update the daily data
+            day_trimp = save_daily_hr_timeseries(cur, target_date, final_hr_series)
             
             conn.commit()
-            logger.info(f"collect_garmin_data_job: Updated daily data with {len(final_hr_series)} HR points, TRIMP: {trimp_results['total_trimp']}")
+            logger.info(f"collect_garmin_data_job: Updated daily data with {len(final_hr_series)} HR points, TRIMP: {day_trimp}")
         else:
             logger.info(f"collect_garmin_data_job: No HR time series could be built for {target_date}")
         
+        # Activities that could not be fetched keep their stored data and old sync state, and the day
+        # keeps no new sync state, so it stays unsettled and the next sync fetches them again
+        save_sync_states(cur, SYNC_KIND_ACTIVITY, {activity_id: activity_fingerprints[activity_id] for activity_id in stored_ids})
+        if activity_collection_success:
+            save_sync_states(cur, SYNC_KIND_DAY, {target_date: hr_fingerprint})
+        conn.commit()
+        
         # Update job status based on whether activity collection succeeded
         if activity_collection_success:
             if has_daily_hr_data:
@@ -376,7 +426,7 @@ def collect_garmin_data_job(target_date: str, job_id: str):
         logger.error(f"collect_garmin_data_job: {error_msg}")
         
         # Check if this is a rate limit error
-        if "429" in str(e) or "Too Many Requests" in str(e):
+        if isinstance(e, garminconnect.GarminConnectTooManyRequestsError) or "429" in str(e) or "Too Many Requests" in str(e):
             error_msg = f"Rate limited by Garmin API for {target_date}. Please try again later."
             logger.warning(f"collect_garmin_data_job: {error_msg}")
             # Mark as failed but with a specific message
@@ -409,35 +459,319 @@ def collect_garmin_data_job(target_date: str, job_id: str):
             except Exception as db_error:
                 logger.error(f"collect_garmin_data_job: Failed to update job status: {str(db_error)}") 
 
-def collect_activities_for_date(api, target_date: str, conn, cur):
+def clear_day_data(cur, target_date: str):
+    """
+    Delete a day's daily and activity data after Garmin returned no data for it.
+    
+    The day is recorded as synced with no data, so settled days are not fetched again.
+    """
+    cur.execute("SELECT activity_id FROM activity_data WHERE date = ?", (target_date,))
+    delete_sync_states(cur, SYNC_KIND_ACTIVITY, [row['activity_id'] for row in cur.fetchall()])
+    cur.execute("DELETE FROM daily_data WHERE date = ?", (target_date,))
+    cur.execute("DELETE FROM activity_data WHERE date = ?", (target_date,))
+    save_sync_states(cur, SYNC_KIND_DAY, {target_date: day_fingerprint(None)})
+
+
+def save_daily_hr_timeseries(cur, target_date: str, final_hr_series: List) -> float:
+    """
+    Calculate TRIMP for a day's final HR time series and replace its daily_data row.
+    
+    Args:
+        cur: Database cursor
+        target_date: Date (YYYY-MM-DD)
+        final_hr_series: Daily HR merged with activity HR
+        
+    Returns:
+        The day's total TRIMP
+    """
+    trimp_results = calculate_trimp_from_timeseries(final_hr_series)
+    
+    cur.execute("DELETE FROM daily_data WHERE date = ?", (target_date,))
+    cur.execute("""
+        INSERT INTO daily_data 
+        (date, heart_rate_series, trimp_data, total_trimp, daily_score, activity_type)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (
+        str(target_date),
+        encode_series(final_hr_series),
+        json.dumps({
+            'presentation_buckets': trimp_results['presentation_buckets'],
+            'total_trimp': trimp_results['total_trimp']
+        }),
+        float(trimp_results['total_trimp']),
+        0.0,  # daily_score - could be calculated separately
+        'mixed'  # activity_type - could be determined from activities
+    ))
+    return float(trimp_results['total_trimp'])
+
+
+def fetch_activity_fit_series(api, activity_id: str) -> Optional[Tuple[List, List]]:
+    """
+    Download the original FIT file of an activity and decode its HR and breathing rate.
+    
+    Args:
+        api: Garmin API instance
+        activity_id: Garmin activity ID
+        
+    Returns:
+        Tuple of (hr_series, breathing_series) at the recorded 1 Hz resolution,
+        or None if the file could not be downloaded or decoded or has no HR data
+    """
+    try:
+        fit_data = api.download_activity(activity_id, dl_fmt=Garmin.ActivityDownloadFormat.ORIGINAL)
+        series = FitDecoder(fit_data).activity_series()
+    except Exception as e:
+        logger.warning(f"fetch_activity_fit_series: Could not decode FIT file for activity {activity_id}: {e}")
+        return None
+    
+    if not series['heart_rate']:
+        logger.info(f"fetch_activity_fit_series: No HR records in FIT file for activity {activity_id}")
+        return None
+    
+    logger.info(f"fetch_activity_fit_series: Decoded {len(series['heart_rate'])} HR and {len(series['respiration_rate'])} breathing rate samples for activity {activity_id}")
+    return series['heart_rate'], series['respiration_rate']
+
+
+def extract_activity_details_series(activity_details: Dict, activity_id: str) -> Tuple[List, List]:
+    """
+    Extract HR and breathing rate series from activity details.
+    
+    Args:
+        activity_details: Activity details from Garmin API
+        activity_id: Garmin activity ID (for logging)
+        
+    Returns:
+        Tuple of (hr_series, breathing_series); HR values are scaled by the
+        metric factor but not yet filtered or rounded
+    """
+    hr_series = []
+    breathing_series = []
+    
+    if 'activityDetailMetrics' not in activity_details:
+        logger.warning(f"extract_activity_details_series: No activityDetailMetrics in activity details for {activity_id}")
+        return hr_series, breathing_series
+    
+    activity_metrics = activity_details['activityDetailMetrics']
+    if not activity_metrics:
+        logger.warning(f"extract_activity_details_series: No activityDetailMetrics data for activity {activity_id}")
+        return hr_series, breathing_series
+    
+    logger.info(f"extract_activity_details_series: Found activityDetailMetrics with {len(activity_metrics)} entries")
+    
+    # Use the clean HR detection function with activity details
+    hr_pos, ts_pos = detect_hr_and_timestamp_positions(activity_details)
+    
+    # Detect breathing rate position
+    breathing_pos = detect_breathing_rate_position(activity_details)
+    
+    if hr_pos is None or ts_pos is None:
+        logger.warning(f"extract_activity_details_series: Could not find HR and timestamp positions for activity {activity_id}")
+        return hr_series, breathing_series
+    
+    logger.info(f"extract_activity_details_series: Selected HR position {hr_pos}, Timestamp position {ts_pos}")
+    if breathing_pos is not None:
+        logger.info(f"extract_activity_details_series: Selected breathing rate position {breathing_pos}")
+    
+    # Get the factor for HR values from metricDescriptors
+    hr_factor = 1.0
+    for descriptor in activity_details.get('metricDescriptors', []):
+        if descriptor.get('key') == 'directHeartRate':
+            hr_factor = descriptor.get('unit', {}).get('factor', 1.0)
+            logger.info(f"extract_activity_details_series: Using HR factor: {hr_factor}")
+            break
+    
+    for entry in activity_metrics:
+        if 'metrics' in entry and len(entry['metrics']) > max(hr_pos, ts_pos):
+            metrics = entry['metrics']
+            timestamp = metrics[ts_pos]
+            hr_value = metrics[hr_pos]
+            
+            if timestamp is not None and hr_value is not None:
+                # Apply the factor to get the actual HR value
+                hr_series.append([timestamp, hr_value * hr_factor])
+            
+            # Extract breathing rate if available
+            if breathing_pos is not None and len(metrics) > breathing_pos:
+                breathing_value = metrics[breathing_pos]
+                if timestamp is not None and breathing_value is not None:
+                    breathing_series.append([timestamp, float(breathing_value)])
+    
+    logger.info(f"extract_activity_details_series: Extracted {len(hr_series)} HR and {len(breathing_series)} breathing rate values")
+    return hr_series, breathing_series
+
+
+def fetch_activity_series(api, activity_id: str, refresh: bool = False) -> Optional[Tuple[List, List]]:
+    """
+    Fetch an activity's raw HR and breathing rate series.
+    
+    Prefers the original FIT file, which has the native 1 Hz samples, over the
+    activity details, which Garmin downsamples for long activities.
+    
+    Args:
+        api: Garmin API instance
+        activity_id: Garmin activity ID
+        refresh: Drop cached responses first (the activity changed since it was last fetched)
+        
+    Returns:
+        Tuple of (raw_hr_series, breathing_series), or None if neither source could be fetched
+    """
+    if refresh:
+        api.forget_activity(activity_id)
+    
+    fit_series = None
+    if API_CONFIG['ACTIVITY_FIT_DOWNLOAD']:
+        fit_series = fetch_activity_fit_series(api, activity_id)
+    if fit_series is not None:
+        return fit_series
+    
+    # Get detailed activity data for HR extraction
+    try:
+        activity_details = api.get_activity_details(activity_id)
+        logger.info(f"fetch_activity_series: Got activity details for {activity_id}")
+    except Exception as e:
+        logger.error(f"fetch_activity_series: Failed to get activity details for {activity_id}: {e}")
+        return None
+    
+    return extract_activity_details_series(activity_details, activity_id)
+
+
+def store_activity(cur, activity: Dict, target_date: str, raw_hr_series: List, breathing_series: List,
+                   max_hr: Optional[int], csv_override: Optional[List] = None) -> float:
+    """
+    Filter an activity's HR series, calculate its TRIMP and insert it into activity_data.
+    
+    Args:
+        cur: Database cursor
+        activity: Activity summary from Garmin
+        target_date: Date the activity is stored under (YYYY-MM-DD)
+        raw_hr_series: Unfiltered [timestamp, hr] pairs
+        breathing_series: [timestamp, breathing rate] pairs
+        max_hr: User's max HR; readings above it are dropped as sensor artifacts
+        csv_override: Uploaded HR series to calculate TRIMP from instead, if any
+        
+    Returns:
+        The activity's total TRIMP
+    """
+    activity_id = str(activity['activityId'])
+    
+    # Extract basic activity info
+    activity_name = activity.get('activityName', 'Unknown Activity')
+    activity_type = activity.get('activityType', 'unknown')
+    if isinstance(activity_type, dict):
+        # Activity search results describe the type as a dict
+        activity_type = activity_type.get('typeKey', 'unknown')
+    start_time_local = activity.get('startTimeLocal', '')
+    duration_seconds = activity.get('duration', 0)
+    distance_meters = activity.get('distance', 0)
+    elevation_gain = activity.get('elevationGain', 0)
+    average_hr = activity.get('averageHR', 0)
+    activity_max_hr = activity.get('maxHR', 0)
+    
+    hr_series = []
+    if raw_hr_series:
+        # Skip HR readings above max HR (likely sensor artifacts)
+        hr_series = [[timestamp, int(hr_value)] for timestamp, hr_value in raw_hr_series if hr_value <= max_hr]
+        logger.info(f"store_activity: Checked {len(raw_hr_series)} HR values, filtered {len(raw_hr_series) - len(hr_series)}, extracted {len(hr_series)}")
+    
+    # Calculate TRIMP for the activity
+    trimp_data = {'zones': {}, 'total_trimp': 0.0}
+    total_trimp = 0.0
+    if hr_series:
+        if csv_override:
+            logger.info(f"store_activity: Using CSV override for TRIMP calculation of activity {activity_id}")
+            trimp_results = calculate_trimp_from_timeseries(csv_override)
+        else:
+            trimp_results = calculate_trimp_from_timeseries(hr_series)
+        
+        trimp_data = {
+            'presentation_buckets': trimp_results['presentation_buckets'],
+            'total_trimp': trimp_results['total_trimp']
+        }
+        total_trimp = float(trimp_results['total_trimp'])
+        logger.info(f"store_activity: Calculated TRIMP for activity {activity_id}: {total_trimp}")
+    
+    cur.execute("""
+        INSERT INTO activity_data 
+        (activity_id, date, activity_name, activity_type, start_time_local, duration_seconds,
+         distance_meters, elevation_gain, average_hr, max_hr, heart_rate_series, breathing_rate_series, trimp_data, total_trimp)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (
+        activity_id, 
+        str(target_date), 
+        str(activity_name), 
+        str(activity_type), 
+        str(start_time_local) if start_time_local else None, 
+        int(duration_seconds) if duration_seconds else 0,
+        float(distance_meters) if distance_meters else None, 
+        float(elevation_gain) if elevation_gain else None, 
+        int(average_hr) if average_hr else None, 
+        int(activity_max_hr) if activity_max_hr else None, 
+        encode_series(hr_series), 
+        encode_series(breathing_series), 
+        json.dumps(trimp_data), 
+        total_trimp
+    ))
+    
+    logger.info(f"store_activity: Stored activity {activity_id} in new schema")
+    return total_trimp
+
+
+def list_activities_for_date(api, target_date: str) -> List[Dict]:
+    """
+    List the activities Garmin has for a date.
+    
+    Args:
+        api: Garmin API instance
+        target_date: Date (YYYY-MM-DD)
+        
+    Returns:
+        List of activity summaries
+    """
+    activities = api.get_activities_fordate(target_date)
+    
+    # Handle new API structure: extract from ActivitiesForDay['payload'] if present
+    if isinstance(activities, dict) and 'ActivitiesForDay' in activities:
+        afd = activities['ActivitiesForDay']
+        if isinstance(afd, dict) and 'payload' in afd:
+            activities = afd['payload']
+            logger.info(f"list_activities_for_date: Extracted {len(activities) if activities else 0} activities from ActivitiesForDay['payload']")
+        else:
+            logger.error(f"list_activities_for_date: 'ActivitiesForDay' present but no 'payload' key or not a dict")
+            activities = []
+    
+    return activities or []
+
+
+def collect_activities_for_date(api, target_date: str, conn, cur, activities: Optional[List[Dict]] = None) -> List[str]:
     """
     Collect activities for a specific date and store in new schema.
     
+    The activities' series are fetched concurrently with the shared client; each
+    one is filtered, scored and stored as soon as its response arrives, replacing
+    the activity's stored row. Activities whose series could not be fetched keep
+    their stored row and are left out of the returned IDs.
+    
     Args:
         api: Garmin API instance
         target_date: Date to collect activities for (YYYY-MM-DD)
         conn: Database connection
         cur: Database cursor
+        activities: Activity summaries to collect (lists the date's activities if not given)
+        
+    Returns:
+        IDs of the activities that were stored
     """
     logger.info(f"collect_activities_for_date: Starting collection for {target_date}")
     
+    stored_ids = []
     try:
         # Get activities for the date
-        activities = api.get_activities_fordate(target_date)
-        
-        # Handle new API structure: extract from ActivitiesForDay['payload'] if present
-        if isinstance(activities, dict) and 'ActivitiesForDay' in activities:
-            afd = activities['ActivitiesForDay']
-            if isinstance(afd, dict) and 'payload' in afd:
-                activities = afd['payload']
-                logger.info(f"collect_activities_for_date: Extracted {len(activities) if activities else 0} activities from ActivitiesForDay['payload']")
-            else:
-                logger.error(f"collect_activities_for_date: 'ActivitiesForDay' present but no 'payload' key or not a dict")
-                activities = []
+        if activities is None:
+            activities = list_activities_for_date(api, target_date)
 
         if not activities:
             logger.info(f"collect_activities_for_date: No activities found for {target_date}")
-            return
+            return stored_ids
         
         logger.info(f"collect_activities_for_date: Found {len(activities)} activities for {target_date}")
         
@@ -446,158 +780,44 @@ def collect_activities_for_date(api, target_date: str, conn, cur):
             logger.info(f"collect_activities_for_date: First activity type: {type(activities[0])}")
             logger.info(f"collect_activities_for_date: First activity keys: {list(activities[0].keys()) if isinstance(activities[0], dict) else 'Not a dict'}")
         
-        # Process each activity
-        for activity in activities:
-            activity_id = str(activity['activityId'])
-            logger.info(f"collect_activities_for_date: Processing activity {activity_id}")
-            
-            # Extract basic activity info
-            activity_name = activity.get('activityName', 'Unknown Activity')
-            activity_type = activity.get('activityType', 'unknown')
-            start_time_local = activity.get('startTimeLocal', '')
-            duration_seconds = activity.get('duration', 0)
-            distance_meters = activity.get('distance', 0)
-            elevation_gain = activity.get('elevationGain', 0)
-            average_hr = activity.get('averageHR', 0)
-            max_hr = activity.get('maxHR', 0)
-            
-            # Get detailed activity data for HR extraction
+        # Get user's HR parameters for filtering and any CSV overrides for TRIMP once for the day
+        user_resting_hr, user_max_hr = get_user_hr_parameters()
+        logger.info(f"collect_activities_for_date: Using max HR {user_max_hr} for filtering")
+        csv_overrides = get_user_data_batch('activity_hr_csv', [str(activity['activityId']) for activity in activities])
+        
+        # Activities fetched by an earlier sync changed since, so their cached responses are stale
+        refetched = get_sync_states(SYNC_KIND_ACTIVITY, [str(activity['activityId']) for activity in activities])
+        
+        # Process each activity as its series arrives
+        with ThreadPoolExecutor(max_workers=API_CONFIG['ACTIVITY_FETCH_WORKERS']) as pool:
+            futures = {
+                pool.submit(fetch_activity_series, api, str(activity['activityId']),
+                            str(activity['activityId']) in refetched): activity
+                for activity in activities
+            }
             try:
-                activity_details = api.get_activity_details(activity_id)
-                logger.info(f"collect_activities_for_date: Got activity details for {activity_id}")
-            except Exception as e:
-                logger.error(f"collect_activities_for_date: Failed to get activity details for {activity_id}: {e}")
-                continue
-            
-            # Extract HR and breathing rate data from activity
-            hr_series = []
-            breathing_series = []
-            trimp_data = {'zones': {}, 'total_trimp': 0.0}
-            total_trimp = 0.0
-            
-            if 'activityDetailMetrics' in activity_details:
-                activity_metrics = activity_details['activityDetailMetrics']
-                if activity_metrics:
-                    logger.info(f"collect_activities_for_date: Found activityDetailMetrics with {len(activity_metrics)} entries")
+                for future in as_completed(futures):
+                    activity = futures[future]
+                    activity_id = str(activity['activityId'])
+                    logger.info(f"collect_activities_for_date: Processing activity {activity_id}")
                     
-                    # Use the clean HR detection function with activity details
-                    hr_pos, ts_pos = detect_hr_and_timestamp_positions(activity_details)
+                    series = future.result()
+                    if series is None:
+                        continue
+                    raw_hr_series, breathing_series = series
                     
-                    # Detect breathing rate position
-                    breathing_pos = detect_breathing_rate_position(activity_details)
-                    
-                    if hr_pos is not None and ts_pos is not None:
-                        logger.info(f"collect_activities_for_date: Selected HR position {hr_pos}, Timestamp position {ts_pos}")
-                        if breathing_pos is not None:
-                            logger.info(f"collect_activities_for_date: Selected breathing rate position {breathing_pos}")
-                        
-                        # Get the factor for HR values from metricDescriptors
-                        hr_factor = 1.0
-                        for descriptor in activity_details.get('metricDescriptors', []):
-                            if descriptor.get('key') == 'directHeartRate':
-                                hr_factor = descriptor.get('unit', {}).get('factor', 1.0)
-                                logger.info(f"collect_activities_for_date: Using HR factor: {hr_factor}")
-                                break
-                        
-                        # Extract HR and breathing rate time series
-                        hr_values_checked = 0
-                        hr_values_filtered = 0
-                        breathing_values_checked = 0
-                        
-                        # Get user's HR parameters for filtering
-                        user_resting_hr, user_max_hr = get_user_hr_parameters()
-                        logger.info(f"collect_activities_for_date: Using max HR {user_max_hr} for filtering")
-                        
-                        for entry in activity_metrics:
-                            if 'metrics' in entry and len(entry['metrics']) > max(hr_pos, ts_pos):
-                                metrics = entry['metrics']
-                                timestamp = metrics[ts_pos]
-                                hr_value = metrics[hr_pos]
-                                
-                                if timestamp is not None and hr_value is not None:
-                                    hr_values_checked += 1
-                                    
-                                    # Apply the factor to get the actual HR value
-                                    actual_hr_value = hr_value * hr_factor
-                                    
-                                    # Log first few HR values for debugging
-                                    if hr_values_checked <= 5:
-                                        logger.info(f"collect_activities_for_date: Sample HR value {hr_values_checked}: raw={hr_value}, actual={actual_hr_value} (factor={hr_factor})")
-                                    
-                                    # Skip HR readings above max HR (likely sensor artifacts)
-                                    if actual_hr_value > user_max_hr:
-                                        if hr_values_checked <= 10:  # Log first 10 filtered values
-                                            logger.info(f"collect_activities_for_date: Filtering HR reading {actual_hr_value} above max HR {user_max_hr}")
-                                        hr_values_filtered += 1
-                                        continue
-                                    
-                                    hr_series.append([timestamp, int(actual_hr_value)])
-                                
-                                # Extract breathing rate if available
-                                if breathing_pos is not None and len(metrics) > breathing_pos:
-                                    breathing_value = metrics[breathing_pos]
-                                    if timestamp is not None and breathing_value is not None:
-                                        breathing_values_checked += 1
-                                        
-                                        # Log first few breathing values for debugging
-                                        if breathing_values_checked <= 5:
-                                            logger.info(f"collect_activities_for_date: Sample breathing value {breathing_values_checked}: {breathing_value}")
-                                        
-                                        breathing_series.append([timestamp, float(breathing_value)])
-                        
-                        logger.info(f"collect_activities_for_date: Checked {hr_values_checked} HR values, filtered {hr_values_filtered}, extracted {len(hr_series)}")
-                        logger.info(f"collect_activities_for_date: Checked {breathing_values_checked} breathing values, extracted {len(breathing_series)}")
-                        
-                        # Calculate TRIMP for activity using the new function
-                        if hr_series:
-                            # Check for CSV override before calculating TRIMP
-                            from database import get_user_data
-                            csv_override = get_user_data('activity_hr_csv', activity_id)
-                            if csv_override:
-                                logger.info(f"collect_activities_for_date: Using CSV override for TRIMP calculation of activity {activity_id}")
-                                trimp_results = calculate_trimp_from_timeseries(csv_override)
-                            else:
-                                trimp_results = calculate_trimp_from_timeseries(hr_series)
-                            
-                            trimp_data = {
-                                'presentation_buckets': trimp_results['presentation_buckets'],
-                                'total_trimp': trimp_results['total_trimp']
-                            }
-                            logger.info(f"collect_activities_for_date: Calculated TRIMP for activity {activity_id}: {trimp_results['total_trimp']}")
-                    else:
-                        logger.warning(f"collect_activities_for_date: Could not find HR and timestamp positions for activity {activity_id}")
-                else:
-                    logger.warning(f"collect_activities_for_date: No activityDetailMetrics data for activity {activity_id}")
-            else:
-                logger.warning(f"collect_activities_for_date: No activityDetailMetrics in activity details for {activity_id}")
-            
-            # Store activity data in new schema
-            cur.execute("""
-                INSERT INTO activity_data 
-                (activity_id, date, activity_name, activity_type, start_time_local, duration_seconds,
-                 distance_meters, elevation_gain, average_hr, max_hr, heart_rate_series, breathing_rate_series, trimp_data, total_trimp)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                str(activity_id), 
-                str(target_date), 
-                str(activity_name), 
-                str(activity_type), 
-                str(start_time_local) if start_time_local else None, 
-                int(duration_seconds) if duration_seconds else 0,
-                float(distance_meters) if distance_meters else None, 
-                float(elevation_gain) if elevation_gain else None, 
-                int(average_hr) if average_hr else None, 
-                int(max_hr) if max_hr else None, 
-                json.dumps(hr_series), 
-                json.dumps(breathing_series), 
-                json.dumps(trimp_data), 
-                float(trimp_results['total_trimp']) if 'trimp_results' in locals() else 0.0
-            ))
-            
-            logger.info(f"collect_activities_for_date: Stored activity {activity_id} in new schema")
+                    cur.execute("DELETE FROM activity_data WHERE activity_id = ?", (activity_id,))
+                    store_activity(cur, activity, target_date, raw_hr_series, breathing_series, user_max_hr,
+                                   csv_overrides.get(activity_id))
+                    stored_ids.append(activity_id)
+            except Exception:
+                for pending in futures:
+                    pending.cancel()
+                raise
         
         conn.commit()
         logger.info(f"collect_activities_for_date: Completed collection for {target_date}")
+        return stored_ids
         
     except Exception as e:
         logger.error(f"collect_activities_for_date: Error collecting activities for {target_date}: {e}")
@@ -646,9 +866,150 @@ def find_continuous_segments(hr_series):
     if current_segment:
         segments.append(current_segment)
     
-    return segments 
+    return segments
 
 
+def _drop_covered_points(points, starts, ends):
+    """
+    Drop points whose timestamp falls inside any of the given intervals.
+    
+    Args:
+        points: Timestamp-sorted list of [timestamp, heart_rate] pairs
+        starts: Sorted start timestamps of disjoint intervals
+        ends: End timestamps matching starts
+        
+    Returns:
+        List of the points outside every interval, in their original order
+    """
+    if not starts:
+        return points
+    
+    kept = []
+    interval_index = 0
+    interval_count = len(starts)
+    for point in points:
+        timestamp = point[0]
+        while interval_index < interval_count and ends[interval_index] < timestamp:
+            interval_index += 1
+        if interval_index < interval_count and starts[interval_index] <= timestamp:
+            continue
+        kept.append(point)
+    return kept
+
+
+def _add_covered_interval(starts, ends, start, end):
+    """
+    Add [start, end] to a list of sorted disjoint intervals, coalescing overlaps in place.
+    """
+    left = bisect.bisect_left(ends, start)
+    right = bisect.bisect_right(starts, end)
+    if left < right:
+        start = min(start, starts[left])
+        end = max(end, ends[right - 1])
+    starts[left:right] = [start]
+    ends[left:right] = [end]
+
+
+def merge_hr_series(daily_hr_series, activity_hr_series_list):
+    """
+    Overlay activity HR series onto the daily HR series.
+    
+    Each continuous segment of an activity replaces every point (daily, or from an
+    earlier activity) between the segment's first and last timestamp, and the result
+    is sorted by timestamp. Gives the same result as filtering and re-sorting the whole
+    series once per segment, but masks each source once against the segments that come
+    after it and finishes with a single merge of the sorted runs.
+    
+    Args:
+        daily_hr_series: List of [timestamp, heart_rate] pairs
+        activity_hr_series_list: Activity HR series in processing order (later ones win)
+        
+    Returns:
+        List of [timestamp, heart_rate] pairs sorted by timestamp
+    """
+    activity_hr_series_list = [series for series in activity_hr_series_list if series]
+    if not activity_hr_series_list:
+        return daily_hr_series
+    
+    # Sources in processing order; the daily series has no interval of its own
+    sources = [(daily_hr_series, None)]
+    for activity_hr_series in activity_hr_series_list:
+        for segment in find_continuous_segments(activity_hr_series):
+            sources.append((segment, (segment[0][0], segment[-1][0])))
+    
+    # Walk backwards so each source is masked by the union of all later segments
+    covered_starts = []
+    covered_ends = []
+    runs = []
+    for points, interval in reversed(sources):
+        points = sorted(points, key=itemgetter(0))
+        runs.append(_drop_covered_points(points, covered_starts, covered_ends))
+        if interval and interval[0] <= interval[1]:
+            _add_covered_interval(covered_starts, covered_ends, interval[0], interval[1])
+    runs.reverse()
+    
+    # Timsort detects the pre-sorted runs and merges them in a single pass
+    merged = [point for run in runs for point in run]
+    merged.sort(key=itemgetter(0))
+    return merged
+
+
+def _assemble_daily_hr_timeseries(target_date, daily_hr_series, activities, csv_overrides):
+    """
+    Combine a day's daily HR series with its activities' HR series.
+    
+    Args:
+        target_date: Date being processed (for logging)
+        daily_hr_series: List of [timestamp, heart_rate] pairs from daily_data
+        activities: activity_data rows for the day, ordered by start_time_local
+        csv_overrides: Dict of activity_id -> uploaded CSV HR series
+        
+    Returns:
+        List of [timestamp, heart_rate] pairs for the day
+    """
+    # If no daily HR data and no activities, return empty
+    if not daily_hr_series and not activities:
+        logger.info(f"build_daily_hr_timeseries: No HR data available for {target_date}")
+        return []
+    
+    # Collect each activity's HR series, honouring CSV overrides
+    activity_hr_series_list = []
+    for activity in activities:
+        activity_id = activity['activity_id']
+        activity_hr_series = decode_series(activity['heart_rate_series'])
+        
+        csv_override = csv_overrides.get(activity_id)
+        logger.info(f"build_daily_hr_timeseries: Checking CSV override for activity {activity_id}, found: {csv_override is not None}")
+        if csv_override:
+            activity_hr_series = csv_override
+            logger.info(f"build_daily_hr_timeseries: Using CSV override for activity {activity_id} with {len(csv_override)} points")
+        
+        if not activity_hr_series:
+            continue
+        
+        logger.info(f"build_daily_hr_timeseries: Processing activity {activity_id} with {len(activity_hr_series)} HR points")
+        activity_hr_series_list.append(activity_hr_series)
+    
+    # If no daily HR data but we have activities, construct from activities only
+    if not daily_hr_series:
+        logger.info(f"build_daily_hr_timeseries: Constructing from activities only")
+        all_hr_series = [point for activity_hr_series in activity_hr_series_list for point in activity_hr_series]
+        
+        if all_hr_series:
+            all_hr_series.sort(key=lambda x: x[0])
+            logger.info(f"build_daily_hr_timeseries: Constructed {len(all_hr_series)} HR points from activities")
+            return all_hr_series
+        else:
+            logger.info(f"build_daily_hr_timeseries: No HR data collected from activities")
+            return []
+    
+    # If we have daily HR data, replace it with activity HR data for each continuous segment
+    logger.info(f"build_daily_hr_timeseries: Merging daily HR data with activity data")
+    daily_hr_series = merge_hr_series(daily_hr_series, activity_hr_series_list)
+    
+    logger.info(f"build_daily_hr_timeseries: Final HR time series has {len(daily_hr_series)} points")
+    return daily_hr_series
+
 
 def build_daily_hr_timeseries(target_date, conn, cur):
     """
@@ -676,7 +1037,7 @@ def build_daily_hr_timeseries(target_date, conn, cur):
     
     daily_hr_series = []
     if daily_result and daily_result['heart_rate_series']:
-        daily_hr_series = json.loads(daily_result['heart_rate_series'])
+        daily_hr_series = decode_series(daily_result['heart_rate_series'])
         logger.info(f"build_daily_hr_timeseries: Found {len(daily_hr_series)} daily HR points")
     else:
         logger.info(f"build_daily_hr_timeseries: No daily HR data found for {target_date}")
@@ -692,98 +1053,62 @@ def build_daily_hr_timeseries(target_date, conn, cur):
     activities = cur.fetchall()
     logger.info(f"build_daily_hr_timeseries: Found {len(activities)} activities with HR data")
     
-    # If no daily HR data and no activities, return empty
-    if not daily_hr_series and not activities:
-        logger.info(f"build_daily_hr_timeseries: No HR data available for {target_date}")
-        return []
+    csv_overrides = get_user_data_batch('activity_hr_csv', [activity['activity_id'] for activity in activities])
+    return _assemble_daily_hr_timeseries(target_date, daily_hr_series, activities, csv_overrides)
+
+
+def build_daily_hr_timeseries_batch(dates, conn, cur):
+    """
+    Build the daily HR time series for several dates with one query per table.
     
-    # If no daily HR data but we have activities, construct from activities only
-    if not daily_hr_series and activities:
-        logger.info(f"build_daily_hr_timeseries: Constructing from activities only")
-        all_hr_series = []
-        
-        for activity in activities:
-            activity_hr_series = json.loads(activity['heart_rate_series'])
-            
-            # Check for CSV override
-            from database import get_user_data
-            csv_override = get_user_data('activity_hr_csv', activity['activity_id'])
-            logger.info(f"build_daily_hr_timeseries: Checking CSV override for activity {activity['activity_id']}, found: {csv_override is not None}")
-            if csv_override:
-                activity_hr_series = csv_override
-                logger.info(f"build_daily_hr_timeseries: Using CSV override for activity {activity['activity_id']}")
-            
-            if activity_hr_series:
-                # Find continuous segments in activity HR data
-                segments = find_continuous_segments(activity_hr_series)
-                logger.info(f"build_daily_hr_timeseries: Activity {activity['activity_id']} has {len(segments)} segments")
-                
-                # Add all segments to the daily HR series
-                for segment in segments:
-                    all_hr_series.extend(segment)
+    Args:
+        dates: List of dates to process
+        conn: Database connection
+        cur: Database cursor
         
-        if all_hr_series:
-            all_hr_series.sort(key=lambda x: x[0])
-            logger.info(f"build_daily_hr_timeseries: Constructed {len(all_hr_series)} HR points from activities")
-            return all_hr_series
-        else:
-            logger.info(f"build_daily_hr_timeseries: No HR data collected from activities")
-            return []
+    Returns:
+        Dict of date -> list of [timestamp, heart_rate] pairs
+    """
+    dates = list(dict.fromkeys(dates))
+    if not dates:
+        return {}
     
-    # If we have daily HR data, merge with activity data
-    if daily_hr_series:
-        logger.info(f"build_daily_hr_timeseries: Merging daily HR data with activity data")
-        
-        # Process each activity
-        for activity in activities:
-            activity_id = activity['activity_id']
-            activity_hr_series = json.loads(activity['heart_rate_series'])
-            
-            # Check for CSV override
-            from database import get_user_data
-            csv_override = get_user_data('activity_hr_csv', activity_id)
-            logger.info(f"build_daily_hr_timeseries: Checking CSV override for activity {activity_id}, found: {csv_override is not None}")
-            if csv_override:
-                activity_hr_series = csv_override
-                logger.info(f"build_daily_hr_timeseries: Using CSV override for activity {activity_id} with {len(csv_override)} points")
-            
-            if not activity_hr_series:
-                continue
-            
-            logger.info(f"build_daily_hr_timeseries: Processing activity {activity_id} with {len(activity_hr_series)} HR points")
-            
-            # Find continuous segments in activity HR data
-            segments = find_continuous_segments(activity_hr_series)
-            logger.info(f"build_daily_hr_timeseries: Found {len(segments)} continuous segments")
-            
-            # Replace daily HR data with activity HR data for each segment
-            for segment in segments:
-                segment_start = segment[0][0]  # First timestamp in segment
-                segment_end = segment[-1][0]   # Last timestamp in segment
-                
-                # Remove daily HR points that fall within this segment
-                daily_hr_series = [point for point in daily_hr_series 
-                                 if point[0] < segment_start or point[0] > segment_end]
-                
-                # Add activity HR points for this segment
-                daily_hr_series.extend(segment)
-                
-                logger.info(f"build_daily_hr_timeseries: Replaced daily HR data from {segment_start} to {segment_end}")
-            
-            # Sort daily HR series by timestamp
-            daily_hr_series.sort(key=lambda x: x[0])
-        
-        logger.info(f"build_daily_hr_timeseries: Final HR time series has {len(daily_hr_series)} points")
-        return daily_hr_series
+    logger.info(f"build_daily_hr_timeseries_batch: Building HR time series for {len(dates)} dates")
+    placeholders = ', '.join('?' * len(dates))
     
-    return []
+    cur.execute(f"SELECT date, heart_rate_series FROM daily_data WHERE date IN ({placeholders})", dates)
+    daily_hr_series_by_date = {row['date']: decode_series(row['heart_rate_series']) for row in cur.fetchall()}
+    
+    cur.execute(f"""
+        SELECT date, activity_id, heart_rate_series, start_time_local, duration_seconds
+        FROM activity_data 
+        WHERE date IN ({placeholders}) AND heart_rate_series IS NOT NULL
+        ORDER BY date, start_time_local
+    """, dates)
+    activities_by_date = {}
+    for activity in cur.fetchall():
+        activities_by_date.setdefault(activity['date'], []).append(activity)
+    
+    activity_ids = [activity['activity_id'] for activities in activities_by_date.values() for activity in activities]
+    csv_overrides = get_user_data_batch('activity_hr_csv', activity_ids)
+    
+    return {
+        target_date: _assemble_daily_hr_timeseries(
+            target_date,
+            daily_hr_series_by_date.get(target_date, []),
+            activities_by_date.get(target_date, []),
+            csv_overrides
+        )
+        for target_date in dates
+    }
 
-def calculate_trimp_from_timeseries(hr_series):
+def calculate_trimp_from_timeseries(hr_series, hr_parameters: Optional[Tuple[int, int]] = None):
     """
     Calculate TRIMP from heart rate series data.
     
     Args:
         hr_series: List of [timestamp, heart_rate] pairs
+        hr_parameters: (resting_hr, max_hr), read from the database if not given
         
     Returns:
         Dict with presentation_buckets and total_trimp
@@ -795,7 +1120,7 @@ def calculate_trimp_from_timeseries(hr_series):
         }
     
     # Get HR parameters
-    resting_hr, max_hr = get_user_hr_parameters()
+    resting_hr, max_hr = hr_parameters or get_user_hr_parameters()
     
     # Use the existing TRIMPCalculator which has the correct presentation bucket logic
     from models import TRIMPCalculator
@@ -814,6 +1139,22 @@ def calculate_trimp_from_timeseries(hr_series):
         'total_trimp': results['total_trimp']
     }
 
+def trimp_cache_prefix(hr_parameters: Tuple[int, int]) -> str:
+    """Start of the cache key of every TRIMP calculated with some HR parameters."""
+    resting_hr, max_hr = hr_parameters
+    return f"{resting_hr}-{max_hr}:"
+
+def trimp_cache_key(hr_series, hr_parameters: Tuple[int, int]) -> str:
+    """
+    Cache key of a TRIMP calculation: the HR series and the HR parameters it was calculated with.
+    
+    The parameters are spelled out at the start (see trimp_cache_prefix), so readers
+    that do not have the series can still reject caches calculated with other ones.
+    """
+    resting_hr, max_hr = hr_parameters
+    return trimp_cache_prefix(hr_parameters) + calculate_data_hash(
+        {'resting_hr': resting_hr, 'max_hr': max_hr, 'series': hr_series})
+
 def calculate_trimp_with_caching(target_date, hr_series, data_type='daily'):
     """
     Calculate TRIMP with caching support.
@@ -832,8 +1173,9 @@ def calculate_trimp_with_caching(target_date, hr_series, data_type='daily'):
             'total_trimp': 0.0
         }
     
-    # Calculate hash of input data
-    data_hash = calculate_data_hash(hr_series)
+    # Cached results are only valid for the same series and HR parameters
+    hr_parameters = get_user_hr_parameters()
+    data_hash = trimp_cache_key(hr_series, hr_parameters)
     
     # Check for cached data
     cached_data = get_cached_trimp_data(target_date, data_type)
@@ -843,7 +1185,7 @@ def calculate_trimp_with_caching(target_date, hr_series, data_type='daily'):
     
     # Calculate TRIMP
     logger.info(f"calculate_trimp_with_caching: Calculating TRIMP for {target_date}")
-    trimp_data = calculate_trimp_from_timeseries(hr_series)
+    trimp_data = calculate_trimp_from_timeseries(hr_series, hr_parameters)
     
     # Cache the result
     save_cached_trimp_data(target_date, trimp_data, data_hash, data_type)
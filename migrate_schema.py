@@ -125,6 +125,21 @@ def migrate_database():
         else:
             logger.info("spo2_distribution_calculation_hash column already exists in activity_data table")
         
+        # Check and add job queue columns to background_jobs table
+        logger.info("Checking job queue columns in background_jobs table...")
+        
+        if not check_column_exists(conn, 'background_jobs', 'attempts'):
+            logger.info("Adding attempts column to background_jobs table")
+            cur.execute("ALTER TABLE background_jobs ADD COLUMN attempts INTEGER DEFAULT 0")
+        else:
+            logger.info("attempts column already exists in background_jobs table")
+        
+        if not check_column_exists(conn, 'background_jobs', 'next_attempt_at'):
+            logger.info("Adding next_attempt_at column to background_jobs table")
+            cur.execute("ALTER TABLE background_jobs ADD COLUMN next_attempt_at TIMESTAMP")
+        else:
+            logger.info("next_attempt_at column already exists in background_jobs table")
+        
         # Commit changes
         conn.commit()
         logger.info("Migration completed successfully!")
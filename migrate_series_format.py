@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Migration script to convert JSON heart rate and breathing rate series to the binary series format.
+"""
+
+import sqlite3
+import logging
+
+from database import decode_series, encode_series, is_binary_series
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# (table, key column, series columns)
+SERIES_COLUMNS = [
+    ('daily_data', 'date', ['heart_rate_series']),
+    ('activity_data', 'activity_id', ['heart_rate_series', 'breathing_rate_series']),
+]
+
+def get_db_connection():
+    """Create a SQLite database connection."""
+    conn = sqlite3.connect('garmin_hr.db')
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def migrate_table(conn, table_name, key_column, series_columns):
+    """
+    Re-encode the series columns of one table.
+    
+    Args:
+        conn: Database connection
+        table_name: Table to migrate
+        key_column: Primary key column of the table
+        series_columns: Columns holding [timestamp, value] series
+        
+    Returns:
+        Tuple of (rows converted, bytes before, bytes after)
+    """
+    cur = conn.cursor()
+    columns = ', '.join(series_columns)
+    cur.execute(f"SELECT {key_column}, {columns} FROM {table_name}")
+    rows = cur.fetchall()
+    
+    converted = 0
+    bytes_before = 0
+    bytes_after = 0
+    
+    for row in rows:
+        updates = {}
+        for column in series_columns:
+            stored_value = row[column]
+            if stored_value is None or is_binary_series(stored_value):
+                continue
+            
+            encoded = encode_series(decode_series(stored_value))
+            bytes_before += len(stored_value)
+            bytes_after += len(encoded)
+            if is_binary_series(encoded):
+                updates[column] = encoded
+        
+        if updates:
+            assignments = ', '.join(f"{column} = ?" for column in updates)
+            cur.execute(f"UPDATE {table_name} SET {assignments} WHERE {key_column} = ?",
+                        (*updates.values(), row[key_column]))
+            converted += 1
+    
+    cur.close()
+    return converted, bytes_before, bytes_after
+
+def migrate_database():
+    """Migrate the database to the binary series format."""
+    logger.info("Starting series format migration...")
+    
+    conn = get_db_connection()
+    
+    try:
+        for table_name, key_column, series_columns in SERIES_COLUMNS:
+            logger.info(f"Converting {', '.join(series_columns)} in {table_name} table...")
+            converted, bytes_before, bytes_after = migrate_table(conn, table_name, key_column, series_columns)
+            logger.info(f"{table_name}: converted {converted} rows, {bytes_before} -> {bytes_after} bytes")
+        
+        # Commit changes
+        conn.commit()
+        logger.info("Migration completed successfully!")
+        
+        # Reclaim the space freed by the smaller rows
+        logger.info("Vacuuming database...")
+        conn.execute("VACUUM")
+        
+    except Exception as e:
+        logger.error(f"Migration failed: {e}")
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    migrate_database()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Migration script to index the desaturation events and nightly SpO2 summaries of O2Ring files loaded before they existed.
+"""
+
+import sqlite3
+import logging
+
+from database import init_database
+from spo2_analysis import index_o2ring_file, london_dates_between, refresh_spo2_summaries
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def get_db_connection():
+    """Create a SQLite database connection."""
+    conn = sqlite3.connect('garmin_hr.db')
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def migrate_database():
+    """Index every loaded O2Ring file and summarise the nights they cover."""
+    logger.info("Starting SpO2 events migration...")
+
+    # Creates the spo2_events and spo2_daily_summary tables
+    init_database()
+
+    conn = get_db_connection()
+
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT id, filename, first_timestamp, last_timestamp FROM o2ring_files ORDER BY first_timestamp")
+        files = cur.fetchall()
+
+        dates = set()
+        for file in files:
+            cur.execute("SELECT timestamp, spo2_value FROM o2ring_data WHERE file_id = ? ORDER BY timestamp", (file['id'],))
+            rows = cur.fetchall()
+            event_count = index_o2ring_file(cur, file['id'], [row[0] for row in rows], [row[1] for row in rows])
+            dates.update(london_dates_between(file['first_timestamp'], file['last_timestamp']))
+            logger.info(f"{file['filename']}: {event_count} desaturation events")
+
+        logger.info(f"Summarising {len(dates)} nights...")
+        refresh_spo2_summaries(cur, sorted(dates))
+        cur.close()
+
+        # Commit changes
+        conn.commit()
+        logger.info("Migration completed successfully!")
+
+    except Exception as e:
+        logger.error(f"Migration failed: {e}")
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    migrate_database()
@@ -6,13 +6,71 @@ Shared models for Garmin Heart Rate Analyzer
 import json
 import logging
 import math
-from typing import Dict, List, Optional, Tuple
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Tuple
 from collections import defaultdict
 
+import numpy as np
+
+from config import TIME_CONFIG
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Lower bound of each presentation bucket (80-89, 90-99, ... 160+)
+PRESENTATION_ZONE_LOWER_BOUNDS = (80, 90, 100, 110, 120, 130, 140, 150, 160)
+
+# Highest BPM covered by the lookup table (upper bound of the 160+ bucket)
+TRIMP_TABLE_MAX_BPM = 999
+
+class TRIMPLookupTable(NamedTuple):
+    """Per-BPM TRIMP weights and presentation zones for one (resting_hr, max_hr) pair."""
+    weights: np.ndarray        # TRIMP per minute at each integer BPM (0.0 below 80)
+    zone_indices: np.ndarray   # Presentation bucket index at each BPM (-1 below 80)
+    weights_list: List[float]  # Same values as Python floats for the per-sample path
+    zone_indices_list: List[int]
+
+def trimp_weight(hr: float, resting_hr: int, max_hr: int) -> float:
+    """
+    Calculate the TRIMP accumulated per minute at a given heart rate.
+    
+    Args:
+        hr: Heart rate in BPM
+        resting_hr: Resting heart rate in BPM
+        max_hr: Maximum heart rate in BPM
+        
+    Returns:
+        hr_reserve_ratio * 0.64 * exp(1.92 * hr_reserve_ratio), or 0.0 below 80 BPM
+    """
+    if hr < 80:  # Below exercise threshold
+        return 0.0
+    
+    hr_reserve_ratio = 0.0 if hr <= resting_hr else (hr - resting_hr) / (max_hr - resting_hr)
+    return hr_reserve_ratio * 0.64 * math.exp(1.92 * hr_reserve_ratio)
+
+@lru_cache(maxsize=32)
+def get_trimp_lookup_table(resting_hr: int, max_hr: int) -> TRIMPLookupTable:
+    """
+    Build (or fetch from the LRU cache) the per-BPM TRIMP lookup table.
+    
+    Args:
+        resting_hr: Resting heart rate in BPM
+        max_hr: Maximum heart rate in BPM
+        
+    Returns:
+        TRIMPLookupTable indexed by integer BPM from 0 to TRIMP_TABLE_MAX_BPM
+    """
+    bpm = np.arange(TRIMP_TABLE_MAX_BPM + 1)
+    weights = np.array([trimp_weight(int(hr), resting_hr, max_hr) for hr in bpm])
+    zone_indices = np.searchsorted(PRESENTATION_ZONE_LOWER_BOUNDS, bpm, side='right') - 1
+    
+    # Shared between calculators, so keep the arrays immutable
+    weights.setflags(write=False)
+    zone_indices.setflags(write=False)
+    
+    return TRIMPLookupTable(weights, zone_indices, weights.tolist(), zone_indices.tolist())
+
 class TRIMPCalculator:
     """Class to calculate TRIMP (Training Impulse) using exponential model."""
     
@@ -33,6 +91,11 @@ class TRIMPCalculator:
             (80, 89), (90, 99), (100, 109), (110, 119), (120, 129),
             (130, 139), (140, 149), (150, 159), (160, 999)
         ]
+        self.presentation_bucket_names = [
+            '160+' if max_hr == 999 else f'{min_hr}-{max_hr}'
+            for min_hr, max_hr in self.presentation_buckets
+        ]
+        self.trimp_table = get_trimp_lookup_table(resting_hr, max_hr)
         
         # Color temperature scale for presentation buckets
         self.bucket_colors = [
@@ -67,16 +130,33 @@ class TRIMPCalculator:
         if hr < 80:  # Below exercise threshold
             return 0.0
         
-        hr_reserve_ratio = self.calculate_hr_reserve_ratio(hr)
-        y = 1.92 * hr_reserve_ratio
-        trimp = minutes * hr_reserve_ratio * 0.64 * (math.exp(y))
+        if isinstance(hr, int) and hr <= TRIMP_TABLE_MAX_BPM:
+            return minutes * self.trimp_table.weights_list[hr]
         
-        return trimp
+        return minutes * trimp_weight(hr, self.resting_hr, self.max_hr)
+    
+    def _empty_presentation_buckets(self) -> Dict:
+        """Return zeroed presentation buckets (80-89, 90-99, ... 160+)."""
+        return {
+            '80-89': {'minutes': 0, 'trimp': 0.0},
+            '90-99': {'minutes': 0, 'trimp': 0.0},
+            '100-109': {'minutes': 0, 'trimp': 0.0},
+            '110-119': {'minutes': 0, 'trimp': 0.0},
+            '120-129': {'minutes': 0, 'trimp': 0.0},
+            '130-139': {'minutes': 0, 'trimp': 0.0},
+            '140-149': {'minutes': 0, 'trimp': 0.0},
+            '150-159': {'minutes': 0, 'trimp': 0.0},
+            '160+': {'minutes': 0, 'trimp': 0.0}
+        }
     
     def bucket_heart_rates(self, heart_rate_data: Dict) -> Dict:
         """
         Bucket heart rate values into individual buckets and calculate TRIMP.
         
+        Uses the NumPy engine; series it cannot represent as integer HR arrays
+        (e.g. fractional HR values) go through the per-sample loop instead.
+        Both paths return identical results.
+        
         Returns:
             Dict with individual buckets, presentation buckets, and TRIMP data
         """
@@ -88,27 +168,108 @@ class TRIMPCalculator:
                 'total_trimp': 0.0
             }
         
-        # Initialize buckets
-        individual_buckets = {}  # 80, 81, 82, etc.
-        presentation_buckets = {  # 80-89, 90-99, 100-109, etc.
-            '80-89': {'minutes': 0, 'trimp': 0.0},
-            '90-99': {'minutes': 0, 'trimp': 0.0},
-            '100-109': {'minutes': 0, 'trimp': 0.0},
-            '110-119': {'minutes': 0, 'trimp': 0.0},
-            '120-129': {'minutes': 0, 'trimp': 0.0},
-            '130-139': {'minutes': 0, 'trimp': 0.0},
-            '140-149': {'minutes': 0, 'trimp': 0.0},
-            '150-159': {'minutes': 0, 'trimp': 0.0},
-            '160+': {'minutes': 0, 'trimp': 0.0}
-        }
-        trimp_data = {}
-        total_trimp = 0.0
-        
         heart_rate_values = heart_rate_data['heartRateValues']
         
         # Sort by timestamp to ensure proper time calculation
         heart_rate_values.sort(key=lambda x: x[0] if isinstance(x, list) else x.get('timestamp', 0))
         
+        arrays = _series_to_arrays(heart_rate_values)
+        if arrays is None:
+            return self._bucket_heart_rates_loop(heart_rate_values)
+        
+        return self._bucket_heart_rate_arrays(*arrays)
+    
+    def _bucket_heart_rate_arrays(self, timestamps: np.ndarray, hr_values: np.ndarray, valid: np.ndarray) -> Dict:
+        """
+        Vectorized TRIMP bucketing over timestamp-sorted arrays.
+        
+        Args:
+            timestamps: int64 (or float64) timestamps in milliseconds
+            hr_values: int16 heart rates (0 where the reading is missing)
+            valid: Boolean mask of readings that have a heart rate
+            
+        Returns:
+            Same dict shape as bucket_heart_rates
+        """
+        presentation_buckets = self._empty_presentation_buckets()
+        
+        if len(timestamps) < 2:
+            return {
+                'individual_buckets': {},
+                'presentation_buckets': presentation_buckets,
+                'trimp_data': {},
+                'total_trimp': 0.0
+            }
+        
+        # Each reading (except the first) covers the gap since the previous one
+        gap_seconds = np.diff(timestamps) / 1000
+        hr = hr_values[1:]
+        mask = valid[1:] & (hr >= 80) & ~(gap_seconds > TIME_CONFIG['GAP_THRESHOLD_SECONDS'])
+        
+        hr = hr[mask]
+        if hr.size == 0:
+            return {
+                'individual_buckets': {},
+                'presentation_buckets': presentation_buckets,
+                'trimp_data': {},
+                'total_trimp': 0.0
+            }
+        minutes = gap_seconds[mask] / 60
+        
+        # Gather per-minute weights and zones from the lookup table
+        in_table = hr <= TRIMP_TABLE_MAX_BPM
+        table_hr = np.where(in_table, hr, 0)
+        weights = self.trimp_table.weights[table_hr]
+        zone_index = np.where(in_table, self.trimp_table.zone_indices[table_hr], -1)
+        if not in_table.all():
+            weights[~in_table] = [trimp_weight(int(v), self.resting_hr, self.max_hr) for v in hr[~in_table]]
+        trimp = minutes * weights
+        
+        unique_hr, first_index, inverse = np.unique(hr, return_index=True, return_inverse=True)
+        
+        # Keep first-seen key order and sequential (cumsum) accumulation so the
+        # dicts match the per-sample loop exactly
+        order = np.argsort(inverse, kind='stable')
+        group_starts = np.searchsorted(inverse[order], np.arange(len(unique_hr)))
+        group_ends = np.append(group_starts[1:], len(order))
+        counts = group_ends - group_starts
+        sorted_trimp = trimp[order]
+        
+        individual_buckets = {}
+        trimp_data = {}
+        for u in np.argsort(first_index, kind='stable'):
+            key = int(unique_hr[u])
+            individual_buckets[key] = int(counts[u])
+            trimp_data[key] = float(np.cumsum(sorted_trimp[group_starts[u]:group_ends[u]])[-1])
+        
+        # Readings above the 160+ bucket's upper bound have zone -1 and no bucket
+        for j, bucket_name in enumerate(presentation_buckets):
+            in_zone = zone_index == j
+            if in_zone.any():
+                presentation_buckets[bucket_name]['minutes'] += float(np.cumsum(minutes[in_zone])[-1])
+                presentation_buckets[bucket_name]['trimp'] += float(np.cumsum(trimp[in_zone])[-1])
+        
+        return {
+            'individual_buckets': individual_buckets,
+            'presentation_buckets': presentation_buckets,
+            'trimp_data': trimp_data,
+            'total_trimp': float(np.cumsum(trimp)[-1])
+        }
+    
+    def _bucket_heart_rates_loop(self, heart_rate_values: List) -> Dict:
+        """
+        Per-sample reference implementation of bucket_heart_rates.
+        
+        Args:
+            heart_rate_values: Timestamp-sorted list of [timestamp, hr] pairs or
+                {"value": x, "timestamp": y} dicts
+        """
+        # Initialize buckets
+        individual_buckets = {}  # 80, 81, 82, etc.
+        presentation_buckets = self._empty_presentation_buckets()  # 80-89, 90-99, 100-109, etc.
+        trimp_data = {}
+        total_trimp = 0.0
+        
         for i, hr_value in enumerate(heart_rate_values):
             # Handle both list and dict formats
             if isinstance(hr_value, list):
@@ -126,7 +287,7 @@ class TRIMPCalculator:
                 gap_seconds = (timestamp - prev_timestamp) / 1000
                 
                 # Skip readings after large gaps (watch taken off)
-                if gap_seconds > 300:
+                if gap_seconds > TIME_CONFIG['GAP_THRESHOLD_SECONDS']:
                     continue
                 
                 # Use the gap duration as the time interval for this reading
@@ -142,15 +303,15 @@ class TRIMPCalculator:
                 total_trimp += trimp
                 
                 # Presentation bucket
-                for j, (min_hr, max_hr) in enumerate(self.presentation_buckets):
-                    if min_hr <= hr <= max_hr:
-                        if max_hr == 999:
-                            bucket_name = "160+"
-                        else:
-                            bucket_name = f"{min_hr}-{max_hr}"
-                        presentation_buckets[bucket_name]['minutes'] += time_interval_minutes
-                        presentation_buckets[bucket_name]['trimp'] += trimp
-                        break
+                if isinstance(hr, int) and hr <= TRIMP_TABLE_MAX_BPM:
+                    zone = self.trimp_table.zone_indices_list[hr]
+                else:
+                    zone = next((j for j, (min_hr, max_hr) in enumerate(self.presentation_buckets)
+                                 if min_hr <= hr <= max_hr), -1)
+                if zone >= 0:
+                    bucket_name = self.presentation_bucket_names[zone]
+                    presentation_buckets[bucket_name]['minutes'] += time_interval_minutes
+                    presentation_buckets[bucket_name]['trimp'] += trimp
         
         return {
             'individual_buckets': individual_buckets,
@@ -159,6 +320,56 @@ class TRIMPCalculator:
             'total_trimp': total_trimp
         }
 
+def _series_to_arrays(heart_rate_values: List) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Convert an HR series to (timestamps, hr_values, valid) arrays in one pass.
+    
+    Args:
+        heart_rate_values: List of [timestamp, hr] pairs or {"value": x, "timestamp": y} dicts
+        
+    Returns:
+        Tuple of int64 timestamps (float64 if any timestamp is fractional), int16
+        heart rates and a validity mask, or None if the series holds values the
+        arrays cannot represent exactly (non-numeric timestamps, fractional HR)
+    """
+    if not heart_rate_values:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty.astype(np.int16), empty.astype(bool)
+    
+    if isinstance(heart_rate_values[0], list):
+        timestamps = [point[0] for point in heart_rate_values]
+        hr_list = [point[1] for point in heart_rate_values]
+    else:
+        timestamps = [point.get('timestamp', 0) for point in heart_rate_values]
+        hr_list = [point.get('value') for point in heart_rate_values]
+    
+    try:
+        ts_array = np.asarray(timestamps)
+        hr_array = np.asarray(hr_list)
+    except (TypeError, ValueError):
+        return None
+    if ts_array.ndim != 1 or hr_array.ndim != 1 or ts_array.dtype.kind not in 'iuf':
+        return None
+    
+    if hr_array.dtype.kind in 'iu':
+        valid = np.ones(len(hr_array), dtype=bool)
+    elif hr_array.dtype == object:
+        # Missing readings: only ints and None are representable
+        valid = np.array([value is not None for value in hr_list])
+        if not all(isinstance(value, int) for value in hr_array[valid]):
+            return None
+        hr_array = np.where(valid, hr_array, 0).astype(np.int64)
+    else:
+        return None
+    
+    if hr_array.size and (hr_array.min() < np.iinfo(np.int16).min or hr_array.max() > np.iinfo(np.int16).max):
+        return None
+    
+    if ts_array.dtype.kind in 'iu':
+        ts_array = ts_array.astype(np.int64)
+    
+    return ts_array, hr_array.astype(np.int16), valid
+
 class HeartRateAnalyzer:
     """Class to analyze heart rate data using TRIMP calculations."""
     
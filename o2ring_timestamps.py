@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+O2Ring timestamp parsing for Garmin Heart Rate Analyzer
+
+O2Ring CSV exports record local UK wall-clock times such as "10:09:10PM Aug 21, 2025".
+A night is about 8,000 rows, so instead of strptime and a pytz localize per row
+the fixed format is tokenized by hand and the UTC offset is looked up once per
+calendar day. On the two days a year when the clocks change the offset is looked
+up per hour instead, which gives the same answer as pytz localize(is_dst=False).
+"""
+
+import logging
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Optional, Tuple
+
+import pytz
+
+logger = logging.getLogger(__name__)
+
+UK_TIMEZONE = pytz.timezone('Europe/London')
+
+O2RING_MONTHS = {
+    'JAN': 1, 'FEB': 2, 'MAR': 3, 'APR': 4, 'MAY': 5, 'JUN': 6,
+    'JUL': 7, 'AUG': 8, 'SEP': 9, 'OCT': 10, 'NOV': 11, 'DEC': 12,
+}
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+@lru_cache(maxsize=4096)
+def _london_day(year: int, month: int, day: int) -> Tuple[int, Optional[int]]:
+    """
+    Look up a London calendar day.
+    
+    Returns:
+        Tuple of (seconds from the epoch to the day's midnight as if it were UTC,
+        UTC offset in seconds), with an offset of None if it changes during the day
+    """
+    day_start = (date(year, month, day).toordinal() - EPOCH_ORDINAL) * 86400
+    first_offset = UK_TIMEZONE.localize(datetime(year, month, day)).utcoffset()
+    last_offset = UK_TIMEZONE.localize(datetime(year, month, day, 23, 59, 59)).utcoffset()
+    if first_offset != last_offset:
+        return day_start, None
+    return day_start, int(first_offset.total_seconds())
+
+
+@lru_cache(maxsize=256)
+def _london_hour_offset(year: int, month: int, day: int, hour: int) -> int:
+    """UTC offset in seconds for one hour of a day on which the clocks change."""
+    return int(UK_TIMEZONE.localize(datetime(year, month, day, hour)).utcoffset().total_seconds())
+
+
+def parse_o2ring_timestamp_strptime(time_str: str) -> Optional[int]:
+    """
+    Parse an O2Ring timestamp with strptime and pytz.
+    
+    This is the reference implementation, used for anything the fast parser
+    does not recognise.
+    
+    Args:
+        time_str: Local UK time, e.g. "10:09:10PM Aug 21, 2025"
+    
+    Returns:
+        Unix timestamp in milliseconds, or None if the string cannot be parsed
+    """
+    try:
+        dt = datetime.strptime(time_str, "%I:%M:%S%p %b %d, %Y")
+        return int(UK_TIMEZONE.localize(dt).timestamp() * 1000)
+    except Exception as e:
+        logger.error(f"Error parsing O2Ring timestamp '{time_str}': {e}")
+        return None
+
+
+def parse_o2ring_timestamp(time_str: str) -> Optional[int]:
+    """
+    Parse O2Ring timestamp format: "10:09:10PM Aug 21, 2025"
+    
+    Args:
+        time_str: Local UK time as written by the O2Ring app
+    
+    Returns:
+        Unix timestamp in milliseconds (same format as Garmin data), or None if invalid
+    """
+    try:
+        clock, month_name, day_str, year_str = time_str.split(' ')
+        hour_str, minute_str, second_str = clock[:-2].split(':')
+        meridiem = clock[-2:].upper()
+        
+        if not (day_str.endswith(',') and len(year_str) == 4 and year_str.isdigit()
+                and 0 < len(hour_str) <= 2 and hour_str.isdigit()
+                and len(minute_str) == 2 and minute_str.isdigit()
+                and len(second_str) == 2 and second_str.isdigit()
+                and 0 < len(day_str) - 1 <= 2 and day_str[:-1].isdigit()):
+            raise ValueError(time_str)
+        
+        hour = int(hour_str)
+        minute = int(minute_str)
+        second = int(second_str)
+        if not (1 <= hour <= 12 and minute <= 59 and second <= 59) or meridiem not in ('AM', 'PM'):
+            raise ValueError(time_str)
+        
+        # 12:xxAM is the hour after midnight, 12:xxPM the hour after noon
+        hour = hour % 12 + (12 if meridiem == 'PM' else 0)
+        
+        year = int(year_str)
+        month = O2RING_MONTHS[month_name.upper()]
+        day = int(day_str[:-1])
+        day_start, offset = _london_day(year, month, day)
+    except (ValueError, KeyError):
+        # Not the exact format written by the O2Ring app, let strptime decide
+        return parse_o2ring_timestamp_strptime(time_str)
+    
+    if offset is None:
+        offset = _london_hour_offset(year, month, day, hour)
+    
+    return (day_start + hour * 3600 + minute * 60 + second - offset) * 1000
@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+Date range data collection for Garmin Heart Rate Analyzer
+
+A multi-day /collect-data request runs as a single job that plans the minimal
+set of Garmin calls for the whole range: one ranged activity listing, one
+series fetch per distinct activity and one heart rate request per day, issued
+in parallel. All days are then written in a single transaction. Per-day
+progress is kept in the job's result while the job runs.
+
+Collection is incremental: settled days (see sync_state) are skipped, only new
+or changed activities are downloaded, and only days whose heart rates or
+activities changed since the last sync are rewritten.
+"""
+
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from typing import Dict, List, Set, Tuple
+
+from config import API_CONFIG
+from garminconnect import GarminConnectTooManyRequestsError
+from database import db_connection, encode_series, get_db_connection, get_user_data_batch, get_user_hr_parameters
+from jobs import (
+    GarminClientError,
+    build_daily_hr_timeseries_batch,
+    clear_day_data,
+    create_garmin_client,
+    fetch_activity_series,
+    save_daily_hr_timeseries,
+    store_activity,
+)
+from sync_state import (
+    SYNC_KIND_ACTIVITY,
+    SYNC_KIND_DAY,
+    day_fingerprint,
+    days_to_sync,
+    delete_sync_states,
+    get_sync_states,
+    plan_activity_sync,
+    save_sync_states,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def date_range(start_date: str, end_date: str) -> List[str]:
+    """Return every date from start_date to end_date inclusive (YYYY-MM-DD)."""
+    start = datetime.strptime(start_date, '%Y-%m-%d').date()
+    end = datetime.strptime(end_date, '%Y-%m-%d').date()
+    return [(start + timedelta(days=offset)).isoformat() for offset in range((end - start).days + 1)]
+
+
+def update_range_job(job_id: str, result: Dict, status: str = 'running', error_message: str = None):
+    """Store a range job's progress (or final result) in background_jobs."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("""
+        UPDATE background_jobs
+        SET status = ?, result = ?, error_message = ?, updated_at = CURRENT_TIMESTAMP
+        WHERE job_id = ?
+    """, (status, json.dumps(result), error_message, job_id))
+    conn.commit()
+    cur.close()
+    conn.close()
+
+
+def list_range_activities(api, days: List[str]) -> Dict[str, List[Dict]]:
+    """
+    List the activities in the range with one ranged query.
+
+    Args:
+        api: Garmin API instance
+        days: Dates in the range, in order
+
+    Returns:
+        Dict of date -> activity summaries starting that (local) day, each activity once
+    """
+    activities_by_day = {day: [] for day in days}
+    seen = set()
+    for activity in api.get_activities_by_date(days[0], days[-1], sortorder='asc') or []:
+        activity_id = str(activity['activityId'])
+        day = (activity.get('startTimeLocal') or '')[:10]
+        if activity_id in seen or day not in activities_by_day:
+            continue
+        seen.add(activity_id)
+        activities_by_day[day].append(activity)
+
+    logger.info(f"list_range_activities: Found {len(seen)} activities from {days[0]} to {days[-1]}")
+    return activities_by_day
+
+
+def has_heart_rate_data(heart_rate_data) -> bool:
+    """Check a daily heart rate response the way the per-day job does before storing it."""
+    if not heart_rate_data or 'heartRateValues' not in heart_rate_data:
+        return False
+    return not any(value is None for value in heart_rate_data['heartRateValues'] or [])
+
+
+def fetch_range(api, job_id: str, days: List[str], activities_by_day: Dict[str, List[Dict]], changed_ids: Set[str],
+                progress: Dict):
+    """
+    Fetch daily heart rates and new or changed activities' series for the range in parallel.
+
+    Days are marked 'fetched', 'no_data' or 'failed' in progress as their last
+    request completes; a day fails if any of its requests raised or any of its
+    activities' series could not be fetched. A rate limit error is raised so
+    the job can be retried.
+
+    Args:
+        api: Garmin API instance
+        job_id: Job to report progress on
+        days: Dates in the range
+        activities_by_day: Output of list_range_activities
+        changed_ids: IDs of the activities to download, from plan_activity_sync
+        progress: Job result dict, with a 'days' dict of date -> status
+
+    Returns:
+        Tuple of (heart_rates, activity_series): date -> heart rate response,
+        and activity_id -> (raw_hr_series, breathing_series) or None
+    """
+    heart_rates = {}
+    activity_series = {}
+    remaining = {day: 1 for day in days}
+    # Activities fetched by an earlier sync changed since, so their cached responses are stale
+    refetched = get_sync_states(SYNC_KIND_ACTIVITY, changed_ids)
+
+    with ThreadPoolExecutor(max_workers=API_CONFIG['RANGE_COLLECTION_WORKERS']) as pool:
+        futures = {pool.submit(api.get_heart_rates, day): ('hr', day, day) for day in days}
+        for day in days:
+            for activity in activities_by_day[day]:
+                activity_id = str(activity['activityId'])
+                if activity_id in changed_ids:
+                    future = pool.submit(fetch_activity_series, api, activity_id, activity_id in refetched)
+                    futures[future] = ('activity', day, activity_id)
+                    remaining[day] += 1
+
+        for future in as_completed(futures):
+            kind, day, key = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                if isinstance(e, GarminConnectTooManyRequestsError) or '429' in str(e) or 'Too Many Requests' in str(e):
+                    # Leave the whole range for the job queue to retry
+                    for pending in futures:
+                        pending.cancel()
+                    raise
+                logger.error(f"fetch_range: Failed to fetch {kind} data for {key}: {e}")
+                progress['days'][day] = 'failed'
+                result = None
+
+            if kind == 'hr':
+                heart_rates[day] = result
+            else:
+                activity_series[key] = result
+                if result is None:
+                    # fetch_activity_series logs and swallows its errors
+                    logger.error(f"fetch_range: Could not fetch the series of activity {key}")
+                    progress['days'][day] = 'failed'
+
+            remaining[day] -= 1
+            if remaining[day] == 0 and progress['days'][day] != 'failed':
+                progress['days'][day] = 'fetched' if has_heart_rate_data(heart_rates.get(day)) else 'no_data'
+                progress['fetched_days'] += 1
+                update_range_job(job_id, progress)
+
+    return heart_rates, activity_series
+
+
+def store_range(days: List[str], heart_rates: Dict, activities_by_day: Dict, activity_series: Dict,
+                activity_plan: Tuple, progress: Dict):
+    """
+    Write the fetched days that changed since the last sync in one transaction.
+
+    Days without heart rate data are cleared and skipped, as the per-day job does.
+    Days whose heart rates and activities match the last sync are left alone and
+    marked 'unchanged'. Failed days, including days with a changed activity whose
+    series could not be fetched, keep their existing data and get no sync state.
+
+    Args:
+        days: Dates in the range
+        heart_rates: Date -> heart rate response, from fetch_range
+        activities_by_day: Output of list_range_activities
+        activity_series: Activity ID -> series, from fetch_range
+        activity_plan: Output of plan_activity_sync for activities_by_day
+        progress: Job result dict
+    """
+    statuses = progress['days']
+    changed_ids, removed_ids, activity_fingerprints = activity_plan
+
+    # A day is only rewritten once every changed activity on it was fetched
+    for day in days:
+        if statuses[day] == 'fetched' and any(
+            str(a['activityId']) in changed_ids and activity_series.get(str(a['activityId'])) is None
+            for a in activities_by_day[day]
+        ):
+            statuses[day] = 'failed'
+
+    cleared_days = [day for day in days if statuses[day] == 'no_data']
+    fetched_days = [day for day in days if statuses[day] == 'fetched']
+    if not cleared_days and not fetched_days:
+        return
+
+    hr_fingerprints = {day: day_fingerprint(heart_rates[day]['heartRateValues']) for day in fetched_days}
+    day_states = get_sync_states(SYNC_KIND_DAY, fetched_days)
+    stored_days = [
+        day for day in fetched_days
+        if day_states.get(day, {}).get('fingerprint') != hr_fingerprints[day]
+        or removed_ids[day]
+        or any(str(a['activityId']) in changed_ids for a in activities_by_day[day])
+    ]
+    unchanged_days = [day for day in fetched_days if day not in stored_days]
+
+    resting_hr, max_hr = get_user_hr_parameters()
+    stale_ids = [str(a['activityId']) for day in stored_days for a in activities_by_day[day]
+                 if str(a['activityId']) in changed_ids]
+    csv_overrides = get_user_data_batch('activity_hr_csv', stale_ids)
+    gone_ids = [activity_id for day in stored_days for activity_id in removed_ids[day]]
+    stored_ids = []
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute("BEGIN IMMEDIATE")
+            for day in cleared_days:
+                clear_day_data(cur, day)
+
+            if stored_days:
+                cur.execute(f"DELETE FROM daily_data WHERE date IN ({', '.join('?' * len(stored_days))})", stored_days)
+            if stale_ids or gone_ids:
+                # Activities may have been stored under another date by the per-day job
+                cur.execute(f"DELETE FROM activity_data WHERE activity_id IN ({', '.join('?' * len(stale_ids + gone_ids))})",
+                            stale_ids + gone_ids)
+            delete_sync_states(cur, SYNC_KIND_ACTIVITY, gone_ids)
+
+            for day in stored_days:
+                heart_rate_values = heart_rates[day]['heartRateValues']
+                if heart_rate_values:
+                    cur.execute("INSERT INTO daily_data (date, heart_rate_series) VALUES (?, ?)",
+                                (day, encode_series(heart_rate_values)))
+                for activity in activities_by_day[day]:
+                    activity_id = str(activity['activityId'])
+                    if activity_id not in changed_ids:
+                        continue
+                    raw_hr_series, breathing_series = activity_series[activity_id]
+                    store_activity(cur, activity, day, raw_hr_series, breathing_series, max_hr,
+                                   csv_overrides.get(activity_id))
+                    stored_ids.append(activity_id)
+
+            final_series = build_daily_hr_timeseries_batch(stored_days, conn, cur)
+            for day in stored_days:
+                if final_series.get(day):
+                    progress['total_trimp'][day] = save_daily_hr_timeseries(cur, day, final_series[day])
+                statuses[day] = 'stored'
+            for day in unchanged_days:
+                statuses[day] = 'unchanged'
+
+            save_sync_states(cur, SYNC_KIND_ACTIVITY, {activity_id: activity_fingerprints[activity_id]
+                                                       for activity_id in stored_ids})
+            save_sync_states(cur, SYNC_KIND_DAY, {day: hr_fingerprints[day] for day in fetched_days})
+
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+
+    logger.info(f"store_range: Stored {len(stored_days)} days, {len(unchanged_days)} unchanged, "
+                f"cleared {len(cleared_days)} without data")
+
+
+def collect_garmin_range_job(start_date: str, end_date: str, job_id: str, api=None):
+    """
+    Background job collecting every day from start_date to end_date.
+
+    Args:
+        start_date: First date to collect (YYYY-MM-DD)
+        end_date: Last date to collect (YYYY-MM-DD)
+        job_id: Unique job identifier
+        api: Authenticated Garmin client to reuse (logs in if not given)
+    """
+    logger.info(f"collect_garmin_range_job: Starting job {job_id} for {start_date} to {end_date}")
+
+    days = date_range(start_date, end_date)
+    sync_days = days_to_sync(days)
+    progress = {
+        'total_days': len(sync_days),
+        'fetched_days': 0,
+        'up_to_date_days': len(days) - len(sync_days),
+        'days': {day: 'pending' if day in sync_days else 'up_to_date' for day in days},
+        'total_trimp': {},
+    }
+
+    try:
+        update_range_job(job_id, progress)
+
+        if sync_days:
+            if api is None:
+                api = create_garmin_client()
+
+            activities_by_day = list_range_activities(api, sync_days)
+            with db_connection() as conn:
+                cur = conn.cursor()
+                activity_plan = plan_activity_sync(cur, activities_by_day)
+                cur.close()
+            heart_rates, activity_series = fetch_range(api, job_id, sync_days, activities_by_day, activity_plan[0],
+                                                       progress)
+            store_range(sync_days, heart_rates, activities_by_day, activity_series, activity_plan, progress)
+
+        failed_days = [day for day in days if progress['days'][day] == 'failed']
+        progress['message'] = f"Collected {len(sync_days) - len(failed_days)} of {len(sync_days)} days"
+        if progress['up_to_date_days']:
+            progress['message'] += f", {progress['up_to_date_days']} already up to date"
+        if failed_days:
+            update_range_job(job_id, progress, 'failed', f"Failed to collect {', '.join(failed_days)}")
+        else:
+            update_range_job(job_id, progress, 'completed')
+        logger.info(f"collect_garmin_range_job: Job {job_id} finished: {progress['message']}")
+
+    except GarminClientError as e:
+        logger.error(f"collect_garmin_range_job: {e}")
+        update_range_job(job_id, progress, 'failed', str(e))
+    except Exception as e:
+        logger.error(f"collect_garmin_range_job: Error collecting data: {e}")
+        if isinstance(e, GarminConnectTooManyRequestsError) or '429' in str(e) or 'Too Many Requests' in str(e):
+            error_msg = f"Rate limited by Garmin API for {start_date} to {end_date}. Please try again later."
+        else:
+            error_msg = f"Error collecting data: {str(e)}"
+        update_range_job(job_id, progress, 'failed', error_msg)
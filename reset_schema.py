@@ -24,6 +24,7 @@ def reset_schema():
     cur.execute("DROP TABLE IF EXISTS garmin_credentials")
     cur.execute("DROP TABLE IF EXISTS background_jobs")
     cur.execute("DROP TABLE IF EXISTS hr_parameters")
+    cur.execute("DROP TABLE IF EXISTS sync_state")
     
     print("Creating new schema...")
     
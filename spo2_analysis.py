@@ -0,0 +1,525 @@
+#!/usr/bin/env python3
+"""
+SpO2 analytics for Garmin Heart Rate Analyzer
+
+Distribution statistics, desaturation events and per-night summaries of
+O2Ring data. When a file is loaded its desaturation events are detected over
+the whole file at once and stored in spo2_events, and every night the file
+touches gets a spo2_daily_summary row (ODI, nadir, T90 and the SpO2
+distribution). Range charts read those rows instead of the raw samples.
+
+Nights are keyed by their Europe/London calendar date, like the SpO2 pages.
+"""
+
+import json
+import logging
+from datetime import datetime, timedelta
+from operator import itemgetter
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from config import SPO2_CONFIG
+from database import db_connection
+from o2ring_timestamps import UK_TIMEZONE
+
+logger = logging.getLogger(__name__)
+
+# Minimum drops below the baseline (SpO2 percentage points) that count as a desaturation
+DESATURATION_DROPS = (3, 4)
+
+SPO2_DISPLAY_LEVELS = list(range(99, 79, -1))  # 99 down to 80; 80 also covers everything below it
+OXYGEN_DEBT_THRESHOLDS = (95, 90, 88)
+
+
+def _descending_sums(values, starts):
+    """
+    Sum values[start], values[start - 1], ..., values[0] for each start.
+
+    The sums are accumulated one term at a time in that order (a cumsum over a
+    zero-padded row per start), so they round exactly like a Python loop adding
+    the same terms.
+    """
+    offsets = np.asarray(starts)[:, None] - np.arange(len(values))
+    terms = np.where(offsets >= 0, values[np.clip(offsets, 0, None)], 0.0)
+    return np.cumsum(terms, axis=1)[:, -1]
+
+
+def calculate_spo2_distribution(spo2_data, start_timestamp=None, end_timestamp=None):
+    """
+    Calculate SpO2 distribution statistics for a given time period.
+
+    Uses NumPy over the whole period; data it cannot represent exactly as
+    arrays (e.g. fractional SpO2 values) goes through the per-point loop
+    instead. Both paths return identical results.
+
+    Args:
+        spo2_data: List of [timestamp, spo2_value, spo2_reminder] tuples
+        start_timestamp: Optional start timestamp in milliseconds (for filtering)
+        end_timestamp: Optional end timestamp in milliseconds (for filtering)
+
+    Returns:
+        Dictionary with 'at_level' and 'at_or_below_level' statistics
+    """
+    if not spo2_data:
+        return {
+            'at_level': [],
+            'at_or_below_level': [],
+            'total_seconds': 0
+        }
+
+    try:
+        timestamps = np.fromiter(map(itemgetter(0), spo2_data), dtype=np.float64, count=len(spo2_data))
+        spo2_values = np.fromiter(map(itemgetter(1), spo2_data), dtype=np.float64, count=len(spo2_data))
+    except (TypeError, ValueError):
+        return _calculate_spo2_distribution_loop(spo2_data, start_timestamp, end_timestamp)
+    # Millisecond timestamps are exact in float64; SpO2 levels must be whole numbers
+    if (not np.isfinite(timestamps).all() or np.abs(timestamps).max() >= 2 ** 53
+            or not np.isfinite(spo2_values).all() or not np.array_equal(spo2_values, np.floor(spo2_values))):
+        return _calculate_spo2_distribution_loop(spo2_data, start_timestamp, end_timestamp)
+    spo2_values = spo2_values.astype(np.int64)
+
+    # Filter data to time period if specified
+    if start_timestamp and end_timestamp:
+        in_period = (timestamps >= start_timestamp) & (timestamps <= end_timestamp)
+        timestamps = timestamps[in_period]
+        spo2_values = spo2_values[in_period]
+
+    if len(timestamps) == 0:
+        return {
+            'at_level': [],
+            'at_or_below_level': [],
+            'total_seconds': 0
+        }
+
+    # Sort by timestamp
+    order = np.argsort(timestamps, kind='stable')
+    timestamps = timestamps[order]
+    spo2_values = spo2_values[order]
+
+    total_seconds = float(timestamps[-1] - timestamps[0]) / 1000  # Convert from milliseconds
+
+    # Each point lasts until the next one; the last point is assumed to last 1 second
+    intervals = np.diff(timestamps) / 1000
+    total_spo2_seconds = float(np.cumsum(intervals)[-1]) + 1 if len(intervals) else 1
+
+    # Seconds at each SpO2 level 0-100, added in time order like the loop does
+    interval_levels = spo2_values[:-1]
+    in_range = (interval_levels >= 0) & (interval_levels <= 100)
+    level_seconds = np.bincount(interval_levels[in_range], weights=intervals[in_range], minlength=101)
+    # Levels no interval fell on hold the integer 0 (or 1, from the last point) in the loop
+    has_intervals = np.bincount(interval_levels[in_range], minlength=101) > 0
+    last_spo2 = int(spo2_values[-1])
+    if 0 <= last_spo2 <= 100:
+        level_seconds[last_spo2] += 1
+
+    def as_loop_number(value, levels_up_to):
+        """Return a sum over levels 0..levels_up_to as the float or int the loop would have produced."""
+        return float(value) if has_intervals[:levels_up_to + 1].any() else int(value)
+
+    def stats(level, seconds):
+        percent = (seconds / total_spo2_seconds * 100) if total_spo2_seconds > 0 else 0
+        return {
+            'spo2': level,
+            'seconds': round(seconds, 1),
+            'percent': round(percent, 0)  # 0 decimal places
+        }
+
+    # Time at or below each display level, accumulated from that level down to 0
+    at_or_below_seconds = _descending_sums(level_seconds, SPO2_DISPLAY_LEVELS)
+    at_or_below_stats = [
+        stats(level, as_loop_number(seconds, level))
+        for level, seconds in zip(SPO2_DISPLAY_LEVELS, at_or_below_seconds)
+    ]
+
+    # At level 80 covers everything at 80 or below, like the at-or-below figure
+    at_level_stats = [
+        stats(level, float(level_seconds[level]) if has_intervals[level] else int(level_seconds[level]))
+        for level in SPO2_DISPLAY_LEVELS[:-1]
+    ]
+    at_level_stats.append(dict(at_or_below_stats[-1]))
+
+    # Calculate oxygen debt metrics: time below each threshold and that time weighted by depth below it
+    below_levels = [threshold - 1 for threshold in OXYGEN_DEBT_THRESHOLDS]
+    time_under = _descending_sums(level_seconds, below_levels)
+    oxygen_debt = {}
+    for threshold, time_under_threshold in zip(OXYGEN_DEBT_THRESHOLDS, time_under):
+        depths = threshold - np.arange(threshold)
+        area_under_threshold = _descending_sums(level_seconds[:threshold] * depths, [threshold - 1])[0]
+        oxygen_debt[f'time_under_{threshold}'] = round(as_loop_number(time_under_threshold, threshold - 1), 1)
+        oxygen_debt[f'area_under_{threshold}'] = round(as_loop_number(area_under_threshold, threshold - 1), 1)
+
+    return {
+        'at_level': at_level_stats,
+        'at_or_below_level': at_or_below_stats,
+        'total_seconds': round(total_seconds, 1),
+        'oxygen_debt': oxygen_debt
+    }
+
+def _calculate_spo2_distribution_loop(spo2_data, start_timestamp=None, end_timestamp=None):
+    """
+    Per-point implementation of calculate_spo2_distribution.
+
+    Args:
+        spo2_data: List of [timestamp, spo2_value, spo2_reminder] tuples
+        start_timestamp: Optional start timestamp in milliseconds (for filtering)
+        end_timestamp: Optional end timestamp in milliseconds (for filtering)
+
+    Returns:
+        Dictionary with 'at_level' and 'at_or_below_level' statistics
+    """
+    if not spo2_data:
+        return {
+            'at_level': [],
+            'at_or_below_level': [],
+            'total_seconds': 0
+        }
+
+    # Filter data to time period if specified
+    if start_timestamp and end_timestamp:
+        filtered_data = [
+            point for point in spo2_data
+            if start_timestamp <= point[0] <= end_timestamp
+        ]
+    else:
+        filtered_data = spo2_data
+
+    if not filtered_data:
+        return {
+            'at_level': [],
+            'at_or_below_level': [],
+            'total_seconds': 0
+        }
+
+    # Sort by timestamp
+    filtered_data.sort(key=lambda x: x[0])
+
+    # Calculate total time period in seconds
+    total_start = filtered_data[0][0]
+    total_end = filtered_data[-1][0]
+    total_seconds = (total_end - total_start) / 1000  # Convert from milliseconds
+
+    # Calculate total SpO2 data time (sum of all intervals)
+    total_spo2_seconds = 0
+    for i in range(len(filtered_data) - 1):
+        current_point = filtered_data[i]
+        next_point = filtered_data[i + 1]
+        interval_seconds = (next_point[0] - current_point[0]) / 1000
+        total_spo2_seconds += interval_seconds
+
+    # Add the last point
+    if filtered_data:
+        total_spo2_seconds += 1  # Assume last point represents 1 second
+
+    # Initialize counters for each SpO2 level (0-100 to handle all possible values)
+    level_counts = {level: 0 for level in range(0, 101)}
+
+    # Count seconds at each level
+    # Since O2Ring data is typically recorded every few seconds, we'll interpolate
+    # between consecutive points to get a more accurate time distribution
+
+    for i in range(len(filtered_data) - 1):
+        current_point = filtered_data[i]
+        next_point = filtered_data[i + 1]
+
+        current_timestamp = current_point[0]
+        next_timestamp = next_point[0]
+        current_spo2 = current_point[1]
+
+        # Calculate time interval between points in seconds
+        interval_seconds = (next_timestamp - current_timestamp) / 1000
+
+        # Add this interval to the appropriate SpO2 level
+        if 0 <= current_spo2 <= 100:
+            level_counts[current_spo2] += interval_seconds
+
+    # Handle the last point (assume it continues for a short interval)
+    if filtered_data:
+        last_point = filtered_data[-1]
+        last_spo2 = last_point[1]
+        if 0 <= last_spo2 <= 100:
+            # Assume last point represents 1 second
+            level_counts[last_spo2] += 1
+
+    # Create at_level statistics (80-99 for display, with same logic as individual_levels)
+    at_level_stats = []
+    for level in range(99, 79, -1):  # 99 down to 80
+        if level == 80:
+            # Special case: level 80 includes all time at 80 or below
+            seconds = 0
+            for l in range(80, -1, -1):  # From 80 down to 0
+                seconds += level_counts[l]
+        else:
+            # Regular case: just time at this specific level
+            seconds = level_counts[level]
+
+        percent = (seconds / total_spo2_seconds * 100) if total_spo2_seconds > 0 else 0
+        at_level_stats.append({
+            'spo2': level,
+            'seconds': round(seconds, 1),
+            'percent': round(percent, 0)  # 0 decimal places
+        })
+
+    # Create at_or_below_level statistics (80-99 for display)
+    at_or_below_stats = []
+    for level in range(99, 79, -1):  # 99 down to 80
+        # Calculate cumulative time from current level down to 80 (inclusive)
+        cumulative_seconds = 0
+        for l in range(level, 79, -1):  # From current level down to 80
+            if l == 80:
+                # For level 80, include all time at 80 or below
+                for ll in range(80, -1, -1):
+                    cumulative_seconds += level_counts[ll]
+            else:
+                cumulative_seconds += level_counts[l]
+
+        percent = (cumulative_seconds / total_spo2_seconds * 100) if total_spo2_seconds > 0 else 0
+        at_or_below_stats.append({
+            'spo2': level,
+            'seconds': round(cumulative_seconds, 1),
+            'percent': round(percent, 0)  # 0 decimal places
+        })
+
+    # Calculate oxygen debt metrics for thresholds 95, 90, and 88
+    oxygen_debt = {}
+
+    for threshold in [95, 90, 88]:
+        # Calculate time under threshold (cumulative time at threshold-1 and below)
+        time_under_threshold = 0
+        area_under_threshold = 0
+
+        for level in range(threshold - 1, -1, -1):  # From threshold-1 down to 0
+            if level in level_counts:
+                time_at_level = level_counts[level]
+                time_under_threshold += time_at_level
+                # Calculate area: time * depth below threshold
+                depth_below = threshold - level
+                area_under_threshold += time_at_level * depth_below
+
+        oxygen_debt[f'time_under_{threshold}'] = round(time_under_threshold, 1)
+        oxygen_debt[f'area_under_{threshold}'] = round(area_under_threshold, 1)
+
+    return {
+        'at_level': at_level_stats,
+        'at_or_below_level': at_or_below_stats,
+        'total_seconds': round(total_seconds, 1),
+        'oxygen_debt': oxygen_debt
+    }
+
+
+def london_day_bounds(date: str) -> Tuple[int, int]:
+    """Return the (start, end) timestamps in milliseconds of the 24 hours from Europe/London midnight, as the SpO2 pages use."""
+    start_of_day = UK_TIMEZONE.localize(datetime.strptime(date, '%Y-%m-%d'))
+    end_of_day = start_of_day + timedelta(days=1)
+    return int(start_of_day.timestamp() * 1000), int(end_of_day.timestamp() * 1000)
+
+
+def london_dates_between(first_timestamp: int, last_timestamp: int) -> List[str]:
+    """Return the Europe/London dates from the one containing first_timestamp to the one containing last_timestamp."""
+    first = datetime.fromtimestamp(first_timestamp / 1000, UK_TIMEZONE).date()
+    last = datetime.fromtimestamp(last_timestamp / 1000, UK_TIMEZONE).date()
+    return [(first + timedelta(days=offset)).isoformat() for offset in range((last - first).days + 1)]
+
+
+def _rolling_baseline(timestamps: np.ndarray, spo2_values: np.ndarray) -> np.ndarray:
+    """
+    Mean SpO2 over the BASELINE_WINDOW_SECONDS before each sample (the sample itself excluded).
+
+    Samples with nothing in their window get NaN.
+    """
+    window_ms = SPO2_CONFIG['BASELINE_WINDOW_SECONDS'] * 1000
+    cumulative = np.concatenate(([0], np.cumsum(spo2_values, dtype=np.int64)))
+    window_start = np.searchsorted(timestamps, timestamps - window_ms, side='left')
+    index = np.arange(len(timestamps))
+    count = index - window_start
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(count > 0, (cumulative[index] - cumulative[window_start]) / count, np.nan)
+
+
+def detect_desaturation_events(timestamps, spo2_values, drop: int) -> List[Dict]:
+    """
+    Find desaturations: runs of samples at least `drop` points below the rolling baseline.
+
+    A run ends at the first sample back above the threshold or at a recording gap
+    longer than MAX_SAMPLE_GAP_SECONDS; runs shorter than MIN_EVENT_SECONDS are
+    ignored. The baseline of an event is the rolling baseline of its first sample.
+
+    Args:
+        timestamps: Sample timestamps in milliseconds
+        spo2_values: SpO2 values, same length
+        drop: Minimum drop below the baseline
+
+    Returns:
+        List of event dicts with start_timestamp, end_timestamp, baseline and nadir, in time order
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    spo2_values = np.asarray(spo2_values, dtype=np.int64)
+    if len(timestamps) < 2:
+        return []
+
+    order = np.argsort(timestamps, kind='stable')
+    timestamps = timestamps[order]
+    spo2_values = spo2_values[order]
+
+    baseline = _rolling_baseline(timestamps, spo2_values)
+    with np.errstate(invalid='ignore'):
+        low = spo2_values <= baseline - drop
+
+    # Runs of low samples, split where the recording has a gap
+    gap = np.diff(timestamps) > SPO2_CONFIG['MAX_SAMPLE_GAP_SECONDS'] * 1000
+    starts_run = low & np.concatenate(([True], ~low[:-1] | gap))
+    ends_run = low & np.concatenate((~low[1:] | gap, [True]))
+    run_starts = np.flatnonzero(starts_run)
+    run_ends = np.flatnonzero(ends_run)
+    if not len(run_starts):
+        return []
+
+    # An event lasts until the next sample recovers, unless the recording stops first
+    has_recovery = run_ends + 1 < len(timestamps)
+    recovery = np.minimum(run_ends + 1, len(timestamps) - 1)
+    recovered_in_time = has_recovery & ~np.concatenate((gap, [True]))[run_ends]
+    end_timestamps = np.where(recovered_in_time, timestamps[recovery], timestamps[run_ends])
+
+    long_enough = end_timestamps - timestamps[run_starts] >= SPO2_CONFIG['MIN_EVENT_SECONDS'] * 1000
+    # Minimum over each run alone: reduce over (start, end + 1) pairs and keep
+    # every other result, with a sentinel so end + 1 is a valid index
+    bounds = np.column_stack((run_starts, run_ends + 1)).ravel()
+    nadirs = np.minimum.reduceat(np.append(spo2_values, 0), bounds)[::2]
+
+    return [
+        {
+            'start_timestamp': int(timestamps[start]),
+            'end_timestamp': int(end),
+            'baseline': round(float(baseline[start]), 1),
+            'nadir': int(nadir),
+        }
+        for start, end, nadir in zip(run_starts[long_enough], end_timestamps[long_enough], nadirs[long_enough])
+    ]
+
+
+def index_o2ring_file(cur, file_id: int, timestamps, spo2_values) -> int:
+    """
+    Detect and store the desaturation events of a loaded O2Ring file.
+
+    Runs on the caller's cursor so the events are committed with the file.
+
+    Returns:
+        Number of events stored
+    """
+    cur.execute("DELETE FROM spo2_events WHERE file_id = ?", (file_id,))
+
+    stored = 0
+    for drop in DESATURATION_DROPS:
+        events = detect_desaturation_events(timestamps, spo2_values, drop)
+        cur.executemany("""
+            INSERT INTO spo2_events (file_id, drop_percent, start_timestamp, end_timestamp, baseline, nadir)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, [(file_id, drop, e['start_timestamp'], e['end_timestamp'], e['baseline'], e['nadir']) for e in events])
+        stored += len(events)
+
+    return stored
+
+
+def _recording_seconds(timestamps: np.ndarray) -> float:
+    """Recorded time: the sum of sample intervals, leaving out recording gaps."""
+    intervals = np.diff(timestamps) / 1000
+    return float(intervals[intervals <= SPO2_CONFIG['MAX_SAMPLE_GAP_SECONDS']].sum())
+
+
+def refresh_spo2_summaries(cur, dates: List[str]):
+    """
+    Recompute the spo2_daily_summary rows of the given nights from o2ring_data and spo2_events.
+
+    Nights without any O2Ring data lose their summary row. Runs on the caller's cursor.
+    """
+    for date in dates:
+        start_timestamp, end_timestamp = london_day_bounds(date)
+        cur.execute("""
+            SELECT timestamp, spo2_value, spo2_reminder
+            FROM o2ring_data
+            WHERE timestamp >= ? AND timestamp <= ?
+            ORDER BY timestamp
+        """, (start_timestamp, end_timestamp))
+        day_points = [[row[0], row[1], row[2]] for row in cur.fetchall()]
+
+        if not day_points:
+            cur.execute("DELETE FROM spo2_daily_summary WHERE date = ?", (date,))
+            continue
+
+        distribution = calculate_spo2_distribution(day_points)
+        timestamps = np.fromiter(map(itemgetter(0), day_points), dtype=np.int64, count=len(day_points))
+        recording_hours = _recording_seconds(timestamps) / 3600
+
+        cur.execute("""
+            SELECT drop_percent, COUNT(*) AS events
+            FROM spo2_events
+            WHERE start_timestamp >= ? AND start_timestamp < ?
+            GROUP BY drop_percent
+        """, (start_timestamp, end_timestamp))
+        event_counts = {row[0]: row[1] for row in cur.fetchall()}
+
+        def odi(drop):
+            return round(event_counts.get(drop, 0) / recording_hours, 1) if recording_hours > 0 else None
+
+        cur.execute("""
+            INSERT INTO spo2_daily_summary
+            (date, recording_seconds, nadir, t90_seconds, events_3, odi_3, events_4, odi_4, spo2_distribution, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT (date) DO UPDATE SET
+                recording_seconds = excluded.recording_seconds, nadir = excluded.nadir,
+                t90_seconds = excluded.t90_seconds, events_3 = excluded.events_3, odi_3 = excluded.odi_3,
+                events_4 = excluded.events_4, odi_4 = excluded.odi_4,
+                spo2_distribution = excluded.spo2_distribution, updated_at = excluded.updated_at
+        """, (
+            date,
+            round(recording_hours * 3600, 1),
+            min(point[1] for point in day_points),
+            distribution['oxygen_debt']['time_under_90'],
+            event_counts.get(3, 0), odi(3),
+            event_counts.get(4, 0), odi(4),
+            json.dumps(distribution),
+        ))
+
+
+def get_spo2_summaries(dates: List[str]) -> Dict[str, Dict]:
+    """
+    Get the precomputed summaries of many nights in one query.
+
+    Returns:
+        Dict of date -> summary (with the SpO2 distribution decoded), for nights that have one
+    """
+    dates = list(dict.fromkeys(dates))
+    if not dates:
+        return {}
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT date, recording_seconds, nadir, t90_seconds, events_3, odi_3, events_4, odi_4, spo2_distribution
+            FROM spo2_daily_summary
+            WHERE date IN ({', '.join('?' * len(dates))})
+        """, dates)
+        summaries = {}
+        for row in cur.fetchall():
+            summary = dict(row)
+            summary['spo2_distribution'] = json.loads(summary['spo2_distribution'])
+            summaries[row['date']] = summary
+        cur.close()
+
+    return summaries
+
+
+def get_spo2_events(start_timestamp: int, end_timestamp: int, drop: int) -> List[Dict]:
+    """Get the stored desaturation events starting in a time range."""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT start_timestamp, end_timestamp, baseline, nadir
+            FROM spo2_events
+            WHERE drop_percent = ? AND start_timestamp >= ? AND start_timestamp < ?
+            ORDER BY start_timestamp
+        """, (drop, start_timestamp, end_timestamp))
+        events = [dict(row) for row in cur.fetchall()]
+        cur.close()
+
+    return events
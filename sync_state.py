@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Incremental Garmin sync state for Garmin Heart Rate Analyzer
+
+The sync_state table records, for every collected day and activity, when it was
+last fetched from Garmin and a fingerprint of what Garmin returned. Collection
+jobs compare fresh responses against it and only rewrite the days and
+activities whose content changed, so the cached calculations of everything
+else survive a re-sync.
+
+A day is settled once it has been fetched SYNC_SETTLE_DAYS after the fact:
+Garmin has received everything the watch recorded by then, so range jobs skip
+settled days instead of fetching them again.
+"""
+
+import logging
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from config import API_CONFIG
+from database import calculate_data_hash, db_connection
+
+logger = logging.getLogger(__name__)
+
+SYNC_KIND_DAY = 'day'
+SYNC_KIND_ACTIVITY = 'activity'
+
+# Activity summary fields stored in activity_data. Both the per-day listing and
+# the activity search return them, so either fingerprints an activity the same way.
+ACTIVITY_FINGERPRINT_FIELDS = (
+    'activityName', 'startTimeLocal', 'duration', 'distance',
+    'elevationGain', 'averageHR', 'maxHR',
+)
+
+
+def day_fingerprint(heart_rate_values) -> str:
+    """Fingerprint a day's heart rate values as returned by Garmin (None if the day has no data)."""
+    return calculate_data_hash(heart_rate_values)
+
+
+def activity_fingerprint(activity: Dict) -> str:
+    """Fingerprint the parts of an activity summary that end up in activity_data."""
+    activity_type = activity.get('activityType')
+    if isinstance(activity_type, dict):
+        activity_type = activity_type.get('typeKey')
+    summary = {field: activity.get(field) for field in ACTIVITY_FINGERPRINT_FIELDS}
+    summary['activityType'] = activity_type
+    return calculate_data_hash(summary)
+
+
+def get_sync_states(kind: str, entity_ids: Iterable[str]) -> Dict[str, Dict]:
+    """
+    Get the sync state of many days or activities in one query.
+
+    Args:
+        kind: SYNC_KIND_DAY or SYNC_KIND_ACTIVITY
+        entity_ids: Dates (YYYY-MM-DD) or activity IDs
+
+    Returns:
+        Dict of entity_id -> {'fingerprint', 'fetched_at'}, for entities that have been synced
+    """
+    entity_ids = list(dict.fromkeys(entity_ids))
+    if not entity_ids:
+        return {}
+
+    placeholders = ', '.join('?' * len(entity_ids))
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT entity_id, fingerprint, fetched_at
+            FROM sync_state
+            WHERE kind = ? AND entity_id IN ({placeholders})
+        """, (kind, *entity_ids))
+        states = {
+            row['entity_id']: {'fingerprint': row['fingerprint'], 'fetched_at': row['fetched_at']}
+            for row in cur.fetchall()
+        }
+        cur.close()
+
+    return states
+
+
+def save_sync_states(cur, kind: str, fingerprints: Dict[str, str]):
+    """
+    Record that days or activities were fetched now with the given fingerprints.
+
+    Runs on the caller's cursor so the state is committed with the data it describes.
+    """
+    cur.executemany("""
+        INSERT INTO sync_state (kind, entity_id, fingerprint, fetched_at)
+        VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT (kind, entity_id) DO UPDATE
+        SET fingerprint = excluded.fingerprint, fetched_at = excluded.fetched_at
+    """, [(kind, entity_id, fingerprint) for entity_id, fingerprint in fingerprints.items()])
+
+
+def delete_sync_states(cur, kind: str, entity_ids: Iterable[str]):
+    """Forget the sync state of days or activities whose data was removed."""
+    cur.executemany("DELETE FROM sync_state WHERE kind = ? AND entity_id = ?",
+                    [(kind, entity_id) for entity_id in entity_ids])
+
+
+def is_settled(day: str, fetched_at: Optional[str]) -> bool:
+    """
+    Check whether a day was last fetched long enough after it to be final.
+
+    Args:
+        day: Date (YYYY-MM-DD)
+        fetched_at: sync_state.fetched_at (UTC, 'YYYY-MM-DD HH:MM:SS'), or None if never fetched
+    """
+    if not fetched_at:
+        return False
+    settled_from = date.fromisoformat(day) + timedelta(days=API_CONFIG['SYNC_SETTLE_DAYS'])
+    return datetime.strptime(fetched_at[:10], '%Y-%m-%d').date() >= settled_from
+
+
+def days_to_sync(days: List[str]) -> List[str]:
+    """Return the days of a range that are not settled yet, in order."""
+    states = get_sync_states(SYNC_KIND_DAY, days)
+    return [day for day in days if not is_settled(day, states.get(day, {}).get('fetched_at'))]
+
+
+def sync_start_date(today: date) -> date:
+    """
+    First day an incremental sync up to today has to fetch.
+
+    That is the day after the watermark (the latest settled day), or the earliest
+    day that was fetched too soon to be settled if that comes first. The range is
+    limited to API_CONFIG['MAX_DATE_RANGE_DAYS'], which is also where the first
+    sync starts.
+    """
+    earliest = today - timedelta(days=API_CONFIG['MAX_DATE_RANGE_DAYS'])
+    settle_offset = f"+{API_CONFIG['SYNC_SETTLE_DAYS']} days"
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT
+                MAX(CASE WHEN date(fetched_at) >= date(entity_id, ?) THEN entity_id END) AS watermark,
+                MIN(CASE WHEN date(fetched_at) < date(entity_id, ?) THEN entity_id END) AS unsettled
+            FROM sync_state
+            WHERE kind = ?
+        """, (settle_offset, settle_offset, SYNC_KIND_DAY))
+        row = cur.fetchone()
+        cur.close()
+
+    candidates = []
+    if row['watermark']:
+        candidates.append(date.fromisoformat(row['watermark']) + timedelta(days=1))
+    if row['unsettled']:
+        candidates.append(date.fromisoformat(row['unsettled']))
+    if not candidates:
+        return earliest
+    return min(max(min(candidates), earliest), today)
+
+
+def plan_activity_sync(cur, activities_by_day: Dict[str, List[Dict]]) -> Tuple[Set[str], Dict[str, List[str]], Dict[str, str]]:
+    """
+    Compare freshly listed activities against what is stored for their days.
+
+    Args:
+        cur: Database cursor
+        activities_by_day: Dict of date -> activity summaries listed by Garmin for that day
+
+    Returns:
+        Tuple of (changed, removed, fingerprints): the IDs of new or changed
+        activities (including ones whose data could not be stored last time),
+        date -> IDs of stored activities Garmin no longer lists, and the
+        fingerprint of every listed activity
+    """
+    fingerprints = {
+        str(activity['activityId']): activity_fingerprint(activity)
+        for activities in activities_by_day.values()
+        for activity in activities
+    }
+
+    days = list(activities_by_day)
+    stored = {}
+    if days:
+        cur.execute(f"SELECT activity_id, date FROM activity_data WHERE date IN ({', '.join('?' * len(days))})", days)
+        stored = {row['activity_id']: row['date'] for row in cur.fetchall()}
+
+    states = get_sync_states(SYNC_KIND_ACTIVITY, fingerprints)
+    changed = {
+        activity_id for activity_id, fingerprint in fingerprints.items()
+        if activity_id not in stored or states.get(activity_id, {}).get('fingerprint') != fingerprint
+    }
+
+    removed = {day: [] for day in days}
+    for activity_id, day in stored.items():
+        if activity_id not in fingerprints:
+            removed[day].append(activity_id)
+
+    return changed, removed, fingerprints
@@ -0,0 +1,124 @@
+import threading
+import time
+
+import pytest
+
+from garminconnect import Garmin
+
+
+class FakeGarth:
+    """Serves a list of activities page by page."""
+
+    def __init__(self, count, delay=0.0, max_page_size=None):
+        self.activities = [{"activityId": n} for n in range(count)]
+        self.delay = delay
+        self.max_page_size = max_page_size
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def connectapi(self, path, params=None, **kwargs):
+        with self.lock:
+            self.requests.append(params)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.delay)
+        with self.lock:
+            self.in_flight -= 1
+        start, limit = int(params["start"]), int(params["limit"])
+        if self.max_page_size:
+            limit = min(limit, self.max_page_size)
+        return self.activities[start : start + limit]
+
+
+def make_api(count, delay=0.0, max_page_size=None):
+    api = Garmin("user@example.com", "secret")
+    api.garth = FakeGarth(count, delay, max_page_size)
+    return api
+
+
+def test_get_activities_by_date_collects_all_pages():
+    api = make_api(45)
+    activities = api.get_activities_by_date("2024-01-01", "2024-12-31")
+
+    assert activities == api.garth.activities
+    # A short page may not be the last one: only an empty page ends the listing
+    assert [r["start"] for r in api.garth.requests] == ["0", "20", "40", "45"]
+    assert api.garth.requests[0]["startDate"] == "2024-01-01"
+    assert api.garth.requests[0]["endDate"] == "2024-12-31"
+    assert api.garth.requests[0]["limit"] == "20"
+
+
+def test_full_last_page_needs_an_empty_page():
+    api = make_api(40)
+    assert len(api.get_activities_by_date("2024-01-01")) == 40
+    assert len(api.garth.requests) == 3
+
+
+def test_iterator_is_lazy():
+    api = make_api(100)
+    activities = api.iter_activities_by_date("2024-01-01", page_size=10)
+
+    assert [next(activities) for _ in range(15)] == api.garth.activities[:15]
+    assert len(api.garth.requests) == 2
+
+
+@pytest.mark.parametrize("count", [0, 7, 50, 257])
+def test_prefetch_yields_activities_in_order(count):
+    api = make_api(count, delay=0.01)
+    activities = list(
+        api.iter_activities_by_date("2024-01-01", page_size=10, prefetch=3)
+    )
+
+    assert activities == api.garth.activities
+    starts = sorted(int(r["start"]) for r in api.garth.requests)
+    assert count in starts
+
+
+def test_prefetch_requests_pages_concurrently():
+    api = make_api(200, delay=0.05)
+    started = time.monotonic()
+    activities = list(
+        api.iter_activities_by_date("2024-01-01", page_size=10, prefetch=4)
+    )
+
+    assert len(activities) == 200
+    assert api.garth.max_in_flight == 4
+    # 21 pages at 50 ms each would take over a second one at a time
+    assert time.monotonic() - started < 0.8
+
+
+def test_closing_the_iterator_stops_prefetching():
+    api = make_api(10_000, delay=0.01)
+    activities = api.iter_activities_by_date(
+        "2024-01-01", page_size=10, prefetch=2
+    )
+    next(activities)
+    activities.close()
+    time.sleep(0.05)
+    assert len(api.garth.requests) <= 4
+
+
+def test_page_size_is_capped():
+    api = make_api(5)
+    list(api.iter_activities_by_date("2024-01-01", page_size=5000))
+    assert api.garth.requests[0]["limit"] == str(
+        Garmin.ACTIVITIES_MAX_PAGE_SIZE
+    )
+
+    with pytest.raises(ValueError):
+        list(api.iter_activities_by_date("2024-01-01", page_size=0))
+
+
+@pytest.mark.parametrize("prefetch", [0, 3])
+def test_server_page_cap_below_page_size(prefetch):
+    api = make_api(257, delay=0.005, max_page_size=25)
+    activities = list(
+        api.iter_activities_by_date(
+            "2024-01-01", page_size=100, prefetch=prefetch
+        )
+    )
+
+    assert activities == api.garth.activities
+    assert api.garth.requests[-1]["start"] == "257"
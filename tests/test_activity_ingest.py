@@ -0,0 +1,119 @@
+import os
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import jobs
+from database import decode_series, init_database
+
+FIT_FILE = os.path.join(os.path.dirname(__file__), '12129115726_ACTIVITY.fit')
+DATE = '2023-09-29'
+
+
+class FakeGarmin:
+    """Stand-in for the Garmin client serving one activity."""
+
+    def __init__(self, fit_data=None, details=None):
+        self.fit_data = fit_data
+        self.details = details
+        self.calls = []
+
+    def get_activities_fordate(self, target_date):
+        return [{'activityId': 12129115726, 'activityName': 'Walk', 'startTimeLocal': f"{DATE} 01:10:57", 'duration': 10}]
+
+    def download_activity(self, activity_id, dl_fmt=None):
+        self.calls.append('download_activity')
+        if self.fit_data is None:
+            raise Exception("404 Client Error: Not Found")
+        return self.fit_data
+
+    def get_activity_details(self, activity_id):
+        self.calls.append('get_activity_details')
+        return self.details
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    init_database()
+    conn = sqlite3.connect('garmin_hr.db')
+    conn.row_factory = sqlite3.Row
+    conn.execute("CREATE TABLE hr_parameters (id INTEGER PRIMARY KEY, resting_hr INTEGER, max_hr INTEGER)")
+    conn.execute("INSERT INTO hr_parameters (resting_hr, max_hr) VALUES (48, 88)")
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def stored_hr_series(conn):
+    row = conn.execute("SELECT heart_rate_series FROM activity_data").fetchone()
+    return decode_series(row['heart_rate_series'])
+
+
+def test_hr_comes_from_fit_file(db):
+    with open(FIT_FILE, 'rb') as f:
+        api = FakeGarmin(fit_data=f.read())
+    jobs.collect_activities_for_date(api, DATE, db, db.cursor())
+
+    assert api.calls == ['download_activity']
+    hr_series = stored_hr_series(db)
+    assert hr_series[0] == [1695946257000, 86]
+    # 89 bpm is above the max HR of 88 and is filtered out
+    assert len(hr_series) == 9
+    assert max(hr for _, hr in hr_series) == 88
+
+
+def test_falls_back_to_activity_details(db):
+    details = {
+        'metricDescriptors': [
+            {'metricsIndex': 0, 'key': 'directTimestamp', 'unit': {'key': 'gmt', 'factor': 1.0}},
+            {'metricsIndex': 1, 'key': 'directHeartRate', 'unit': {'key': 'bpm', 'factor': 1.0}},
+            {'metricsIndex': 2, 'key': 'directRespirationRate', 'unit': {'key': 'brpm', 'factor': 1.0}},
+        ],
+        'activityDetailMetrics': [{'metrics': [1695946257000 + i * 5000, 80.0 + i, 20.5]} for i in range(12)],
+    }
+    api = FakeGarmin(details=details)
+    jobs.collect_activities_for_date(api, DATE, db, db.cursor())
+
+    assert api.calls == ['download_activity', 'get_activity_details']
+    hr_series = stored_hr_series(db)
+    assert hr_series == [[1695946257000 + i * 5000, 80 + i] for i in range(9)]
+    row = db.execute("SELECT breathing_rate_series FROM activity_data").fetchone()
+    assert len(decode_series(row['breathing_rate_series'])) == 12
+
+
+class SlowGarmin(FakeGarmin):
+    """Serves several activities, each download taking a while."""
+
+    def __init__(self, fit_data, count):
+        super().__init__(fit_data=fit_data)
+        self.count = count
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def get_activities_fordate(self, target_date):
+        return [{'activityId': 12129115726 + n, 'activityName': 'Walk', 'startTimeLocal': f"{DATE} 01:10:57",
+                 'duration': 10} for n in range(self.count)]
+
+    def download_activity(self, activity_id, dl_fmt=None):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(0.05)
+        with self.lock:
+            self.in_flight -= 1
+        return super().download_activity(activity_id, dl_fmt)
+
+
+def test_activities_are_fetched_concurrently(db):
+    with open(FIT_FILE, 'rb') as f:
+        api = SlowGarmin(f.read(), count=4)
+    stored_ids = jobs.collect_activities_for_date(api, DATE, db, db.cursor())
+
+    assert api.max_in_flight > 1
+    assert sorted(stored_ids) == [str(12129115726 + n) for n in range(4)]
+    rows = db.execute("SELECT heart_rate_series FROM activity_data").fetchall()
+    assert [len(decode_series(row['heart_rate_series'])) for row in rows] == [9] * 4
@@ -0,0 +1,158 @@
+import asyncio
+import time
+
+import pytest
+
+aiohttp = pytest.importorskip("aiohttp")
+from aiohttp import web  # noqa: E402
+from garth.auth_tokens import OAuth2Token  # noqa: E402
+
+from garminconnect import (  # noqa: E402
+    AsyncGarmin,
+    Garmin,
+    GarminConnectTooManyRequestsError,
+)
+
+
+def oauth2_token(access_token="access", expires_in=3600):
+    now = int(time.time())
+    return OAuth2Token(
+        scope="",
+        jti="",
+        token_type="bearer",
+        access_token=access_token,
+        refresh_token="refresh",
+        expires_in=expires_in,
+        expires_at=now + expires_in,
+        refresh_token_expires_in=86400,
+        refresh_token_expires_at=now + 86400,
+    )
+
+
+@pytest.fixture
+def api():
+    api = Garmin("user@example.com", "secret")
+    api.display_name = "runner"
+    api.garth.oauth2_token = oauth2_token()
+    return api
+
+
+class StandIn:
+    """Local aiohttp server answering the daily heart rate endpoint."""
+
+    def __init__(self, busy_dates=()):
+        self.busy_dates = set(busy_dates)
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def heart_rates(self, request):
+        self.requests.append(request)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.02)
+        finally:
+            self.in_flight -= 1
+        cdate = request.query["date"]
+        if cdate in self.busy_dates:
+            return web.Response(status=429)
+        return web.json_response({"calendarDate": cdate})
+
+    async def run(self, test):
+        app = web.Application()
+        app.router.add_get(
+            "/wellness-service/wellness/dailyHeartRate/{name}",
+            self.heart_rates,
+        )
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        try:
+            return await test(f"http://127.0.0.1:{port}")
+        finally:
+            await runner.cleanup()
+
+
+def test_gather_range_bounded_and_ordered(api):
+    server = StandIn()
+
+    async def test(base_url):
+        async with AsyncGarmin(api, base_url=base_url) as client:
+            return await client.gather_range(
+                "get_heart_rates", "2024-02-26", "2024-03-06", concurrency=3
+            )
+
+    results = asyncio.run(server.run(test))
+
+    assert list(results)[0] == "2024-02-26"
+    assert list(results)[-1] == "2024-03-06"
+    assert len(results) == 10
+    assert all(v == {"calendarDate": k} for k, v in results.items())
+    assert server.max_in_flight == 3
+    request = server.requests[0]
+    assert request.path.endswith("/dailyHeartRate/runner")
+    assert request.headers["Authorization"] == "Bearer access"
+    assert (
+        request.headers["User-Agent"] == api.garth.sess.headers["User-Agent"]
+    )
+
+
+def test_client_concurrency_limits_requests(api):
+    server = StandIn()
+
+    async def test(base_url):
+        async with AsyncGarmin(api, concurrency=2, base_url=base_url) as c:
+            return await c.gather_range(
+                c.get_heart_rates, "2024-01-01", "2024-01-08", concurrency=8
+            )
+
+    assert len(asyncio.run(server.run(test))) == 8
+    assert server.max_in_flight == 2
+
+
+def test_too_many_requests(api):
+    server = StandIn(busy_dates={"2024-01-02"})
+
+    async def test(base_url):
+        async with AsyncGarmin(api, base_url=base_url) as client:
+            results = await client.gather_range(
+                "get_heart_rates",
+                "2024-01-01",
+                "2024-01-03",
+                return_exceptions=True,
+            )
+            with pytest.raises(GarminConnectTooManyRequestsError):
+                await client.get_heart_rates("2024-01-02")
+            return results
+
+    results = asyncio.run(server.run(test))
+    assert results["2024-01-01"] == {"calendarDate": "2024-01-01"}
+    assert isinstance(results["2024-01-02"], GarminConnectTooManyRequestsError)
+    assert results["2024-01-03"] == {"calendarDate": "2024-01-03"}
+
+
+def test_expired_token_is_refreshed_once(api):
+    server = StandIn()
+    api.garth.oauth2_token = oauth2_token(expires_in=-10)
+    refreshes = []
+
+    def refresh_oauth2():
+        refreshes.append(1)
+        api.garth.oauth2_token = oauth2_token("fresh")
+
+    api.garth.refresh_oauth2 = refresh_oauth2
+
+    async def test(base_url):
+        async with AsyncGarmin(api, base_url=base_url) as client:
+            return await client.gather_range(
+                "get_heart_rates", "2024-01-01", "2024-01-05"
+            )
+
+    asyncio.run(server.run(test))
+    assert refreshes == [1]
+    assert {r.headers["Authorization"] for r in server.requests} == {
+        "Bearer fresh"
+    }
@@ -0,0 +1,110 @@
+import json
+import sqlite3
+
+import pytest
+
+from database import encode_series, get_daily_batch_data, init_database, save_user_data
+
+START_MS = 1_719_964_800_000  # 2024-07-03 00:00 UTC
+DATES = ['2024-07-03', '2024-07-04', '2024-07-05', '2024-07-06']
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """App test client on a fresh database with a mix of cached, uncached and override-only days."""
+    monkeypatch.chdir(tmp_path)
+    init_database()
+    from migrate_schema import migrate_database
+    migrate_database()
+
+    conn = sqlite3.connect('garmin_hr.db')
+    conn.execute("CREATE TABLE hr_parameters (id INTEGER PRIMARY KEY AUTOINCREMENT, resting_hr INTEGER, max_hr INTEGER, updated_at TIMESTAMP)")
+    conn.execute("INSERT INTO hr_parameters (resting_hr, max_hr) VALUES (48, 167)")
+    cached = {'presentation_buckets': {'80-89': 1.5}, 'total_trimp': 1.5}
+    conn.execute("INSERT INTO daily_data (date, heart_rate_series, daily_score, activity_type, cached_trimp_data, trimp_calculation_hash, cached_oxygen_debt_data) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                 ('2024-07-03', encode_series([[START_MS, 70]]), 1.0, 'mixed', json.dumps(cached), '48-167:fixture', json.dumps({'total_area': 3.0})))
+    day_ms = START_MS + 86_400_000
+    daily = [[day_ms + i * 120_000, 60 + i % 50] for i in range(720)]
+    activity = [[day_ms + 3_600_000 + i * 1000, 100 + i % 60] for i in range(1800)]
+    conn.execute("INSERT INTO daily_data (date, heart_rate_series, daily_score, activity_type) VALUES (?, ?, ?, ?)",
+                 ('2024-07-04', encode_series(daily), 2.0, 'running'))
+    conn.execute("INSERT INTO activity_data (activity_id, date, heart_rate_series, start_time_local) VALUES (?, ?, ?, ?)",
+                 ('a1', '2024-07-04', encode_series(activity), '2024-07-04T02:00:00'))
+    conn.executemany("INSERT INTO o2ring_data (file_id, timestamp, spo2_value, heart_rate, motion, spo2_reminder, pr_reminder) VALUES (1, ?, ?, 60, 0, 0, 0)",
+                     [(day_ms - 3_600_000 + i * 4000, 88 + i % 10) for i in range(2000)])
+    conn.commit()
+    conn.close()
+    save_user_data('daily_trimp_overrides', '2024-07-05', json.dumps({'80-89': '4', '90-99': ''}))
+
+    from app import app
+    app.testing = True
+    test_client = app.test_client()
+    with test_client.session_transaction() as session:
+        session['user_id'] = 1
+    return test_client
+
+
+def test_get_daily_batch_data_joins_cache_and_user_data(client):
+    batch_data = get_daily_batch_data(DATES, 'cached_trimp_data', 'daily_trimp_overrides')
+    assert list(batch_data) == DATES
+    assert batch_data['2024-07-03']['cached_data']['total_trimp'] == 1.5
+    assert batch_data['2024-07-04']['has_daily_data'] and batch_data['2024-07-04']['cached_data'] is None
+    assert not batch_data['2024-07-05']['has_daily_data']
+    assert json.loads(batch_data['2024-07-05']['user_data']) == {'80-89': '4', '90-99': ''}
+    assert batch_data['2024-07-06'] == {'has_daily_data': False, 'daily_score': None, 'activity_type': None,
+                                        'cached_data': None, 'user_data': None}
+    with pytest.raises(ValueError):
+        get_daily_batch_data(DATES, 'heart_rate_series')
+
+
+def test_build_daily_hr_timeseries_batch_matches_single_date(client):
+    from database import get_db_connection
+    from jobs import build_daily_hr_timeseries, build_daily_hr_timeseries_batch
+    conn = get_db_connection()
+    cur = conn.cursor()
+    batch = build_daily_hr_timeseries_batch(DATES, conn, cur)
+    for date in DATES:
+        assert batch[date] == build_daily_hr_timeseries(date, conn, cur)
+    conn.close()
+    assert len(batch['2024-07-04']) > 720
+
+
+def test_trimp_batch_serves_cache_recalculates_misses_and_applies_overrides(client):
+    from database import get_db_connection
+    from jobs import build_daily_hr_timeseries, calculate_trimp_from_timeseries
+    conn = get_db_connection()
+    expected_miss = calculate_trimp_from_timeseries(build_daily_hr_timeseries('2024-07-04', conn, conn.cursor()))
+    conn.close()
+
+    results = client.post('/api/data/batch/trimp', json={'dates': DATES}).get_json()['data']
+    assert results['2024-07-03']['total_trimp'] == 1.5
+    assert results['2024-07-04']['presentation_buckets'] == expected_miss['presentation_buckets']
+    assert results['2024-07-04']['total_trimp'] == expected_miss['total_trimp']
+    assert results['2024-07-05']['total_trimp'] == 4.0
+    assert results['2024-07-06'] is None
+
+    # The recalculated day is now cached
+    assert get_daily_batch_data(['2024-07-04'], 'cached_trimp_data')['2024-07-04']['cached_data'] is not None
+
+
+def test_oxygen_debt_batch_recalculates_misses_per_day(client):
+    from app import calculate_spo2_distribution, get_o2ring_data_for_dates, get_o2ring_data_for_period
+    results = client.post('/api/data/batch/oxygen-debt', json={'dates': DATES}).get_json()['data']
+    assert results['2024-07-03']['oxygen_debt'] == {'total_area': 3.0}
+    assert results['2024-07-05'] is None
+
+    day_ms = START_MS + 86_400_000 - 3_600_000  # London midnight during BST
+    day_points = get_o2ring_data_for_period(day_ms, day_ms + 86_400_000)
+    assert get_o2ring_data_for_dates(['2024-07-04'])['2024-07-04'] == day_points
+    expected = calculate_spo2_distribution([[row[0], row[1]] for row in day_points])['oxygen_debt']
+    assert results['2024-07-04']['oxygen_debt'] == json.loads(json.dumps(expected))
+
+
+def test_spo2_distribution_batch_recalculates_misses_per_day(client):
+    from app import calculate_spo2_distribution, get_o2ring_data_for_dates
+    results = client.post('/api/data/batch/spo2-distribution', json={'dates': DATES}).get_json()['data']
+    day_points = get_o2ring_data_for_dates(['2024-07-04'])['2024-07-04']
+    expected = calculate_spo2_distribution(day_points)
+    assert results['2024-07-04']['spo2_distribution'] == json.loads(json.dumps(expected))
+    assert results['2024-07-03']['spo2_distribution']['at_level'] == []
+    assert results['2024-07-06'] is None
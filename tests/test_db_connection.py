@@ -0,0 +1,83 @@
+import sqlite3
+
+import pytest
+
+import database
+from database import (
+    close_connection_scope,
+    connection_scope,
+    db_connection,
+    get_user_data,
+    init_database,
+    open_connection_scope,
+    save_user_data,
+)
+
+
+@pytest.fixture
+def opened_connections(tmp_path, monkeypatch):
+    """Run against a fresh database and record every connection opened."""
+    monkeypatch.chdir(tmp_path)
+    init_database()
+
+    opened = []
+    get_db_connection = database.get_db_connection
+
+    def counting_get_db_connection():
+        conn = get_db_connection()
+        opened.append(conn)
+        return conn
+
+    monkeypatch.setattr(database, 'get_db_connection', counting_get_db_connection)
+    return opened
+
+
+def is_closed(conn):
+    try:
+        conn.execute("SELECT 1")
+    except sqlite3.ProgrammingError:
+        return True
+    return False
+
+
+def test_helpers_open_a_connection_per_call_outside_a_scope(opened_connections):
+    save_user_data('activity_notes', '1', 'note')
+    assert get_user_data('activity_notes', '1') == 'note'
+    assert len(opened_connections) == 2
+    assert all(is_closed(conn) for conn in opened_connections)
+
+
+def test_helpers_share_one_connection_inside_a_scope(opened_connections):
+    with connection_scope():
+        save_user_data('activity_notes', '1', 'note')
+        for _ in range(5):
+            assert get_user_data('activity_notes', '1') == 'note'
+        assert len(opened_connections) == 1
+        assert not is_closed(opened_connections[0])
+    assert is_closed(opened_connections[0])
+
+
+def test_scope_opens_connection_lazily_and_nests(opened_connections):
+    open_connection_scope()
+    open_connection_scope()
+    assert opened_connections == []
+    get_user_data('activity_notes', '1')
+    close_connection_scope()
+    assert not is_closed(opened_connections[0])
+    close_connection_scope()
+    assert is_closed(opened_connections[0])
+    close_connection_scope()
+
+
+def test_failed_block_rolls_back_shared_connection(opened_connections):
+    with connection_scope():
+        with pytest.raises(RuntimeError):
+            with db_connection() as conn:
+                conn.execute("INSERT INTO user_data (data_type, target_id, data_content) VALUES ('activity_notes', '1', '\"x\"')")
+                raise RuntimeError("boom")
+        assert get_user_data('activity_notes', '1') is None
+
+
+def test_database_uses_wal(opened_connections):
+    with db_connection() as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
@@ -0,0 +1,125 @@
+import json
+import sqlite3
+
+import pytest
+
+import job_queue
+from database import encode_series, init_database
+from derived_data import data_changed, recompute_derived_job, stale_caches
+from job_queue import JobExecutor
+
+START_MS = 1_719_964_800_000  # 2024-07-03 00:00 UTC
+DATES = ['2024-07-03', '2024-07-04', '2024-07-05']
+CACHED = json.dumps({'presentation_buckets': {}, 'total_trimp': 0.0})
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """Three days and two activities with every derived cache filled."""
+    monkeypatch.chdir(tmp_path)
+    init_database()
+    from migrate_schema import migrate_database
+    migrate_database()
+
+    conn = sqlite3.connect('garmin_hr.db')
+    conn.row_factory = sqlite3.Row
+    conn.execute("CREATE TABLE hr_parameters (id INTEGER PRIMARY KEY, resting_hr INTEGER, max_hr INTEGER, updated_at TIMESTAMP)")
+    conn.execute("INSERT INTO hr_parameters (resting_hr, max_hr) VALUES (50, 180)")
+    for index, date in enumerate(DATES):
+        day_ms = START_MS + index * 86_400_000
+        series = encode_series([[day_ms + i * 120_000, 60 + i % 80] for i in range(720)])
+        conn.execute("""
+            INSERT INTO daily_data (date, heart_rate_series, cached_trimp_data, trimp_calculation_hash,
+                                    cached_oxygen_debt_data, cached_spo2_distribution_data)
+            VALUES (?, ?, ?, 'h', '{}', '{}')
+        """, (date, series, CACHED))
+    for activity_id, date, offset in (('a1', '2024-07-03', 0), ('a2', '2024-07-04', 1)):
+        activity_ms = START_MS + offset * 86_400_000 + 3_600_000
+        conn.execute("""
+            INSERT INTO activity_data (activity_id, date, heart_rate_series, start_time_local,
+                                       cached_trimp_data, trimp_calculation_hash, cached_oxygen_debt_data)
+            VALUES (?, ?, ?, ?, ?, 'h', '{}')
+        """, (activity_id, date, encode_series([[activity_ms + i * 1000, 120 + i % 50] for i in range(600)]),
+              f"{date}T01:00:00", CACHED))
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def cached(db, table, column='cached_trimp_data'):
+    key = 'date' if table == 'daily_data' else 'activity_id'
+    return {row[0] for row in db.execute(f"SELECT {key} FROM {table} WHERE {column} IS NOT NULL")}
+
+
+def recompute_jobs(db):
+    return [dict(row) for row in db.execute(
+        "SELECT job_id, start_date, end_date, status, result FROM background_jobs WHERE job_type = 'recompute_derived'")]
+
+
+def test_stale_caches_follow_the_graph():
+    assert stale_caches('activity_hr') == ['activity_trimp', 'daily_trimp']
+    assert stale_caches('trimp_overrides') == ['daily_trimp']
+    assert stale_caches('o2ring') == ['activity_oxygen_debt', 'activity_spo2_distribution',
+                                      'daily_oxygen_debt', 'daily_spo2_distribution']
+    with pytest.raises(ValueError):
+        stale_caches('weather')
+
+
+def test_activity_change_clears_the_activity_and_its_day(db):
+    cleared = data_changed('activity_hr', activity_ids=['a1'])
+
+    assert cleared == {'activity_trimp': 1, 'daily_trimp': 1}
+    assert cached(db, 'activity_data') == {'a2'}
+    assert cached(db, 'daily_data') == {'2024-07-04', '2024-07-05'}
+    # Other calculations of the day are unaffected
+    assert cached(db, 'daily_data', 'cached_oxygen_debt_data') == set(DATES)
+    assert [(job['start_date'], job['end_date']) for job in recompute_jobs(db)] == [('2024-07-03', '2024-07-03')]
+
+    # Further edits widen the pending job instead of queueing another
+    data_changed('trimp_overrides', dates=['2024-07-05'])
+    assert cached(db, 'daily_data') == {'2024-07-04'}
+    assert [(job['start_date'], job['end_date']) for job in recompute_jobs(db)] == [('2024-07-03', '2024-07-05')]
+
+
+def test_o2ring_change_is_not_recomputed_in_the_background(db):
+    data_changed('o2ring', dates=['2024-07-04'])
+    assert cached(db, 'daily_data', 'cached_oxygen_debt_data') == {'2024-07-03', '2024-07-05'}
+    assert cached(db, 'daily_data', 'cached_spo2_distribution_data') == {'2024-07-03', '2024-07-05'}
+    assert cached(db, 'activity_data', 'cached_oxygen_debt_data') == {'a1'}
+    assert cached(db, 'daily_data') == set(DATES)
+    assert recompute_jobs(db) == []
+
+
+def test_hr_parameter_change_recomputes_every_trimp(db, monkeypatch):
+    db.execute("UPDATE hr_parameters SET resting_hr = 60, max_hr = 170")
+    db.commit()
+    data_changed('hr_parameters', everything=True)
+    assert cached(db, 'activity_data') == set()
+    assert cached(db, 'daily_data') == set()
+    job = recompute_jobs(db)[0]
+    assert (job['start_date'], job['end_date']) == (None, None)
+
+    # The job executor runs it without logging in to Garmin
+    monkeypatch.setattr(job_queue, 'create_garmin_client', lambda: pytest.fail("recompute needs no Garmin client"))
+    executor = JobExecutor(max_workers=1)
+    executor.run_job(*executor.claim_next_job())
+
+    job = recompute_jobs(db)[0]
+    assert job['status'] == 'completed'
+    result = json.loads(job['result'])
+    assert result['hr_parameters'] == [60, 170]
+    assert (result['activities_recalculated'], result['days_recalculated']) == (2, 3)
+    assert cached(db, 'activity_data') == {'a1', 'a2'}
+    assert cached(db, 'daily_data') == set(DATES)
+    totals = [row[0] for row in db.execute("SELECT total_trimp FROM daily_data ORDER BY date")]
+    assert all(total > 0 for total in totals)
+    assert db.execute("SELECT total_trimp FROM activity_data WHERE activity_id = 'a1'").fetchone()[0] > 0
+
+
+def test_recompute_leaves_filled_caches_alone(db):
+    data_changed('trimp_overrides', dates=['2024-07-04'])
+    job_id = recompute_jobs(db)[0]['job_id']
+    recompute_derived_job('2024-07-04', '2024-07-04', job_id)
+    result = json.loads(recompute_jobs(db)[0]['result'])
+    assert (result['activities_recalculated'], result['days_recalculated']) == (0, 1)
+    assert db.execute("SELECT cached_trimp_data FROM daily_data WHERE date = '2024-07-03'").fetchone()[0] == CACHED
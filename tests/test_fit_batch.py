@@ -0,0 +1,108 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from garminconnect import Garmin
+from garminconnect.fit import FitDecoder
+
+
+class FakeGarth:
+    """Records uploads instead of sending them."""
+
+    def __init__(self):
+        self.uploads = []
+
+    def post(self, subdomain, url, files=None, api=False, **kwargs):
+        self.uploads.append((url, files["file"]))
+        return {"uploaded": len(self.uploads)}
+
+
+@pytest.fixture
+def api():
+    api = Garmin("user@example.com", "secret")
+    api.garth = FakeGarth()
+    return api
+
+
+def weigh_ins(count):
+    start = datetime(2023, 1, 1, 7, 30)
+    return [
+        {
+            "timestamp": (start + timedelta(days=day)).isoformat(),
+            "weight": 80 - day / 100,
+            "percent_fat": 22.5,
+        }
+        for day in range(count)
+    ]
+
+
+def decoded(upload, msg_num):
+    return [
+        fields
+        for num, fields in FitDecoder(upload[1][1]).messages()
+        if num == msg_num
+    ]
+
+
+def test_body_composition_batch_in_one_file(api):
+    responses = api.add_body_composition_batch(weigh_ins(100))
+
+    assert responses == [{"uploaded": 1}]
+    url, (filename, data) = api.garth.uploads[0]
+    assert url == api.garmin_connect_upload
+    assert filename == "body_composition.fit"
+    weights = decoded(api.garth.uploads[0], 30)
+    assert len(weights) == 100
+    assert weights[0][0] == 8000
+    assert weights[-1][0] == 7901
+    assert all(w[1] == 2250 for w in weights)
+
+
+def test_body_composition_batch_is_split_by_size(api):
+    records = weigh_ins(500)
+    responses = api.add_body_composition_batch(records, max_file_bytes=4096)
+
+    assert len(responses) > 1
+    sizes = [len(data) for _, (_, data) in api.garth.uploads]
+    assert max(sizes) <= 4096
+    counts = [len(decoded(upload, 30)) for upload in api.garth.uploads]
+    assert sum(counts) == 500
+    # files are filled up before a new one is started
+    assert min(sizes[:-1]) > 4096 - 100
+
+
+def test_single_measurement_matches_batch(api):
+    record = weigh_ins(1)[0]
+    api.add_body_composition(**record)
+    api.add_body_composition_batch([record])
+
+    single, batch = api.garth.uploads
+    assert decoded(single, 30) == decoded(batch, 30)
+
+
+def test_blood_pressure_batch(api):
+    start = datetime(2023, 1, 1, 8, 0)
+    records = [
+        {
+            "timestamp": (start + timedelta(hours=hour)).isoformat(),
+            "systolic": 120 + hour % 10,
+            "diastolic": 80,
+            "pulse": 60,
+        }
+        for hour in range(300)
+    ]
+    responses = api.add_blood_pressure_batch(records, max_file_bytes=2048)
+
+    assert len(responses) > 1
+    readings = [
+        fields
+        for upload in api.garth.uploads
+        for fields in decoded(upload, 51)
+    ]
+    assert [r[0] for r in readings] == [r["systolic"] for r in records]
+    assert all(r[1] == 80 and r[6] == 60 for r in readings)
+
+
+def test_empty_batch_uploads_nothing(api):
+    assert api.add_body_composition_batch([]) == []
+    assert api.garth.uploads == []
@@ -0,0 +1,125 @@
+import io
+import os
+import zipfile
+from datetime import datetime
+from struct import pack
+
+import pytest
+
+from garminconnect.fit import FitDecoder, FitEncoderWeight
+
+FIT_FILE = os.path.join(os.path.dirname(__file__), "12129115726_ACTIVITY.fit")
+
+
+def read_fit_file():
+    with open(FIT_FILE, "rb") as f:
+        return f.read()
+
+
+def build_fit(*records):
+    """Wrap raw record bytes in a FIT header and a (dummy) CRC."""
+    body = b"".join(records)
+    return pack("<BBHI4s", 12, 16, 108, len(body), b".FIT") + body + b"\0\0"
+
+
+def record_definition(local_type, fields, big_endian=False):
+    """Definition message for record messages (global 20)."""
+    endian = ">" if big_endian else "<"
+    header = pack("B", 0x40 | local_type)
+    fixed = pack("BB", 0, int(big_endian)) + pack(endian + "H", 20)
+    field_defs = b"".join(pack("BBB", *field) for field in fields)
+    return header + fixed + pack("B", len(fields)) + field_defs
+
+
+def test_decodes_activity_file():
+    decoder = FitDecoder(read_fit_file())
+    messages = list(decoder.messages())
+
+    file_id = messages[0]
+    assert file_id[0] == 0
+    assert file_id[1][0] == 4  # file type: activity
+
+    series = decoder.activity_series()
+    timestamps = [point[0] for point in series["heart_rate"]]
+    assert len(timestamps) == 10
+    assert timestamps[0] == 1695946257000
+    assert timestamps[-1] == 1695946267000
+    assert timestamps == sorted(set(timestamps))
+    assert [point[1] for point in series["heart_rate"]][:3] == [86, 85, 86]
+    assert len(list(decoder.records())) == 10
+
+
+def test_decodes_zipped_download():
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("12129115726_ACTIVITY.fit", read_fit_file())
+
+    zipped = FitDecoder(archive.getvalue()).activity_series()
+    assert zipped == FitDecoder(read_fit_file()).activity_series()
+
+
+def test_decodes_encoder_output():
+    encoder = FitEncoderWeight()
+    encoder.write_file_info()
+    encoder.write_file_creator()
+    encoder.write_weight_scale(datetime(2024, 7, 3, 8, 0), weight=71.5)
+    encoder.finish()
+
+    weights = [
+        fields
+        for msg, fields in FitDecoder(encoder.getvalue()).messages()
+        if msg == 30
+    ]
+    assert len(weights) == 1
+    assert weights[0][0] == 7150
+    assert weights[0][1] is None  # percent_fat left invalid
+
+
+@pytest.mark.parametrize("big_endian", [False, True])
+def test_compressed_timestamps_and_invalid_values(big_endian):
+    endian = ">" if big_endian else "<"
+    data = build_fit(
+        # timestamp (uint32), heart_rate (uint8), enhanced respiration (uint16)
+        record_definition(
+            0, [(253, 4, 0x86), (3, 1, 0x02), (108, 2, 0x84)], big_endian
+        ),
+        pack("B", 0) + pack(endian + "IBH", 1_000_000_030, 120, 1525),
+        # compressed header for local type 1, which has no timestamp field
+        record_definition(1, [(3, 1, 0x02)], big_endian),
+        pack("B", 0x80 | (1 << 5) | 31) + pack("B", 121),
+        pack("B", 0x80 | (1 << 5) | 2) + pack("B", 0xFF),
+        pack("B", 0) + pack(endian + "IBH", 1_000_000_040, 122, 0xFFFF),
+    )
+
+    records = list(FitDecoder(data).records())
+    assert [r[253] for r in records] == [
+        1_000_000_030,
+        1_000_000_031,
+        1_000_000_034,
+        1_000_000_040,
+    ]
+    assert [r[3] for r in records] == [120, 121, None, 122]
+
+    series = FitDecoder(data).activity_series()
+    assert series["respiration_rate"] == [
+        [(1_000_000_030 + FitDecoder.EPOCH_OFFSET) * 1000, 15.25]
+    ]
+    assert len(series["heart_rate"]) == 3
+
+
+def test_developer_fields_are_skipped():
+    definition = pack("B", 0x60) + pack("<BBHB", 0, 0, 20, 2)
+    definition += pack("BBB", 253, 4, 0x86) + pack("BBB", 3, 1, 0x02)
+    definition += pack("B", 1) + pack("BBB", 0, 3, 0)  # one 3 byte field
+    data = build_fit(
+        definition,
+        pack("B", 0) + pack("<IB", 500, 99) + b"abc",
+        pack("B", 0) + pack("<IB", 501, 98) + b"def",
+    )
+    records = list(FitDecoder(data).records())
+    assert [(r[253], r[3]) for r in records] == [(500, 99), (501, 98)]
+
+
+def test_rejects_non_fit_data():
+    with pytest.raises(ValueError):
+        list(FitDecoder(b"\x0e" + b"\0" * 20).messages())
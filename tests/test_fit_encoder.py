@@ -0,0 +1,79 @@
+import os
+import random
+from datetime import datetime, timedelta
+from struct import unpack
+
+import pytest
+
+from garminconnect.fit import (
+    FitEncoderBloodPressure,
+    FitEncoderWeight,
+    _calcCRC,
+    _crc_combine,
+    _crc_update,
+)
+
+
+def reference_crc(data):
+    """The original nibble-at-a-time CRC, one byte at a time."""
+    crc = 0
+    for byte in data:
+        crc = _calcCRC(crc, byte)
+    return crc
+
+
+def test_table_crc_matches_nibble_crc():
+    data = bytes(random.Random(1).randrange(256) for _ in range(5000))
+    assert _crc_update(0, data) == reference_crc(data)
+    fit_path = os.path.join(
+        os.path.dirname(__file__), "12129115726_ACTIVITY.fit"
+    )
+    with open(fit_path, "rb") as f:
+        fit_file = f.read()
+    # the file ends with its CRC, so the CRC of the whole file is zero
+    assert _crc_update(0, fit_file) == 0
+
+
+@pytest.mark.parametrize("split", [0, 1, 12, 255, 256, 4999, 5000])
+def test_crc_combine(split):
+    data = bytes(random.Random(split).randrange(256) for _ in range(5000))
+    first, second = data[:split], data[split:]
+    combined = _crc_combine(
+        _crc_update(0, first), _crc_update(0, second), len(second)
+    )
+    assert combined == reference_crc(data)
+
+
+@pytest.mark.parametrize("records", [0, 1, 50])
+def test_weight_file_crc(records):
+    encoder = FitEncoderWeight()
+    encoder.write_file_info()
+    encoder.write_file_creator()
+    start = datetime(2024, 7, 1, 7, 30)
+    for day in range(records):
+        encoder.write_device_info(start + timedelta(days=day))
+        encoder.write_weight_scale(
+            start + timedelta(days=day), weight=70 + day / 10, percent_fat=20
+        )
+    encoder.finish()
+
+    data = encoder.getvalue()
+    assert unpack("<I", data[4:8])[0] == len(data) - 14
+    assert unpack("<H", data[-2:])[0] == reference_crc(data[:-2])
+
+
+def test_blood_pressure_file_crc():
+    encoder = FitEncoderBloodPressure()
+    encoder.write_file_info()
+    encoder.write_file_creator()
+    for minute in range(20):
+        encoder.write_blood_pressure(
+            datetime(2024, 7, 1, 8, minute),
+            diastolic_blood_pressure=80,
+            systolic_blood_pressure=120 + minute,
+            heart_rate=60,
+        )
+    encoder.finish()
+
+    data = encoder.getvalue()
+    assert unpack("<H", data[-2:])[0] == reference_crc(data[:-2])
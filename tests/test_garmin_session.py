@@ -0,0 +1,148 @@
+import time
+
+import pytest
+
+import garmin_session
+from database import get_config_value, init_database, set_config_value
+from garmin_session import (
+    GARMIN_TOKENS_CONFIG_KEY,
+    clear_garmin_tokens,
+    load_garmin_tokens,
+    login_garmin_client,
+    refresh_garmin_tokens,
+    save_garmin_tokens,
+    tokens_need_refresh,
+)
+
+
+class FakeToken:
+    def __init__(self, expires_in):
+        self.expires_at = time.time() + expires_in
+
+
+class FakeGarth:
+    """Stand-in for garth.Client that never touches the network."""
+
+    def __init__(self, expires_in=3600):
+        self.oauth2_token = FakeToken(expires_in)
+        self.refreshes = 0
+        self.loaded = None
+
+    def dumps(self):
+        return f"tokens-{self.refreshes}-" + "x" * 600
+
+    def loads(self, tokens):
+        self.loaded = tokens
+
+    def refresh_oauth2(self):
+        self.refreshes += 1
+        self.oauth2_token = FakeToken(3600)
+
+
+class FakeGarmin:
+    instances = []
+    reject_tokens = False
+    token_lifetime = 3600
+
+    def __init__(self, email, password, response_cache=None):
+        self.response_cache = response_cache
+        self.garth = FakeGarth(self.token_lifetime)
+        self.logins = []
+        FakeGarmin.instances.append(self)
+
+    def login(self, tokenstore=None):
+        if tokenstore and FakeGarmin.reject_tokens:
+            raise Exception("401 Client Error: Unauthorized")
+        if tokenstore:
+            self.garth.loads(tokenstore)
+        self.logins.append('tokens' if tokenstore else 'password')
+
+
+@pytest.fixture
+def session_db(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    init_database()
+    FakeGarmin.instances = []
+    FakeGarmin.reject_tokens = False
+    FakeGarmin.token_lifetime = 3600
+    monkeypatch.setattr(garmin_session, 'Garmin', FakeGarmin)
+    monkeypatch.setattr(garmin_session, '_response_cache', None)
+    monkeypatch.setitem(garmin_session.API_CONFIG, 'RESPONSE_CACHE_PATH', 'cache.db')
+    return tmp_path
+
+
+def test_tokens_are_stored_encrypted(session_db):
+    api = FakeGarmin('me@example.com', 'secret')
+    save_garmin_tokens(api)
+    stored = get_config_value(GARMIN_TOKENS_CONFIG_KEY)
+    assert 'tokens-0' not in stored
+    assert load_garmin_tokens() == api.garth.dumps()
+
+    clear_garmin_tokens()
+    assert load_garmin_tokens() is None
+
+
+def test_undecryptable_tokens_are_ignored(session_db):
+    set_config_value(GARMIN_TOKENS_CONFIG_KEY, 'not-a-fernet-token')
+    assert load_garmin_tokens() is None
+
+
+def test_first_login_uses_password_then_sessions_are_resumed(session_db):
+    first = login_garmin_client('me@example.com', 'secret')
+    assert first.logins == ['password']
+
+    second = login_garmin_client('me@example.com', 'secret')
+    assert second.logins == ['tokens']
+    assert second.garth.loaded == first.garth.dumps()
+    assert len(FakeGarmin.instances) == 2
+
+
+def test_rejected_tokens_fall_back_to_password_login(session_db):
+    login_garmin_client('me@example.com', 'secret')
+    FakeGarmin.reject_tokens = True
+
+    api = login_garmin_client('me@example.com', 'secret')
+    assert api.logins == ['password']
+    assert load_garmin_tokens() == api.garth.dumps()
+
+
+def test_rate_limited_resume_does_not_attempt_password_login(session_db, monkeypatch):
+    login_garmin_client('me@example.com', 'secret')
+
+    def rate_limited_login(self, tokenstore=None):
+        raise Exception("429 Client Error: Too Many Requests")
+
+    monkeypatch.setattr(FakeGarmin, 'login', rate_limited_login)
+    with pytest.raises(Exception, match="429"):
+        login_garmin_client('me@example.com', 'secret')
+    assert load_garmin_tokens() is not None
+
+
+def test_tokens_close_to_expiry_are_refreshed_and_saved(session_db):
+    api = FakeGarmin('me@example.com', 'secret')
+    save_garmin_tokens(api)
+    assert not refresh_garmin_tokens(api, margin_seconds=600)
+
+    api.garth.oauth2_token = FakeToken(60)
+    assert tokens_need_refresh(api, margin_seconds=600)
+    assert refresh_garmin_tokens(api, margin_seconds=600)
+    assert api.garth.refreshes == 1
+    assert load_garmin_tokens() == api.garth.dumps()
+
+
+def test_resumed_session_with_expiring_token_is_refreshed(session_db):
+    login_garmin_client('me@example.com', 'secret')
+    FakeGarmin.token_lifetime = 10
+
+    api = login_garmin_client('me@example.com', 'secret')
+    assert api.logins == ['tokens']
+    assert api.garth.refreshes == 1
+
+
+def test_clients_share_one_response_cache(session_db):
+    first = login_garmin_client('me@example.com', 'secret')
+    second = login_garmin_client('me@example.com', 'secret')
+    assert first.response_cache is not None
+    assert second.response_cache is first.response_cache
+    assert (session_db / 'cache.db').exists()
+    first.response_cache.close()
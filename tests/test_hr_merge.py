@@ -0,0 +1,69 @@
+import copy
+import random
+
+import pytest
+
+from jobs import find_continuous_segments, merge_hr_series
+
+DAY_START_MS = 1_720_000_000_000
+
+
+def legacy_merge(daily_hr_series, activity_hr_series_list):
+    """Per-segment filter and re-sort, as build_daily_hr_timeseries used to do."""
+    for activity_hr_series in activity_hr_series_list:
+        if not activity_hr_series:
+            continue
+        for segment in find_continuous_segments(activity_hr_series):
+            segment_start = segment[0][0]
+            segment_end = segment[-1][0]
+            daily_hr_series = [point for point in daily_hr_series
+                               if point[0] < segment_start or point[0] > segment_end]
+            daily_hr_series.extend(segment)
+        daily_hr_series.sort(key=lambda x: x[0])
+    return daily_hr_series
+
+
+def make_day(seed, activity_count, overlapping=False):
+    """Build a daily 2-minute HR series plus 1 Hz activity series with pauses."""
+    rng = random.Random(seed)
+    daily = [[DAY_START_MS + i * 120_000, rng.choice([None, rng.randint(45, 110)])] for i in range(720)]
+    activities = []
+    for _ in range(activity_count):
+        ts = DAY_START_MS + rng.randint(0, 86_000) * 1000
+        if not overlapping:
+            ts -= ts % 120_000
+        series = []
+        for _ in range(rng.randint(1, 1500)):
+            ts += rng.choice([61_000, 90_000]) if rng.random() < 0.01 else rng.choice([1000, 5000])
+            series.append([ts, rng.randint(70, 180)])
+        activities.append(series)
+    return daily, activities
+
+
+@pytest.mark.parametrize("seed", range(6))
+@pytest.mark.parametrize("activity_count", [1, 5, 50])
+def test_merge_matches_legacy(seed, activity_count):
+    daily, activities = make_day(seed, activity_count, overlapping=seed % 2 == 1)
+    expected = legacy_merge(copy.deepcopy(daily), copy.deepcopy(activities))
+    assert merge_hr_series(daily, activities) == expected
+
+
+def test_later_activity_replaces_earlier_overlap():
+    daily = [[0, 60], [10_000, 61], [20_000, 62]]
+    first = [[5000, 100], [6000, 101], [7000, 102]]
+    second = [[6000, 150], [6500, 151]]
+    merged = merge_hr_series(daily, [first, second])
+    assert merged == legacy_merge(copy.deepcopy(daily), [first, second])
+    assert merged == [[0, 60], [5000, 100], [6000, 150], [6500, 151], [7000, 102], [10_000, 61], [20_000, 62]]
+
+
+def test_no_activity_data_returns_daily_series_untouched():
+    daily = [[20_000, 62], [0, 60]]
+    assert merge_hr_series(daily, []) is daily
+    assert merge_hr_series(daily, [[], []]) is daily
+
+
+def test_unsorted_daily_series_is_sorted_once_merged():
+    daily = [[20_000, 62], [0, 60], [10_000, 61]]
+    activity = [[30_000, 120]]
+    assert merge_hr_series(daily, [activity]) == legacy_merge(list(daily), [activity])
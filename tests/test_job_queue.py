@@ -0,0 +1,226 @@
+import sqlite3
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import job_queue
+from database import init_database
+from garminconnect.ratelimit import TokenBucket
+from job_queue import JobExecutor, RateLimitedClient
+
+
+class FakeGarmin:
+    """Stand-in for an authenticated Garmin client."""
+
+    def __init__(self, fail_with=None):
+        self.fail_with = fail_with
+        self.calls = 0
+        self.garth = SimpleNamespace(oauth2_token=SimpleNamespace(expires_at=time.time() + 3600))
+
+    def get_heart_rates(self, target_date):
+        self.calls += 1
+        if isinstance(self.fail_with, Exception):
+            raise self.fail_with
+        if self.fail_with:
+            raise Exception(self.fail_with)
+        return {'heartRateValues': []}
+
+
+@pytest.fixture
+def queue_db(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    init_database()
+    monkeypatch.setitem(job_queue.JOB_CONFIG, 'POLL_INTERVAL_SECONDS', 0.05)
+    monkeypatch.setitem(job_queue.JOB_CONFIG, 'RETRY_BASE_SECONDS', 0)
+    monkeypatch.setitem(job_queue.JOB_CONFIG, 'MAX_RETRIES', 2)
+    return tmp_path
+
+
+def add_job(job_id, target_date, status='pending', created_at='2024-07-01 00:00:00'):
+    conn = sqlite3.connect('garmin_hr.db')
+    conn.execute("""
+        INSERT INTO background_jobs (job_id, job_type, target_date, status, created_at, updated_at)
+        VALUES (?, 'collect_data', ?, ?, ?, ?)
+    """, (job_id, target_date, status, created_at, created_at))
+    conn.commit()
+    conn.close()
+
+
+def job_row(job_id):
+    conn = sqlite3.connect('garmin_hr.db')
+    conn.row_factory = sqlite3.Row
+    row = conn.execute("SELECT * FROM background_jobs WHERE job_id = ?", (job_id,)).fetchone()
+    conn.close()
+    return row
+
+
+def fake_job(target_date, job_id, api=None):
+    """Mimics collect_garmin_data_job: one API call, then a final status."""
+    try:
+        api.get_heart_rates(target_date)
+        status = 'completed'
+    except Exception:
+        status = 'failed'
+    conn = sqlite3.connect('garmin_hr.db')
+    conn.execute("UPDATE background_jobs SET status = ? WHERE job_id = ?", (status, job_id))
+    conn.commit()
+    conn.close()
+
+
+def test_token_bucket_allows_burst_then_throttles():
+    bucket = TokenBucket(rate=20, capacity=3)
+    started = time.monotonic()
+    for _ in range(3):
+        bucket.acquire()
+    assert time.monotonic() - started < 0.02
+    for _ in range(2):
+        bucket.acquire()
+    assert time.monotonic() - started >= 0.09
+
+
+def test_token_bucket_pause_blocks_acquire():
+    bucket = TokenBucket(rate=1000, capacity=5)
+    bucket.pause(0.1)
+    started = time.monotonic()
+    bucket.acquire()
+    assert time.monotonic() - started >= 0.09
+
+
+def test_rate_limited_client_flags_swallowed_429():
+    client = RateLimitedClient(FakeGarmin(fail_with="429 Client Error: Too Many Requests"))
+    with pytest.raises(Exception):
+        client.get_heart_rates('2024-07-01')
+    assert client.rate_limited and not client.auth_failed
+    assert client.fail_with.startswith("429")
+
+
+def test_auth_errors_are_recognised_by_status_not_text():
+    from garth.exc import GarthHTTPError
+    from requests import HTTPError, Response
+    from garminconnect import GarminConnectAuthenticationError
+
+    response = Response()
+    response.status_code = 401
+    expired = GarthHTTPError(msg="Error in request", error=HTTPError("401 Client Error", response=response))
+    for error in (expired, GarminConnectAuthenticationError("Authentication error")):
+        client = RateLimitedClient(FakeGarmin(fail_with=error))
+        with pytest.raises(Exception):
+            client.get_heart_rates('2024-07-01')
+        assert client.auth_failed
+
+    # An activity ID or byte count containing 401 is not an auth failure
+    client = RateLimitedClient(FakeGarmin(fail_with="Activity 14015401 not found"))
+    with pytest.raises(Exception):
+        client.get_heart_rates('2024-07-01')
+    assert not client.auth_failed
+
+
+def test_cached_responses_take_no_rate_limiter_token(tmp_path):
+    from garminconnect import Garmin
+    from garminconnect.cache import ResponseCache
+    from garminconnect.ratelimit import RateLimiter
+
+    api = Garmin(response_cache=ResponseCache(str(tmp_path / 'cache.db')),
+                 rate_limiter=RateLimiter(rate=0.001, burst=1))
+    api.display_name = 'runner'
+    api.garth = SimpleNamespace(connectapi=lambda path, **kwargs: {'heartRateValues': [[1719792000000, 60]]})
+    client = RateLimitedClient(api)
+
+    started = time.monotonic()
+    for _ in range(5):
+        client.get_heart_rates('2024-07-01')
+    assert time.monotonic() - started < 1
+    assert api.response_cache.stats()['hits'] == 4
+    assert api.rate_limiter.metrics()['requests'] == 1
+
+
+def test_claim_takes_oldest_pending_job_once(queue_db):
+    add_job('newer', '2024-07-02', created_at='2024-07-01 00:00:02')
+    add_job('older', '2024-07-01', created_at='2024-07-01 00:00:01')
+    add_job('done', '2024-06-30', status='completed', created_at='2024-07-01 00:00:00')
+    executor = JobExecutor(max_workers=1)
+    assert executor.queue_depth() == 2
+    assert executor.claim_next_job() == ('older', '2024-07-01', 1)
+    assert executor.claim_next_job() == ('newer', '2024-07-02', 1)
+    assert executor.claim_next_job() is None
+    assert job_row('older')['status'] == 'running'
+
+
+def test_stale_running_jobs_are_requeued(queue_db):
+    add_job('orphan', '2024-07-01', status='running')
+    JobExecutor(max_workers=1).requeue_stale_jobs()
+    assert job_row('orphan')['status'] == 'pending'
+
+
+def test_rate_limited_job_is_retried_with_backoff_then_failed(queue_db, monkeypatch):
+    fake_client = FakeGarmin(fail_with="429 Client Error: Too Many Requests")
+    monkeypatch.setattr(job_queue, 'create_garmin_client', lambda: fake_client)
+    monkeypatch.setattr(job_queue, 'collect_garmin_data_job', fake_job)
+    add_job('job', '2024-07-01')
+    executor = JobExecutor(max_workers=1, requests_per_second=1000, burst=10)
+
+    executor.run_job(*executor.claim_next_job())
+    row = job_row('job')
+    assert row['status'] == 'pending'
+    assert row['next_attempt_at'] is not None
+    assert 'retrying' in row['error_message']
+
+    executor.run_job(*executor.claim_next_job())
+    executor.run_job(*executor.claim_next_job())
+    row = job_row('job')
+    assert row['status'] == 'failed'
+    assert row['attempts'] == 3
+    assert executor.metrics()['retries_scheduled'] == 2
+
+
+def test_workers_share_one_client_and_drain_the_queue(queue_db, monkeypatch):
+    logins = []
+
+    def create_client():
+        logins.append(1)
+        return FakeGarmin()
+
+    monkeypatch.setattr(job_queue, 'create_garmin_client', create_client)
+    monkeypatch.setattr(job_queue, 'collect_garmin_data_job', fake_job)
+    for day in range(6):
+        add_job(f"job{day}", f"2024-07-0{day + 1}")
+
+    executor = JobExecutor(max_workers=3, requests_per_second=1000, burst=10)
+    executor.start()
+    try:
+        deadline = time.monotonic() + 5
+        while executor.queue_depth() and time.monotonic() < deadline:
+            time.sleep(0.02)
+        while executor.metrics()['completed'] < 6 and time.monotonic() < deadline:
+            time.sleep(0.02)
+    finally:
+        executor.stop(timeout=2)
+
+    assert all(job_row(f"job{day}")['status'] == 'completed' for day in range(6))
+    assert logins == [1]
+    assert executor.metrics()['queue_depth'] == 0
+
+
+def test_range_job_is_dispatched_to_range_collection(queue_db, monkeypatch):
+    ranges = []
+
+    def fake_range_job(start_date, end_date, job_id, api=None):
+        ranges.append((start_date, end_date))
+        fake_job(start_date, job_id, api=api)
+
+    monkeypatch.setattr(job_queue, 'create_garmin_client', lambda: FakeGarmin())
+    monkeypatch.setattr(job_queue, 'collect_garmin_range_job', fake_range_job)
+    conn = sqlite3.connect('garmin_hr.db')
+    conn.execute("""
+        INSERT INTO background_jobs (job_id, job_type, start_date, end_date, status)
+        VALUES ('range', 'collect_range', '2024-07-01', '2024-07-07', 'pending')
+    """)
+    conn.commit()
+    conn.close()
+
+    executor = JobExecutor(max_workers=1, requests_per_second=1000, burst=10)
+    assert executor.queue_depth() == 1
+    executor.run_job(*executor.claim_next_job())
+    assert ranges == [('2024-07-01', '2024-07-07')]
+    assert job_row('range')['status'] == 'completed'
@@ -0,0 +1,96 @@
+import csv
+import io
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+from database import init_database
+
+HEADER = ['Time', 'SpO2(%)', 'Pulse Rate(bpm)', 'Motion', 'SpO2 Reminder', 'PR Reminder', '']
+START = datetime(2024, 7, 3, 22, 0, 0)
+
+
+def make_csv(rows):
+    """Build O2Ring CSV bytes from (spo2, pulse) pairs sampled every 4 seconds."""
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(HEADER)
+    for index, (spo2, pulse) in enumerate(rows):
+        when = START + timedelta(seconds=4 * index)
+        writer.writerow([when.strftime('%I:%M:%S%p %b %d, %Y'), spo2, pulse, 0, 0, 0, ''])
+    return out.getvalue().encode('utf-8')
+
+
+def ingest(filename, content):
+    from app import process_o2ring_file
+    return process_o2ring_file(FileStorage(stream=io.BytesIO(content), filename=filename))
+
+
+def stored_rows():
+    conn = sqlite3.connect('garmin_hr.db')
+    rows = conn.execute("SELECT spo2_value, heart_rate FROM o2ring_data ORDER BY timestamp").fetchall()
+    conn.close()
+    return rows
+
+
+@pytest.fixture
+def o2ring_db(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    init_database()
+    from app import app
+    app.testing = True
+    return tmp_path
+
+
+def test_rows_are_stored_with_file_summary(o2ring_db):
+    rows = [(90 + i % 8, 60 + i % 5) for i in range(500)]
+    result = ingest('night.csv', make_csv(rows))
+    assert result['success'] and result['data_points'] == 500
+    assert stored_rows() == rows
+
+    conn = sqlite3.connect('garmin_hr.db')
+    first, last, count = conn.execute("SELECT first_timestamp, last_timestamp, row_count FROM o2ring_files").fetchone()
+    conn.close()
+    assert count == 500
+    assert last - first == 499 * 4000
+
+
+def legacy_filter(rows):
+    """The previous two-pass filter: a failure marks the indices either side of it in the valid rows."""
+    kept, invalid = [], set()
+    for spo2, pulse in rows:
+        if spo2 == 255 or pulse == 65535:
+            invalid.update({len(kept), len(kept) - 1})
+            continue
+        kept.append((spo2, pulse))
+    return [row for index, row in enumerate(kept) if index not in invalid]
+
+
+@pytest.mark.parametrize("rows", [
+    [(90, 60), (91, 61), (255, 61), (92, 62), (93, 63), (94, 65535), (95, 64), (96, 65), (255, 65535), (255, 65535), (97, 66), (98, 67)],
+    [(255, 60), (90, 61), (91, 62), (92, 63), (93, 63), (255, 60), (94, 64), (95, 64), (96, 65), (97, 66), (98, 65535)],
+    [(255 if i % 7 == 3 else 90 + i % 9, 60) for i in range(40)],
+])
+def test_recording_failures_drop_adjacent_rows(o2ring_db, rows):
+    result = ingest('night.csv', make_csv(rows))
+    assert result['success']
+    assert stored_rows() == legacy_filter(rows)
+
+
+def test_duplicate_and_empty_files_are_rejected(o2ring_db):
+    assert ingest('night.csv', make_csv([(90, 60)] * 3))['success']
+    duplicate = ingest('night.csv', make_csv([(90, 60)] * 3))
+    assert not duplicate['success'] and 'already been loaded' in duplicate['error']
+
+    empty = ingest('empty.csv', make_csv([(255, 60), (90, 65535)]))
+    assert not empty['success']
+    conn = sqlite3.connect('garmin_hr.db')
+    assert conn.execute("SELECT COUNT(*) FROM o2ring_files WHERE filename = 'empty.csv'").fetchone()[0] == 0
+    conn.close()
+
+
+def test_invalid_header_is_rejected(o2ring_db):
+    result = ingest('bad.csv', b'Time,SpO2\n10:00:00PM Jul 03, 2024,95\n')
+    assert not result['success'] and 'Invalid header' in result['error']
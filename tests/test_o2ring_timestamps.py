@@ -0,0 +1,52 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from o2ring_timestamps import parse_o2ring_timestamp, parse_o2ring_timestamp_strptime
+
+# Days the UK clocks change, plus the days either side
+DST_DAYS = ['2024-03-30', '2024-03-31', '2024-04-01', '2024-10-26', '2024-10-27', '2024-10-28',
+            '2025-03-30', '2025-10-26', '1996-10-27', '2037-03-29']
+
+
+def format_o2ring(when):
+    return when.strftime('%I:%M:%S%p %b %d, %Y')
+
+
+@pytest.mark.parametrize("day", DST_DAYS)
+def test_matches_strptime_across_dst_days(day):
+    start = datetime.strptime(day, '%Y-%m-%d')
+    for minute in range(0, 24 * 60, 3):
+        time_str = format_o2ring(start + timedelta(minutes=minute, seconds=minute % 60))
+        assert parse_o2ring_timestamp(time_str) == parse_o2ring_timestamp_strptime(time_str), time_str
+
+
+def test_matches_strptime_for_random_times():
+    rng = random.Random(5)
+    start = datetime(2015, 1, 1)
+    for _ in range(20000):
+        time_str = format_o2ring(start + timedelta(seconds=rng.randrange(15 * 365 * 86400)))
+        assert parse_o2ring_timestamp(time_str) == parse_o2ring_timestamp_strptime(time_str), time_str
+
+
+@pytest.mark.parametrize("time_str", [
+    "10:09:10PM Aug 21, 2025",
+    "12:00:00AM Jan 01, 2025",
+    "12:30:59PM Jul 4, 2024",
+    "9:05:00am Mar 31, 2024",
+    "1:30:00AM Mar 31, 2024",
+    "1:30:00AM Oct 27, 2024",
+])
+def test_variants_accepted_by_strptime(time_str):
+    assert parse_o2ring_timestamp(time_str) == parse_o2ring_timestamp_strptime(time_str)
+    assert parse_o2ring_timestamp(time_str) is not None
+
+
+@pytest.mark.parametrize("time_str", [
+    "", "garbage", "13:00:00PM Aug 21, 2025", "10:60:00PM Aug 21, 2025", "10:09:10XM Aug 21, 2025",
+    "10:09:10PM Feb 30, 2025", "10:09:10PM Foo 21, 2025", "10:09:10PM Aug 21 2025", "10:09:60PM Aug 21, 2025",
+])
+def test_invalid_timestamps_return_none(time_str):
+    assert parse_o2ring_timestamp(time_str) is None
+    assert parse_o2ring_timestamp_strptime(time_str) is None
@@ -0,0 +1,137 @@
+import json
+import sqlite3
+import threading
+
+import pytest
+
+import range_collection
+from database import decode_series, encode_series, init_database
+
+DAYS = ['2024-03-01', '2024-03-02', '2024-03-03']
+DAY_START_MS = {'2024-03-01': 1709251200000, '2024-03-02': 1709337600000, '2024-03-03': 1709424000000}
+
+
+def activity(activity_id, day):
+    return {'activityId': activity_id, 'activityName': 'Run', 'activityType': {'typeKey': 'running'},
+            'startTimeLocal': f"{day} 07:00:00", 'duration': 600}
+
+
+def details(start_ms):
+    return {
+        'metricDescriptors': [
+            {'metricsIndex': 0, 'key': 'directTimestamp', 'unit': {'key': 'gmt', 'factor': 1.0}},
+            {'metricsIndex': 1, 'key': 'directHeartRate', 'unit': {'key': 'bpm', 'factor': 1.0}},
+        ],
+        'activityDetailMetrics': [{'metrics': [start_ms + i * 5000, 150.0]} for i in range(20)],
+    }
+
+
+class FakeGarmin:
+    """Stand-in for the Garmin client serving a few days of data."""
+
+    def __init__(self, activities, failing_days=(), failing_activities=()):
+        self.activities = activities
+        self.failing_days = failing_days
+        self.failing_activities = failing_activities
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def _record(self, *call):
+        with self.lock:
+            self.calls.append(call)
+
+    def get_activities_by_date(self, startdate, enddate=None, activitytype=None, sortorder=None):
+        self._record('get_activities_by_date', startdate, enddate)
+        return self.activities
+
+    def get_heart_rates(self, cdate):
+        self._record('get_heart_rates', cdate)
+        if cdate in self.failing_days:
+            raise Exception("500 Server Error")
+        if cdate == '2024-03-03':
+            return {}
+        start_ms = DAY_START_MS[cdate]
+        return {'heartRateValues': [[start_ms + i * 120000, 60] for i in range(30)]}
+
+    def download_activity(self, activity_id, dl_fmt=None):
+        raise Exception("404 Client Error: Not Found")
+
+    def get_activity_details(self, activity_id):
+        self._record('get_activity_details', activity_id)
+        if activity_id in self.failing_activities:
+            raise Exception("503 Server Error")
+        day = next(a['startTimeLocal'][:10] for a in self.activities if str(a['activityId']) == activity_id)
+        return details(DAY_START_MS[day] + 25200000)
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    init_database()
+    conn = sqlite3.connect('garmin_hr.db')
+    conn.row_factory = sqlite3.Row
+    conn.execute("CREATE TABLE hr_parameters (id INTEGER PRIMARY KEY, resting_hr INTEGER, max_hr INTEGER)")
+    conn.execute("INSERT INTO hr_parameters (resting_hr, max_hr) VALUES (50, 180)")
+    conn.execute("""
+        INSERT INTO background_jobs (job_id, job_type, start_date, end_date, status)
+        VALUES ('range', 'collect_range', '2024-03-01', '2024-03-03', 'running')
+    """)
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def test_range_is_collected_with_one_listing_and_one_transaction(db):
+    activities = [activity(1, '2024-03-01'), activity(2, '2024-03-02'), activity(2, '2024-03-02'),
+                  activity(3, '2024-03-04')]
+    api = FakeGarmin(activities)
+    range_collection.collect_garmin_range_job('2024-03-01', '2024-03-03', 'range', api=api)
+
+    assert [call for call in api.calls if call[0] == 'get_activities_by_date'] == [
+        ('get_activities_by_date', '2024-03-01', '2024-03-03')]
+    assert sorted(call[1] for call in api.calls if call[0] == 'get_heart_rates') == DAYS
+    # Duplicates and activities outside the range are fetched once or not at all
+    assert sorted(call[1] for call in api.calls if call[0] == 'get_activity_details') == ['1', '2']
+
+    rows = {row['date']: row for row in db.execute("SELECT * FROM daily_data")}
+    assert sorted(rows) == ['2024-03-01', '2024-03-02']
+    assert rows['2024-03-01']['total_trimp'] > 0
+    assert len(decode_series(rows['2024-03-01']['heart_rate_series'])) == 50
+    stored = db.execute("SELECT activity_id, date, activity_type FROM activity_data ORDER BY activity_id").fetchall()
+    assert [tuple(row) for row in stored] == [('1', '2024-03-01', 'running'), ('2', '2024-03-02', 'running')]
+
+    job = db.execute("SELECT status, result FROM background_jobs WHERE job_id = 'range'").fetchone()
+    assert job['status'] == 'completed'
+    result = json.loads(job['result'])
+    assert result['fetched_days'] == 3
+    assert result['days'] == {'2024-03-01': 'stored', '2024-03-02': 'stored', '2024-03-03': 'no_data'}
+
+
+def test_failed_day_keeps_its_data_and_fails_the_job(db):
+    db.execute("INSERT INTO daily_data (date, heart_rate_series, total_trimp) VALUES (?, ?, ?)",
+               ('2024-03-02', encode_series([[DAY_START_MS['2024-03-02'], 70]]), 12.5))
+    db.commit()
+    api = FakeGarmin([activity(1, '2024-03-01')], failing_days=('2024-03-02',))
+    range_collection.collect_garmin_range_job('2024-03-01', '2024-03-03', 'range', api=api)
+
+    rows = {row['date']: row['total_trimp'] for row in db.execute("SELECT date, total_trimp FROM daily_data")}
+    assert rows['2024-03-02'] == 12.5
+    assert '2024-03-01' in rows
+
+    job = db.execute("SELECT status, error_message, result FROM background_jobs WHERE job_id = 'range'").fetchone()
+    assert job['status'] == 'failed'
+    assert '2024-03-02' in job['error_message']
+    assert json.loads(job['result'])['days']['2024-03-02'] == 'failed'
+
+
+def test_day_with_an_unfetchable_activity_fails(db):
+    api = FakeGarmin([activity(1, '2024-03-01'), activity(2, '2024-03-02')], failing_activities=('2',))
+    range_collection.collect_garmin_range_job('2024-03-01', '2024-03-03', 'range', api=api)
+
+    job = db.execute("SELECT status, error_message, result FROM background_jobs WHERE job_id = 'range'").fetchone()
+    assert job['status'] == 'failed'
+    assert '2024-03-02' in job['error_message']
+    result = json.loads(job['result'])
+    assert result['days'] == {'2024-03-01': 'stored', '2024-03-02': 'failed', '2024-03-03': 'no_data'}
+    assert result['message'].startswith('Collected 2 of 3 days')
+    assert [row['date'] for row in db.execute("SELECT date FROM daily_data")] == ['2024-03-01']
@@ -0,0 +1,159 @@
+import threading
+import time
+from email.utils import formatdate
+
+import pytest
+from garth.exc import GarthHTTPError
+from requests import HTTPError, Response
+
+from garminconnect import Garmin, GarminConnectTooManyRequestsError
+from garminconnect.ratelimit import (
+    AdaptiveConcurrency,
+    RateLimiter,
+    retry_after_seconds,
+    throttle_response,
+)
+
+
+def http_error(status, retry_after=None):
+    response = Response()
+    response.status_code = status
+    if retry_after is not None:
+        response.headers["Retry-After"] = retry_after
+    error = HTTPError(f"{status} Client Error", response=response)
+    return GarthHTTPError(msg="Error in request", error=error)
+
+
+class FlakyGarth:
+    """Answers with queued errors first, then succeeds."""
+
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def connectapi(self, path, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return {"path": path}
+
+
+def make_api(errors=(), **limiter_args):
+    sleeps = []
+    limiter_args.setdefault("rate", 1000)
+    limiter = RateLimiter(sleep=sleeps.append, **limiter_args)
+    api = Garmin(rate_limiter=limiter)
+    api.garth = FlakyGarth(errors)
+    return api, sleeps
+
+
+def test_throttle_response_unwraps_garth_errors():
+    assert throttle_response(http_error(429)).status_code == 429
+    assert throttle_response(http_error(500)) is None
+    assert throttle_response(ValueError("429")) is None
+
+
+def test_retry_after_seconds():
+    assert retry_after_seconds(http_error(429, "7").error.response) == 7
+    in_a_minute = formatdate(time.time() + 60, usegmt=True)
+    parsed = retry_after_seconds(http_error(429, in_a_minute).error.response)
+    assert 55 < parsed <= 60
+    assert retry_after_seconds(http_error(429).error.response) is None
+    assert retry_after_seconds(http_error(429, "soon").error.response) is None
+
+
+def test_throttled_requests_are_retried_with_backoff():
+    api, sleeps = make_api(
+        [http_error(429), http_error(429)], backoff_base=1, backoff_max=60
+    )
+
+    assert api.connectapi("/x") == {"path": "/x"}
+    assert api.garth.calls == 3
+    assert 1 <= sleeps[0] <= 2
+    assert 2 <= sleeps[1] <= 4
+    metrics = api.rate_limiter.metrics()
+    assert metrics["throttled"] == 2
+    assert metrics["retries"] == 2
+    assert metrics["requests"] == 3
+    assert metrics["given_up"] == 0
+
+
+def test_retry_after_is_honoured():
+    api, sleeps = make_api([http_error(429, "0.2")], backoff_base=0.01)
+
+    api.connectapi("/x")
+    assert sleeps == [0.2]
+    metrics = api.rate_limiter.metrics()
+    assert metrics["retry_after_honoured"] == 1
+    # the bucket was paused for every thread, not just the throttled one
+    assert metrics["bucket_wait_seconds"] >= 0.15
+
+
+def test_gives_up_with_typed_error():
+    api, sleeps = make_api([http_error(429)] * 5, max_retries=2)
+
+    with pytest.raises(GarminConnectTooManyRequestsError) as excinfo:
+        api.connectapi("/x")
+    assert "429" in str(excinfo.value)
+    assert api.garth.calls == 3
+    assert len(sleeps) == 2
+    assert api.rate_limiter.metrics()["given_up"] == 1
+
+
+def test_other_errors_are_not_retried():
+    api, sleeps = make_api([http_error(500)])
+
+    with pytest.raises(GarthHTTPError):
+        api.connectapi("/x")
+    assert api.garth.calls == 1
+    assert sleeps == []
+
+
+def test_adaptive_concurrency_is_aimd():
+    concurrency = AdaptiveConcurrency(maximum=8, minimum=1)
+    concurrency.acquire()
+    concurrency.release(throttled=True)
+    assert concurrency.limit == 4
+    concurrency.acquire()
+    concurrency.release(throttled=True)
+    concurrency.acquire()
+    concurrency.release(throttled=True)
+    concurrency.acquire()
+    concurrency.release(throttled=True)
+    assert concurrency.limit == 1
+
+    # about one more slot per round of successful requests
+    for _ in range(1 + 2 + 3):
+        concurrency.acquire()
+        concurrency.release()
+    assert 3 < concurrency.limit < 4
+    for _ in range(100):
+        concurrency.acquire()
+        concurrency.release()
+    assert concurrency.limit == 8
+
+
+def test_concurrency_limit_is_shared_across_threads():
+    limiter = RateLimiter(rate=1000, burst=1000, max_concurrency=3)
+    lock = threading.Lock()
+    in_flight = [0, 0]
+
+    def fetch():
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight[1], in_flight[0])
+        time.sleep(0.01)
+        with lock:
+            in_flight[0] -= 1
+
+    threads = [
+        threading.Thread(target=limiter.call, args=(fetch,)) for _ in range(12)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert in_flight[1] == 3
+    assert limiter.metrics()["requests"] == 12
+    assert limiter.metrics()["in_flight"] == 0
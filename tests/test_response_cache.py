@@ -0,0 +1,175 @@
+from datetime import date, timedelta
+
+import pytest
+
+from garminconnect import Garmin
+from garminconnect.cache import MISS, CachePolicy, ResponseCache
+
+
+class FakeGarth:
+    """Counts upstream requests and answers with the requested path."""
+
+    def __init__(self):
+        self.requests = []
+
+    def connectapi(self, path, method="GET", **kwargs):
+        self.requests.append((method, path))
+        return {
+            "path": path,
+            "params": kwargs.get("params"),
+            "heartRateValues": [[0, 60]],
+        }
+
+    def download(self, path, **kwargs):
+        self.requests.append(("DOWNLOAD", path))
+        return b"FIT" + path.encode()
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.db"))
+    yield cache
+    cache.close()
+
+
+@pytest.fixture
+def api(cache):
+    api = Garmin("user@example.com", "secret", response_cache=cache)
+    api.display_name = "runner"
+    api.garth = FakeGarth()
+    return api
+
+
+def days_ago(days):
+    return (date.today() - timedelta(days=days)).isoformat()
+
+
+def test_policy_ttl():
+    policy = CachePolicy(r"/x/", recent_ttl=60, immutable_after_days=2)
+    today = date(2024, 5, 10)
+    assert policy.ttl("/x/2024-05-10", today=today) == 60
+    assert policy.ttl("/x/2024-05-09", today=today) == 60
+    assert policy.ttl("/x/2024-05-08", today=today) is None
+    assert policy.ttl("/x", {"date": "2024-05-01"}, today=today) is None
+    # a range is only immutable once its last day is
+    assert policy.ttl("/x/2024-04-01/2024-05-10", today=today) == 60
+    assert policy.ttl("/x/123") is None
+    assert CachePolicy(r"/x/", undated_ttl=5).ttl("/x/123") == 5
+
+
+def test_past_days_are_served_from_cache(api, cache):
+    day = days_ago(10)
+    first = [
+        api.get_heart_rates(day),
+        api.get_activities_fordate(day),
+        api.get_spo2_data(day),
+        api.get_activity_details(42),
+    ]
+    second = [
+        api.get_heart_rates(day),
+        api.get_activities_fordate(day),
+        api.get_spo2_data(day),
+        api.get_activity_details(42),
+    ]
+
+    assert second == first
+    assert len(api.garth.requests) == 4
+    assert cache.stats()["hits"] == 4
+    assert cache.stats()["misses"] == 4
+    assert cache.stats()["entries"] == 4
+
+
+def test_params_are_part_of_the_key(api):
+    api.get_heart_rates(days_ago(10))
+    api.get_heart_rates(days_ago(11))
+    api.get_activity_details(42, maxchart=100)
+    api.get_activity_details(42, maxchart=200)
+    assert len(api.garth.requests) == 4
+
+
+def test_recent_days_expire(tmp_path):
+    cache = ResponseCache(
+        str(tmp_path / "cache.db"),
+        policies=[CachePolicy(r"/wellness-service/", recent_ttl=0)],
+    )
+    api = Garmin(response_cache=cache)
+    api.display_name = "runner"
+    api.garth = FakeGarth()
+
+    api.get_heart_rates(days_ago(0))
+    api.get_heart_rates(days_ago(0))
+    api.get_heart_rates(days_ago(5))
+    api.get_heart_rates(days_ago(5))
+    assert len(api.garth.requests) == 3
+
+
+def test_uncached_endpoints_and_writes_go_upstream(api):
+    api.get_user_profile()
+    api.get_user_profile()
+    api.connectapi("/mobile-gateway/heartRate/forDate/2020-01-01", method="POST")
+    api.connectapi("/mobile-gateway/heartRate/forDate/2020-01-01", method="POST")
+    assert len(api.garth.requests) == 4
+
+
+def test_downloads_are_cached_as_bytes(api):
+    first = api.download_activity(7, dl_fmt=Garmin.ActivityDownloadFormat.ORIGINAL)
+    second = api.download_activity(7, dl_fmt=Garmin.ActivityDownloadFormat.ORIGINAL)
+    assert first == second == b"FIT/download-service/files/activity/7"
+    assert len(api.garth.requests) == 1
+
+
+def test_cache_persists_on_disk(tmp_path, api, cache):
+    api.get_heart_rates(days_ago(10))
+    cache.close()
+
+    reopened = ResponseCache(str(tmp_path / "cache.db"))
+    api.response_cache = reopened
+    api.get_heart_rates(days_ago(10))
+    assert len(api.garth.requests) == 1
+    assert reopened.stats()["hits"] == 1
+    reopened.close()
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.db"), max_bytes=1000)
+    body = [str(n) * 40 for n in range(30)]
+    cache.set("a", body)
+    cache.set("b", body)
+    assert cache.get("a") == body  # a is now more recent than b
+    for key in "cdefghijklmnop":
+        cache.set(key, body)
+        cache.get("a")
+
+    assert cache.get("a") == body
+    assert cache.get("b") is MISS
+    assert cache.stats()["bytes"] <= 1000
+    assert cache.stats()["evictions"] > 0
+    cache.close()
+
+
+
+def test_activities_expire_and_can_be_forgotten(api, cache):
+    activity_policy = cache.policy_for("/activity-service/activity/42/details")
+    assert activity_policy.ttl("/activity-service/activity/42/details") > 0
+
+    api.get_activity_details(42)
+    api.download_activity(42, dl_fmt=Garmin.ActivityDownloadFormat.ORIGINAL)
+    api.get_activity_details(43)
+    api.forget_activity(42)
+    api.get_activity_details(42)
+    api.download_activity(42, dl_fmt=Garmin.ActivityDownloadFormat.ORIGINAL)
+    api.get_activity_details(43)
+    assert len(api.garth.requests) == 5
+    assert cache.stats()["entries"] == 3
+
+
+@pytest.mark.parametrize(
+    "response", [None, {}, [], b"", {"heartRateValues": None}]
+)
+def test_empty_responses_are_not_cached(api, cache, response):
+    api.garth.connectapi = lambda path, **kwargs: response
+    api.garth.download = lambda path, **kwargs: response
+    api.get_heart_rates(days_ago(10))
+    if not response:
+        api.download_activity(7, dl_fmt=Garmin.ActivityDownloadFormat.ORIGINAL)
+    assert cache.stats()["entries"] == 0
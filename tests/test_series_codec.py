@@ -0,0 +1,120 @@
+import json
+import random
+import sqlite3
+
+import pytest
+
+from database import calculate_data_hash, decode_series, encode_series, init_database, is_binary_series
+
+START_MS = 1_720_000_000_000
+
+
+def daily_series():
+    rng = random.Random(1)
+    return [[START_MS + i * 120_000, rng.choice([None, rng.randint(40, 120)])] for i in range(720)]
+
+
+def activity_series():
+    rng = random.Random(2)
+    return [[float(START_MS + i * 1000), float(rng.randint(80, 180))] for i in range(3600)]
+
+
+def breathing_series():
+    rng = random.Random(3)
+    return [[float(START_MS + i * 1000), round(rng.uniform(10, 30), 2)] for i in range(3600)]
+
+
+@pytest.mark.parametrize("series", [daily_series(), activity_series(), breathing_series()])
+def test_binary_round_trip_is_exact(series):
+    encoded = encode_series(series)
+    assert is_binary_series(encoded)
+    assert len(encoded) * 10 < len(json.dumps(series))
+    assert json.dumps(decode_series(encoded)) == json.dumps(series)
+
+
+@pytest.mark.parametrize("series", [
+    [[START_MS, None], [START_MS + 1000, None]],
+    [[START_MS, -5], [START_MS - 1000, 32767]],
+    [[START_MS, 70]],
+])
+def test_binary_round_trip_edge_cases(series):
+    for compress in (True, False):
+        encoded = encode_series(series, compress=compress)
+        assert is_binary_series(encoded)
+        assert decode_series(encoded) == series
+
+
+@pytest.mark.parametrize("series", [
+    [],
+    [[START_MS, 70], [START_MS + 1000, 70.5]],
+    [[START_MS, 40000]],
+    [[START_MS + 0.5, 70]],
+    [["2024-07-03T10:00:00", 70]],
+    [{'timestamp': START_MS, 'value': 70}],
+])
+def test_unrepresentable_series_stay_json(series):
+    encoded = encode_series(series)
+    assert isinstance(encoded, str)
+    assert decode_series(encoded) == series
+
+
+def test_decode_reads_legacy_json_and_empty_values():
+    assert decode_series('[[1720000000000, 65], [1720000120000, null]]') == [[START_MS, 65], [START_MS + 120_000, None]]
+    assert decode_series(None) == []
+    assert decode_series('') == []
+    assert encode_series(None) is None
+
+
+def test_decode_rejects_unknown_version():
+    encoded = bytearray(encode_series([[START_MS, 70]]))
+    encoded[3] = 99
+    with pytest.raises(ValueError):
+        decode_series(bytes(encoded))
+
+
+def test_migration_converts_json_rows(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    init_database()
+    from migrate_series_format import migrate_database
+
+    conn = sqlite3.connect('garmin_hr.db')
+    conn.execute("INSERT INTO daily_data (date, heart_rate_series) VALUES (?, ?)",
+                 ('2024-07-03', json.dumps(daily_series())))
+    conn.execute("INSERT INTO activity_data (activity_id, date, heart_rate_series, breathing_rate_series) VALUES (?, ?, ?, ?)",
+                 ('1', '2024-07-03', json.dumps(activity_series()), json.dumps(breathing_series())))
+    conn.commit()
+    conn.close()
+
+    migrate_database()
+    migrate_database()
+
+    conn = sqlite3.connect('garmin_hr.db')
+    daily_value = conn.execute("SELECT heart_rate_series FROM daily_data").fetchone()[0]
+    hr_value, breathing_value = conn.execute("SELECT heart_rate_series, breathing_rate_series FROM activity_data").fetchone()
+    conn.close()
+
+    assert all(is_binary_series(value) for value in (daily_value, hr_value, breathing_value))
+    assert decode_series(daily_value) == daily_series()
+    assert decode_series(hr_value) == activity_series()
+    assert decode_series(breathing_value) == breathing_series()
+
+
+@pytest.mark.parametrize("series", [daily_series(), activity_series(), breathing_series()])
+def test_fingerprint_survives_storage_and_detects_changes(series):
+    fingerprint = calculate_data_hash(series)
+    assert len(fingerprint) == 32
+    assert calculate_data_hash(decode_series(encode_series(series))) == fingerprint
+    assert calculate_data_hash(json.loads(json.dumps(series))) == fingerprint
+
+    changed = [list(point) for point in series]
+    changed[-1][1] = 1 if changed[-1][1] is None else changed[-1][1] + 1
+    assert calculate_data_hash(changed) != fingerprint
+
+
+def test_fingerprint_ignores_key_order():
+    series = activity_series()
+    assert calculate_data_hash({'resting_hr': 50, 'max_hr': 190, 'series': series}) == \
+        calculate_data_hash({'series': series, 'max_hr': 190, 'resting_hr': 50})
+    assert calculate_data_hash({'resting_hr': 50, 'max_hr': 190, 'series': series}) != \
+        calculate_data_hash({'resting_hr': 51, 'max_hr': 190, 'series': series})
+    assert calculate_data_hash({'nested': {'b': 1, 'a': 2}}) == calculate_data_hash({'nested': {'a': 2, 'b': 1}})
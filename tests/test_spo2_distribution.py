@@ -0,0 +1,69 @@
+import copy
+import json
+import random
+
+import pytest
+
+from spo2_analysis import _calculate_spo2_distribution_loop, calculate_spo2_distribution
+
+START_MS = 1_720_000_000_000
+
+
+def make_night(n, seed, step_ms=4000, jitter=False, low=70, out_of_range=False):
+    """Build a night of [timestamp, spo2, spo2_reminder] O2Ring points."""
+    rng = random.Random(seed)
+    points = []
+    ts = START_MS
+    spo2 = 95
+    for _ in range(n):
+        ts += step_ms + (rng.choice([0, 0, 1, 3, 7, 1000]) if jitter else 0)
+        spo2 = max(low, min(100, spo2 + rng.randint(-2, 2)))
+        value = rng.choice([-1, 101, 255]) if out_of_range and rng.random() < 0.01 else spo2
+        points.append([ts, value, 0])
+    return points
+
+
+def run_both(points, *period):
+    expected = _calculate_spo2_distribution_loop(copy.deepcopy(points), *period)
+    actual = calculate_spo2_distribution(copy.deepcopy(points), *period)
+    return expected, actual
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_vectorized_matches_loop_for_a_night(seed):
+    expected, actual = run_both(make_night(8000, seed, jitter=True))
+    assert json.dumps(actual) == json.dumps(expected)
+
+
+def test_vectorized_matches_loop_for_a_period():
+    points = make_night(3000, 11, jitter=True)
+    expected, actual = run_both(points, points[500][0], points[1200][0])
+    assert json.dumps(actual) == json.dumps(expected)
+
+
+def test_vectorized_matches_loop_for_unsorted_and_out_of_range_values():
+    points = make_night(2000, 3, out_of_range=True)
+    random.Random(3).shuffle(points)
+    expected, actual = run_both(points)
+    assert json.dumps(actual) == json.dumps(expected)
+
+
+def test_vectorized_matches_loop_for_levels_without_time():
+    # High saturation only: most levels (and every oxygen debt sum) see no interval
+    expected, actual = run_both(make_night(50, 5, low=97))
+    assert json.dumps(actual) == json.dumps(expected)
+    expected, actual = run_both([[START_MS, 85, 0], [START_MS + 4000, 97, 0], [START_MS + 8000, 82, 0]])
+    assert json.dumps(actual) == json.dumps(expected)
+    expected, actual = run_both([[START_MS, 86, 0]])
+    assert json.dumps(actual) == json.dumps(expected)
+
+
+def test_vectorized_matches_loop_for_float_values():
+    points = [[float(ts), float(spo2), 0] for ts, spo2, _ in make_night(500, 9, jitter=True)]
+    expected, actual = run_both(points)
+    assert json.dumps(actual) == json.dumps(expected)
+
+
+def test_empty_period():
+    points = make_night(10, 1)
+    assert calculate_spo2_distribution(points, 1, 2) == {'at_level': [], 'at_or_below_level': [], 'total_seconds': 0}
@@ -0,0 +1,108 @@
+import io
+import json
+import sqlite3
+
+from werkzeug.datastructures import FileStorage
+
+from database import init_database
+from spo2_analysis import _calculate_spo2_distribution_loop, detect_desaturation_events, london_day_bounds
+from test_o2ring_ingest import make_csv
+
+START_MS = 1_720_000_000_000
+
+
+def night(values, step_ms=4000):
+    """Timestamps and SpO2 values sampled every step_ms."""
+    return [START_MS + i * step_ms for i in range(len(values))], values
+
+
+def test_desaturation_is_measured_against_the_rolling_baseline():
+    timestamps, spo2 = night([96] * 40 + [94, 92, 91, 92, 93, 95] + [96] * 40)
+    events = detect_desaturation_events(timestamps, spo2, 3)
+    assert events == [{
+        'start_timestamp': timestamps[41],
+        'end_timestamp': timestamps[44],  # 93 is back within 3 of the baseline
+        'baseline': 95.9,  # The 94 before it is in the baseline window
+        'nadir': 91,
+    }]
+    # Only the 91 is 4 below its baseline, for 4 seconds
+    assert detect_desaturation_events(timestamps, spo2, 4) == []
+    assert detect_desaturation_events(timestamps, spo2, 6) == []
+
+
+def test_short_dips_and_recording_gaps():
+    # A one-sample dip lasts 4 seconds and is ignored
+    timestamps, spo2 = night([96] * 40 + [90] + [96] * 40)
+    assert detect_desaturation_events(timestamps, spo2, 3) == []
+
+    # A gap ends the desaturation at the last sample before it
+    timestamps, spo2 = night([96] * 40 + [90] * 5 + [90] * 5)
+    timestamps = timestamps[:45] + [t + 600_000 for t in timestamps[45:]]
+    events = detect_desaturation_events(timestamps, spo2, 3)
+    assert [(e['start_timestamp'], e['end_timestamp']) for e in events] == [(timestamps[40], timestamps[44])]
+
+    assert detect_desaturation_events([START_MS], [90], 3) == []
+
+
+def test_ingest_indexes_events_and_summarises_the_night(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    init_database()
+    from app import app, process_o2ring_file
+    app.testing = True
+
+    # 22:00 on 2024-07-03 for 500 samples: three dips of 5 points, the last below 90
+    values = [95] * 500
+    for start, low in ((100, 90), (250, 90), (400, 88)):
+        values[start:start + 6] = [low] * 6
+    result = process_o2ring_file(FileStorage(stream=io.BytesIO(make_csv([(v, 60) for v in values])), filename='night.csv'))
+    assert result['success'] and result['desaturation_events'] == 6
+    assert result['dates'] == ['2024-07-03']
+
+    conn = sqlite3.connect('garmin_hr.db')
+    conn.row_factory = sqlite3.Row
+    assert [row['nadir'] for row in conn.execute("SELECT nadir FROM spo2_events WHERE drop_percent = 4 ORDER BY start_timestamp")] == [90, 90, 88]
+    summary = dict(conn.execute("SELECT * FROM spo2_daily_summary").fetchone())
+    assert summary['date'] == '2024-07-03'
+    assert summary['recording_seconds'] == 499 * 4
+    assert summary['nadir'] == 88
+    assert (summary['events_3'], summary['events_4']) == (3, 3)
+    assert summary['odi_4'] == round(3 / (499 * 4 / 3600), 1)
+
+    start_ms, end_ms = london_day_bounds('2024-07-03')
+    points = [[row[0], row[1], row[2]] for row in conn.execute(
+        "SELECT timestamp, spo2_value, spo2_reminder FROM o2ring_data WHERE timestamp >= ? AND timestamp <= ? ORDER BY timestamp",
+        (start_ms, end_ms))]
+    distribution = _calculate_spo2_distribution_loop(points)
+    assert json.loads(summary['spo2_distribution']) == distribution
+    assert summary['t90_seconds'] == distribution['oxygen_debt']['time_under_90']
+
+    # The range endpoint reads the summary rows
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+        session['user_role'] = 'admin'
+    response = client.post('/api/data/batch/spo2-summary', json={'dates': ['2024-07-03', '2024-07-04']})
+    data = response.get_json()['data']
+    assert data['2024-07-04'] is None
+    assert data['2024-07-03']['odi_4'] == summary['odi_4']
+    events = client.get('/api/data/2024-07-03/spo2-events?drop=4').get_json()['events']
+    assert len(events) == 3
+
+    # Deleting the file removes its events and the night's summary
+    file_id = conn.execute("SELECT id FROM o2ring_files").fetchone()[0]
+    assert client.delete(f'/admin/o2ring/delete/{file_id}').get_json()['success']
+    assert conn.execute("SELECT COUNT(*) FROM spo2_events").fetchone()[0] == 0
+    assert conn.execute("SELECT COUNT(*) FROM spo2_daily_summary").fetchone()[0] == 0
+    conn.close()
+
+
+def test_nadir_is_taken_within_the_event():
+    # A slow slide to 85 after the dip never drops 3 below its own baseline
+    slide = [97 - i // 10 for i in range(121)]
+    timestamps, spo2 = night([97] * 40 + [92] * 5 + [97] * 40 + slide)
+    events = detect_desaturation_events(timestamps, spo2, 3)
+    assert [(e['start_timestamp'], e['nadir']) for e in events] == [(timestamps[40], 92)]
+
+    # A run that lasts to the end of the recording
+    timestamps, spo2 = night([97] * 40 + [93, 92, 91, 90, 89])
+    assert [e['nadir'] for e in detect_desaturation_events(timestamps, spo2, 3)] == [89]
@@ -0,0 +1,226 @@
+import json
+import sqlite3
+from datetime import date
+
+import pytest
+
+import jobs
+import range_collection
+from database import init_database
+from sync_state import SYNC_KIND_DAY, save_sync_states, sync_start_date
+
+DAYS = ['2024-03-01', '2024-03-02']
+DAY_START_MS = {'2024-03-01': 1709251200000, '2024-03-02': 1709337600000}
+
+
+def activity(activity_id, day, duration=600):
+    return {'activityId': activity_id, 'activityName': 'Run', 'activityType': {'typeKey': 'running'},
+            'startTimeLocal': f"{day} 07:00:00", 'duration': duration}
+
+
+class FakeGarmin:
+    """Stand-in for the Garmin client whose data can be changed between syncs."""
+
+    def __init__(self, activities):
+        self.activities = activities
+        self.heart_rate = 60
+        self.failing_activities = ()
+        self.calls = []
+
+    def get_activities_by_date(self, startdate, enddate=None, activitytype=None, sortorder=None):
+        self.calls.append(('get_activities_by_date', startdate, enddate))
+        return self.activities
+
+    def get_activities_fordate(self, cdate):
+        self.calls.append(('get_activities_fordate', cdate))
+        return [a for a in self.activities if a['startTimeLocal'].startswith(cdate)]
+
+    def get_heart_rates(self, cdate):
+        self.calls.append(('get_heart_rates', cdate))
+        start_ms = DAY_START_MS[cdate]
+        return {'heartRateValues': [[start_ms + i * 120000, self.heart_rate] for i in range(30)]}
+
+    def download_activity(self, activity_id, dl_fmt=None):
+        raise Exception("404 Client Error: Not Found")
+
+    def forget_activity(self, activity_id):
+        self.calls.append(('forget_activity', activity_id))
+
+    def get_activity_details(self, activity_id):
+        self.calls.append(('get_activity_details', activity_id))
+        if activity_id in self.failing_activities:
+            raise Exception("429 Client Error: Too Many Requests")
+        day = next(a['startTimeLocal'][:10] for a in self.activities if str(a['activityId']) == activity_id)
+        start_ms = DAY_START_MS[day] + 25200000
+        return {
+            'metricDescriptors': [
+                {'metricsIndex': 0, 'key': 'directTimestamp', 'unit': {'key': 'gmt', 'factor': 1.0}},
+                {'metricsIndex': 1, 'key': 'directHeartRate', 'unit': {'key': 'bpm', 'factor': 1.0}},
+            ],
+            'activityDetailMetrics': [{'metrics': [start_ms + i * 5000, 150.0]} for i in range(20)],
+        }
+
+    def fetched(self, name):
+        return sorted(call[1] for call in self.calls if call[0] == name)
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    init_database()
+    conn = sqlite3.connect('garmin_hr.db')
+    conn.row_factory = sqlite3.Row
+    conn.execute("CREATE TABLE hr_parameters (id INTEGER PRIMARY KEY, resting_hr INTEGER, max_hr INTEGER)")
+    conn.execute("INSERT INTO hr_parameters (resting_hr, max_hr) VALUES (50, 180)")
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def run_range_job(db, api, job_id):
+    db.execute("""
+        INSERT INTO background_jobs (job_id, job_type, start_date, end_date, status)
+        VALUES (?, 'collect_range', ?, ?, 'running')
+    """, (job_id, DAYS[0], DAYS[-1]))
+    db.commit()
+    range_collection.collect_garmin_range_job(DAYS[0], DAYS[-1], job_id, api=api)
+    return json.loads(db.execute("SELECT result FROM background_jobs WHERE job_id = ?", (job_id,)).fetchone()['result'])
+
+
+def fetched_too_soon(db):
+    """Pretend the days were fetched on the day, before Garmin had all their data."""
+    db.execute("UPDATE sync_state SET fetched_at = date(entity_id) || ' 23:00:00' WHERE kind = 'day'")
+    db.commit()
+
+
+def mark_cached(db):
+    db.execute("UPDATE daily_data SET cached_trimp_data = '{}'")
+    db.execute("UPDATE activity_data SET cached_trimp_data = '{}'")
+    db.commit()
+
+
+def test_resync_without_changes_keeps_stored_rows(db):
+    api = FakeGarmin([activity(1, '2024-03-01'), activity(2, '2024-03-02')])
+    run_range_job(db, api, 'first')
+    fetched_too_soon(db)
+    mark_cached(db)
+
+    api.calls = []
+    result = run_range_job(db, api, 'second')
+
+    assert result['days'] == {'2024-03-01': 'unchanged', '2024-03-02': 'unchanged'}
+    assert api.fetched('get_heart_rates') == DAYS
+    assert api.fetched('get_activity_details') == []
+    # Rows were not rewritten, so their cached calculations survive
+    assert [row[0] for row in db.execute("SELECT cached_trimp_data FROM daily_data")] == ['{}', '{}']
+    assert [row[0] for row in db.execute("SELECT cached_trimp_data FROM activity_data")] == ['{}', '{}']
+
+
+def test_only_changed_days_and_activities_are_rewritten(db):
+    api = FakeGarmin([activity(1, '2024-03-01'), activity(2, '2024-03-02'), activity(3, '2024-03-02')])
+    run_range_job(db, api, 'first')
+    fetched_too_soon(db)
+    mark_cached(db)
+
+    # Activity 2 was edited and activity 3 deleted on Garmin
+    api.activities = [activity(1, '2024-03-01'), activity(2, '2024-03-02', duration=900)]
+    api.calls = []
+    result = run_range_job(db, api, 'second')
+
+    assert result['days'] == {'2024-03-01': 'unchanged', '2024-03-02': 'stored'}
+    assert api.fetched('get_activity_details') == ['2']
+    assert api.fetched('forget_activity') == ['2']
+    daily = {row['date']: row['cached_trimp_data'] for row in db.execute("SELECT date, cached_trimp_data FROM daily_data")}
+    assert daily == {'2024-03-01': '{}', '2024-03-02': None}
+    stored = {row['activity_id']: row['duration_seconds'] for row in db.execute("SELECT * FROM activity_data")}
+    assert stored == {'1': 600, '2': 900}
+    assert db.execute("SELECT COUNT(*) FROM sync_state WHERE kind = 'activity' AND entity_id = '3'").fetchone()[0] == 0
+
+
+def test_settled_days_are_not_fetched_again(db):
+    api = FakeGarmin([activity(1, '2024-03-01')])
+    run_range_job(db, api, 'first')
+    db.execute("UPDATE sync_state SET fetched_at = '2024-03-03 09:00:00' WHERE kind = 'day'")
+    db.commit()
+
+    api.calls = []
+    result = run_range_job(db, api, 'second')
+
+    # 2024-03-01 was fetched two days later and is final, 2024-03-02 may still change
+    assert result['days'] == {'2024-03-01': 'up_to_date', '2024-03-02': 'unchanged'}
+    assert result['up_to_date_days'] == 1
+    assert api.fetched('get_heart_rates') == ['2024-03-02']
+
+
+def test_day_job_skips_unchanged_day(db):
+    api = FakeGarmin([activity(1, '2024-03-01')])
+    db.execute("INSERT INTO background_jobs (job_id, job_type, target_date) VALUES ('day', 'collect_data', '2024-03-01')")
+    db.commit()
+    jobs.collect_garmin_data_job('2024-03-01', 'day', api=api)
+    assert api.fetched('get_activity_details') == ['1']
+    mark_cached(db)
+
+    api.calls = []
+    jobs.collect_garmin_data_job('2024-03-01', 'day', api=api)
+    job = db.execute("SELECT status, result FROM background_jobs WHERE job_id = 'day'").fetchone()
+    assert job['status'] == 'completed'
+    assert json.loads(job['result'])['data_changed'] is False
+    assert api.fetched('get_activity_details') == []
+    assert db.execute("SELECT cached_trimp_data FROM daily_data").fetchone()[0] == '{}'
+
+    # New heart rates rewrite the day but keep the unchanged activity
+    api.heart_rate = 70
+    api.calls = []
+    jobs.collect_garmin_data_job('2024-03-01', 'day', api=api)
+    assert api.fetched('get_activity_details') == []
+    assert db.execute("SELECT cached_trimp_data FROM daily_data").fetchone()[0] is None
+    assert db.execute("SELECT cached_trimp_data FROM activity_data").fetchone()[0] == '{}'
+
+
+def test_failed_refetch_keeps_the_activity_and_leaves_the_day_unsettled(db):
+    api = FakeGarmin([activity(1, '2024-03-01'), activity(2, '2024-03-02')])
+    run_range_job(db, api, 'first')
+    fetched_too_soon(db)
+    day_states = dict(db.execute("SELECT entity_id, fetched_at FROM sync_state WHERE kind = 'day'").fetchall())
+
+    # Activity 2 was edited, but its new series cannot be fetched
+    api.activities = [activity(1, '2024-03-01'), activity(2, '2024-03-02', duration=900)]
+    api.failing_activities = ('2',)
+    result = run_range_job(db, api, 'second')
+
+    assert result['days']['2024-03-02'] == 'failed'
+    stored = {row['activity_id']: row['duration_seconds'] for row in db.execute("SELECT * FROM activity_data")}
+    assert stored == {'1': 600, '2': 600}
+    assert db.execute("SELECT fetched_at FROM sync_state WHERE kind = 'day' AND entity_id = '2024-03-02'").fetchone()[0] \
+        == day_states['2024-03-02']
+
+    # The per-day job keeps it too, fails, and leaves the day for the next sync
+    db.execute("INSERT INTO background_jobs (job_id, job_type, target_date) VALUES ('day', 'collect_data', '2024-03-02')")
+    db.commit()
+    jobs.collect_garmin_data_job('2024-03-02', 'day', api=api)
+    assert db.execute("SELECT status FROM background_jobs WHERE job_id = 'day'").fetchone()[0] == 'failed'
+    assert db.execute("SELECT duration_seconds FROM activity_data WHERE activity_id = '2'").fetchone()[0] == 600
+    assert db.execute("SELECT fetched_at FROM sync_state WHERE kind = 'day' AND entity_id = '2024-03-02'").fetchone()[0] \
+        == day_states['2024-03-02']
+
+    # Once the series can be fetched the edit is stored
+    api.failing_activities = ()
+    result = run_range_job(db, api, 'third')
+    assert result['days']['2024-03-02'] == 'stored'
+    assert db.execute("SELECT duration_seconds FROM activity_data WHERE activity_id = '2'").fetchone()[0] == 900
+
+
+def test_sync_start_date(db):
+    today = date(2024, 3, 20)
+    assert sync_start_date(today) == date(2024, 2, 19)
+
+    cur = db.cursor()
+    save_sync_states(cur, SYNC_KIND_DAY, {'2024-03-10': 'a', '2024-03-15': 'b', '2024-03-18': 'c'})
+    cur.execute("UPDATE sync_state SET fetched_at = '2024-03-19 08:00:00'")
+    db.commit()
+    # 2024-03-15 is the watermark; 2024-03-18 was fetched too soon to be final
+    assert sync_start_date(today) == date(2024, 3, 16)
+
+    cur.execute("UPDATE sync_state SET fetched_at = '2024-03-11 08:00:00' WHERE entity_id = '2024-03-10'")
+    db.commit()
+    assert sync_start_date(today) == date(2024, 3, 10)
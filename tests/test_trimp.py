@@ -0,0 +1,122 @@
+import copy
+import json
+import random
+
+import pytest
+
+from models import (
+    TRIMP_TABLE_MAX_BPM,
+    TRIMPCalculator,
+    get_trimp_lookup_table,
+    trimp_weight,
+)
+
+RESTING_HR = 48
+MAX_HR = 167
+START_MS = 1_720_000_000_000
+
+
+def make_series(n, seed, step_ms=1000, gap_every=0, with_none=False):
+    """Build a [timestamp, hr] series with optional long gaps and missing readings."""
+    rng = random.Random(seed)
+    series = []
+    ts = START_MS
+    hr = 90
+    for i in range(n):
+        ts += step_ms
+        if gap_every and i % gap_every == 0:
+            ts += rng.choice([301_000, 299_000, 600_000])
+        hr = max(40, min(200, hr + rng.randint(-4, 4)))
+        value = None if with_none and rng.random() < 0.02 else hr
+        series.append([ts, value])
+    rng.shuffle(series)
+    return series
+
+
+def run_both(series, resting_hr=RESTING_HR, max_hr=MAX_HR):
+    calculator = TRIMPCalculator(resting_hr, max_hr)
+    reference_values = copy.deepcopy(series)
+    reference_values.sort(key=lambda x: x[0] if isinstance(x, list) else x.get('timestamp', 0))
+    expected = calculator._bucket_heart_rates_loop(reference_values)
+    actual = calculator.bucket_heart_rates({'heartRateValues': copy.deepcopy(series)})
+    return expected, actual
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_vectorized_matches_loop_at_1hz(seed):
+    expected, actual = run_both(make_series(5000, seed, gap_every=700))
+    assert actual == expected
+    assert json.dumps(actual) == json.dumps(expected)
+
+
+def test_vectorized_matches_loop_with_missing_readings():
+    expected, actual = run_both(make_series(3000, 42, step_ms=4000, gap_every=250, with_none=True))
+    assert actual == expected
+    assert json.dumps(actual) == json.dumps(expected)
+
+
+def test_vectorized_matches_loop_for_dict_format():
+    series = [{'timestamp': ts, 'value': hr} for ts, hr in make_series(500, 7, step_ms=15000)]
+    expected, actual = run_both(series)
+    assert actual == expected
+
+
+@pytest.mark.parametrize("resting_hr,max_hr", [(40, 190), (60, 150), (48, 167)])
+def test_vectorized_matches_loop_for_hr_parameters(resting_hr, max_hr):
+    expected, actual = run_both(make_series(2000, 3, step_ms=2000), resting_hr, max_hr)
+    assert actual == expected
+
+
+def test_fractional_values_fall_back_to_loop():
+    series = [[START_MS + i * 1000.5, 100.5 + i % 3] for i in range(100)]
+    expected, actual = run_both(series)
+    assert actual == expected
+    assert actual['total_trimp'] > 0
+
+
+@pytest.mark.parametrize("series", [[], [[START_MS, 120]], [[START_MS, 70], [START_MS + 1000, 75]]])
+def test_short_series(series):
+    expected, actual = run_both(series)
+    assert actual == expected
+    assert actual['total_trimp'] == 0.0
+
+
+def test_sorts_input_in_place():
+    series = make_series(50, 1)
+    heart_rate_data = {'heartRateValues': series}
+    TRIMPCalculator(RESTING_HR, MAX_HR).bucket_heart_rates(heart_rate_data)
+    timestamps = [point[0] for point in heart_rate_data['heartRateValues']]
+    assert timestamps == sorted(timestamps)
+
+
+def test_lookup_table_matches_formula():
+    table = get_trimp_lookup_table(RESTING_HR, MAX_HR)
+    assert len(table.weights) == TRIMP_TABLE_MAX_BPM + 1
+    for hr in (0, 79, 80, 89, 90, 120, 159, 160, 167, 220, TRIMP_TABLE_MAX_BPM):
+        assert table.weights[hr] == trimp_weight(hr, RESTING_HR, MAX_HR)
+    assert table.zone_indices[79] == -1
+    assert table.zone_indices[80] == 0
+    assert table.zone_indices[159] == 7
+    assert table.zone_indices[TRIMP_TABLE_MAX_BPM] == 8
+
+
+def test_lookup_table_is_cached_and_read_only():
+    table = get_trimp_lookup_table(RESTING_HR, MAX_HR)
+    assert get_trimp_lookup_table(RESTING_HR, MAX_HR) is table
+    assert TRIMPCalculator(RESTING_HR, MAX_HR).trimp_table is table
+    with pytest.raises(ValueError):
+        table.weights[100] = 0.0
+
+
+def test_calculate_trimp_for_hr_uses_table_weight():
+    calculator = TRIMPCalculator(RESTING_HR, MAX_HR)
+    assert calculator.calculate_trimp_for_hr(79, 1.0) == 0.0
+    assert calculator.calculate_trimp_for_hr(140, 2.5) == 2.5 * calculator.trimp_table.weights_list[140]
+    assert calculator.calculate_trimp_for_hr(140.5, 1.0) == trimp_weight(140.5, RESTING_HR, MAX_HR)
+
+
+def test_readings_above_table_range():
+    series = [[START_MS + i * 1000, 900 + i * 20] for i in range(20)]
+    expected, actual = run_both(series)
+    assert actual == expected
+    assert 1200 in actual['trimp_data']
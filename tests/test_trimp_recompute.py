@@ -0,0 +1,126 @@
+import json
+import sqlite3
+
+import pytest
+
+import jobs
+import trimp_recompute
+from database import encode_series, get_daily_batch_data, init_database, save_user_data
+from jobs import calculate_trimp_from_timeseries, calculate_trimp_with_caching, trimp_cache_prefix
+
+START_MS = 1_719_964_800_000  # 2024-07-03 00:00 UTC
+DATES = [f"2024-07-{day:02d}" for day in range(3, 10)]
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """A week of days with one activity each and no TRIMP caches."""
+    monkeypatch.chdir(tmp_path)
+    init_database()
+    conn = sqlite3.connect('garmin_hr.db')
+    conn.row_factory = sqlite3.Row
+    conn.execute("CREATE TABLE hr_parameters (id INTEGER PRIMARY KEY, resting_hr INTEGER, max_hr INTEGER, updated_at TIMESTAMP)")
+    conn.execute("INSERT INTO hr_parameters (resting_hr, max_hr) VALUES (50, 180)")
+    for index, date in enumerate(DATES):
+        day_ms = START_MS + index * 86_400_000
+        conn.execute("INSERT INTO daily_data (date, heart_rate_series) VALUES (?, ?)",
+                     (date, encode_series([[day_ms + i * 120_000, 60 + (i * 7 + index) % 90] for i in range(720)])))
+        conn.execute("INSERT INTO activity_data (activity_id, date, heart_rate_series, start_time_local) VALUES (?, ?, ?, ?)",
+                     (f"a{index}", date, encode_series([[day_ms + 3_600_000 + i * 1000, 110 + (i + index) % 60] for i in range(900)]),
+                      f"{date}T01:00:00"))
+    conn.execute("INSERT INTO background_jobs (job_id, job_type, status) VALUES ('job', 'recompute_derived', 'running')")
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def stored_trimp(db, table, key_column):
+    return {row[0]: (json.loads(row[1]), row[2], row[3])
+            for row in db.execute(f"SELECT {key_column}, cached_trimp_data, trimp_calculation_hash, total_trimp FROM {table}")}
+
+
+def test_recompute_matches_calculate_trimp_with_caching(db, monkeypatch):
+    monkeypatch.setitem(trimp_recompute.JOB_CONFIG, 'RECOMPUTE_CHUNK_SIZE', 3)
+    monkeypatch.setitem(trimp_recompute.JOB_CONFIG, 'RECOMPUTE_PROCESSES', 1)
+    save_user_data('activity_hr_csv', 'a2', [[START_MS + i * 1000, 150] for i in range(100)])
+
+    progress = trimp_recompute.recompute_trimp(None, None, 'job')
+
+    assert progress['activities_recalculated'] == progress['total_activities'] == len(DATES)
+    assert progress['days_recalculated'] == progress['total_days'] == len(DATES)
+    assert json.loads(db.execute("SELECT result FROM background_jobs").fetchone()[0]) == progress
+
+    activities = stored_trimp(db, 'activity_data', 'activity_id')
+    days = stored_trimp(db, 'daily_data', 'date')
+    # The CSV override is what the activity's TRIMP is calculated from
+    assert activities['a2'][0] == calculate_trimp_from_timeseries([[START_MS + i * 1000, 150] for i in range(100)], (50, 180))
+
+    # The pages find the results cached
+    monkeypatch.setattr(jobs, 'calculate_trimp_from_timeseries', lambda *args: pytest.fail("TRIMP was not cached"))
+    cur = db.cursor()
+    for date in DATES:
+        trimp, _, total = days[date]
+        assert calculate_trimp_with_caching(date, jobs.build_daily_hr_timeseries(date, db, cur), 'daily') == trimp
+        assert total == trimp['total_trimp'] > 0
+
+
+def test_process_pool_gives_the_same_results(db, monkeypatch):
+    monkeypatch.setitem(trimp_recompute.JOB_CONFIG, 'RECOMPUTE_CHUNK_SIZE', 2)
+    monkeypatch.setitem(trimp_recompute.JOB_CONFIG, 'RECOMPUTE_PROCESSES', 1)
+    trimp_recompute.recompute_trimp(None, None, 'job')
+    inline = (stored_trimp(db, 'activity_data', 'activity_id'), stored_trimp(db, 'daily_data', 'date'))
+
+    db.execute("UPDATE activity_data SET cached_trimp_data = NULL, trimp_calculation_hash = NULL, total_trimp = NULL")
+    db.execute("UPDATE daily_data SET cached_trimp_data = NULL, trimp_calculation_hash = NULL, total_trimp = NULL")
+    db.commit()
+    monkeypatch.setitem(trimp_recompute.JOB_CONFIG, 'RECOMPUTE_PROCESSES', 2)
+    trimp_recompute.recompute_trimp(None, None, 'job')
+
+    assert (stored_trimp(db, 'activity_data', 'activity_id'), stored_trimp(db, 'daily_data', 'date')) == inline
+
+
+def test_cached_trimp_is_not_served_after_hr_parameters_change(db):
+    hr_series = [[START_MS + i * 1000, 120 + i % 40] for i in range(600)]
+    before = calculate_trimp_with_caching('a0', hr_series, 'activity')
+
+    db.execute("UPDATE hr_parameters SET resting_hr = 60, max_hr = 160")
+    db.commit()
+    after = calculate_trimp_with_caching('a0', hr_series, 'activity')
+
+    assert after == calculate_trimp_from_timeseries(hr_series, (60, 160))
+    assert after['total_trimp'] != before['total_trimp']
+
+
+def test_recompute_stops_when_hr_parameters_change(db, monkeypatch):
+    monkeypatch.setitem(trimp_recompute.JOB_CONFIG, 'RECOMPUTE_CHUNK_SIZE', 3)
+    monkeypatch.setitem(trimp_recompute.JOB_CONFIG, 'RECOMPUTE_PROCESSES', 1)
+    read_activity_series = trimp_recompute.read_activity_series
+    chunks_read = []
+
+    def read_and_change_parameters(activity_ids):
+        chunks_read.append(activity_ids)
+        if len(chunks_read) == 2:
+            db.execute("UPDATE hr_parameters SET resting_hr = 60, max_hr = 160")
+            db.commit()
+        return read_activity_series(activity_ids)
+
+    monkeypatch.setattr(trimp_recompute, 'read_activity_series', read_and_change_parameters)
+    progress = trimp_recompute.recompute_trimp(None, None, 'job')
+
+    # Only the chunk calculated before the change was written
+    assert progress['superseded'] and progress['activities_recalculated'] == 3
+    assert progress['days_recalculated'] == 0
+    written = db.execute("SELECT COUNT(*) FROM activity_data WHERE cached_trimp_data IS NOT NULL").fetchone()[0]
+    assert written == 3
+    assert db.execute("SELECT COUNT(*) FROM daily_data WHERE cached_trimp_data IS NOT NULL").fetchone()[0] == 0
+
+
+def test_batch_data_rejects_trimp_cached_with_other_hr_parameters(db, monkeypatch):
+    monkeypatch.setitem(trimp_recompute.JOB_CONFIG, 'RECOMPUTE_PROCESSES', 1)
+    trimp_recompute.recompute_trimp(None, None, 'job')
+
+    current = get_daily_batch_data(DATES, 'cached_trimp_data', hash_prefix=trimp_cache_prefix((50, 180)))
+    assert all(row['cached_data'] for row in current.values())
+    other = get_daily_batch_data(DATES, 'cached_trimp_data', hash_prefix=trimp_cache_prefix((60, 160)))
+    assert not any(row['cached_data'] for row in other.values())
+    assert all(row['has_daily_data'] for row in other.values())
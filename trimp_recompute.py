@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+TRIMP recompute engine for Garmin Heart Rate Analyzer
+
+Recalculates the TRIMP of activities and days whose TRIMP cache was cleared,
+which after an HR parameter change is the whole history. Stale rows are read
+JOB_CONFIG['RECOMPUTE_CHUNK_SIZE'] at a time, their TRIMP is calculated in a
+process pool across cores while the next chunks are read, and each chunk's
+results are written back in one transaction. Progress is kept in the job's
+result while it runs.
+
+Activities go first, since the day series are assembled from them too. The
+HR parameters are read once, and the cache key of every result includes them
+(see jobs.trimp_cache_key), so results calculated before a parameter change
+are never served after it. A chunk is only written if the parameters are
+still current; otherwise the job stops, leaving the rows to the recompute job
+the parameter change queued.
+"""
+
+import json
+import logging
+import os
+from collections import deque
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from config import JOB_CONFIG
+from database import (
+    db_connection,
+    decode_series,
+    get_user_data_batch,
+    get_user_hr_parameters,
+    read_hr_parameters,
+    update_job_status,
+)
+from jobs import build_daily_hr_timeseries_batch, calculate_trimp_from_timeseries, trimp_cache_key
+
+logger = logging.getLogger(__name__)
+
+
+def calculate_trimp_chunk(items: List[Tuple[str, List]], hr_parameters: Tuple[int, int]) -> List[Tuple[str, Dict, str]]:
+    """
+    Calculate the TRIMP of a chunk of series (runs in a worker process).
+
+    Args:
+        items: (key, [timestamp, heart_rate] pairs) tuples
+        hr_parameters: (resting_hr, max_hr)
+
+    Returns:
+        (key, TRIMP results, cache key) tuples
+    """
+    return [
+        (key, calculate_trimp_from_timeseries(hr_series, hr_parameters), trimp_cache_key(hr_series, hr_parameters))
+        for key, hr_series in items
+    ]
+
+
+def recompute_processes() -> int:
+    """Number of worker processes: JOB_CONFIG['RECOMPUTE_PROCESSES'], or one per core if 0."""
+    return JOB_CONFIG['RECOMPUTE_PROCESSES'] or os.cpu_count() or 1
+
+
+def map_chunks(chunks: Iterable[List[Tuple[str, List]]], hr_parameters: Tuple[int, int],
+               processes: int) -> Iterator[List[Tuple[str, Dict, str]]]:
+    """
+    Yield calculate_trimp_chunk() of each chunk, in order.
+
+    With several processes, up to two chunks per process are in flight while
+    the caller writes earlier results back and the next chunks are read. The
+    pool is spawned rather than forked, since job workers are threads.
+    """
+    if processes <= 1:
+        for items in chunks:
+            yield calculate_trimp_chunk(items, hr_parameters)
+        return
+
+    with ProcessPoolExecutor(processes, mp_context=get_context('spawn')) as pool:
+        in_flight = deque()
+        for items in chunks:
+            in_flight.append(pool.submit(calculate_trimp_chunk, items, hr_parameters))
+            if len(in_flight) >= 2 * processes:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+def stale_keys(table: str, key_column: str, start_date: Optional[str], end_date: Optional[str]) -> List[str]:
+    """Keys of the rows of a table whose TRIMP cache is empty, within a date range (None for every day)."""
+    query = f"SELECT {key_column} FROM {table} WHERE cached_trimp_data IS NULL AND heart_rate_series IS NOT NULL"
+    params = []
+    if start_date is not None:
+        query += " AND date >= ? AND date <= ?"
+        params = [start_date, end_date]
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(query + f" ORDER BY {key_column}", params)
+        keys = [row[0] for row in cur.fetchall()]
+        cur.close()
+    return keys
+
+
+def _chunked(keys: List[str]) -> Iterator[List[str]]:
+    size = JOB_CONFIG['RECOMPUTE_CHUNK_SIZE']
+    for start in range(0, len(keys), size):
+        yield keys[start:start + size]
+
+
+def read_activity_series(activity_ids: List[str]) -> List[Tuple[str, List]]:
+    """Read the series activity TRIMP is calculated from: the HR CSV override, else the stored HR series."""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT activity_id, heart_rate_series FROM activity_data
+            WHERE activity_id IN ({', '.join('?' * len(activity_ids))})
+        """, activity_ids)
+        stored = {row['activity_id']: row['heart_rate_series'] for row in cur.fetchall()}
+        cur.close()
+
+    overrides = get_user_data_batch('activity_hr_csv', list(stored))
+    return [
+        (activity_id, overrides.get(activity_id) or decode_series(stored[activity_id]))
+        for activity_id in activity_ids if activity_id in stored
+    ]
+
+
+def read_daily_series(dates: List[str]) -> List[Tuple[str, List]]:
+    """Assemble the HR series day TRIMP is calculated from (daily HR merged with activities)."""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        hr_series_by_date = build_daily_hr_timeseries_batch(dates, conn, cur)
+        cur.close()
+    return [(target_date, hr_series_by_date[target_date]) for target_date in dates]
+
+
+def write_trimp_results(table: str, key_column: str, results: List[Tuple[str, Dict, str]],
+                        hr_parameters: Tuple[int, int]) -> bool:
+    """
+    Store a chunk's TRIMP and TRIMP cache in one transaction, if it was calculated
+    with the current HR parameters.
+
+    Returns:
+        False (and nothing is written) if the HR parameters have changed since
+    """
+    with db_connection() as conn:
+        cur = conn.cursor()
+        # Take the write lock first, so the parameters cannot change before the commit
+        cur.execute("BEGIN IMMEDIATE")
+        if tuple(read_hr_parameters(cur)) != tuple(hr_parameters):
+            conn.rollback()
+            cur.close()
+            return False
+
+        cur.executemany(f"""
+            UPDATE {table}
+            SET trimp_data = ?, total_trimp = ?, cached_trimp_data = ?, trimp_calculation_hash = ?,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE {key_column} = ?
+        """, [
+            (json.dumps(trimp), float(trimp.get('total_trimp', 0.0)), json.dumps(trimp), cache_key, key)
+            for key, trimp, cache_key in results
+        ])
+        conn.commit()
+        cur.close()
+    return True
+
+
+def recompute_trimp(start_date: Optional[str], end_date: Optional[str], job_id: str) -> Dict:
+    """
+    Recalculate every cleared activity and day TRIMP in a date range.
+
+    Args:
+        start_date: First day (YYYY-MM-DD), None for every day
+        end_date: Last day (YYYY-MM-DD), None for every day
+        job_id: Background job to report progress on
+
+    Returns:
+        The job's progress dict, with 'superseded' set if the HR parameters changed while it ran
+    """
+    hr_parameters = get_user_hr_parameters()
+    activity_ids = stale_keys('activity_data', 'activity_id', start_date, end_date)
+    dates = stale_keys('daily_data', 'date', start_date, end_date)
+    progress = {
+        'hr_parameters': list(hr_parameters),
+        'total_activities': len(activity_ids),
+        'activities_recalculated': 0,
+        'total_days': len(dates),
+        'days_recalculated': 0,
+    }
+    update_job_status(job_id, 'running', json.dumps(progress))
+
+    processes = recompute_processes()
+    for table, key_column, keys, read_series, counter in (
+        ('activity_data', 'activity_id', activity_ids, read_activity_series, 'activities_recalculated'),
+        ('daily_data', 'date', dates, read_daily_series, 'days_recalculated'),
+    ):
+        chunks = (read_series(chunk) for chunk in _chunked(keys))
+        for results in map_chunks(chunks, hr_parameters, processes):
+            if not write_trimp_results(table, key_column, results, hr_parameters):
+                logger.info(f"recompute_trimp: {job_id} stopped, HR parameters changed from {hr_parameters}")
+                progress['superseded'] = True
+                return progress
+            progress[counter] += len(results)
+            update_job_status(job_id, 'running', json.dumps(progress))
+
+    logger.info(f"recompute_trimp: {job_id} recalculated {progress['activities_recalculated']} activities "
+                f"and {progress['days_recalculated']} days with HR parameters {hr_parameters}")
+    return progress